@@ -43,6 +43,9 @@ class TestingConfigLoader(ConfigLoader):
     A config loader used for testing.
     """
 
+    # Not a test class, although test modules import it.
+    __test__ = False
+
     def __init__(self, configs: Dict[str, Dict[str, ConfigDict]]):
         self.configs = configs
 
@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the agent registry.
+"""
+
+from wlbb.lib.agent.agent import Status
+from wlbb.lib.agent.registry import AgentRegistry
+from wlbb.lib.agent.runtime import SyncAgentAdapter
+
+from . import WLBBDummyAgent
+from .test_agent_runtime import WLBBAsyncDummyAgent
+
+
+def make_registry():
+    """
+    Return a registry of 3 dummy agents and 2 async dummy agents.
+    """
+    registry = AgentRegistry()
+    dummies = [WLBBDummyAgent("dummy%d" % i) for i in range(3)]
+    async_dummies = [WLBBAsyncDummyAgent("async%d" % i) for i in range(2)]
+    for wlbb_agent in dummies + async_dummies:
+        registry.register(wlbb_agent)
+    return registry, dummies, async_dummies
+
+
+#%% Indexes
+
+
+def test_lookup():
+    """
+    Test looking agents up by id, type and status.
+    """
+    registry, dummies, async_dummies = make_registry()
+
+    assert len(registry) == 5, "Wrong agent count"
+    assert "dummy-dummy0" in registry, "Agent isn't registered"
+    assert registry.get_agent("dummy-dummy1") is dummies[1], "Wrong agent"
+    assert registry.get_agent_ids("dummy") == frozenset(
+        wlbb_agent.agent_id for wlbb_agent in dummies
+    ), "Wrong type index"
+    assert registry.get_agent_ids(status=Status.ACTIVE) == frozenset()
+    assert sorted(registry.get_agent_types()) == ["async_dummy", "dummy"]
+
+
+def test_status_index_follows_transitions():
+    """
+    Test that the status index is updated when agents change status.
+    """
+    registry, dummies, async_dummies = make_registry()
+    version = registry.get_version()
+
+    dummies[0].start()
+    async_dummies[1].status = Status.ACTIVE
+
+    assert registry.get_version() != version, "Version didn't change"
+    assert registry.get_agent_ids("dummy", Status.ACTIVE) == {"dummy-dummy0"}
+    assert registry.get_agent_ids(status=Status.ACTIVE) == {
+        "dummy-dummy0",
+        "async_dummy-async1",
+    }, "Wrong status index"
+    assert registry.get_agents("async_dummy", Status.ACTIVE) == [async_dummies[1]]
+    assert registry.get_status_counts("dummy") == {
+        Status.INACTIVE: 2,
+        Status.ACTIVE: 1,
+    }, "Wrong status counts"
+
+    dummies[0].stop()
+    assert registry.get_agent_ids("dummy", Status.ACTIVE) == frozenset()
+    assert registry.get_status("dummy-dummy0") is Status.INACTIVE
+
+
+def test_cached_queries():
+    """
+    Test that queries are cached until an agent they match changes.
+    """
+    registry, dummies, async_dummies = make_registry()
+
+    active_dummies = registry.get_agent_ids("dummy", Status.ACTIVE)
+    async_ids = registry.get_agent_ids("async_dummy")
+    assert registry.get_agent_ids("dummy", Status.ACTIVE) is active_dummies
+
+    dummies[2].start()
+    assert registry.get_agent_ids("async_dummy") is async_ids, "Cache was cleared"
+    assert registry.get_agent_ids("dummy", Status.ACTIVE) == {"dummy-dummy2"}
+
+
+def test_unregister():
+    """
+    Test that unregistered agents leave every index.
+    """
+    registry, dummies, async_dummies = make_registry()
+    registry.get_agent_ids("dummy")
+
+    registry.unregister("dummy-dummy0")
+    dummies[0].start()
+
+    assert "dummy-dummy0" not in registry, "Agent is still registered"
+    assert "dummy-dummy0" not in registry.get_agent_ids("dummy"), "Stale type index"
+    assert registry.get_agent_ids(status=Status.ACTIVE) == frozenset()
+    assert "dummy-dummy0" not in registry.get_statuses(), "Stale status"
+
+
+def test_status_snapshot():
+    """
+    Test batched status snapshots.
+    """
+    registry, dummies, async_dummies = make_registry()
+    dummies[1].start()
+
+    snapshot = registry.get_statuses(["dummy-dummy0", "dummy-dummy1", "unknown"])
+    assert snapshot == {
+        "dummy-dummy0": Status.INACTIVE,
+        "dummy-dummy1": Status.ACTIVE,
+    }, "Wrong snapshot"
+    dummies[1].stop()
+    assert snapshot["dummy-dummy1"] is Status.ACTIVE, "Snapshot was modified"
+
+
+def test_adapted_agent():
+    """
+    Test that status changes of agents run by an adapter are indexed.
+    """
+    registry = AgentRegistry()
+    wlbb_agent = WLBBDummyAgent("test")
+    registry.register(SyncAgentAdapter(wlbb_agent))
+
+    wlbb_agent.start()
+    assert registry.get_agent_ids(status=Status.ACTIVE) == {"dummy-test"}
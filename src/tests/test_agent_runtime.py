@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the asyncio agent runtime.
+"""
+
+import time
+import asyncio
+
+from wlbb.lib.agent.agent import Status
+from wlbb.lib.agent.runtime import AgentRuntime, AsyncWLBBAgent, SyncAgentAdapter
+
+from . import WLBBDummyAgent
+
+
+def run(coroutine):
+    """
+    Run a coroutine in a new event loop.
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class WLBBSlowDummyAgent(WLBBDummyAgent):
+    """
+    A synchronous dummy agent which takes `delay` seconds to start.
+    """
+
+    def __init__(self, name, delay=0.2, fail=False):
+        super().__init__(name)
+        self.delay = delay
+        self.fail = fail
+
+    def start(self):
+        time.sleep(self.delay)
+        if self.fail:
+            raise RuntimeError("Camera not found")
+        self.status = Status.ACTIVE
+
+
+class WLBBAsyncDummyAgent(AsyncWLBBAgent):
+    """
+    An asynchronous dummy agent which takes `delay` seconds to start.
+    """
+
+    agent = "async_dummy"
+    config_sections = ["PARAM_GROUP1"]
+
+    def __init__(self, name, delay=0.2):
+        super().__init__(name)
+        self.delay = delay
+
+    async def init(self):
+        pass
+
+    async def start(self):
+        await asyncio.sleep(self.delay)
+        self.status = Status.ACTIVE
+
+    async def stop(self):
+        self.status = Status.INACTIVE
+
+    async def quit(self):
+        pass
+
+    async def restart(self):
+        pass
+
+    async def reload(self):
+        pass
+
+
+#%% Concurrent transitions
+
+
+def test_concurrent_sync_agents():
+    """
+    Test that synchronous agents are started concurrently.
+    """
+    runtime = AgentRuntime()
+    for i in range(5):
+        adapter = runtime.add_agent(WLBBSlowDummyAgent("slow%d" % i))
+        assert isinstance(adapter, SyncAgentAdapter), "Sync agent isn't wrapped"
+
+    begin = time.monotonic()
+    results = run(runtime.start_agents())
+    duration = time.monotonic() - begin
+    runtime.close()
+
+    assert duration < 0.6, "Agents were started one after another"
+    for agent_id, result in results.items():
+        assert result.error is None, "%a failed to start" % agent_id
+        assert result.status is Status.ACTIVE, "Wrong status in result"
+        assert runtime.get_status(agent_id) is Status.ACTIVE, "Agent isn't active"
+
+
+def test_concurrent_async_agents():
+    """
+    Test that asynchronous agents are started concurrently and stopped.
+    """
+    runtime = AgentRuntime()
+    agents = [runtime.add_agent(WLBBAsyncDummyAgent("async%d" % i)) for i in range(5)]
+    assert not any(
+        isinstance(agent, SyncAgentAdapter) for agent in agents
+    ), "Async agent is wrapped"
+
+    async def start_stop():
+        begin = time.monotonic()
+        await runtime.start_agents()
+        duration = time.monotonic() - begin
+        statuses = [agent.status for agent in agents]
+        await runtime.stop_agents()
+        return duration, statuses
+
+    duration, statuses = run(start_stop())
+    runtime.close()
+
+    assert duration < 0.6, "Agents were started one after another"
+    assert statuses == [Status.ACTIVE] * 5, "Agents weren't started"
+    assert all(
+        agent.status is Status.INACTIVE for agent in agents
+    ), "Agents weren't stopped"
+
+
+def test_max_concurrency():
+    """
+    Test that the runtime limits the number of concurrent transitions.
+    """
+    runtime = AgentRuntime(max_concurrency=1)
+    for i in range(3):
+        runtime.add_agent(WLBBAsyncDummyAgent("async%d" % i, delay=0.1))
+
+    begin = time.monotonic()
+    run(runtime.start_agents())
+    duration = time.monotonic() - begin
+    runtime.close()
+
+    assert duration >= 0.3, "Transitions ran concurrently"
+
+
+#%% Failures
+
+
+def test_failing_agent():
+    """
+    Test that a failing agent doesn't prevent the others from starting.
+    """
+    runtime = AgentRuntime()
+    runtime.add_agent(WLBBSlowDummyAgent("good", delay=0.05))
+    runtime.add_agent(WLBBSlowDummyAgent("bad", delay=0.05, fail=True))
+
+    results = run(runtime.start_agents())
+    runtime.close()
+
+    assert results["dummy-good"].error is None, "Good agent failed"
+    assert isinstance(results["dummy-bad"].error, RuntimeError), "Error is lost"
+    assert runtime.get_status("dummy-good") is Status.ACTIVE, "Good agent inactive"
+    assert runtime.get_status("dummy-bad") is Status.INACTIVE, "Bad agent active"
+
+
+def test_async_timeout():
+    """
+    Test that a transition taking too long is cancelled and keeps the status.
+    """
+    runtime = AgentRuntime(timeout=0.05)
+    runtime.add_agent(WLBBAsyncDummyAgent("slow", delay=10))
+
+    begin = time.monotonic()
+    results = run(runtime.start_agents())
+    duration = time.monotonic() - begin
+    runtime.close()
+
+    assert duration < 1, "Transition wasn't cancelled"
+    assert isinstance(
+        results["async_dummy-slow"].error, asyncio.TimeoutError
+    ), "Timeout isn't reported"
+    assert runtime.get_status("async_dummy-slow") is Status.INACTIVE, "Wrong status"
+
+
+def test_sync_timeout():
+    """
+    Test that a timed out synchronous transition doesn't change the status once
+    it returns, and that the next transition waits for it.
+    """
+    runtime = AgentRuntime(timeout=0.05)
+    runtime.add_agent(WLBBSlowDummyAgent("slow", delay=0.2))
+
+    async def start_and_reload():
+        start_results = await runtime.start_agents()
+        reload_results = await runtime.run_transitions("reload", timeout=1)
+        return start_results, reload_results
+
+    start_results, reload_results = run(start_and_reload())
+    runtime.close()
+
+    assert isinstance(
+        start_results["dummy-slow"].error, asyncio.TimeoutError
+    ), "Timeout isn't reported"
+    assert reload_results["dummy-slow"].error is None, "Reload failed"
+    assert runtime.get_status("dummy-slow") is Status.INACTIVE, "Wrong status"
+
+
+def test_cancellation():
+    """
+    Test that cancelling transitions keeps the status of the agents.
+    """
+    runtime = AgentRuntime()
+    for i in range(3):
+        runtime.add_agent(WLBBAsyncDummyAgent("async%d" % i, delay=10))
+
+    async def cancel_start():
+        task = asyncio.ensure_future(runtime.start_agents())
+        await asyncio.sleep(0.05)
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            return True
+        return False
+
+    cancelled = run(cancel_start())
+    runtime.close()
+
+    assert cancelled, "Transitions weren't cancelled"
+    for agent in runtime.get_agents().values():
+        assert agent.status is Status.INACTIVE, "Cancelled agent is active"
+
+
+def test_adapter_delegates_config():
+    """
+    Test that the adapter exposes the wrapped agent's identity and config.
+    """
+    wlbb_agent = WLBBDummyAgent("test")
+    adapter = SyncAgentAdapter(wlbb_agent)
+    adapter.set_config("config")
+
+    assert adapter.agent_id == wlbb_agent.agent_id, "Wrong agent id"
+    assert adapter.get_config_sections_list() == wlbb_agent.config_sections
+    assert wlbb_agent.get_config() == "config", "Config wasn't set"
+    adapter.status = Status.ACTIVE
+    assert wlbb_agent.status is Status.ACTIVE, "Status isn't shared"
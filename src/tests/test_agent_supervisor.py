@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the agent supervisor.
+"""
+
+import os
+import time
+import uuid
+
+from wlbb.lib.agent.agent import Status
+from wlbb.lib.agent.supervisor import AgentSupervisor, RestartPolicy
+from wlbb.lib.config.shared_config import SharedConfigPublisher
+
+from . import TestingConfigLoader, WLBBDummyAgent
+
+
+class WLBBPidDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent writing the pid of its process in a file once started.
+    """
+
+    def __init__(self, name, pid_path):
+        super().__init__(name)
+        self.pid_path = pid_path
+
+    def start(self):
+        with open(self.pid_path, "w") as pid_file:
+            pid_file.write(str(os.getpid()))
+        super().start()
+
+
+class WLBBConfigDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent writing a parameter of its config in a file once loaded,
+    without any config file to read.
+    """
+
+    def __init__(self, name, path):
+        super().__init__(name)
+        self.path = path
+        self.set_config_loader(TestingConfigLoader({}))
+
+    def init(self):
+        config = self.load_config()
+        with open(self.path, "w") as parameter_file:
+            parameter_file.write(str(config.get_parameter("PARAM_GROUP1", "p")))
+
+
+class WLBBCrashingDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent whose process crashes as soon as it starts.
+    """
+
+    def start(self):
+        os._exit(3)
+
+
+def wait_for(predicate, timeout=5.0):
+    """
+    Wait until `predicate` returns True and return whether it did.
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return False
+
+
+#%% Supervisor
+
+
+def test_agent_in_own_process(tmp_path):
+    """
+    Test that an agent runs in its own process and reports its status.
+    """
+    pid_path = str(tmp_path / "pid")
+    supervisor = AgentSupervisor()
+    agent_id = supervisor.add_agent(WLBBPidDummyAgent, "test", pid_path)
+    assert agent_id == "dummy-test", "Wrong agent id"
+    assert supervisor.get_status(agent_id) is Status.INACTIVE, "Agent is active"
+
+    supervisor.start(interval=0.02)
+    try:
+        assert wait_for(
+            lambda: supervisor.get_status(agent_id) is Status.ACTIVE
+        ), "Status isn't shared"
+        with open(pid_path) as pid_file:
+            pid = int(pid_file.read())
+        assert pid != os.getpid(), "Agent runs in the supervisor's process"
+        assert pid == supervisor.get_pid(agent_id), "Wrong pid"
+    finally:
+        supervisor.stop()
+
+    assert supervisor.get_status(agent_id) is Status.INACTIVE, "Agent is active"
+    assert supervisor.get_restart_count(agent_id) == 0, "Agent was restarted"
+
+
+def test_restart_backoff():
+    """
+    Test that crashed agents are restarted with an exponential backoff.
+    """
+    policy = RestartPolicy(initial_delay=0.05, factor=2.0, max_delay=0.2)
+    supervisor = AgentSupervisor(restart_policy=policy)
+    agent_id = supervisor.add_agent(WLBBCrashingDummyAgent, "crash")
+    supervisor.start_agent(agent_id)
+
+    delays = []
+    try:
+        deadline = time.monotonic() + 10
+        while len(delays) < 4 and time.monotonic() < deadline:
+            if supervisor.poll():
+                delays.append(supervisor.get_restart_delay(agent_id))
+            time.sleep(0.01)
+    finally:
+        supervisor.stop()
+
+    assert delays == [0.05, 0.1, 0.2, 0.2], "Wrong restart delays : %a" % delays
+    assert supervisor.get_restart_count(agent_id) == 4, "Wrong restart count"
+
+
+def test_max_restarts():
+    """
+    Test that an agent isn't restarted more than `max_restarts` times.
+    """
+    policy = RestartPolicy(initial_delay=0.01, max_restarts=1)
+    supervisor = AgentSupervisor(restart_policy=policy)
+    agent_id = supervisor.add_agent(WLBBCrashingDummyAgent, "crash")
+    supervisor.start(interval=0.01)
+    try:
+        time.sleep(0.5)
+    finally:
+        supervisor.stop()
+
+    assert supervisor.get_restart_count(agent_id) == 1, "Wrong restart count"
+    assert supervisor.get_status(agent_id) is Status.INACTIVE, "Agent is active"
+
+
+def test_shared_configs(tmp_path):
+    """
+    Test that the agents of the supervisor load their config from the
+    shared configs.
+    """
+    path = str(tmp_path / "parameter")
+    publisher = SharedConfigPublisher("wlbb_test_" + uuid.uuid4().hex[:12], 4096)
+    publisher.publish({"dummy-test": {"PARAM_GROUP1": {"p": "shared"}}})
+    supervisor = AgentSupervisor(shared_configs=publisher.name)
+    supervisor.add_agent(WLBBConfigDummyAgent, "test", path)
+    supervisor.start(interval=0.02)
+    try:
+        assert wait_for(lambda: os.path.exists(path)), "Agent not initialized"
+    finally:
+        supervisor.stop()
+        publisher.close()
+    with open(path) as parameter_file:
+        assert parameter_file.read() == "shared", "Config not loaded from memory"
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the detection of lit LEDs in camera frames.
+"""
+
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from wlbb.lib.vision.blobs import BlobDetector, label_pixels
+from wlbb.lib.agent.processing import WLBBProcessingAgent
+
+HEIGHT, WIDTH = 1080, 1920
+
+
+def make_scene(led_count=200, seed=0):
+    """
+    Return a noisy dark frame, the same frame with Gaussian spots of lit
+    LEDs at random sub-pixel positions, and these positions.
+    """
+    rng = np.random.default_rng(seed)
+    dark = rng.integers(0, 30, (HEIGHT, WIDTH), dtype=np.uint8)
+    # LEDs on a jittered grid, so their spots don't overlap.
+    grid = np.stack(np.meshgrid(np.arange(20, WIDTH - 20, 60), np.arange(20, 1060, 60)))
+    positions = grid.reshape(2, -1).T[:led_count].astype(float)
+    positions += rng.uniform(-5, 5, positions.shape)
+
+    rows, cols = np.mgrid[0:HEIGHT, 0:WIDTH]
+    light = np.zeros((HEIGHT, WIDTH))
+    for u, v in positions:
+        r0, c0 = int(v) - 6, int(u) - 6
+        window = np.s_[r0 : r0 + 13, c0 : c0 + 13]
+        light[window] += 200 * np.exp(
+            -((cols[window] - u) ** 2 + (rows[window] - v) ** 2) / 4
+        )
+    frame = np.clip(dark + light, 0, 255).astype(np.uint8)
+    return dark, frame, positions
+
+
+#%% Connected components
+
+
+def test_label_shapes():
+    """
+    Test that pixels touching by a side or a corner are in the same component,
+    whatever the shape of the component.
+    """
+    mask = np.zeros((8, 10), bool)
+    mask[1:6, 1] = mask[1:6, 4] = mask[5, 1:5] = True  # U shape
+    mask[1, 7] = mask[2, 8] = True  # Diagonal
+    mask[7, 0] = mask[7, 9] = True  # Isolated pixels
+    count, components = label_pixels(np.flatnonzero(mask), 10)
+    labels = np.full(mask.size, -1)
+    labels[np.flatnonzero(mask)] = components
+    labels = labels.reshape(mask.shape)
+
+    assert count == 4, "Wrong component count : %d" % count
+    assert labels[1, 1] == labels[1, 4], "U shape split"
+    assert labels[1, 7] == labels[2, 8], "Diagonal pixels split"
+    assert labels[7, 0] != labels[7, 9], "Isolated pixels merged"
+    assert labels[1, 1] < labels[1, 7] < labels[7, 0], "Components not in order"
+    assert label_pixels(np.zeros(0, np.intp), 10)[0] == 0, "Components found"
+
+
+#%% Detection
+
+
+def test_detect_centroids():
+    """
+    Test that LEDs are found at their sub-pixel position.
+    """
+    dark, frame, positions = make_scene()
+    detector = BlobDetector(threshold=30, dark_frame=dark)
+    blobs = detector.detect(frame)
+
+    assert blobs.dtype == np.float32 and blobs.shape == (200, 3), "Wrong blobs"
+    distances = np.hypot(
+        blobs[:, None, 0] - positions[None, :, 0],
+        blobs[:, None, 1] - positions[None, :, 1],
+    )
+    assert len(set(distances.argmin(axis=1))) == 200, "LED found twice"
+    errors = distances.min(axis=1)
+    assert errors.max() < 0.2, "Centroid error of %.2f pixels" % errors.max()
+    assert (blobs[:, 2] > 0).all(), "Null intensity"
+
+
+def test_dark_frame_and_area():
+    """
+    Test that hot pixels of the dark frame and too small blobs are ignored.
+    """
+    dark = np.zeros((20, 20), np.uint8)
+    dark[2, 2] = 255
+    frame = dark.copy()
+    frame[10:13, 10:13] = 100
+    frame[5, 15] = 100
+
+    detector = BlobDetector(threshold=50, dark_frame=dark)
+    assert len(detector.detect(frame)) == 2, "Hot pixel detected"
+    detector.min_area = 2
+    blobs = detector.detect(frame)
+    assert blobs.tolist() == [[11, 11, 900]], "Wrong blob : %r" % blobs
+    detector.max_area = 8
+    assert len(detector.detect(frame)) == 0, "Large blob not ignored"
+    with pytest.raises(ValueError):
+        detector.detect(np.zeros((10, 10), np.uint8))
+
+
+def test_detect_speed():
+    """
+    Test that a 1080p frame is processed in a few milliseconds.
+    """
+    dark, frame, _ = make_scene()
+    agent = WLBBProcessingAgent("test")
+    agent.init()
+    agent.set_dark_frame(dark)
+    agent.process_frame(frame)
+    start = time.perf_counter()
+    for _ in range(20):
+        blobs = agent.process_frame(frame)
+    duration = (time.perf_counter() - start) / 20
+    assert len(blobs) == 200, "Wrong blob count"
+    assert duration < 0.02, "Frame processed in %.1f ms" % (duration * 1000)
+    assert agent.get_loop_stats()[0] == 21, "Wrong processed frame count"
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the camera self-calibration by bundle adjustment.
+"""
+
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+
+from scipy.spatial.transform import Rotation
+
+from wlbb.lib.vision.calibration import (
+    bundle_adjust,
+    get_jacobian_sparsity,
+    initialize_cameras,
+    project_observations,
+)
+
+PRINCIPAL_POINT = (640, 360)
+
+
+def make_scene(led_count=400, camera_count=6, noise=0.3, seed=0):
+    """
+    Return the true cameras, LED positions and their noisy observations with
+    their mask, for cameras around a cloud of LEDs.
+    """
+    rng = np.random.default_rng(seed)
+    cameras = np.zeros((camera_count, 9))
+    for camera, angle in enumerate(np.linspace(0, 2 * np.pi, camera_count, False)):
+        center = np.array((5 * np.cos(angle), 5 * np.sin(angle), 1.5))
+        forward = -center / np.linalg.norm(center)
+        right = np.cross((0, 0, 1), forward)
+        right /= np.linalg.norm(right)
+        rotation = np.stack((right, np.cross(forward, right), forward))
+        cameras[camera, :3] = Rotation.from_matrix(rotation).as_rotvec()
+        cameras[camera, 3:6] = -rotation @ center
+        cameras[camera, 6] = rng.uniform(800, 1000)
+        cameras[camera, 7:] = (-0.1, 0.02)
+    xyz = rng.uniform(-1, 1, (led_count, 3))
+
+    point_indexes, camera_indexes = np.indices((led_count, camera_count))
+    observations = project_observations(
+        cameras[camera_indexes.ravel()], PRINCIPAL_POINT, xyz[point_indexes.ravel()]
+    ).reshape(led_count, camera_count, 2)
+    observations += rng.normal(0, noise, observations.shape)
+    mask = rng.random((led_count, camera_count)) < 0.8
+    return cameras, xyz, observations, mask
+
+
+def perturb_cameras(cameras, seed=1):
+    """
+    Return rough estimates of `cameras`, without distortion.
+    """
+    rng = np.random.default_rng(seed)
+    estimates = cameras.copy()
+    estimates[:, :3] += rng.normal(0, 0.02, (len(cameras), 3))
+    estimates[:, 3:6] += rng.normal(0, 0.1, (len(cameras), 3))
+    estimates[:, 6] *= 1.1
+    estimates[:, 7:] = 0
+    return estimates
+
+
+def radial_projection(cameras, radius):
+    """
+    Return the distance in pixels (C, R) to the principal point of the
+    projections by `cameras` of the normalized radiuses `radius`.
+    """
+    r2 = radius**2
+    distortion = 1 + r2 * (cameras[:, 7, None] + r2 * cameras[:, 8, None])
+    return cameras[:, 6, None] * radius * distortion
+
+
+def align(source, target):
+    """
+    Return `source` (N, 3) moved by the similarity transform best matching
+    it with `target` (Umeyama).
+    """
+    source_mean, target_mean = source.mean(axis=0), target.mean(axis=0)
+    centered_source, centered_target = source - source_mean, target - target_mean
+    u, s, vt = np.linalg.svd(centered_target.T @ centered_source)
+    sign = np.sign(np.linalg.det(u @ vt))
+    s[-1] *= sign
+    u[:, -1] *= sign
+    rotation = u @ vt
+    scale = s.sum() / (centered_source**2).sum()
+    return scale * centered_source @ rotation.T + target_mean
+
+
+def test_jacobian_sparsity():
+    """
+    Test that the Jacobian has 12 non zeros per residual, so its size grows
+    linearly with the number of observations.
+    """
+    camera_indexes = np.array((0, 1, 1))
+    point_indexes = np.array((0, 0, 2))
+    sparsity = get_jacobian_sparsity(camera_indexes, point_indexes, 2, 3)
+    assert sparsity.shape == (6, 2 * 9 + 3 * 3), "Wrong shape"
+    assert sparsity.nnz == 6 * 12, "Wrong non zero count"
+    dense = sparsity.toarray()
+    assert dense[4, 9:18].all() and dense[4, 18 + 6 : 18 + 9].all(), "Wrong columns"
+    assert not dense[4, :9].any() and not dense[4, 18:24].any(), "Extra columns"
+
+
+def test_calibration_recovers_ground_truth():
+    """
+    Test that the intrinsics and LED positions are recovered from rough
+    camera estimates, and that a warm start converges faster.
+    """
+    cameras, xyz, observations, mask = make_scene()
+    cold = bundle_adjust(observations, mask, perturb_cameras(cameras), PRINCIPAL_POINT)
+    assert cold.success, "Solver didn't converge"
+    assert cold.rms_error < 0.5, "RMS error of %.2f pixels" % cold.rms_error
+    focal_errors = np.abs(cold.cameras[:, 6] / cameras[:, 6] - 1)
+    assert focal_errors.max() < 0.02, "Wrong focal lengths : %s" % focal_errors
+    # k1 and k2 are correlated over the small field of the LEDs, so the radial
+    # projections are compared instead.
+    radius = np.linspace(0, 0.25, 20)
+    radial_errors = np.abs(
+        radial_projection(cold.cameras, radius) - radial_projection(cameras, radius)
+    )
+    assert radial_errors.max() < 1, "Wrong distortion : %s" % radial_errors.max()
+    solved = ~np.isnan(cold.xyz).any(axis=1)
+    assert solved.sum() == (mask.sum(axis=1) >= 2).sum(), "LEDs not solved"
+    position_errors = np.linalg.norm(
+        align(cold.xyz[solved], xyz[solved]) - xyz[solved], axis=1
+    )
+    assert position_errors.max() < 0.02, "Wrong LED positions"
+
+    # A few LEDs moved and new ones appeared since the previous calibration.
+    moved = observations.copy()
+    moved[:10] += 2
+    previous_xyz = cold.xyz.copy()
+    previous_xyz[-20:] = np.nan
+    warm = bundle_adjust(moved, mask, cold.cameras, PRINCIPAL_POINT, previous_xyz)
+    assert warm.rms_error < 0.5, "Warm start RMS error of %.2f" % warm.rms_error
+    assert (
+        warm.evaluation_count < cold.evaluation_count
+    ), "Warm start didn't converge faster"
+
+
+@pytest.mark.parametrize("camera_count, focal", [(6, None), (4, 600), (8, 1500)])
+def test_calibration_from_observations(camera_count, focal):
+    """
+    Test that uncalibrated cameras are calibrated from the observations alone,
+    even with a wrong focal length guess.
+    """
+    cameras, xyz, observations, mask = make_scene(camera_count=camera_count, seed=5)
+    initial_cameras, initial_xyz = initialize_cameras(
+        observations, mask, PRINCIPAL_POINT, focal
+    )
+    calibration = bundle_adjust(
+        observations, mask, initial_cameras, PRINCIPAL_POINT, initial_xyz
+    )
+    assert calibration.success, "Solver didn't converge"
+    assert calibration.rms_error < 0.5, "RMS error of %.2f" % calibration.rms_error
+    focal_errors = np.abs(calibration.cameras[:, 6] / cameras[:, 6] - 1)
+    assert focal_errors.max() < 0.02, "Wrong focal lengths : %s" % focal_errors
+    solved = ~np.isnan(calibration.xyz).any(axis=1)
+    position_errors = np.linalg.norm(
+        align(calibration.xyz[solved], xyz[solved]) - xyz[solved], axis=1
+    )
+    assert position_errors.max() < 0.02, "Wrong LED positions"
+
+    with pytest.raises(ValueError):
+        initialize_cameras(observations[:5], mask[:5], PRINCIPAL_POINT)
+
+
+def test_calibration_scales_linearly():
+    """
+    Test that the time of an evaluation of the bundle adjustment grows
+    linearly with the number of LEDs, not cubically.
+    """
+    durations = {}
+    for led_count in (250, 500, 1000, 2000):
+        cameras, _, observations, mask = make_scene(led_count=led_count)
+        start = time.perf_counter()
+        calibration = bundle_adjust(
+            observations,
+            mask,
+            perturb_cameras(cameras),
+            PRINCIPAL_POINT,
+            max_evaluations=5,
+        )
+        durations[led_count] = (
+            time.perf_counter() - start
+        ) / calibration.evaluation_count
+    # 8 times more LEDs take 8 times longer when linear, 512 when cubic.
+    ratio = durations[2000] / durations[250]
+    assert ratio < 20, "Evaluations %.1f times longer : %s" % (ratio, durations)
+
+
+def test_robust_loss():
+    """
+    Test that misidentified LEDs spoil the calibration with the linear loss
+    but not with a robust loss.
+    """
+    cameras, xyz, observations, mask = make_scene(seed=2)
+    previous = bundle_adjust(
+        observations, mask, perturb_cameras(cameras), PRINCIPAL_POINT
+    )
+    rng = np.random.default_rng(3)
+    outliers = rng.random(mask.shape) < 0.05
+    observations[outliers] = rng.uniform(0, 1280, (outliers.sum(), 2))
+
+    focal_errors = {}
+    for loss in ("linear", "soft_l1"):
+        calibration = bundle_adjust(
+            observations,
+            mask,
+            previous.cameras,
+            PRINCIPAL_POINT,
+            previous.xyz,
+            loss=loss,
+            f_scale=2,
+            max_evaluations=20,
+        )
+        assert calibration.evaluation_count <= 20, "Too many evaluations"
+        focal_errors[loss] = np.abs(calibration.cameras[:, 6] / cameras[:, 6] - 1)
+    assert focal_errors["linear"].max() > 0.1, "Outliers without effect"
+    assert focal_errors["soft_l1"].max() < 0.02, "Wrong focal lengths : %s" % (
+        focal_errors["soft_l1"],
+    )
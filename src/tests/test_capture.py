@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the capture of camera frames into preallocated buffers and the camera
+agent streaming the detected LEDs.
+"""
+
+import threading
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from wlbb.lib.agent.agent import Status
+from wlbb.lib.agent.camera import WLBBCameraAgent, parse_region
+from wlbb.lib.vision.capture import (
+    FrameRing,
+    SyntheticSource,
+    create_source,
+    register_backend,
+)
+
+from .test_agent_runtime import run
+
+WIDTH, HEIGHT = 320, 240
+POSITIONS = [(40.3, 50.6), (120.0, 80.2), (200.7, 150.4), (280.2, 200.9)]
+
+
+#%% Frame ring
+
+
+def test_ring_recycles_buffers():
+    """
+    Test that frames are captured into the same buffers, and that the oldest
+    frames are dropped when the consumer doesn't keep up.
+    """
+    ring = FrameRing((4, 4), size=3)
+    for number in range(5):
+        slot, buffer = ring.acquire()
+        buffer[:] = number
+        ring.publish(slot, number, 0.0)
+    assert ring.dropped == 2 and ring.captured == 5, "Wrong frame counts"
+    assert len(ring) == 3, "Wrong queued frame count"
+
+    frames = [ring.get(0) for _ in range(3)]
+    assert [frame.number for frame in frames] == [2, 3, 4], "Wrong frames kept"
+    for frame in frames:
+        assert (frame.image == frame.number).all(), "Wrong frame content"
+        assert np.shares_memory(frame.image, ring.buffers), "Frame not in a buffer"
+    assert ring.get(0) is None, "Frame out of an empty ring"
+    assert ring.acquire(0.01) is None, "Buffer held by the consumer acquired"
+
+    # The capture waits for the consumer to release a buffer.
+    acquired = []
+    thread = threading.Thread(target=lambda: acquired.append(ring.acquire()))
+    thread.start()
+    time.sleep(0.05)
+    assert thread.is_alive() and not acquired, "Capture didn't wait"
+    ring.release(frames[0])
+    thread.join(5)
+    assert acquired[0][0] == frames[0].slot, "Released buffer not reused"
+
+    thread = threading.Thread(target=lambda: acquired.append(ring.acquire()))
+    thread.start()
+    ring.close()
+    thread.join(5)
+    assert acquired[1] is None, "Closed ring acquired"
+    assert ring.get() is None, "Closed ring blocked"
+    with pytest.raises(ValueError):
+        FrameRing((4, 4), size=1)
+
+
+def test_backends():
+    """
+    Test that camera sources are built by backend name.
+    """
+    register_backend("test_small", lambda: SyntheticSource(8, 6, frame_count=1))
+    source = create_source("test_small")
+    assert source.shape == (6, 8), "Wrong source"
+    buffer = np.zeros(source.shape, np.uint8)
+    assert source.read_into(buffer) and not source.read_into(buffer), "Wrong end"
+    with pytest.raises(ValueError):
+        create_source("unknown")
+    assert parse_region("10, 20,30,40") == (10, 20, 30, 40), "Wrong region"
+    assert parse_region("") is None, "Wrong empty region"
+
+
+#%% Camera agent
+
+
+def start_agent(region=None, step=1, frame_count=30, frame_rate=None):
+    """
+    Return a started camera agent seeing the LEDs of POSITIONS.
+    """
+    source = SyntheticSource(
+        WIDTH, HEIGHT, POSITIONS, frame_rate=frame_rate, frame_count=frame_count
+    )
+    agent = WLBBCameraAgent("test", source)
+    agent.region = region
+    agent.step = step
+    agent.init()
+    agent.start()
+    return agent
+
+
+def test_synthetic_pipeline():
+    """
+    Test that the LEDs in the region of the frames are found at their full
+    frame position, with the frames downsampled.
+    """
+    agent = start_agent(region=(100, 40, 260, 220), step=2)
+    try:
+        observations = list(agent.observations(timeout=5))
+    finally:
+        agent.stop()
+
+    assert observations, "No frame processed"
+    numbers = [observation.number for observation in observations]
+    assert numbers == sorted(set(numbers)), "Frames out of order"
+    assert numbers[-1] == 29, "Last frame missing"
+    assert len(observations) + agent.get_dropped_frames() == 30, "Frames lost"
+    expected = np.array(POSITIONS[1:3])
+    for observation in observations:
+        assert len(observation.blobs) == 2, "Wrong LEDs : %s" % observation.blobs
+        errors = np.abs(observation.blobs[:, :2] - expected)
+        assert errors.max() < 1.5, "Wrong positions : %s" % observation.blobs
+    assert agent.get_loop_stats()[0] == len(observations), "Wrong stats"
+
+
+def test_slow_consumer_drops_oldest_frames():
+    """
+    Test that a slow consumer gets the latest frames, the older ones being
+    dropped, without any new frame buffer.
+    """
+    agent = start_agent(frame_count=None, frame_rate=500)
+    buffers = agent.ring.buffers
+    numbers = []
+    try:
+        for frame in agent.frames(timeout=5):
+            assert np.shares_memory(frame.image, buffers), "Frame not in a buffer"
+            numbers.append(frame.number)
+            if len(numbers) == 5:
+                break
+            time.sleep(0.05)
+    finally:
+        agent.stop()
+    assert agent.ring.buffers is buffers, "Buffers reallocated"
+    assert agent.get_dropped_frames() > 0, "No frame dropped"
+    assert min(np.diff(numbers)) > 1, "Oldest frames not dropped : %s" % numbers
+
+
+class FailingSource(SyntheticSource):
+    """
+    A synthetic camera failing after `frame_count` frames.
+    """
+
+    def read_into(self, buffer):
+        if self.read_frames == self.frame_count:
+            raise OSError("Camera unplugged")
+        return super().read_into(buffer)
+
+
+def test_capture_failure():
+    """
+    Test that a capture failure makes the agent inactive and is raised to the
+    consumer once the frames captured before it are processed.
+    """
+    agent = WLBBCameraAgent("test", FailingSource(WIDTH, HEIGHT, frame_count=3))
+    agent.buffer_count = 4
+    agent.start()
+    numbers = []
+    try:
+        with pytest.raises(RuntimeError) as error:
+            for frame in agent.frames(timeout=5):
+                numbers.append(frame.number)
+        assert agent.status == Status.INACTIVE, "Agent still active"
+    finally:
+        agent.stop()
+    assert numbers == [0, 1, 2], "Frames lost : %s" % numbers
+    assert isinstance(error.value.__cause__, OSError), "Wrong cause"
+    assert isinstance(agent.capture_error, OSError), "Failure not recorded"
+
+
+def test_async_stream():
+    """
+    Test that the observations are streamed by an async iterator.
+    """
+    agent = start_agent(frame_count=10, frame_rate=200)
+
+    async def collect():
+        return [observation async for observation in agent.stream(timeout=5)]
+
+    try:
+        observations = run(collect())
+    finally:
+        agent.stop()
+    assert observations[-1].number == 9, "Stream stopped early"
+    assert all(
+        len(observation.blobs) == 4 for observation in observations
+    ), "Wrong LEDs"
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the configparser based config loader.
+"""
+
+import os
+
+import pytest
+
+from wlbb.lib.config import CfgConfigLoader
+from wlbb.lib.config.config_cache import ParsedConfigCache
+from wlbb.lib.config.config_dir_index import ConfigDirIndex
+
+
+def write_cfg(config_dir, config_name, content):
+    """
+    Write `content` in the config file `config_name` of `config_dir`.
+    """
+    path = os.path.join(str(config_dir), config_name + ".cfg")
+    with open(path, "w") as cfg:
+        cfg.write(content)
+    return path
+
+
+#%% Testing the parsed config cache
+
+
+def test_load_config_cached(tmp_path):
+    """
+    Check if loading an unchanged config twice only parses it once.
+    """
+    cache = ParsedConfigCache()
+    cfg_loader = CfgConfigLoader(cache)
+    write_cfg(tmp_path, "test", "[PARAM_GROUP1]\nparameter1 = 1\n")
+
+    first = cfg_loader.load_config(str(tmp_path), "test")
+    second = cfg_loader.load_config(str(tmp_path), "test")
+
+    assert first == second, "Testing cached load returned a different config."
+    assert first["PARAM_GROUP1"] == {"parameter1": "1"}
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses) == (1, 1), "Testing cache counters failed."
+
+
+def test_load_config_returns_copies(tmp_path):
+    """
+    Check if modifying a loaded config doesn't modify the cached one.
+    """
+    cfg_loader = CfgConfigLoader(ParsedConfigCache())
+    write_cfg(tmp_path, "test", "[PARAM_GROUP1]\nparameter1 = 1\n")
+
+    cfg_loader.load_config(str(tmp_path), "test")["PARAM_GROUP1"]["parameter1"] = "2"
+    frozen = cfg_loader.load_frozen_config(str(tmp_path), "test")
+
+    assert frozen["PARAM_GROUP1"]["parameter1"] == "1"
+    with pytest.raises(TypeError):
+        frozen["PARAM_GROUP1"]["parameter1"] = "2"
+
+
+def test_load_config_modified(tmp_path):
+    """
+    Check if a modified config is parsed again.
+    """
+    cache = ParsedConfigCache()
+    cfg_loader = CfgConfigLoader(cache)
+    path = write_cfg(tmp_path, "test", "[PARAM_GROUP1]\nparameter1 = 1\n")
+    cfg_loader.load_config(str(tmp_path), "test")
+
+    write_cfg(tmp_path, "test", "[PARAM_GROUP1]\nparameter1 = 10\n")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert cfg_loader.load_config(str(tmp_path), "test") == {
+        "WLBB_CONFIG": {},
+        "PARAM_GROUP1": {"parameter1": "10"},
+    }
+    assert cache.get_stats().misses == 2, "Testing cache invalidation failed."
+
+
+def test_load_config_no_leak(tmp_path):
+    """
+    Check if sections of a config don't appear in the next loaded config.
+    """
+    cfg_loader = CfgConfigLoader(ParsedConfigCache())
+    write_cfg(tmp_path, "first", "[PARAM_GROUP1]\nparameter1 = 1\n")
+    write_cfg(tmp_path, "second", "[PARAM_GROUP2]\nparameter3 = 3\n")
+
+    cfg_loader.load_config(str(tmp_path), "first")
+    second = cfg_loader.load_config(str(tmp_path), "second")
+
+    assert "PARAM_GROUP1" not in second, "Testing section leak between loads failed."
+
+
+def test_load_config_missing(tmp_path):
+    """
+    Check if loading a config which doesn't exist returns an empty dict.
+    """
+    cfg_loader = CfgConfigLoader(ParsedConfigCache())
+
+    assert cfg_loader.load_config(str(tmp_path), "missing") == {}
+    assert cfg_loader.load_config(str(tmp_path / "missing_dir"), "missing") == {}
+
+
+def test_cache_lru_eviction(tmp_path):
+    """
+    Check if the least recently used config is evicted first.
+    """
+    cache = ParsedConfigCache(maxsize=2)
+    cfg_loader = CfgConfigLoader(cache)
+    for name in ("first", "second", "third"):
+        write_cfg(tmp_path, name, "[PARAM_GROUP1]\nparameter1 = 1\n")
+
+    cfg_loader.load_config(str(tmp_path), "first")
+    cfg_loader.load_config(str(tmp_path), "second")
+    cfg_loader.load_config(str(tmp_path), "first")
+    cfg_loader.load_config(str(tmp_path), "third")
+    cfg_loader.load_config(str(tmp_path), "first")
+
+    stats = cache.get_stats()
+    assert (stats.hits, stats.misses, stats.evictions, stats.size) == (2, 3, 1, 2)
+
+
+#%% Testing the config directory index
+
+
+def test_get_config_list(tmp_path):
+    """
+    Check if only the files with the loader's extension are listed.
+    """
+    cfg_loader = CfgConfigLoader(dir_index=ConfigDirIndex("cfg"))
+    write_cfg(tmp_path, "first", "")
+    write_cfg(tmp_path, "second", "")
+    (tmp_path / "other.txt").write_text("")
+    (tmp_path / "cfg").write_text("")
+
+    assert sorted(cfg_loader.get_config_list(str(tmp_path))) == ["first", "second"]
+    assert cfg_loader.get_config_list(str(tmp_path / "missing_dir")) == []
+
+
+def test_create_delete_config_indexed(tmp_path):
+    """
+    Check if creating and deleting configs keeps the index up to date without
+    scanning the directory again.
+    """
+    dir_index = ConfigDirIndex("cfg")
+    cfg_loader = CfgConfigLoader(dir_index=dir_index)
+
+    cfg_loader.create_config(str(tmp_path), "test")
+    assert os.path.isfile(os.path.join(str(tmp_path), "test.cfg"))
+    assert cfg_loader.get_config_list(str(tmp_path)) == ["test"]
+
+    cfg_loader.delete_config(str(tmp_path), "test")
+    assert not os.path.exists(os.path.join(str(tmp_path), "test.cfg"))
+    assert cfg_loader.get_config_list(str(tmp_path)) == []
+
+    assert dir_index.scans == 1, "Testing incremental index update failed."
+
+
+def test_index_external_change(tmp_path):
+    """
+    Check if a config created by someone else is found once the directory's
+    mtime changed.
+    """
+    dir_index = ConfigDirIndex("cfg")
+    cfg_loader = CfgConfigLoader(dir_index=dir_index)
+    cfg_loader.create_config(str(tmp_path), "test")
+
+    write_cfg(tmp_path, "external", "")
+    stat = os.stat(str(tmp_path))
+    os.utime(str(tmp_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    assert dir_index.contains(str(tmp_path), "external")
+    assert dir_index.scans == 2
+
+
+def test_index_change_during_save(tmp_path):
+    """
+    Check if a config created by someone else since the last scan isn't
+    hidden by the directory's mtime after a save.
+    """
+    dir_index = ConfigDirIndex("cfg")
+    cfg_loader = CfgConfigLoader(dir_index=dir_index)
+    cfg_loader.create_config(str(tmp_path), "test")
+
+    write_cfg(tmp_path, "external", "")
+    stat = os.stat(str(tmp_path))
+    os.utime(str(tmp_path), ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    cfg_loader.save_config({}, str(tmp_path), "saved")
+
+    assert sorted(cfg_loader.get_config_list(str(tmp_path))) == [
+        "external",
+        "saved",
+        "test",
+    ], "Testing concurrent creation failed."
+
+
+#%% Testing saves
+
+
+def test_save_config_atomic(tmp_path):
+    """
+    Check if a saved config can be loaded back and no temporary file is left.
+    """
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    cfg_loader.load_config(str(tmp_path), "test")
+
+    cfg_loader.save_config({"PARAM_GROUP1": {"parameter1": 1}}, str(tmp_path), "test")
+    cfg_loader.save_config({"PARAM_GROUP1": {"parameter1": 2}}, str(tmp_path), "test")
+
+    assert os.listdir(str(tmp_path)) == ["test.cfg"]
+    assert cfg_loader.get_config_list(str(tmp_path)) == ["test"]
+    assert cfg_loader.load_config(str(tmp_path), "test")["PARAM_GROUP1"] == {
+        "parameter1": "2"
+    }
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the config watcher.
+"""
+
+import os
+import sys
+
+import pytest
+
+from wlbb.lib.config import CfgConfigLoader, ConfigWatcher, WLBBConfig
+from wlbb.lib.config import config_cache
+from wlbb.lib.config import watcher as watcher_module
+from wlbb.lib.config.config_cache import ParsedConfigCache
+from wlbb.lib.config.config_diff import SectionDiff, diff_config
+from wlbb.lib.config.config_dir_index import ConfigDirIndex
+from wlbb.lib.config.default import SITE_CFG_NAME
+from wlbb.lib.paths import get_config_dir
+
+from . import WLBBDummyAgent
+from .test_cfg_config_loader import write_cfg
+
+
+class WLBBWatchingDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent recording the config changes pushed to it.
+    """
+
+    config_schema = {"PARAM_GROUP1": {"parameter1": int}}
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.config_diffs = []
+
+    def config_changed(self, config_diff):
+        self.config_diffs.append(config_diff)
+
+
+def touch_later(path):
+    """
+    Make sure the mtime of `path` changed.
+    """
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+
+def make_agent(config_dir, cfg_loader, name="test_agent"):
+    """
+    Return a watching dummy agent whose config is loaded from `config_dir`.
+    """
+    agent = WLBBWatchingDummyAgent(name)
+    config = WLBBConfig(agent)
+    config.import_dict(cfg_loader.load_config(config_dir, name), cfg_loader=cfg_loader)
+    agent.set_config(config)
+    return agent
+
+
+def test_diff_config():
+    """
+    Check if only the changed sections and parameters are in a config diff.
+    """
+    old_config = {
+        "PARAM_GROUP1": {"parameter1": 1, "parameter2": 2},
+        "PARAM_GROUP2": {"parameter3": 3},
+    }
+    new_config = {
+        "PARAM_GROUP1": {"parameter1": 10, "parameter5": 5},
+        "PARAM_GROUP2": {"parameter3": 3},
+    }
+
+    assert diff_config(old_config, new_config) == {
+        "PARAM_GROUP1": SectionDiff(
+            {"parameter1": 10, "parameter5": 5}, ("parameter2",)
+        )
+    }
+
+
+def test_watcher_push_changes(tmp_path):
+    """
+    Check if the changed sections are applied and pushed to the agent.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    path = write_cfg(
+        config_dir,
+        "test_agent",
+        "[PARAM_GROUP1]\nparameter1 = 1\n[PARAM_GROUP2]\nparameter3 = 3\n",
+    )
+    agent = make_agent(config_dir, cfg_loader)
+    watcher = ConfigWatcher(cfg_loader, config_dir)
+    watcher.watch(agent)
+
+    assert watcher.poll() == {}, "Testing unchanged config failed."
+
+    write_cfg(
+        config_dir,
+        "test_agent",
+        "[PARAM_GROUP1]\nparameter1 = 2\n[PARAM_GROUP2]\nparameter3 = 3\n",
+    )
+    touch_later(path)
+    diffs = watcher.poll()
+
+    expected_diff = {"PARAM_GROUP1": SectionDiff({"parameter1": 2}, ())}
+    assert diffs == {agent.agent_id: expected_diff}
+    assert agent.config_diffs == [expected_diff]
+    assert agent.get_config().get_parameter("PARAM_GROUP1", "parameter1") == 2
+
+
+def test_watcher_only_changed_files(tmp_path):
+    """
+    Check if only the agents whose config file changed are updated.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    paths = {}
+    agents = []
+    watcher = ConfigWatcher(cfg_loader, config_dir)
+    for name in ("agent_a", "agent_b"):
+        paths[name] = write_cfg(config_dir, name, "[PARAM_GROUP1]\nparameter1 = 1\n")
+        agents.append(make_agent(config_dir, cfg_loader, name))
+        watcher.watch(agents[-1])
+
+    write_cfg(config_dir, "agent_b", "[PARAM_GROUP1]\nparameter1 = 3\n")
+    touch_later(paths["agent_b"])
+    misses = cfg_loader.cache.get_stats().misses
+    watcher.poll()
+
+    assert [len(agent.config_diffs) for agent in agents] == [0, 1]
+    assert cfg_loader.cache.get_stats().misses == misses + 1
+
+
+def test_watcher_dir_mtime(tmp_path):
+    """
+    Check if a config saved by a config loader is detected when only the config
+    directory's mtime is checked, and a config modified in place once notified.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    write_cfg(config_dir, "test_agent", "[PARAM_GROUP1]\nparameter1 = 1\n")
+    agent = make_agent(config_dir, cfg_loader)
+    watcher = ConfigWatcher(cfg_loader, config_dir, use_inotify=False)
+    watcher.watch(agent)
+    watcher.poll()
+
+    cfg_loader.save_config(
+        {"PARAM_GROUP1": {"parameter1": 4}}, config_dir, "test_agent"
+    )
+    touch_later(config_dir)
+    watcher.poll()
+
+    assert agent.get_config().get_parameter("PARAM_GROUP1", "parameter1") == 4
+
+    path = write_cfg(config_dir, "test_agent", "[PARAM_GROUP1]\nparameter1 = 5\n")
+    touch_later(path)
+    watcher.poll()
+    assert agent.get_config().get_parameter("PARAM_GROUP1", "parameter1") == 4
+    watcher.notify("test_agent")
+    watcher.poll()
+    assert agent.get_config().get_parameter("PARAM_GROUP1", "parameter1") == 5
+
+
+def test_watcher_removed_section(tmp_path):
+    """
+    Check if a section removed from a config file is removed from the agent's
+    config.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    path = write_cfg(
+        config_dir,
+        "test_agent",
+        "[PARAM_GROUP1]\nparameter1 = 1\n[PARAM_GROUP2]\nparameter3 = 3\n",
+    )
+    agent = make_agent(config_dir, cfg_loader)
+    watcher = ConfigWatcher(cfg_loader, config_dir)
+    watcher.watch(agent)
+
+    write_cfg(config_dir, "test_agent", "[PARAM_GROUP1]\nparameter1 = 1\n")
+    touch_later(path)
+    watcher.poll()
+
+    config = agent.get_config()
+    assert config.get_config_section("PARAM_GROUP2") is None, "Section left"
+    assert "PARAM_GROUP2" not in config.get_config_view(), "Section view left"
+    assert config.get_config_dict() == {"PARAM_GROUP1": {"parameter1": 1}}
+
+
+@pytest.mark.parametrize(
+    "stat_all, use_inotify", [(True, False), (False, True), (False, False)]
+)
+def test_watcher_site_config(monkeypatch, tmp_path, stat_all, use_inotify):
+    """
+    Check if a change of the site-wide config is pushed to every agent.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    config_dir = get_config_dir()
+    os.makedirs(config_dir)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    watcher = ConfigWatcher(cfg_loader, config_dir, stat_all, use_inotify)
+    agents = []
+    for name in ("agent_a", "agent_b"):
+        write_cfg(config_dir, name, "[PARAM_GROUP1]\nparameter1 = 1\n")
+        agents.append(make_agent(config_dir, cfg_loader, name))
+        watcher.watch(agents[-1])
+    assert watcher.poll() == {}, "Testing unchanged config failed."
+
+    cfg_loader.save_config(
+        {"PARAM_GROUP2": {"parameter3": "3"}}, config_dir, SITE_CFG_NAME
+    )
+    touch_later(config_dir)
+    diffs = watcher.poll()
+
+    expected_diff = {"PARAM_GROUP2": SectionDiff({"parameter3": "3"}, ())}
+    assert diffs == {agent.agent_id: expected_diff for agent in agents}
+
+
+@pytest.mark.parametrize("use_inotify", [True, False])
+def test_watcher_stats_changed_files_only(monkeypatch, tmp_path, use_inotify):
+    """
+    Check if only the changed config files are stated by default.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    watcher = ConfigWatcher(cfg_loader, config_dir, use_inotify=use_inotify)
+    agents = []
+    for index in range(20):
+        name = "agent_%d" % index
+        write_cfg(config_dir, name, "[PARAM_GROUP1]\nparameter1 = 1\n")
+        agents.append(make_agent(config_dir, cfg_loader, name))
+        watcher.watch(agents[-1])
+    touch_later(config_dir)
+    watcher.poll()
+
+    stated_paths = []
+
+    def get_file_signature(path):
+        stated_paths.append(os.path.basename(path))
+        return config_cache.get_file_signature(path)
+
+    monkeypatch.setattr(watcher_module, "get_file_signature", get_file_signature)
+    cfg_loader.save_config({"PARAM_GROUP1": {"parameter1": 2}}, config_dir, "agent_7")
+    touch_later(config_dir)
+    diffs = watcher.poll()
+
+    assert list(diffs) == [agents[7].agent_id], "Wrong agents updated"
+    assert "agent_7.cfg" in stated_paths, "Replaced file not stated"
+    assert len(stated_paths) <= 2, "Unchanged files stated : %s" % stated_paths
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="No inotify.")
+def test_watcher_inotify_in_place(monkeypatch, tmp_path):
+    """
+    Check if a config modified in place is detected without notification nor
+    stating the unchanged config files.
+    """
+    config_dir = str(tmp_path)
+    cfg_loader = CfgConfigLoader(ParsedConfigCache(), ConfigDirIndex("cfg"))
+    watcher = ConfigWatcher(cfg_loader, config_dir)
+    agents = []
+    for index in range(20):
+        name = "agent_%d" % index
+        write_cfg(config_dir, name, "[PARAM_GROUP1]\nparameter1 = 1\n")
+        agents.append(make_agent(config_dir, cfg_loader, name))
+        watcher.watch(agents[-1])
+    watcher.poll()
+
+    stated_paths = []
+
+    def get_file_signature(path):
+        stated_paths.append(os.path.basename(path))
+        return config_cache.get_file_signature(path)
+
+    monkeypatch.setattr(watcher_module, "get_file_signature", get_file_signature)
+    with open(os.path.join(config_dir, "agent_3.cfg"), "a") as file:
+        file.write("parameter2 = 2\n")
+    try:
+        diffs = watcher.poll()
+    finally:
+        watcher.close()
+
+    assert list(diffs) == [agents[3].agent_id], "In place change missed"
+    # The site-wide config, out of the config directory, is stated too.
+    assert "agent_3.cfg" in stated_paths, "Changed file not stated"
+    assert len(stated_paths) <= 2, "Unchanged files stated : %s" % stated_paths
@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the fan-out of LED frames to LED controllers.
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from wlbb.lib.network.client import WLBBClient
+from wlbb.lib.network.fanout import FramePool, LedFrameFanout
+from wlbb.lib.network.server import WLBBNetworkServer
+
+from .test_agent_runtime import run
+
+LED_COUNT = 10_000
+CONTROLLER_COUNT = 20
+LEDS_PER_CONTROLLER = LED_COUNT // CONTROLLER_COUNT
+
+
+#%% Frame pool
+
+
+def test_frame_pool():
+    """
+    Test that frames are taken from and given back to the pool.
+    """
+    pool = FramePool(12, count=2)
+    first = pool.acquire()
+    second = pool.acquire()
+    assert first is not second, "Frame acquired twice"
+    with pytest.raises(RuntimeError):
+        pool.acquire()
+    pool.release(first)
+    assert pool.acquire() is first, "Frame wasn't reused"
+    assert len(second.buffer) == 12, "Wrong frame size"
+
+
+#%% Fan-out
+
+
+async def connect_controllers(server, fanout):
+    """
+    Connect a client for each controller and return them with the frames they
+    receive.
+    """
+    clients = []
+    received = {}
+    for controller in range(CONTROLLER_COUNT):
+        client = WLBBClient("leds-controller%d" % controller)
+        received[controller] = []
+        client.on_led_frame = lambda controller, number, colors: received[
+            controller
+        ].append((number, bytes(colors)))
+        await client.connect("127.0.0.1", server.port)
+        clients.append(client)
+
+    sessions = {session.agent_id: session for session in server.get_sessions()}
+    for controller in range(CONTROLLER_COUNT):
+        fanout.add_controller(
+            sessions["leds-controller%d" % controller].transport,
+            controller,
+            controller * LEDS_PER_CONTROLLER,
+            LEDS_PER_CONTROLLER,
+        )
+    return clients, received
+
+
+def test_fanout_slices():
+    """
+    Test that every controller receives its slice of every frame.
+    """
+    server = WLBBNetworkServer()
+    fanout = LedFrameFanout(LED_COUNT)
+    frame_count = 60
+
+    async def scenario():
+        await server.start()
+        clients, received = await connect_controllers(server, fanout)
+        begin = time.perf_counter()
+        for frame_number in range(frame_count):
+            frame = fanout.acquire_frame()
+            frame.buffer[:] = bytes([frame_number]) * len(frame.buffer)
+            for controller in range(CONTROLLER_COUNT):
+                start = controller * LEDS_PER_CONTROLLER * 3
+                frame.buffer[start] = controller
+            fanout.send_frame(frame, frame_number)
+            fanout.release_frame(frame)
+            await asyncio.sleep(0)
+        duration = time.perf_counter() - begin
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline and any(
+            len(frames) < frame_count for frames in received.values()
+        ):
+            await asyncio.sleep(0.01)
+        for client in clients:
+            await client.close()
+        fanout.close()
+        await server.stop()
+        return received, duration
+
+    received, duration = run(scenario())
+
+    assert duration < 1.0, "Sending 60 frames took %.2f seconds" % duration
+    for controller, frames in received.items():
+        assert [number for number, _ in frames] == list(range(frame_count))
+        number, colors = frames[7]
+        assert len(colors) == LEDS_PER_CONTROLLER * 3, "Wrong slice size"
+        assert colors[0] == controller, "Wrong slice"
+        assert colors[1:] == bytes([7]) * (len(colors) - 1), "Wrong colors"
+    stats = fanout.get_stats()
+    assert stats.frames == frame_count, "Wrong frame count"
+    assert stats.direct > 0, "No frame was sent without copy"
+    assert stats.dropped == 0, "Frames were dropped"
+
+
+def test_slow_controller_skips_frames():
+    """
+    Test that a controller which doesn't read its frames skips them instead of
+    buffering them.
+    """
+    server = WLBBNetworkServer()
+    fanout = LedFrameFanout(100_000, max_buffered=1 << 16)
+
+    async def scenario():
+        await server.start()
+        client = WLBBClient("leds-slow")
+        await client.connect("127.0.0.1", server.port)
+        client.transport.pause_reading()
+        fanout.add_controller(server.get_sessions()[0].transport, 0, 0, 100_000)
+        frame = fanout.acquire_frame()
+        for frame_number in range(200):
+            fanout.send_frame(frame, frame_number)
+            await asyncio.sleep(0)
+        stats = fanout.get_stats()
+        client.transport.resume_reading()
+        await client.close()
+        fanout.close()
+        await server.stop()
+        return stats
+
+    stats = run(scenario())
+    assert stats.copied > 0, "Partial sends weren't queued"
+    assert stats.dropped > 0, "Slow controller didn't skip frames"
+
+
+def test_closed_connection_removed():
+    """
+    Test that only the closed connection of a controller stops receiving
+    frames, not its other connections.
+    """
+    server = WLBBNetworkServer()
+    fanout = LedFrameFanout(10)
+
+    async def scenario():
+        await server.start()
+        clients = []
+        received = {}
+        for name in ("first", "second"):
+            client = WLBBClient("leds-" + name)
+            received[name] = []
+            client.on_led_frame = lambda controller, number, colors, name=name: (
+                received[name].append(number)
+            )
+            await client.connect("127.0.0.1", server.port)
+            clients.append(client)
+        for session in server.get_sessions():
+            fanout.add_controller(session.transport, 0, 0, 10)
+
+        frame = fanout.acquire_frame()
+        await clients[0].close()
+        deadline = time.monotonic() + 5
+        while len(server.get_sessions()) > 1 and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        for frame_number in range(3):
+            fanout.send_frame(frame, frame_number)
+        await clients[1].ping(timeout=5)
+        await clients[1].close()
+        fanout.close()
+        await server.stop()
+        return received
+
+    received = run(scenario())
+    assert received["first"] == [], "Closed connection received frames"
+    assert received["second"] == [0, 1, 2], "Live connection removed"
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the agent heartbeats and the health table.
+"""
+
+import time
+import asyncio
+
+from wlbb.lib.agent.agent import Status
+from wlbb.lib.agent.heartbeat import (
+    HEARTBEAT_SIZE,
+    HealthTable,
+    HeartbeatEmitter,
+    HeartbeatEncoder,
+    decode_heartbeat,
+    get_rss,
+)
+from wlbb.lib.agent.server import WLBBServer
+from wlbb.lib.config.default import (
+    DEFAULT_CFG_NAME,
+    get_builtin_default_config_dir as get_default_config_dir,
+)
+from wlbb.lib.network.client import WLBBClient
+
+from . import TestingConfigLoader, WLBBDummyAgent
+from .test_agent_runtime import run
+
+
+class WLBBLoopDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent reporting loop statistics.
+    """
+
+    def get_loop_stats(self):
+        return 42, 0.004, 3
+
+
+#%% Encoding
+
+
+def test_encode_decode():
+    """
+    Test that heartbeats are decoded as they were encoded.
+    """
+    wlbb_agent = WLBBDummyAgent("test")
+    wlbb_agent.start()
+    encoder = HeartbeatEncoder(wlbb_agent)
+
+    packed = encoder.encode(1234, 0.5, 7, rss=1 << 33, timestamp=10.0)
+    assert len(packed) == HEARTBEAT_SIZE, "Heartbeat size isn't fixed"
+
+    heartbeat = decode_heartbeat(packed)
+    assert heartbeat.agent_id == "dummy-test", "Wrong agent id"
+    assert heartbeat.status is Status.ACTIVE, "Wrong status"
+    assert heartbeat.iteration == 1234, "Wrong iteration count"
+    assert heartbeat.latency == 0.5, "Wrong latency"
+    assert heartbeat.queue_depth == 7, "Wrong queue depth"
+    assert heartbeat.rss == 1 << 33, "Wrong RSS"
+    assert heartbeat.timestamp == 10.0, "Wrong timestamp"
+
+
+def test_buffer_is_reused():
+    """
+    Test that the encoder packs every heartbeat in the same buffer.
+    """
+    encoder = HeartbeatEncoder(WLBBDummyAgent("test"))
+    first = encoder.encode(1)
+    second = encoder.encode(2)
+    assert first.obj is second.obj, "Buffer wasn't reused"
+    assert decode_heartbeat(first).iteration == 2, "Buffer wasn't overwritten"
+
+
+def test_rss():
+    """
+    Test that the RSS of the current process is measured.
+    """
+    assert get_rss() > 0, "RSS wasn't measured"
+
+
+#%% Emitter
+
+
+def test_emitter():
+    """
+    Test that the emitter sends the agent's loop statistics periodically.
+    """
+    heartbeats = []
+    emitter = HeartbeatEmitter(
+        WLBBLoopDummyAgent("test"),
+        lambda packed: heartbeats.append(decode_heartbeat(packed)),
+        interval=0.01,
+    )
+    emitter.start()
+    time.sleep(0.1)
+    emitter.stop()
+
+    assert len(heartbeats) >= 3, "Heartbeats weren't sent periodically"
+    assert heartbeats[0].iteration == 42, "Wrong iteration count"
+    assert heartbeats[0].queue_depth == 3, "Wrong queue depth"
+
+
+#%% Health table
+
+
+def test_health_table():
+    """
+    Test that the health table tracks the last heartbeat of each agent and
+    finds the stale ones.
+    """
+    table = HealthTable(stale_after=1.0)
+    encoders = [HeartbeatEncoder(WLBBDummyAgent("agent%d" % i)) for i in range(3)]
+    for i, encoder in enumerate(encoders):
+        table.update(encoder.encode(i), received_at=100.0 + i)
+
+    assert len(table) == 3, "Wrong agent count"
+    assert table.get_stale_agents(now=101.5) == ["dummy-agent0"], "Wrong stale"
+
+    table.update(encoders[0].encode(10), received_at=102.0)
+    assert table.get_stale_agents(now=102.5) == ["dummy-agent1"], "Wrong stale"
+    assert table.get_heartbeat("dummy-agent0").iteration == 10, "Not updated"
+    assert not table.is_stale("dummy-agent0", now=102.5), "Fresh agent is stale"
+    assert table.is_stale("dummy-unknown"), "Unknown agent isn't stale"
+
+    table.remove("dummy-agent1")
+    assert table.get_stale_agents(now=102.5) == [], "Removed agent is stale"
+    assert set(table.get_heartbeats()) == {"dummy-agent0", "dummy-agent2"}
+
+
+#%% Server
+
+
+def test_server_health_table():
+    """
+    Test that the server records the heartbeats sent by its agents and closes
+    the connection of an agent sending the heartbeats of another.
+    """
+    server = WLBBServer()
+    server.config_loader = TestingConfigLoader(
+        {get_default_config_dir(): {DEFAULT_CFG_NAME: {"SERVER": {"port": "0"}}}}
+    )
+    wlbb_agent = WLBBLoopDummyAgent("test")
+
+    async def send_heartbeats(port):
+        client = WLBBClient(wlbb_agent.agent_id)
+        await client.connect("127.0.0.1", port)
+        emitter = HeartbeatEmitter(wlbb_agent, client.send_heartbeat, 0.01)
+        emitter.start()
+        await asyncio.sleep(0.1)
+        emitter.stop()
+        await client.ping()
+        await client.close()
+
+        spoofer = WLBBClient("dummy-spoofer")
+        await spoofer.connect("127.0.0.1", port)
+        spoofer.send_heartbeat(HeartbeatEncoder(wlbb_agent).encode())
+        await asyncio.wait_for(spoofer._closed, 5)
+
+    server.start()
+    try:
+        run(send_heartbeats(server.network_server.port))
+    finally:
+        server.stop()
+    heartbeat = server.get_health_table().get_heartbeat("dummy-test")
+    assert heartbeat is not None, "Heartbeats not recorded"
+    assert heartbeat.iteration == 42, "Wrong heartbeat recorded : %s" % (heartbeat,)
+    assert len(server.get_health_table()) == 1, "Spoofed heartbeat recorded"
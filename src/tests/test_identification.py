@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the identification of LEDs by Gray code sequences.
+"""
+
+import time
+import asyncio
+import itertools
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from wlbb.lib.vision.blobs import BlobDetector
+from wlbb.lib.vision.identification import GrayCodeIdentifier, GrayCodeSequence
+from wlbb.lib.agent.processing import WLBBProcessingAgent
+from wlbb.lib.agent.server import WLBBServer
+from wlbb.lib.config.default import (
+    DEFAULT_CFG_NAME,
+    get_builtin_default_config_dir as get_default_config_dir,
+)
+from wlbb.lib.network.client import WLBBClient
+from wlbb.lib.profile import create_profile, get_profile_path
+
+from . import TestingConfigLoader
+from .test_agent_runtime import run
+
+HEIGHT, WIDTH = 480, 640
+
+
+def render_sequence(identifier, positions, brightness, rng, flicker=0.0):
+    """
+    Return the frames of the sequence of `identifier` seen by a still camera,
+    with sensor noise and LEDs randomly dimmed in a `flicker` part of the
+    frames, and the dark frame.
+    """
+    rows, cols = np.mgrid[-4:5, -4:5]
+    dark = rng.integers(0, 20, (HEIGHT, WIDTH)).astype(float)
+    frames = []
+    for frame_index in range(identifier.frame_count):
+        light = np.zeros((HEIGHT, WIDTH))
+        states = identifier.get_frame_states(frame_index)
+        dimmed = rng.random(len(positions)) < flicker
+        for (u, v), level, lit, dim in zip(positions, brightness, states, dimmed):
+            if not lit:
+                continue
+            r, c = int(v), int(u)
+            spot = np.exp(-((cols + c - u) ** 2 + (rows + r - v) ** 2) / 3)
+            light[r - 4 : r + 5, c - 4 : c + 5] += level * (0.6 if dim else 1) * spot
+        noise = rng.normal(0, 3, (HEIGHT, WIDTH))
+        frames.append(np.clip(dark + light + noise, 0, 255).astype(np.uint8))
+    return np.stack(frames), dark.astype(np.uint8)
+
+
+#%% Codes
+
+
+def test_code_words():
+    """
+    Test that every LED has a distinct code word decoded to its index and that
+    the sequence is about 2 * log2(N) frames long.
+    """
+    identifier = GrayCodeIdentifier(5000)
+    words = identifier.code_words
+    assert len({row.tobytes() for row in words}) == 5000, "Code words not distinct"
+    assert (identifier.decode(words) == np.arange(5000)).all(), "Wrong decoding"
+    assert identifier.data_bits == 13, "Wrong data bit count"
+    assert identifier.frame_count <= 2 * (13 + 5), "Sequence too long"
+
+    # Gray code: consecutive LEDs differ by one index bit.
+    changes = (words[1:, :13] != words[:-1, :13]).sum(axis=1)
+    assert (changes == 1).all(), "Not a Gray code"
+
+    # Every LED is lit in exactly one frame of every pair.
+    for frame_index in range(0, identifier.frame_count, 2):
+        states = identifier.get_frame_states(frame_index)
+        complement = identifier.get_frame_states(frame_index + 1)
+        assert (states ^ complement).all(), "Frames aren't complementary"
+
+    colors = np.ones((5000, 3), np.uint8)
+    identifier.render_frame(1, colors)
+    assert (colors[~words[:, 0]] == 255).all(), "LED not lit"
+    assert (colors[words[:, 0]] == 0).all(), "LED not turned off"
+
+
+def test_error_detection():
+    """
+    Test that code words with one or two wrong bits are rejected.
+    """
+    identifier = GrayCodeIdentifier(1000)
+    words = identifier.code_words[::7]
+    for flipped in itertools.chain(
+        itertools.combinations(range(identifier.bit_count), 1),
+        itertools.combinations(range(identifier.bit_count), 2),
+    ):
+        corrupted = words.copy()
+        corrupted[:, flipped] ^= True
+        assert (identifier.decode(corrupted) == -1).all(), "Error in %s missed" % (
+            flipped,
+        )
+    with pytest.raises(ValueError):
+        GrayCodeIdentifier(1000, check_bits=3)
+
+
+#%% Synthetic scene
+
+
+def test_synthetic_recovery():
+    """
+    Test that the LEDs of a synthetic scene are identified despite noise,
+    uneven brightness and flicker, and that no LED is misidentified.
+    """
+    rng = np.random.default_rng(1)
+    led_count = 300
+    grid = np.stack(np.meshgrid(np.arange(20, WIDTH - 20, 30), np.arange(20, 460, 30)))
+    positions = grid.reshape(2, -1).T.astype(float)
+    positions = positions[rng.permutation(len(positions))[:led_count]]
+    positions += rng.uniform(-4, 4, positions.shape)
+    brightness = rng.uniform(80, 250, led_count)
+
+    identifier = GrayCodeIdentifier(led_count)
+    frames, dark = render_sequence(identifier, positions, brightness, rng, 0.02)
+
+    agent = WLBBProcessingAgent("test")
+    agent.init()
+    agent.set_dark_frame(dark)
+    blobs, led_indexes = agent.identify(frames, identifier)
+
+    identified = led_indexes >= 0
+    errors = np.hypot(*(blobs[identified, :2] - positions[led_indexes[identified]]).T)
+    recovery = len(set(led_indexes[identified])) / led_count
+    assert len(blobs) == led_count, "Wrong blob count : %d" % len(blobs)
+    assert recovery >= 0.95, "Only %.1f %% of the LEDs identified" % (100 * recovery)
+    assert (errors < 1).all(), "Misidentified LEDs"
+
+
+def test_wrong_frame_count():
+    """
+    Test that a sequence with missing frames is refused.
+    """
+    agent = WLBBProcessingAgent("test")
+    identifier = GrayCodeIdentifier(10)
+    with pytest.raises(ValueError):
+        agent.identify(np.zeros((3, 10, 10), np.uint8), identifier)
+
+
+#%% Sequence driver
+
+LED_COUNT = 50
+CONTROLLERS = np.arange(LED_COUNT) % 3
+CHANNELS = np.arange(LED_COUNT) // 3
+
+
+def get_sent_intensities(sent):
+    """
+    Return the red level of every LED in every frame, `sent` being the
+    (controller, colors) of the frames sent to the controllers, in order.
+    """
+    frames = {}
+    for controller, colors in sent:
+        frames.setdefault(controller, []).append(
+            np.frombuffer(colors, np.uint8).reshape(-1, 3)[:, 0]
+        )
+    return np.stack(
+        [
+            np.array(frames[controller])[:, channel]
+            for controller, channel in zip(CONTROLLERS, CHANNELS)
+        ]
+    )
+
+
+def test_sequence_driver():
+    """
+    Test that every frame of the sequence is sent to the controllers and held
+    for the given number of ticks, then every LED is turned off.
+    """
+    identifier = GrayCodeIdentifier(LED_COUNT)
+    sent = []
+    sequence = GrayCodeSequence(
+        identifier,
+        CONTROLLERS,
+        CHANNELS,
+        lambda controller, tick, colors: sent.append((controller, bytes(colors))),
+        hold_ticks=3,
+    )
+    tick = 10
+    while sequence.tick(tick):
+        tick += 1
+
+    frame_count = identifier.frame_count
+    assert sequence.frame_ticks == list(range(10, 10 + 3 * frame_count, 3))
+    assert len(sent) == 3 * (frame_count + 1), "Wrong number of frames sent"
+    intensities = get_sent_intensities(sent)
+    assert not intensities[:, -1].any(), "LEDs not turned off"
+    indexes = identifier.decode_intensities(intensities[:, :-1])
+    assert (indexes == np.arange(LED_COUNT)).all(), "Wrong code words sent"
+    assert not sequence.tick(tick + 1), "Sequence restarted"
+
+
+def test_server_identification(monkeypatch, tmp_path):
+    """
+    Test that the server drives the LED controllers through the sequence
+    identifying the LEDs of its profile.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    create_profile(
+        get_profile_path("garden"),
+        range(LED_COUNT),
+        controllers=CONTROLLERS.tolist(),
+        channels=CHANNELS.tolist(),
+    ).close()
+    server = WLBBServer()
+    server.config_loader = TestingConfigLoader(
+        {
+            get_default_config_dir(): {
+                DEFAULT_CFG_NAME: {
+                    "SERVER": {"port": "0", "frame_rate": "500", "profile": "garden"}
+                }
+            }
+        }
+    )
+    sent = []
+
+    async def receive_sequence(port):
+        client = WLBBClient("leds-controllers")
+        client.on_led_frame = lambda controller, number, colors: sent.append(
+            (controller, bytes(colors))
+        )
+        await client.connect("127.0.0.1", port)
+        sequence = server.start_identification(hold_ticks=2)
+        deadline = time.monotonic() + 5
+        while server.identification is not None and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+        await client.ping(timeout=5)
+        await client.close()
+        return sequence
+
+    server.start()
+    try:
+        sequence = run(receive_sequence(server.network_server.port))
+    finally:
+        server.stop()
+        server.get_profile().close()
+
+    assert sequence.done, "Sequence not over"
+    intensities = get_sent_intensities(sent)
+    indexes = sequence.identifier.decode_intensities(intensities[:, :-1])
+    assert (indexes == np.arange(LED_COUNT)).all(), "Wrong code words sent"
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the import time of the WLBB modules used by every agent process.
+"""
+
+import os
+import sys
+import subprocess
+
+import pytest
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Generous budgets in microseconds, to only catch heavy eager imports.
+IMPORT_BUDGETS = {
+    "wlbb.lib.agent.agent": 150_000,
+    "wlbb.lib.agent.simple": 250_000,
+}
+
+LAZY_MODULES = ("configparser", "importlib_resources", "concurrent.futures")
+
+
+def get_import_times(module_name: str) -> dict:
+    """
+    Return the cumulative import time in microseconds of every module imported
+    by a fresh interpreter importing `module_name`.
+    """
+    env = dict(os.environ)
+    env["PYTHONPATH"] = SRC_DIR
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import " + module_name],
+        cwd=SRC_DIR,
+        env=env,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    import_times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        try:
+            import_times[name.strip()] = int(cumulative)
+        except ValueError:
+            # Header line
+            continue
+    return import_times
+
+
+#%% Import time
+
+
+@pytest.mark.parametrize("module_name", sorted(IMPORT_BUDGETS))
+def test_import_time_budget(module_name):
+    """
+    Test that importing agent modules stays under its time budget.
+    """
+    import_times = get_import_times(module_name)
+    assert module_name in import_times, "%a wasn't imported" % module_name
+    assert (
+        import_times[module_name] < IMPORT_BUDGETS[module_name]
+    ), "Importing %a took %d us, more than its budget of %d us" % (
+        module_name,
+        import_times[module_name],
+        IMPORT_BUDGETS[module_name],
+    )
+
+
+@pytest.mark.parametrize("module_name", sorted(IMPORT_BUDGETS))
+def test_lazy_imports(module_name):
+    """
+    Test that modules only needed to load configs aren't imported by agent
+    modules.
+    """
+    import_times = get_import_times(module_name)
+    for lazy_module in LAZY_MODULES:
+        assert lazy_module not in import_times, "%a is imported by %a" % (
+            lazy_module,
+            module_name,
+        )
+
+
+def test_lazy_config_package():
+    """
+    Test that the config subpackage still exposes its classes.
+    """
+    import wlbb.lib.config as config_package
+
+    from wlbb.lib.config.wlbb_config import WLBBConfig
+
+    assert config_package.WLBBConfig is WLBBConfig, "WLBBConfig isn't exposed"
+    assert "CfgConfigLoader" in dir(config_package), "CfgConfigLoader isn't listed"
+    with pytest.raises(AttributeError):
+        config_package.NotAConfigLoader
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the network protocol, server and client through the loopback interface.
+"""
+
+import asyncio
+import tracemalloc
+
+import pytest
+
+from wlbb.lib.network.client import WLBBClient
+from wlbb.lib.network.protocol import (
+    AuthenticationError,
+    CommandError,
+    MAX_HELLO_SIZE,
+    MessageDecoder,
+    MessageType,
+    ProtocolError,
+    decode_command,
+    decode_hello,
+    decode_led_frame,
+    encode_command,
+    encode_hello,
+    encode_led_frame_header,
+    encode_message,
+)
+from wlbb.lib.network.server import WLBBNetworkServer
+
+from .test_agent_runtime import run
+
+CLIENT_COUNT = 50
+FRAMES_PER_CLIENT = 200
+
+
+#%% Protocol
+
+
+def test_payloads():
+    """
+    Test that payloads are decoded as they were encoded.
+    """
+    assert decode_hello(encode_hello("dummy-test", b"secret")) == (
+        "dummy-test",
+        b"secret",
+    ), "Wrong HELLO"
+    assert decode_command(encode_command(7, "reload", b"args")) == (
+        7,
+        "reload",
+        b"args",
+    ), "Wrong COMMAND"
+    frame = encode_led_frame_header(3, 12, 6) + b"\xff" * 6
+    message_type, payload = MessageDecoder().feed(frame)[0]
+    controller, frame_number, colors = decode_led_frame(payload)
+    assert message_type == MessageType.LED_FRAME, "Wrong message type"
+    assert (controller, frame_number, bytes(colors)) == (3, 12, b"\xff" * 6)
+
+
+def test_decoder_split_messages():
+    """
+    Test that messages split and coalesced arbitrarily are decoded.
+    """
+    stream = b"".join(
+        encode_message(MessageType.PING, bytes([i]) * i) for i in range(20)
+    )
+    decoder = MessageDecoder()
+    messages = []
+    for i in range(0, len(stream), 7):
+        messages += decoder.feed(stream[i : i + 7])
+
+    assert [payload for _, payload in messages] == [
+        bytes([i]) * i for i in range(20)
+    ], "Wrong messages"
+    assert decoder.get_buffered_size() == 0, "Data left in the buffer"
+
+
+def test_decoder_message_too_large():
+    """
+    Test that too large messages are refused before being received.
+    """
+    decoder = MessageDecoder(max_message_size=16)
+    with pytest.raises(ProtocolError):
+        decoder.feed(encode_message(MessageType.PING, bytes(17))[:8])
+
+
+#%% Loopback
+
+
+def make_server():
+    """
+    Return a network server recording the LED frames it receives.
+    """
+    server = WLBBNetworkServer(token=b"secret")
+    server.frames = []
+    server.led_frame_handler = lambda session, controller, number, colors: (
+        server.frames.append((session.agent_id, controller, number, bytes(colors)))
+    )
+    server.register_command("echo", lambda session, args: args)
+
+    async def slow_upper(session, args):
+        await asyncio.sleep(0.01)
+        return args.upper()
+
+    server.register_command("slow_upper", slow_upper)
+    return server
+
+
+def test_loopback_many_clients():
+    """
+    Test many clients sending LED frames and commands concurrently.
+    """
+    server = make_server()
+
+    async def client_session(i):
+        client = WLBBClient("dummy-client%d" % i, b"secret")
+        await client.connect("127.0.0.1", server.port)
+        for frame_number in range(FRAMES_PER_CLIENT):
+            client.send_led_frame(i, frame_number, bytes((i, frame_number % 256, 0)))
+        echoed = await client.command("echo", b"hello %d" % i, timeout=5)
+        upper = await client.command("slow_upper", b"abc", timeout=5)
+        await client.ping(timeout=5)
+        await client.close()
+        return echoed, upper
+
+    async def scenario():
+        await server.start()
+        try:
+            return await asyncio.gather(
+                *(client_session(i) for i in range(CLIENT_COUNT))
+            )
+        finally:
+            await server.stop()
+
+    results = run(scenario())
+
+    for i, (echoed, upper) in enumerate(results):
+        assert echoed == b"hello %d" % i, "Wrong echo"
+        assert upper == b"ABC", "Wrong async command result"
+    assert len(server.frames) == CLIENT_COUNT * FRAMES_PER_CLIENT, "Frames lost"
+    client_frames = [frame for frame in server.frames if frame[0] == "dummy-client3"]
+    assert [frame[2] for frame in client_frames] == list(
+        range(FRAMES_PER_CLIENT)
+    ), "Frames out of order"
+    assert client_frames[5][3] == bytes((3, 5, 0)), "Wrong colors"
+    assert not server.get_sessions(), "Sessions left open"
+
+
+def test_authentication_failure():
+    """
+    Test that agents with a wrong token are refused.
+    """
+    server = make_server()
+
+    async def scenario():
+        await server.start()
+        try:
+            client = WLBBClient("dummy-intruder", b"wrong")
+            with pytest.raises(AuthenticationError):
+                await client.connect("127.0.0.1", server.port)
+            return len(server.get_sessions())
+        finally:
+            await server.stop()
+
+    assert run(scenario()) == 0, "Refused agent has a session"
+
+
+def test_commands_errors_and_broadcast():
+    """
+    Test unknown commands and LED frames sent by the server.
+    """
+    server = make_server()
+
+    async def scenario():
+        await server.start()
+        try:
+            client = WLBBClient("dummy-test", b"secret")
+            received = asyncio.get_event_loop().create_future()
+            client.on_led_frame = lambda *frame: received.set_result(
+                (frame[0], frame[1], bytes(frame[2]))
+            )
+            await client.connect("127.0.0.1", server.port)
+            with pytest.raises(CommandError):
+                await client.command("unknown", timeout=5)
+            server.send_led_frame(1, 99, b"\x01\x02\x03")
+            frame = await asyncio.wait_for(received, 5)
+            await client.close()
+            return frame
+        finally:
+            await server.stop()
+
+    assert run(scenario()) == (1, 99, b"\x01\x02\x03"), "Wrong broadcast frame"
+
+
+def test_large_message_before_hello():
+    """
+    Test that a message larger than a HELLO message closes the connection of
+    an agent which isn't authenticated.
+    """
+    server = make_server()
+
+    async def scenario():
+        await server.start()
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.port)
+            writer.write(encode_message(MessageType.PING, bytes(MAX_HELLO_SIZE + 1)))
+            data = await asyncio.wait_for(reader.read(), 5)
+            writer.close()
+            return MessageDecoder().feed(data)
+        finally:
+            await server.stop()
+
+    messages = run(scenario())
+    assert [message.message_type for message in messages] == [
+        MessageType.ERROR
+    ], "Large message accepted before HELLO"
+
+
+def test_slow_reader():
+    """
+    Test that LED frames are dropped for an agent which doesn't read them,
+    and that it is disconnected when other messages fill its write buffer.
+    """
+    server = make_server()
+    server.max_write_buffer_size = 1 << 20
+    frame = bytes(1 << 16)
+
+    async def scenario():
+        await server.start()
+        try:
+            client = WLBBClient("dummy-test", b"secret")
+            received = []
+            client.on_led_frame = lambda *frame: received.append(frame[1])
+            await client.connect("127.0.0.1", server.port)
+            client.transport.pause_reading()
+            (session,) = server.get_sessions()
+            for frame_number in range(200):
+                server.send_led_frame(0, frame_number, frame)
+            buffered = session.transport.get_write_buffer_size()
+            assert session.writing_paused, "Writing not paused"
+            assert session.dropped_frames > 0, "No frame dropped"
+            assert buffered < 4 * len(frame), "Buffered %d bytes" % buffered
+
+            client.transport.resume_reading()
+            await client.ping(timeout=5)
+            assert not session.writing_paused, "Writing not resumed"
+            server.send_led_frame(0, 1000, frame)
+            await client.ping(timeout=5)
+            assert received[-1] == 1000, "Frame not sent after resuming"
+
+            client.transport.pause_reading()
+            for _ in range(100):
+                session.send(MessageType.PONG, frame)
+            assert session.transport.is_closing(), "Slow agent not disconnected"
+            await client.close()
+        finally:
+            await server.stop()
+
+    run(scenario())
+
+
+def test_led_frame_not_copied():
+    """
+    Test that a LED frame sent by the server to several agents isn't copied
+    for each of them.
+    """
+    server = make_server()
+    frame = bytes(range(256)) * 128
+
+    async def scenario():
+        await server.start()
+        try:
+            clients = []
+            received = []
+            for _ in range(4):
+                client = WLBBClient("dummy-test", b"secret")
+                client.on_led_frame = lambda *frame: received.append(
+                    (frame[1], bytes(frame[2]))
+                )
+                await client.connect("127.0.0.1", server.port)
+                clients.append(client)
+            tracemalloc.start()
+            try:
+                server.send_led_frame(0, 7, frame)
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            sessions = [
+                (session.direct_frames, session.copied_frames)
+                for session in server.get_sessions()
+            ]
+            for client in clients:
+                await client.ping(timeout=5)
+                await client.close()
+            return peak, sessions, received
+        finally:
+            await server.stop()
+
+    peak, sessions, received = run(scenario())
+    assert peak < len(frame), "%d bytes allocated to send the frame" % peak
+    assert sessions == [(1, 0)] * 4, "Frames not sent directly : %s" % sessions
+    assert received == [(7, frame)] * 4, "Wrong frames received"
+
+
+def test_invalid_pong():
+    """
+    Test that the client ignores a truncated PONG message.
+    """
+    client = WLBBClient("dummy-test")
+    client.data_received(encode_message(MessageType.PONG, b"\x01"))
+    assert not client._requests, "Request resolved"
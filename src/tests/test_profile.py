@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the memory mapped LED profile.
+"""
+
+import os
+import sys
+import math
+import time
+import subprocess
+
+import pytest
+
+from wlbb.lib.profile import (
+    Profile,
+    create_profile,
+    get_profile_path,
+)
+
+LED_COUNT = 100
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_profile(path, led_count=LED_COUNT):
+    """
+    Create a profile whose LED `i` has the id `1000 + i` and the position
+    `(i, 2 * i, 3 * i)`.
+    """
+    return create_profile(
+        path,
+        [1000 + i for i in range(led_count)],
+        xyz=[(i, 2 * i, 3 * i) for i in range(led_count)],
+        confidence=[0.5] * led_count,
+        controllers=[i // 50 for i in range(led_count)],
+        channels=[i % 50 for i in range(led_count)],
+    )
+
+
+#%% Profile file
+
+
+def test_create_open(tmp_path):
+    """
+    Test that a created profile is read back by another mapping.
+    """
+    path = str(tmp_path / "test.profile")
+    make_profile(path).close()
+    profile = Profile(path)
+    try:
+        assert len(profile) == LED_COUNT, "Wrong LED count"
+        assert profile.get_generation() == 0, "Wrong generation"
+        assert profile.get_led_ids()[10] == 1010, "Wrong LED id"
+        assert profile.get_index(1042) == 42, "Wrong LED index"
+        led = profile.get_led(60)
+        assert tuple(led) == (1060, 60, 120, 180, 0.5, 1, 10), "Wrong LED"
+        assert len(profile.get_xyz()) == 3 * LED_COUNT, "Wrong position count"
+        with pytest.raises(KeyError):
+            profile.get_index(5)
+        with pytest.raises(ValueError):
+            profile.set_led(0, confidence=1.0)
+    finally:
+        profile.close()
+
+
+def test_default_columns(tmp_path):
+    """
+    Test that missing columns take their default values.
+    """
+    path = str(tmp_path / "default.profile")
+    profile = create_profile(path, range(3))
+    try:
+        assert all(math.isnan(value) for value in profile.get_xyz()), "Known LEDs"
+        assert list(profile.get_confidence()) == [0.0] * 3, "Wrong confidence"
+        with pytest.raises(ValueError):
+            create_profile(path, range(3), confidence=[1.0])
+    finally:
+        profile.close()
+
+    empty = Profile()
+    assert len(empty) == 0 and not empty.is_replaced(), "Profile not empty"
+    empty.close()
+
+
+def test_invalid_file(tmp_path):
+    """
+    Test that files which aren't complete profiles are refused.
+    """
+    path = tmp_path / "invalid.profile"
+    path.write_bytes(b"not a profile at all, really not")
+    with pytest.raises(ValueError):
+        Profile(str(path))
+
+    make_profile(str(path)).close()
+    path.write_bytes(path.read_bytes()[:200])
+    with pytest.raises(ValueError):
+        Profile(str(path))
+
+
+#%% Updates
+
+
+def test_update_in_place(tmp_path):
+    """
+    Test that partial updates are seen by the other mappings of the profile.
+    """
+    path = str(tmp_path / "test.profile")
+    writer = make_profile(path)
+    reader = Profile(path)
+    try:
+        writer.update(10, xyz=[(-1, -2, -3), (-4, -5, -6)], channels=[7, 8])
+        writer.set_led(99, confidence=1.0)
+        assert reader.get_generation() == 2, "Generation not incremented"
+        assert reader.get_position(11) == (-4, -5, -6), "Position not updated"
+        assert reader.get_led(10).channel == 7, "Channel not updated"
+        assert reader.get_led(12).channel == 12, "Unrelated LED updated"
+        assert reader.get_confidence()[99] == 1.0, "Confidence not updated"
+        with pytest.raises(IndexError):
+            writer.update(99, channels=[1, 2])
+        assert not reader.is_replaced(), "Profile replaced"
+        make_profile(path).close()
+        assert reader.is_replaced(), "Replacement not detected"
+    finally:
+        writer.close()
+        reader.close()
+
+
+def test_invalid_update_not_applied(tmp_path):
+    """
+    Test that no column is written when the values of one of them are out of
+    the profile.
+    """
+    path = str(tmp_path / "test.profile")
+    profile = make_profile(path)
+    try:
+        with pytest.raises(IndexError):
+            profile.update(
+                LED_COUNT - 2, xyz=[(0.0, 0.0, 0.0)] * 2, controllers=[1, 2, 3]
+            )
+        assert profile.get_position(LED_COUNT - 2) == (
+            LED_COUNT - 2,
+            2 * (LED_COUNT - 2),
+            3 * (LED_COUNT - 2),
+        ), "Partial update applied"
+        assert profile.get_generation() == 0, "Generation incremented"
+    finally:
+        profile.close()
+
+
+def test_update_from_other_process(tmp_path):
+    """
+    Test that the updates of another process are seen in the mapping.
+    """
+    path = str(tmp_path / "test.profile")
+    profile = make_profile(path)
+    try:
+        code = (
+            "from wlbb.lib.profile import Profile\n"
+            "profile = Profile(%r, writable=True)\n"
+            "profile.set_led(5, xyz=(0.25, 0.5, 0.75))\n"
+            "profile.close()\n" % path
+        )
+        env = dict(os.environ)
+        env["PYTHONPATH"] = SRC_DIR
+        subprocess.run([sys.executable, "-c", code], env=env, check=True)
+        assert profile.get_position(5) == (0.25, 0.5, 0.75), "Update not shared"
+        assert profile.get_generation() == 1, "Generation not shared"
+    finally:
+        profile.close()
+
+
+def test_numpy_columns(tmp_path):
+    """
+    Test that NumPy arrays are written without conversion and that columns
+    are wrapped without copy.
+    """
+    numpy = pytest.importorskip("numpy")
+    path = str(tmp_path / "numpy.profile")
+    xyz = numpy.arange(3 * LED_COUNT, dtype=numpy.float32).reshape(-1, 3)
+    profile = create_profile(path, numpy.arange(LED_COUNT, dtype=numpy.uint32), xyz)
+    try:
+        positions = numpy.frombuffer(profile.get_xyz(), numpy.float32).reshape(-1, 3)
+        assert (positions == xyz).all(), "Wrong positions"
+        profile.update(4, xyz=xyz[:2] * 10)
+        assert (positions[4:6] == xyz[:2] * 10).all(), "Array isn't a view"
+        del positions
+    finally:
+        profile.close()
+
+
+def test_open_time(tmp_path):
+    """
+    Test that opening a large profile doesn't read it.
+    """
+    path = str(tmp_path / "large.profile")
+    make_profile(path, 50000).close()
+    start = time.perf_counter()
+    for _ in range(20):
+        Profile(path).close()
+    duration = (time.perf_counter() - start) / 20
+    assert duration < 0.005, "Opening took %.1f ms" % (duration * 1000)
+
+
+def test_profile_path(monkeypatch, tmp_path):
+    """
+    Test that profiles are stored in the data directory.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    path = get_profile_path("garden")
+    assert path.startswith(str(tmp_path)), "Profile outside the data directory"
+    assert path.endswith("garden.profile"), "Wrong profile file name"
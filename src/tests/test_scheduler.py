@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the deadline driven tick scheduler.
+"""
+
+import time
+import asyncio
+
+import pytest
+
+from wlbb.lib.scheduler import TickScheduler
+
+from .test_agent_runtime import run
+
+RATE = 100
+PERIOD = 1 / RATE
+
+
+def run_scheduler(on_tick, tick_count):
+    """
+    Run a scheduler calling `on_tick` until it ticked `tick_count` times and
+    return it with the frame numbers and deadlines of its ticks.
+    """
+    ticks = []
+
+    def record(frame_number, deadline):
+        ticks.append((frame_number, deadline))
+        result = on_tick(frame_number, deadline)
+        if len(ticks) >= tick_count:
+            scheduler.stop()
+        return result
+
+    scheduler = TickScheduler(RATE, record)
+    run(asyncio.wait_for(scheduler.run(), 10))
+    return scheduler, ticks
+
+
+def test_steady_rate():
+    """
+    Test that fast ticks are due at a fixed rate without drift.
+    """
+    scheduler, ticks = run_scheduler(lambda *_: None, 30)
+    frame_numbers = [frame_number for frame_number, _ in ticks]
+    start = ticks[0][1]
+    stats = scheduler.get_stats()
+
+    assert stats.ticks == 30, "Wrong tick count"
+    assert stats.ticks + stats.skipped == frame_numbers[-1] + 1, "Frames missing"
+    assert frame_numbers == sorted(set(frame_numbers)), "Frame numbers not increasing"
+    for frame_number, deadline in ticks:
+        assert deadline == pytest.approx(
+            start + frame_number * PERIOD
+        ), "Deadline drifted"
+    assert stats.mean_jitter < PERIOD, "Ticks too late : %r" % (stats,)
+    assert not scheduler.is_running(), "Scheduler still running"
+
+
+def test_skip_late_frames():
+    """
+    Test that frames whose deadline passed during a slow tick are skipped.
+    """
+
+    def on_tick(frame_number, deadline):
+        if frame_number == 3:
+            time.sleep(3.5 * PERIOD)
+
+    scheduler, ticks = run_scheduler(on_tick, 8)
+    frame_numbers = [frame_number for frame_number, _ in ticks]
+    stats = scheduler.get_stats()
+
+    assert frame_numbers[:4] == [0, 1, 2, 3], "Wrong first frames"
+    assert frame_numbers[4] >= 7, "Late frames not skipped : %r" % frame_numbers
+    assert stats.skipped >= 3, "Wrong skipped count : %r" % (stats,)
+    assert stats.overruns >= 1, "Overrun not counted"
+    assert stats.max_duration >= 3.5 * PERIOD, "Wrong max duration"
+    assert stats.ticks + stats.skipped == frame_numbers[-1] + 1, "Frames missing"
+
+
+def test_async_tick():
+    """
+    Test that awaitable ticks are awaited and failing ticks don't stop the
+    scheduler.
+    """
+    running = []
+
+    async def on_tick(frame_number, deadline):
+        running.append(frame_number)
+        await asyncio.sleep(PERIOD / 4)
+        running.remove(frame_number)
+        if frame_number == 1:
+            raise RuntimeError("Tick failure")
+
+    scheduler, ticks = run_scheduler(on_tick, 5)
+    assert scheduler.get_stats().ticks == 5, "Scheduler stopped by a failure"
+    assert not running, "Tick not awaited"
+
+
+def test_invalid_rate():
+    """
+    Test that the rate must be positive.
+    """
+    with pytest.raises(ValueError):
+        TickScheduler(0, lambda *_: None)
@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the WLBB server.
+"""
+
+import os
+import time
+import uuid
+import socket
+import asyncio
+
+import pytest
+
+from wlbb.lib.agent.server import DEFAULT_PORT, WLBBServer
+from wlbb.lib.config import CfgConfigLoader, WLBBConfig
+from wlbb.lib.config.default import (
+    DEFAULT_CFG_NAME,
+    get_builtin_default_config_dir as get_default_config_dir,
+)
+from wlbb.lib.config.shared_config import SharedConfigReader, open_shared_configs
+from wlbb.lib.network.client import WLBBClient
+from wlbb.lib.paths import get_config_dir
+from wlbb.lib.network.udp import open_udp_frames
+from wlbb.lib.profile import create_profile, get_profile_path
+from wlbb.lib.shared_segment import shared_memory
+
+from . import TestingConfigLoader, WLBBDummyAgent
+from .test_agent_runtime import run
+from .test_cfg_config_loader import write_cfg
+
+
+def make_server(server_config):
+    """
+    Return a server loading the SERVER section `server_config`.
+    """
+    server = WLBBServer()
+    server.config_loader = TestingConfigLoader(
+        {get_default_config_dir(): {DEFAULT_CFG_NAME: {"SERVER": server_config}}}
+    )
+    return server
+
+
+def test_serve_and_tick(monkeypatch, tmp_path):
+    """
+    Test that the server answers agents, ticks and loads its profile.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    create_profile(get_profile_path("garden"), range(10)).close()
+    server = make_server(
+        {"port": "0", "token": "secret", "frame_rate": "100", "profile": "garden"}
+    )
+    ticks = []
+    server.tick = lambda frame_number, deadline: ticks.append(frame_number)
+
+    async def ask_server_id(port):
+        client = WLBBClient("dummy-test", b"secret")
+        await client.connect("127.0.0.1", port)
+        try:
+            return await client.command("get_server_id")
+        finally:
+            await client.close()
+
+    server.start()
+    try:
+        assert len(server.get_profile()) == 10, "Profile not loaded"
+        server_id = run(ask_server_id(server.network_server.port))
+        assert server_id == b"server", "Wrong server id"
+        assert (
+            shared_memory is None or server.network_server.led_frame_ring is not None
+        ), "No LED frame ring"
+        time.sleep(0.1)
+    finally:
+        server.stop()
+
+    stats = server.get_tick_stats()
+    assert stats.ticks > 1 and stats.ticks == len(ticks), "Server didn't tick"
+    assert not server.network_server.is_serving(), "Server still serving"
+
+
+def test_reload_profile(monkeypatch, tmp_path):
+    """
+    Test that a replaced profile is reopened.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    path = get_profile_path("garden")
+    create_profile(path, range(10)).close()
+    server = WLBBServer()
+    server.load_profile("garden")
+    old_profile = server.get_profile()
+
+    server.reload()
+    assert server.get_profile() is old_profile, "Unchanged profile reopened"
+
+    create_profile(path, range(20)).close()
+    server.reload()
+    assert len(server.get_profile()) == 20, "Replaced profile not reopened"
+    server.get_profile().close()
+
+
+def test_shared_configs():
+    """
+    Test that the server publishes the configs in shared memory to the
+    agents of its machine.
+    """
+    name = "wlbb_test_" + uuid.uuid4().hex[:12]
+    server = make_server({"port": "0", "shared_configs": name})
+    agent_config = WLBBConfig(WLBBDummyAgent("agent_a"))
+    agent_config.import_dict({"PARAM_GROUP1": {"parameter1": "7"}})
+
+    async def read_configs(port):
+        client = WLBBClient("dummy-test")
+        await client.connect("127.0.0.1", port)
+        try:
+            reader = await open_shared_configs(client)
+        finally:
+            await client.close()
+        try:
+            return reader.get_config("server"), reader.get_config("dummy-agent_a")
+        finally:
+            reader.close()
+
+    server.start()
+    try:
+        assert server.publish_configs([agent_config]) > 0, "Configs not published"
+        server_config, config = run(read_configs(server.network_server.port))
+    finally:
+        server.stop()
+    assert server_config["SERVER"]["shared_configs"] == name, "Wrong server config"
+    assert config["PARAM_GROUP1"]["parameter1"] == "7", "Wrong agent config"
+    assert server.shared_configs is None, "Shared configs not closed"
+
+
+def test_publish_agent_configs(monkeypatch, tmp_path):
+    """
+    Test that the server publishes the configs of its agents when it starts
+    and when their config files change, and that agents load them without
+    reading their config files.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    name = "wlbb_test_" + uuid.uuid4().hex[:12]
+    config_dir = get_config_dir()
+    os.makedirs(config_dir)
+    write_cfg(
+        config_dir,
+        "server",
+        "[SERVER]\nport = 0\nshared_configs = %s\nconfig_poll_interval = 0.02\n" % name,
+    )
+    write_cfg(config_dir, "agent_a", "[PARAM_GROUP1]\nparameter1 = 7\n")
+    server = WLBBServer()
+    server.add_agents([WLBBDummyAgent("agent_a")])
+
+    server.start()
+    try:
+        reader = SharedConfigReader(name)
+        agent = WLBBDummyAgent("agent_a")
+        # Any config file read would miss the parameter.
+        agent.set_config_loader(TestingConfigLoader({}))
+        agent.set_shared_configs(reader)
+        config = agent.load_config()
+        assert agent.get_config() is config, "Config not set"
+        assert (
+            config.get_parameter("PARAM_GROUP1", "parameter1") == "7"
+        ), "Config not loaded from the shared configs"
+
+        write_cfg(config_dir, "agent_a", "[PARAM_GROUP1]\nparameter1 = 8\n")
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            published = reader.get_config("dummy-agent_a")
+            if published["PARAM_GROUP1"]["parameter1"] == "8":
+                break
+            time.sleep(0.01)
+        reader.close()
+    finally:
+        server.stop()
+    assert published["PARAM_GROUP1"]["parameter1"] == "8", "Change not published"
+
+
+def test_udp_frames():
+    """
+    Test that the LED frames of the server reach the agents asking for them
+    through UDP, and the other agents through their connection.
+    """
+    server = make_server({"port": "0", "udp_frames": "unicast", "udp_mtu": "200"})
+    frame = bytes(range(256)) * 4
+
+    async def receive_frames(port):
+        loop = asyncio.get_event_loop()
+        received = {"udp": [], "tcp": []}
+        clients = []
+        for name in received:
+            client = WLBBClient("dummy-" + name)
+            client.on_led_frame = lambda controller, number, colors, name=name: (
+                received[name].append((controller, number, bytes(colors)))
+            )
+            await client.connect("127.0.0.1", port)
+            clients.append(client)
+        udp_received = received["udp"]
+        receiver = await open_udp_frames(
+            clients[0],
+            lambda controller, number, colors: udp_received.append(
+                (controller, number, bytes(colors))
+            ),
+        )
+        try:
+            assert receiver is not None, "LED frames not sent through UDP"
+            for frame_number in range(3):
+                server._loop.call_soon_threadsafe(
+                    server.network_server.send_led_frame, 2, frame_number, frame
+                )
+            for client in clients:
+                await client.ping(timeout=5)
+            for _ in range(100):
+                if len(udp_received) == 3:
+                    break
+                await asyncio.sleep(0.01)
+        finally:
+            receiver.close()
+            for client in clients:
+                await client.close()
+        return received
+
+    server.start()
+    try:
+        received = run(receive_frames(server.network_server.port))
+    finally:
+        server.stop()
+    expected = [(2, frame_number, frame) for frame_number in range(3)]
+    assert received["udp"] == expected, "Wrong frames received through UDP"
+    assert received["tcp"] == expected, "Wrong frames received through TCP"
+    assert server.network_server.udp_sock is None, "UDP socket not closed"
+
+
+def test_default_config_loader(monkeypatch, tmp_path):
+    """
+    Test that a server without a config loader loads its config files.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    server = WLBBServer("abc")
+    server.init()
+    assert isinstance(server.get_config_loader(), CfgConfigLoader), "Wrong loader"
+    assert server.network_server.port == DEFAULT_PORT, "Wrong default port"
+
+
+def test_port_in_use():
+    """
+    Test that starting a server on a port already in use raises an OSError.
+    """
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        server = make_server({"port": str(sock.getsockname()[1])})
+        with pytest.raises(OSError):
+            server.start()
+    assert server._thread is None, "Server thread left running"
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the shared memory config distribution.
+"""
+
+import multiprocessing
+import uuid
+from multiprocessing import resource_tracker
+
+import pytest
+
+from wlbb.lib.config import WLBBConfig
+from wlbb.lib.config.shared_config import (
+    SharedConfigPublisher,
+    SharedConfigReader,
+    get_checksum,
+)
+from wlbb.lib.shared_segment import shared_memory
+
+from . import WLBBDummyAgent
+
+TEST_CONFIGS = {
+    "dummy-agent_a": {"PARAM_GROUP1": {"parameter1": "1"}},
+    "dummy-agent_b": {"PARAM_GROUP2": {"parameter3": "3"}},
+}
+
+
+@pytest.fixture(name="publisher")
+def fixture_publisher():
+    """
+    Return a publisher using a segment unique to the test.
+    """
+    publisher = SharedConfigPublisher("wlbb_test_" + uuid.uuid4().hex[:12], 4096)
+    yield publisher
+    publisher.close()
+
+
+def read_in_child(name, queue):
+    """
+    Read the published configs from another process.
+    """
+    reader = SharedConfigReader(name)
+    queue.put((reader.get_version(), reader.read()))
+    reader.close()
+
+
+def test_read_published_configs(publisher):
+    """
+    Check if the published configs are read back and only decoded again when
+    the version changed.
+    """
+    reader = SharedConfigReader(publisher.name)
+
+    version = publisher.publish(TEST_CONFIGS)
+    configs = reader.read()
+    assert configs == TEST_CONFIGS
+    assert reader.read() is configs, "Testing unchanged version failed."
+
+    publisher.publish({"dummy-agent_a": {"PARAM_GROUP1": {"parameter1": "2"}}})
+    assert reader.has_changed()
+    assert reader.get_config("dummy-agent_a") == {"PARAM_GROUP1": {"parameter1": "2"}}
+    assert reader.version == version + 2
+    reader.close()
+
+
+def test_read_from_other_process(publisher):
+    """
+    Check if another process reads the published configs.
+    """
+    publisher.publish(TEST_CONFIGS)
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(
+        target=read_in_child, args=(publisher.name, queue)
+    )
+    process.start()
+    version, configs = queue.get(timeout=10)
+    process.join(10)
+
+    assert version == publisher.version
+    assert configs == TEST_CONFIGS
+
+
+def test_update_config(publisher):
+    """
+    Check if an agent's config is only imported when a new version is
+    published.
+    """
+    reader = SharedConfigReader(publisher.name)
+    config = WLBBConfig(WLBBDummyAgent("agent_a"))
+
+    publisher.publish(TEST_CONFIGS)
+    assert reader.update_config(config)
+    assert not reader.update_config(config)
+    assert config.get_config_dict() == TEST_CONFIGS["dummy-agent_a"]
+
+    publisher.publish_configs([config])
+    assert reader.update_config(config)
+    reader.close()
+
+
+def test_publish_too_big(publisher):
+    """
+    Check if publishing configs bigger than the segment fails.
+    """
+    with pytest.raises(ValueError):
+        publisher.publish({"dummy-agent_a": {"PARAM_GROUP1": {"p": "x" * 5000}}})
+
+
+def test_torn_copy_rejected(publisher):
+    """
+    Check if a copy seeing the new version with a stale payload, as the
+    weakly ordered CPUs of the boards allow, is read again instead of being
+    decoded.
+    """
+    reader = SharedConfigReader(publisher.name)
+    version = publisher.publish(TEST_CONFIGS)
+    assert reader.read() == TEST_CONFIGS
+
+    # Only the new version and checksum are visible yet.
+    new_payload = b"x" * 16
+    stale = publisher.shm.buf[8:16].tobytes()
+    publisher.shm.buf[8:16] = (version + 2).to_bytes(8, "little")
+    publisher.shm.buf[24:32] = get_checksum(version + 2, new_payload).to_bytes(
+        8, "little"
+    )
+    with pytest.raises(TimeoutError):
+        reader.read(timeout=0.05)
+    assert reader.version == version, "Torn copy accepted"
+
+    publisher.shm.buf[8:16] = stale
+    publisher.publish(TEST_CONFIGS)
+    assert reader.read() == TEST_CONFIGS
+    reader.close()
+
+
+def test_stale_segment_unlinked():
+    """
+    Check if the segment left by a crashed server is unlinked and replaced,
+    and if a segment which doesn't hold shared configs is kept.
+    """
+    name = "wlbb_test_" + uuid.uuid4().hex[:12]
+    stale = SharedConfigPublisher(name, 4096)
+    stale.publish(TEST_CONFIGS)
+    # The server crashed: the segment is neither closed nor unlinked.
+    resource_tracker.unregister(stale.shm._name, "shared_memory")
+
+    publisher = SharedConfigPublisher(name, 4096)
+    try:
+        reader = SharedConfigReader(name)
+        assert reader.read() == {}, "Stale configs read"
+        reader.close()
+    finally:
+        publisher.close()
+        stale.shm.close()
+
+    other = shared_memory.SharedMemory(name=name, create=True, size=4096)
+    try:
+        with pytest.raises(FileExistsError):
+            SharedConfigPublisher(name, 4096)
+    finally:
+        other.close()
+        other.unlink()
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the shared memory ring buffer transport.
+"""
+
+import os
+import threading
+import multiprocessing
+
+import pytest
+
+from wlbb.lib.shared_segment import shared_memory
+from wlbb.lib.network.client import WLBBClient
+from wlbb.lib.network.protocol import HEADER_SIZE, decode_led_frame
+from wlbb.lib.network.server import LED_FRAMES_STREAM, WLBBNetworkServer
+from wlbb.lib.network.shm_ring import (
+    ShmRingReader,
+    ShmRingWriter,
+    get_wake_dir,
+    open_local_ring,
+)
+
+from .test_agent_runtime import run
+
+pytestmark = pytest.mark.skipif(
+    shared_memory is None, reason="Shared memory isn't available."
+)
+
+FRAME_SIZE = 1 << 20
+
+
+def make_message(sequence, size=100):
+    """
+    Return the content of the message `sequence`.
+    """
+    return bytes((sequence + i) % 256 for i in range(size))
+
+
+#%% Ring
+
+
+def test_write_read():
+    """
+    Test that messages are read in order, starting after the reader attached.
+    """
+    writer = ShmRingWriter(slot_count=4, slot_size=1000)
+    try:
+        writer.write(b"before")
+        reader = ShmRingReader(writer.name)
+        try:
+            assert reader.read() is None, "Message published before attaching"
+            for sequence in range(3):
+                writer.write(make_message(sequence))
+            assert reader.get_pending_count() == 3, "Wrong pending count"
+            messages = [reader.read() for _ in range(3)]
+            assert messages == [make_message(i) for i in range(3)], "Wrong messages"
+            assert reader.read() is None, "Unexpected message"
+            assert tuple(reader.get_stats()) == (3, 0), "Wrong stats"
+        finally:
+            reader.close()
+    finally:
+        writer.close()
+
+
+def test_reserve_commit():
+    """
+    Test that messages written in place are read into a preallocated buffer.
+    """
+    writer = ShmRingWriter(slot_count=2, slot_size=64)
+    reader = ShmRingReader(writer.name)
+    try:
+        slot = writer.reserve()
+        assert len(slot) == 64, "Wrong slot size"
+        assert reader.read() is None, "Reserved message is visible"
+        slot[:5] = b"hello"
+        writer.commit(5)
+        buffer = bytearray(64)
+        assert reader.read_into(buffer) == 5, "Wrong message length"
+        assert buffer[:5] == b"hello", "Wrong message"
+        assert reader.read_into(buffer) == -1, "Unexpected message"
+        with pytest.raises(ValueError):
+            writer.write(bytes(65))
+        with pytest.raises(RuntimeError):
+            writer.commit(0)
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_lagging_reader():
+    """
+    Test that a reader too far behind loses the overwritten messages and can
+    skip to the newest one.
+    """
+    writer = ShmRingWriter(slot_count=4, slot_size=100)
+    reader = ShmRingReader(writer.name)
+    try:
+        for sequence in range(10):
+            writer.write(make_message(sequence))
+        assert reader.read() == make_message(6), "Oldest remaining message not read"
+        assert tuple(reader.get_stats()) == (1, 6), "Wrong stats"
+
+        for sequence in range(10, 15):
+            writer.write(make_message(sequence))
+        reader.seek_latest()
+        assert reader.read() == make_message(14), "Newest message not read"
+        assert reader.read() is None, "Unexpected message"
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_wakeup():
+    """
+    Test that a waiting reader is woken up by a message and that closing the
+    reader and the writer removes their pipes.
+    """
+    writer = ShmRingWriter(slot_count=4, slot_size=100)
+    reader = ShmRingReader(writer.name)
+    try:
+        assert not reader.wait(0.05), "Woken up without message"
+        timer = threading.Timer(0.05, writer.write, (b"wake up",))
+        timer.start()
+        assert reader.wait(5), "Not woken up"
+        timer.join()
+        assert reader.read() == b"wake up", "Wrong message"
+    finally:
+        reader.close()
+    assert not os.listdir(writer.wake_dir), "Reader pipe not removed"
+    writer.write(b"no reader")
+    writer.close()
+    assert not os.path.exists(get_wake_dir(writer.name)), "Wake dir not removed"
+
+
+def read_frames(name, count, started, result):
+    """
+    Read `count` frames from the ring `name` and store how many were intact.
+    """
+    reader = ShmRingReader(name)
+    started.set()
+    buffer = bytearray(FRAME_SIZE)
+    intact = 0
+    try:
+        while reader.read_count + reader.lost_count < count:
+            if not reader.wait(10):
+                break
+            length = reader.read_into(buffer)
+            if length == FRAME_SIZE and buffer.count(buffer[0]) == FRAME_SIZE:
+                intact += 1
+    finally:
+        reader.close()
+    result.value = intact
+
+
+def test_cross_process():
+    """
+    Test that large frames are read intact by readers in other processes.
+    """
+    context = multiprocessing.get_context("spawn")
+    writer = ShmRingWriter(slot_count=8, slot_size=FRAME_SIZE)
+    readers = []
+    try:
+        for _ in range(2):
+            started = context.Event()
+            result = context.Value("i", -1)
+            process = context.Process(
+                target=read_frames, args=(writer.name, 50, started, result)
+            )
+            process.start()
+            assert started.wait(30), "Reader didn't start"
+            readers.append((process, result))
+
+        frame = bytearray(FRAME_SIZE)
+        for sequence in range(50):
+            slot = writer.reserve()
+            frame[:] = bytes((sequence % 256,)) * FRAME_SIZE
+            slot[:] = frame
+            writer.commit(FRAME_SIZE)
+
+        for process, result in readers:
+            process.join(30)
+            assert process.exitcode == 0, "Reader failed"
+            assert result.value > 0, "No frame read"
+    finally:
+        for process, _ in readers:
+            if process.is_alive():
+                process.terminate()
+        writer.close()
+
+
+#%% Automatic selection
+
+
+def test_open_local_ring():
+    """
+    Test that an agent on the server's machine gets a reader of the ring of a
+    stream, and None for an unknown stream.
+    """
+    writer = ShmRingWriter(slot_count=2, slot_size=100)
+
+    async def scenario():
+        server = WLBBNetworkServer(token=b"secret")
+        server.add_local_ring("camera", writer.name)
+        await server.start()
+        client = WLBBClient("dummy-camera", b"secret")
+        try:
+            await client.connect("127.0.0.1", server.port)
+            reader = await open_local_ring(client, "camera")
+            unknown = await open_local_ring(client, "unknown")
+        finally:
+            await client.close()
+            await server.stop()
+        return reader, unknown
+
+    try:
+        reader, unknown = run(scenario())
+        assert unknown is None, "Reader of an unknown stream"
+        assert reader is not None, "No reader of the local ring"
+        try:
+            writer.write(b"frame")
+            assert reader.read() == b"frame", "Wrong message"
+        finally:
+            reader.close()
+    finally:
+        writer.close()
+
+
+def test_server_led_frame_ring():
+    """
+    Test that the LED frames of the server reach a local agent through the
+    ring instead of the network, and the other agents through the network.
+    """
+
+    async def scenario():
+        server = WLBBNetworkServer(token=b"secret")
+        await server.start()
+        server.open_led_frame_ring(slot_count=4, slot_size=1000)
+        clients = []
+        received = {}
+        try:
+            for name in ("local", "remote"):
+                client = WLBBClient("dummy-" + name, b"secret")
+                received[name] = []
+                client.on_led_frame = lambda controller, number, colors, name=name: (
+                    received[name].append(number)
+                )
+                await client.connect("127.0.0.1", server.port)
+                clients.append(client)
+            reader = await open_local_ring(clients[0], LED_FRAMES_STREAM)
+            assert reader is not None, "No reader of the LED frame ring"
+            for frame_number in range(3):
+                server.send_led_frame(1, frame_number, b"\x01\x02\x03")
+            for client in clients:
+                await client.ping(timeout=5)
+            local_frames = []
+            while True:
+                message = reader.read()
+                if message is None:
+                    break
+                controller, number, colors = decode_led_frame(
+                    memoryview(message)[HEADER_SIZE:]
+                )
+                local_frames.append((controller, number, bytes(colors)))
+            reader.close()
+        finally:
+            for client in clients:
+                await client.close()
+            await server.stop()
+        assert server.led_frame_ring is None, "Ring not closed"
+        return received, local_frames
+
+    received, local_frames = run(scenario())
+    assert received["local"] == [], "Local agent got frames through the network"
+    assert received["remote"] == [0, 1, 2], "Remote agent missed frames"
+    assert local_frames == [
+        (1, number, b"\x01\x02\x03") for number in range(3)
+    ], "Wrong frames in the ring"
+
+
+def test_oversized_length_ignored():
+    """
+    Test that a reader doesn't trust a message length larger than the slots.
+    """
+    writer = ShmRingWriter(slot_count=2, slot_size=100)
+    reader = ShmRingReader(writer.name)
+    try:
+        writer.write(b"frame")
+        offset = writer._get_slot_offset(0)
+        writer.buf[offset + 8 : offset + 16] = (1000).to_bytes(8, "little")
+        assert reader.read() is None, "Oversized message read"
+        assert reader.get_stats().lost == 1, "Oversized message not lost"
+    finally:
+        reader.close()
+        writer.close()
+
+
+def test_torn_message_rejected():
+    """
+    Test that a reader seeing a complete state with a partly written message,
+    or with the message of a previous lap of the ring, doesn't return it.
+    """
+    writer = ShmRingWriter(slot_count=1, slot_size=100)
+    reader = ShmRingReader(writer.name)
+    try:
+        writer.write(make_message(0))
+        offset = writer._get_slot_offset(0) + 24
+        writer.buf[offset + 50] ^= 0xFF
+        assert reader.read() is None, "Torn message read"
+        assert tuple(reader.get_stats()) == (0, 1), "Torn message not lost"
+
+        # The state of the message 2 is seen over the rest of the message 1.
+        writer.write(make_message(1))
+        slot = bytes(writer.buf[offset - 24 : offset + 100])
+        writer.write(make_message(2))
+        writer.buf[offset - 16 : offset + 100] = slot[8:]
+        buffer = bytearray(100)
+        assert reader.read_into(buffer) == -1, "Previous message read"
+        writer.write(make_message(3))
+        assert reader.read_into(buffer) == 100, "Intact message not read"
+        assert buffer == make_message(3), "Wrong message"
+    finally:
+        reader.close()
+        writer.close()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the snapshot config loader.
+"""
+
+import os
+
+import pytest
+
+from wlbb.lib.config import CfgConfigLoader
+from wlbb.lib.config.config_cache import ParsedConfigCache
+from wlbb.lib.config.config_dir_index import ConfigDirIndex
+from wlbb.lib.config.snapshot_config_loader import SnapshotConfigLoader
+
+from .test_cfg_config_loader import write_cfg
+
+
+class CountingCfgConfigLoader(CfgConfigLoader):
+    """
+    A CfgConfigLoader counting its loads.
+    """
+
+    def __init__(self):
+        super().__init__(ParsedConfigCache(), ConfigDirIndex("cfg"))
+        self.loads = 0
+
+    def load_config(self, config_dir, config_name):
+        self.loads += 1
+        return super().load_config(config_dir, config_name)
+
+
+@pytest.fixture(name="config_dir")
+def fixture_config_dir(tmp_path):
+    """
+    Return a config directory containing two configs.
+    """
+    config_dir = tmp_path / "configs"
+    config_dir.mkdir()
+    write_cfg(config_dir, "first", "[PARAM_GROUP1]\nparameter1 = 1\n")
+    write_cfg(config_dir, "second", "[PARAM_GROUP2]\nparameter3 = 3\n")
+    return str(config_dir)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_snapshot_load(tmp_path, config_dir, use_mmap):
+    """
+    Check if configs are loaded from a compiled snapshot without using the
+    fallback config loader.
+    """
+    snapshot_path = str(tmp_path / "configs.snapshot")
+    SnapshotConfigLoader(snapshot_path, CountingCfgConfigLoader()).compile_snapshot(
+        [config_dir]
+    )
+
+    fallback = CountingCfgConfigLoader()
+    cfg_loader = SnapshotConfigLoader(snapshot_path, fallback, use_mmap)
+
+    assert cfg_loader.load_config(config_dir, "first") == {
+        "WLBB_CONFIG": {},
+        "PARAM_GROUP1": {"parameter1": "1"},
+    }
+    assert cfg_loader.load_config(config_dir, "second")["PARAM_GROUP2"] == {
+        "parameter3": "3"
+    }
+    assert fallback.loads == 0, "Testing snapshot load used the fallback loader."
+    assert cfg_loader.hits == 2
+
+
+def test_snapshot_stale(tmp_path, config_dir):
+    """
+    Check if a config modified after the snapshot was compiled is loaded by the
+    fallback config loader.
+    """
+    snapshot_path = str(tmp_path / "configs.snapshot")
+    SnapshotConfigLoader(snapshot_path, CountingCfgConfigLoader()).compile_snapshot(
+        [config_dir]
+    )
+
+    path = write_cfg(config_dir, "first", "[PARAM_GROUP1]\nparameter1 = 10\n")
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+
+    fallback = CountingCfgConfigLoader()
+    cfg_loader = SnapshotConfigLoader(snapshot_path, fallback)
+
+    assert cfg_loader.load_config(config_dir, "first")["PARAM_GROUP1"] == {
+        "parameter1": "10"
+    }
+    assert fallback.loads == 1, "Testing stale snapshot entry failed."
+
+    cfg_loader.write_snapshot()
+    fallback = CountingCfgConfigLoader()
+    cfg_loader = SnapshotConfigLoader(snapshot_path, fallback)
+    cfg_loader.load_config(config_dir, "first")
+    assert fallback.loads == 0, "Testing refreshed snapshot entry failed."
+
+
+def test_snapshot_deleted(tmp_path, config_dir):
+    """
+    Check if a deleted config isn't returned from the snapshot.
+    """
+    snapshot_path = str(tmp_path / "configs.snapshot")
+    cfg_loader = SnapshotConfigLoader(snapshot_path, CountingCfgConfigLoader())
+    cfg_loader.compile_snapshot([config_dir])
+
+    os.remove(os.path.join(config_dir, "first.cfg"))
+
+    assert cfg_loader.load_config(config_dir, "first") == {}
+
+
+def test_snapshot_invalid(tmp_path, config_dir):
+    """
+    Check if an invalid snapshot is ignored.
+    """
+    snapshot_path = str(tmp_path / "configs.snapshot")
+    with open(snapshot_path, "wb") as snapshot_file:
+        snapshot_file.write(b"not a snapshot")
+
+    fallback = CountingCfgConfigLoader()
+    cfg_loader = SnapshotConfigLoader(snapshot_path, fallback)
+
+    assert cfg_loader.load_config(config_dir, "first")["PARAM_GROUP1"] == {
+        "parameter1": "1"
+    }
+    assert fallback.loads == 1
+
+
+def test_snapshot_unreadable(tmp_path, config_dir):
+    """
+    Check if a snapshot which can't be read is ignored.
+    """
+    snapshot_path = tmp_path / "configs.snapshot"
+    snapshot_path.mkdir()
+
+    for use_mmap in (False, True):
+        fallback = CountingCfgConfigLoader()
+        cfg_loader = SnapshotConfigLoader(str(snapshot_path), fallback, use_mmap)
+        assert cfg_loader.load_config(config_dir, "first")["PARAM_GROUP1"] == {
+            "parameter1": "1"
+        }
+        assert fallback.loads == 1, "Testing unreadable snapshot failed."
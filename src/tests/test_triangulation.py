@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the batched triangulation of the LED positions.
+"""
+
+import time
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from wlbb.lib.profile import create_profile
+from wlbb.lib.vision.identification import Identification
+from wlbb.lib.vision.triangulation import (
+    gather_observations,
+    project,
+    store_positions,
+    triangulate,
+)
+
+
+def look_at(center, target=(0, 0, 0), focal=1000, width=1920, height=1080):
+    """
+    Return the projection matrix of a camera at `center` looking at `target`.
+    """
+    center = np.asarray(center, float)
+    forward = np.asarray(target, float) - center
+    forward /= np.linalg.norm(forward)
+    right = np.cross((0, 0, 1), forward)
+    right /= np.linalg.norm(right)
+    down = np.cross(forward, right)
+    rotation = np.stack((right, down, forward))
+    intrinsics = np.array(
+        [[focal, 0, width / 2], [0, focal, height / 2], [0, 0, 1]], float
+    )
+    return intrinsics @ np.hstack((rotation, -rotation @ center[:, None]))
+
+
+def make_cameras(count=8, distance=6):
+    """
+    Return the projection matrices of cameras around the origin.
+    """
+    angles = np.linspace(0, 2 * np.pi, count, endpoint=False)
+    return np.stack(
+        [look_at((distance * np.cos(a), distance * np.sin(a), 1)) for a in angles]
+    )
+
+
+def make_observations(projections, led_count, noise, seen=0.8, seed=0):
+    """
+    Return random LED positions, their noisy observations and their mask.
+    """
+    rng = np.random.default_rng(seed)
+    xyz = rng.uniform(-1, 1, (led_count, 3))
+    observations, _ = project(projections, xyz)
+    observations += rng.normal(0, noise, observations.shape)
+    mask = rng.random(observations.shape[:2]) < seen
+    return xyz, observations, mask
+
+
+def test_exact_triangulation():
+    """
+    Test that exact observations give the exact positions, and that LEDs seen
+    by less than two cameras aren't triangulated.
+    """
+    projections = make_cameras(4)
+    xyz, observations, mask = make_observations(projections, 100, 0)
+    mask[:10] = False
+    mask[:5, 2] = True
+    # Masked observations are ignored whatever their value.
+    observations[~mask] = 1e6
+
+    result = triangulate(projections, observations, mask)
+    expected_valid = mask.sum(axis=1) >= 2
+    assert (result.valid == expected_valid).all(), "Wrong valid LEDs"
+    assert np.isnan(result.xyz[~expected_valid]).all(), "Position of invalid LEDs"
+    assert np.allclose(result.xyz[expected_valid], xyz[expected_valid]), "Wrong xyz"
+    assert (result.reprojection_errors[expected_valid] < 1e-6).all(), "Wrong errors"
+    assert (result.camera_counts == mask.sum(axis=1)).all(), "Wrong camera counts"
+
+
+def test_noisy_triangulation_speed():
+    """
+    Test that 50k LEDs seen by 8 cameras are triangulated in less than a
+    second, with reprojection errors matching the noise.
+    """
+    projections = make_cameras(8)
+    xyz, observations, mask = make_observations(projections, 50000, 0.5)
+    start = time.perf_counter()
+    result = triangulate(projections, observations, mask)
+    duration = time.perf_counter() - start
+
+    valid = result.valid
+    assert duration < 1, "Triangulation took %.2f s" % duration
+    assert valid.mean() > 0.99, "Too few LEDs triangulated"
+    assert np.abs(result.xyz[valid] - xyz[valid]).max() < 0.1, "Wrong positions"
+    mean_error = result.reprojection_errors[valid].mean()
+    assert 0.2 < mean_error < 1, "Wrong reprojection error : %.2f" % mean_error
+
+
+def test_identifications_to_profile(tmp_path):
+    """
+    Test that identified LEDs of several cameras are triangulated into a
+    profile, ambiguous and invalid observations being ignored.
+    """
+    projections = make_cameras(3)
+    xyz, observations, _ = make_observations(projections, 20, 0)
+    identifications = []
+    for camera in range(3):
+        led_indexes = np.arange(20)
+        blobs = np.zeros((20, 3), np.float32)
+        blobs[:, :2] = observations[:, camera]
+        led_indexes[0] = -1
+        if camera == 0:
+            led_indexes[1] = 2  # LED 2 found twice by camera 0.
+        identifications.append(Identification(blobs, led_indexes))
+
+    observations, mask = gather_observations(identifications, 20)
+    assert not mask[0].any() and not mask[2, 0] and mask[2, 1:].all(), "Wrong mask"
+    result = triangulate(projections, observations, mask)
+
+    profile = create_profile(str(tmp_path / "test.profile"), range(20))
+    try:
+        store_positions(profile, result, max_error=1)
+        positions = np.array(profile.get_xyz()).reshape(-1, 3)
+        confidence = np.array(profile.get_confidence())
+        assert np.isnan(positions[0]).all(), "Invalid LED stored"
+        assert np.allclose(positions[1:], xyz[1:], atol=1e-3), "Wrong positions"
+        assert (confidence[1:] > 0.99).all(), "Wrong confidence"
+        assert profile.get_generation() == 1, "Profile not updated"
+    finally:
+        profile.close()
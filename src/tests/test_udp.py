@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the UDP transport of LED frames.
+"""
+
+import random
+import socket
+import asyncio
+
+import pytest
+
+from wlbb.lib.network.udp import (
+    FrameReassembler,
+    UdpFrameReceiver,
+    UdpFrameSender,
+    create_multicast_receiver,
+    create_multicast_sender,
+    is_newer_sequence,
+    iter_frame_chunks,
+)
+
+from .test_agent_runtime import run
+
+MTU = 200
+
+
+def make_frame(sequence, size=1000):
+    """
+    Return the content of the frame `sequence`.
+    """
+    return bytes((sequence + i) % 256 for i in range(size))
+
+
+#%% Reassembly
+
+
+def test_sequence_wrap_around():
+    """
+    Test that sequence numbers are compared across wrap around.
+    """
+    assert is_newer_sequence(1, 0), "1 isn't newer than 0"
+    assert not is_newer_sequence(0, 1), "0 is newer than 1"
+    assert not is_newer_sequence(5, 5), "Sequence newer than itself"
+    assert is_newer_sequence(2, 0xFFFFFFFE), "No wrap around"
+    assert not is_newer_sequence(0xFFFFFFFE, 2), "No wrap around"
+
+
+def test_reassemble_reordered_chunks():
+    """
+    Test that frames are reassembled from shuffled and duplicated chunks.
+    """
+    chunks = list(iter_frame_chunks(3, 10, make_frame(10), MTU))
+    assert all(len(chunk) <= MTU for chunk in chunks), "Chunk larger than MTU"
+    chunks += chunks[:2]
+    random.Random(0).shuffle(chunks)
+
+    reassembler = FrameReassembler()
+    completed = [reassembler.feed(chunk) for chunk in chunks]
+    completed = [frame for frame in completed if frame is not None]
+
+    assert len(completed) == 1, "Frame completed %d times" % len(completed)
+    controller, sequence, frame = completed[0]
+    assert (controller, sequence) == (3, 10), "Wrong frame"
+    assert frame == make_frame(10), "Wrong frame content"
+
+
+def test_late_and_lost_chunks():
+    """
+    Test that incomplete and late frames are dropped once a newer frame is
+    complete.
+    """
+    reassembler = FrameReassembler()
+    frame1 = list(iter_frame_chunks(0, 1, make_frame(1), MTU))
+    frame2 = list(iter_frame_chunks(0, 2, make_frame(2), MTU))
+
+    # The last chunk of frame 1 is delayed after frame 2.
+    for chunk in frame1[:-1] + frame2:
+        reassembler.feed(chunk)
+    assert reassembler.feed(frame1[-1]) is None, "Late frame was completed"
+
+    sequence, frame = reassembler.get_latest_frame(0)
+    assert sequence == 2 and frame == make_frame(2), "Wrong latest frame"
+    stats = reassembler.get_stats()
+    assert stats.completed == 1, "Wrong completed count"
+    assert stats.incomplete == 1, "Incomplete frame wasn't dropped"
+    assert stats.late == 1, "Late chunk wasn't counted"
+
+
+def test_max_pending_frames():
+    """
+    Test that the oldest incomplete frames are dropped.
+    """
+    reassembler = FrameReassembler(max_pending=2)
+    for sequence in range(5):
+        reassembler.feed(next(iter_frame_chunks(0, sequence, make_frame(0), MTU)))
+    assert reassembler.get_stats().incomplete == 3, "Pending frames weren't dropped"
+
+
+@pytest.mark.parametrize("new_epoch", [8, 7])
+def test_sender_restart(new_epoch):
+    """
+    Test that the frames of a restarted sender, starting over from sequence
+    0, are received at once with a new epoch and after a few late chunks
+    with the same epoch.
+    """
+    reassembler = FrameReassembler(max_late_chunks=10)
+    for sequence in (1000, 1001):
+        for chunk in iter_frame_chunks(0, sequence, make_frame(sequence), MTU, 7):
+            reassembler.feed(chunk)
+
+    completed = []
+    for sequence in range(200):
+        for chunk in iter_frame_chunks(
+            0, sequence, make_frame(sequence), MTU, new_epoch
+        ):
+            frame = reassembler.feed(chunk)
+            if frame is not None:
+                completed.append(frame[1])
+
+    stats = reassembler.get_stats()
+    assert stats.restarts == 1, "Wrong restart count"
+    if new_epoch != 7:
+        assert completed == list(range(200)), "Frames of the new epoch lost"
+    else:
+        assert len(completed) >= 190, "Only %d frames completed" % len(completed)
+    assert completed[-1] == 199, "Last frame not completed"
+    sequence, frame = reassembler.get_latest_frame(0)
+    assert sequence == 199 and frame == make_frame(199), "Wrong latest frame"
+
+
+def test_invalid_datagrams():
+    """
+    Test that invalid datagrams are ignored.
+    """
+    reassembler = FrameReassembler()
+    assert reassembler.feed(b"\x01\x02") is None
+    assert reassembler.feed(b"\x09" + bytes(20)) is None
+    assert reassembler.get_stats().invalid == 2, "Invalid datagrams not counted"
+
+
+def test_overlapping_chunks_rejected():
+    """
+    Test that chunks cut with another chunk size, which overlap the chunks
+    received before and leave gaps, don't complete a frame.
+    """
+    reassembler = FrameReassembler()
+    chunks = list(iter_frame_chunks(0, 1, make_frame(1), MTU))
+    other_chunks = list(iter_frame_chunks(0, 1, make_frame(1), MTU + 100))
+    # Chunks of 184 bytes at 0 and 552 and of 284 bytes from 284 add up to
+    # more than the frame but miss the bytes 184 to 284.
+    for chunk in [chunks[0], chunks[3]] + other_chunks[1:]:
+        assert reassembler.feed(chunk) is None, "Frame with a gap completed"
+    assert reassembler.get_stats().invalid == 3, "Overlapping chunks accepted"
+
+    completed = [reassembler.feed(chunk) for chunk in chunks[1:]]
+    sequence, frame = reassembler.get_latest_frame(0)
+    assert completed[-1] is not None, "Frame not completed"
+    assert sequence == 1 and frame == make_frame(1), "Wrong frame"
+
+
+#%% Localhost
+
+
+class LossyRelay(asyncio.DatagramProtocol):
+    """
+    Forward datagrams to `target`, dropping one in `loss_period` and swapping
+    every other pair.
+    """
+
+    def __init__(self, target, loss_period=7):
+        self.target = target
+        self.loss_period = loss_period
+        self.count = 0
+        self.held = None
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.count += 1
+        if self.count % self.loss_period == 0:
+            return
+        if self.held is None and self.count % 4 == 1:
+            self.held = data
+            return
+        self.transport.sendto(data, self.target)
+        if self.held is not None:
+            self.transport.sendto(self.held, self.target)
+            self.held = None
+
+
+def test_localhost_loss_and_reordering():
+    """
+    Test frames sent over localhost through a relay losing and reordering
+    datagrams.
+    """
+    displayed = []
+
+    async def scenario():
+        loop = asyncio.get_event_loop()
+        receiver_transport, receiver = await loop.create_datagram_endpoint(
+            lambda: UdpFrameReceiver(
+                lambda controller, sequence, frame: displayed.append(
+                    (sequence, bytes(frame))
+                )
+            ),
+            local_addr=("127.0.0.1", 0),
+        )
+        relay_transport, _ = await loop.create_datagram_endpoint(
+            lambda: LossyRelay(receiver_transport.get_extra_info("sockname")),
+            local_addr=("127.0.0.1", 0),
+        )
+        sender = UdpFrameSender(relay_transport.get_extra_info("sockname"), MTU)
+        for sequence in range(40):
+            sender.send_frame(1, sequence, make_frame(sequence))
+            await asyncio.sleep(0.002)
+        await asyncio.sleep(0.1)
+        sender.close()
+        relay_transport.close()
+        receiver.close()
+
+    run(scenario())
+
+    sequences = [sequence for sequence, _ in displayed]
+    assert displayed, "No frame was displayed"
+    assert len(displayed) < 40, "No frame was lost"
+    assert sequences == sorted(set(sequences)), "Older frame displayed: %a" % sequences
+    for sequence, frame in displayed:
+        assert frame == make_frame(sequence), "Corrupted frame %d" % sequence
+
+
+def test_multicast():
+    """
+    Test frames sent to a multicast group.
+    """
+    group = "239.255.42.42"
+    try:
+        receiver_sock = create_multicast_receiver(group, 0)
+        sender_sock = create_multicast_sender(interface="127.0.0.1")
+        receiver_sock.setsockopt(
+            socket.IPPROTO_IP,
+            socket.IP_ADD_MEMBERSHIP,
+            socket.inet_aton(group) + socket.inet_aton("127.0.0.1"),
+        )
+    except OSError as err:
+        pytest.skip("Multicast isn't available : %s" % err)
+    port = receiver_sock.getsockname()[1]
+    displayed = []
+
+    async def scenario():
+        loop = asyncio.get_event_loop()
+        _, receiver = await loop.create_datagram_endpoint(
+            lambda: UdpFrameReceiver(
+                lambda controller, sequence, frame: displayed.append(sequence)
+            ),
+            sock=receiver_sock,
+        )
+        sender = UdpFrameSender((group, port), MTU, sock=sender_sock)
+        for sequence in range(3):
+            sender.send_frame(0, sequence, make_frame(sequence))
+        await asyncio.sleep(0.1)
+        sender.close()
+        receiver.close()
+
+    run(scenario())
+    if not displayed:
+        pytest.skip("Multicast datagrams aren't looped back here")
+    assert displayed == sorted(displayed), "Frames out of order"
@@ -5,13 +5,16 @@
 Test the WLBB's configuration interface.
 """
 
-from wlbb.lib.config import WLBBConfig
+import pytest
+
+from wlbb.lib.config import CfgConfigLoader, WLBBConfig, load_configs
 
 # from wlbb.lib.config import WLBBConfigSection
 
 from wlbb.lib.paths import get_config_dir
 from wlbb.lib.config.default import (
     DEFAULT_CFG_NAME,
+    SITE_CFG_NAME,
     get_builtin_default_config_dir as get_default_config_dir,
 )
 
@@ -297,3 +300,196 @@ def test_import_config_incompatible():
     assert (
         test_config.get_config_dict() == test_dict_expected
     ), "Testing WLBBConfig.import_config incompatible case failed."
+
+
+#%% Testing load configs
+
+
+def test_load_configs_many():
+    """
+    Check if load_configs loads every agent's config and only loads the builtin
+    default config once.
+    """
+    configs = {
+        get_config_dir(): {
+            "agent_{}".format(i): {"PARAM_GROUP1": {"parameter1": i}} for i in range(20)
+        },
+        get_default_config_dir(): {DEFAULT_CFG_NAME: TEST_DICT_DEFAULT.copy()},
+    }
+    loaded_dirs = []
+
+    class CountingConfigLoader(TestingConfigLoader):
+        def load_config(self, config_dir, config_name):
+            loaded_dirs.append(config_dir)
+            return super().load_config(config_dir, config_name)
+
+    agents = [WLBBDummyAgent("agent_{}".format(i)) for i in range(20)]
+
+    test_configs = load_configs(agents, CountingConfigLoader(configs), max_workers=4)
+
+    assert [config.wlbb_instance for config in test_configs] == agents
+    for i, test_config in enumerate(test_configs):
+        assert test_config.get_config_dict() == {
+            "PARAM_GROUP1": {"parameter1": i, "parameter2": -2},
+            "PARAM_GROUP2": {"parameter3": -3, "parameter4": -4},
+        }, "Testing load_configs failed."
+    assert (
+        loaded_dirs.count(get_default_config_dir()) == 1
+    ), "Testing load_configs single default load failed."
+
+
+#%% Testing typed sections
+
+
+class WLBBTypedDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent declaring the type of its parameters.
+    """
+
+    config_schema = {
+        "PARAM_GROUP1": {"parameter1": int, "parameter2": float},
+        "PARAM_GROUP2": {"parameter3": bool},
+    }
+
+
+def test_import_dict_typed():
+    """
+    Check if parameters are converted according to the agent's schema.
+    """
+    test_dict = {
+        "PARAM_GROUP1": {"parameter1": "1", "parameter2": "2.5"},
+        "PARAM_GROUP2": {"parameter3": "yes", "parameter4": "4"},
+    }
+
+    test_config = WLBBConfig(WLBBTypedDummyAgent("test_agent"))
+    test_config.import_dict(test_dict, complete_default=False)
+
+    assert test_config.get_config_dict() == {
+        "PARAM_GROUP1": {"parameter1": 1, "parameter2": 2.5},
+        "PARAM_GROUP2": {"parameter3": True, "parameter4": "4"},
+    }, "Testing typed import failed."
+
+
+def test_import_dict_typed_invalid():
+    """
+    Check if a value which can't be converted doesn't replace the default one.
+    """
+    test_config_loader = TestingConfigLoader(
+        {get_default_config_dir(): {DEFAULT_CFG_NAME: TEST_DICT_DEFAULT.copy()}}
+    )
+    agent = WLBBTypedDummyAgent("test_agent")
+    agent.set_config_loader(test_config_loader)
+    test_config = WLBBConfig(agent)
+
+    test_config.import_dict({"PARAM_GROUP1": {"parameter1": "one"}})
+
+    assert test_config.get_parameter("PARAM_GROUP1", "parameter1") == -1
+
+
+def test_config_view():
+    """
+    Check if the config view is read-only and follows modifications.
+    """
+    test_config = WLBBConfig(WLBBTypedDummyAgent("test_agent"))
+    test_config.import_dict(
+        {"PARAM_GROUP1": {"parameter1": "1"}}, complete_default=False
+    )
+    view = test_config.get_config_view()
+    section = test_config.get_config_section("PARAM_GROUP1")
+
+    section.set_parameter("parameter1", "2")
+    section.add_parameter("parameter1", "3")
+
+    assert view["PARAM_GROUP1"]["parameter1"] == 2
+    assert view["PARAM_GROUP1"] is section.get_view()
+    assert "parameter1" in section and "parameter2" not in section
+    with pytest.raises(TypeError):
+        view["PARAM_GROUP1"]["parameter1"] = 3
+    with pytest.raises(TypeError):
+        test_config.cfg_dict["PARAM_GROUP1"]["parameter1"] = 3
+
+
+#%% Testing config layers
+
+
+def test_import_config_site_layer():
+    """
+    Check if the site-wide config overrides the builtin default config and is
+    overridden by the agent's config.
+    """
+    test_config_loader = TestingConfigLoader(
+        {
+            get_config_dir(): {
+                "test": {"PARAM_GROUP1": {"parameter1": 1}},
+                SITE_CFG_NAME: {
+                    "PARAM_GROUP1": {"parameter1": 10, "parameter2": 20},
+                    "PARAM_GROUP2": {"parameter3": 30},
+                },
+            },
+            get_default_config_dir(): {DEFAULT_CFG_NAME: TEST_DICT_DEFAULT.copy()},
+        }
+    )
+
+    test_config = WLBBConfig(WLBBDummyAgent("test_agent"))
+    test_config.import_config("test", cfg_loader=test_config_loader)
+
+    assert test_config.get_config_dict() == {
+        "PARAM_GROUP1": {"parameter1": 1, "parameter2": 20},
+        "PARAM_GROUP2": {"parameter3": 30, "parameter4": -4},
+    }, "Testing site-wide config layer failed."
+
+
+def test_layers_shared_between_agents():
+    """
+    Check if agents share the default layers and only copy what they modify.
+    """
+    configs = load_configs(
+        [WLBBDummyAgent("agent_a"), WLBBDummyAgent("agent_b")],
+        TestingConfigLoader(
+            {get_default_config_dir(): {DEFAULT_CFG_NAME: TEST_DICT_DEFAULT.copy()}}
+        ),
+    )
+    section_a = configs[0].get_config_section("PARAM_GROUP1")
+    section_b = configs[1].get_config_section("PARAM_GROUP1")
+    assert section_a._maps[1] is section_b._maps[1], "Default layer copied"
+
+    section_a.set_parameter("parameter1", 1)
+    section_b.remove_parameter("parameter2")
+
+    assert section_a.get_local_dict() == {"parameter1": 1}
+    assert configs[0].get_config_dict()["PARAM_GROUP1"] == {
+        "parameter1": 1,
+        "parameter2": -2,
+    }
+    assert configs[1].get_config_dict()["PARAM_GROUP1"] == {"parameter1": -1}
+    assert configs[1].get_config_dict()["PARAM_GROUP2"] == {
+        "parameter3": -3,
+        "parameter4": -4,
+    }
+    assert not configs[1].get_config_section("PARAM_GROUP2").get_local_dict()
+    assert (
+        configs[0].get_config_section("PARAM_GROUP2")._maps[1]
+        is configs[1].get_config_section("PARAM_GROUP2")._maps[1]
+    ), "Unmodified section copied"
+
+
+#%% Testing the default config loader
+
+
+def test_default_config_loader(monkeypatch, tmp_path):
+    """
+    Check if an agent without a config loader loads and saves its config
+    with a CfgConfigLoader.
+    """
+    monkeypatch.setenv("HOME", str(tmp_path))
+    agent = WLBBDummyAgent("test_agent")
+    test_config = WLBBConfig(agent)
+    test_config.load()
+    assert isinstance(agent.get_config_loader(), CfgConfigLoader)
+
+    test_config.import_dict({"PARAM_GROUP1": {"parameter1": "1"}})
+    test_config.save()
+
+    loaded_config = WLBBConfig(WLBBDummyAgent("test_agent"))
+    loaded_config.load()
+    assert loaded_config.get_parameter("PARAM_GROUP1", "parameter1") == "1"
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Test the write-behind config saver.
+"""
+
+import threading
+import time
+import multiprocessing
+
+from wlbb.lib.agent.runtime import AgentRuntime
+from wlbb.lib.agent.supervisor import _run_agent
+from wlbb.lib.config import WLBBConfig
+from wlbb.lib.config.write_behind import WriteBehindSaver
+from wlbb.lib.paths import get_config_dir
+
+from . import WLBBDummyAgent
+from . import TestingConfigLoader
+from .test_agent_runtime import run
+
+
+class RecordingConfigLoader(TestingConfigLoader):
+    """
+    A testing config loader recording every save and optionally waiting for an
+    event before saving.
+    """
+
+    def __init__(self, configs=None, event=None):
+        super().__init__({} if configs is None else configs)
+        self.saves = []
+        self.event = event
+
+    def save_config(self, config_dict, config_dir, config_name):
+        if self.event is not None:
+            self.event.wait(5)
+        self.saves.append((config_name, config_dict))
+        super().save_config(config_dict, config_dir, config_name)
+
+
+def test_saves_coalesced():
+    """
+    Check if repeated saves of the same config are written once with the last
+    state.
+    """
+    saver = WriteBehindSaver(delay=60)
+    cfg_loader = RecordingConfigLoader()
+
+    for i in range(10):
+        saver.schedule(cfg_loader, {"PARAM_GROUP1": {"parameter1": i}}, "dir", "test")
+    saver.schedule(cfg_loader, {"PARAM_GROUP1": {"parameter1": 0}}, "dir", "other")
+    saver.flush("dir", "test")
+
+    assert cfg_loader.saves == [("test", {"PARAM_GROUP1": {"parameter1": 9}})]
+    assert saver.get_stats().pending == 1
+    saver.close()
+    assert [name for name, _ in cfg_loader.saves] == ["test", "other"]
+    assert saver.get_stats()[:4] == (11, 9, 2, 0)
+
+
+def test_saves_written_after_delay():
+    """
+    Check if the background thread writes pending saves after the delay.
+    """
+    saver = WriteBehindSaver(delay=0.01)
+    cfg_loader = RecordingConfigLoader()
+
+    saver.schedule(cfg_loader, {"PARAM_GROUP1": {"parameter1": 1}}, "dir", "test")
+    deadline = time.monotonic() + 5
+    while not cfg_loader.saves and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    assert cfg_loader.saves, "Testing background write failed."
+    saver.close()
+
+
+def test_schedule_not_blocked():
+    """
+    Check if scheduling a save doesn't wait for a slow write.
+    """
+    event = threading.Event()
+    saver = WriteBehindSaver(delay=0)
+    cfg_loader = RecordingConfigLoader(event=event)
+
+    saver.schedule(cfg_loader, {"PARAM_GROUP1": {"parameter1": 1}}, "dir", "test")
+    time.sleep(0.05)
+    start = time.monotonic()
+    saver.schedule(cfg_loader, {"PARAM_GROUP1": {"parameter1": 2}}, "dir", "test")
+    assert time.monotonic() - start < 1, "Testing non blocking schedule failed."
+
+    event.set()
+    saver.close()
+    assert cfg_loader.saves[-1] == ("test", {"PARAM_GROUP1": {"parameter1": 2}})
+
+
+class SavingDummyAgent(WLBBDummyAgent):
+    """
+    A dummy agent scheduling a deferred save of its config when initialized,
+    whose `quit` doesn't flush it.
+    """
+
+    cfg_loader = None
+
+    def init(self):
+        self.set_config_loader(self.cfg_loader)
+        config = WLBBConfig(self)
+        config.import_dict({"PARAM_GROUP1": {"parameter1": 1}}, complete_default=False)
+        self.set_config(config)
+        config.save(deferred=True)
+
+
+def test_runtime_quit_flushes_config():
+    """
+    Check if a deferred save is written when the runtime quits the agent.
+    """
+    SavingDummyAgent.cfg_loader = cfg_loader = RecordingConfigLoader(
+        {get_config_dir(): {}}
+    )
+    runtime = AgentRuntime()
+    runtime.add_agent(SavingDummyAgent("test_agent"))
+    try:
+        run(runtime.init_agents())
+        assert not cfg_loader.saves
+        run(runtime.quit_agents())
+    finally:
+        runtime.close()
+
+    assert cfg_loader.configs[get_config_dir()]["test_agent"] == {
+        "PARAM_GROUP1": {"parameter1": 1}
+    }
+
+
+def test_supervisor_quit_flushes_config():
+    """
+    Check if a deferred save is written when a supervised agent quits.
+    """
+    SavingDummyAgent.cfg_loader = cfg_loader = RecordingConfigLoader(
+        {get_config_dir(): {}}
+    )
+    stop_event = threading.Event()
+    stop_event.set()
+    status_value = multiprocessing.Value("b", lock=False)
+    _run_agent(SavingDummyAgent, "test_agent", (), {}, status_value, stop_event, 0)
+
+    assert cfg_loader.configs[get_config_dir()]["test_agent"] == {
+        "PARAM_GROUP1": {"parameter1": 1}
+    }
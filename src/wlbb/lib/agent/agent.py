@@ -8,12 +8,15 @@ Define the abstraction of a WLBB agent whose instances are WLBB instances.
 import re
 from enum import Enum
 from abc import ABC, abstractmethod
-from typing import List
+from typing import TYPE_CHECKING, Callable, List, Tuple
 
-from wlbb.lib.logger import WLBBLogger
-from wlbb.lib.config.wlbb_config import ConfigLoader
-from wlbb.lib.config.default import BuiltinDefaultConfigLoader
-from wlbb.lib.config.wlbb_config import WLBBConfig
+from wlbb.lib.wlbb_typing import ConfigSchema
+
+if TYPE_CHECKING:
+    from wlbb.lib.config.config_loader import ConfigLoader
+    from wlbb.lib.config.wlbb_config import WLBBConfig
+    from wlbb.lib.config.config_diff import ConfigDiff
+    from wlbb.lib.config.shared_config import SharedConfigReader
 
 
 def assert_name_is_valid(name):
@@ -50,8 +53,13 @@ class WLBBAgent(ABC):
     agent_id: str
 
     config_sections: List[str]
+    config_schema: ConfigSchema = {}
+
+    _status: Status = Status.INACTIVE
+    _status_listeners: tuple = ()
 
-    status: Status = Status.INACTIVE
+    config_loader: "ConfigLoader" = None
+    shared_configs: "SharedConfigReader" = None
 
     def __init__(self, name: str):
         assert_name_is_valid(name)
@@ -94,19 +102,103 @@ class WLBBAgent(ABC):
         Reload the agent.
         """
 
+    @property
+    def status(self) -> Status:
+        """
+        The agent's status. Status listeners are called when it changes.
+        """
+        return self._status
+
+    @status.setter
+    def status(self, status: Status):
+        old_status = self._status
+        self._status = status
+        if status is not old_status:
+            for listener in self._status_listeners:
+                listener(self, old_status, status)
+
+    def add_status_listener(
+        self, listener: Callable[["WLBBAgent", Status, Status], None]
+    ):
+        """
+        Call `listener(agent, old_status, new_status)` every time the agent's
+        status changes.
+        """
+        if listener not in self._status_listeners:
+            self._status_listeners = self._status_listeners + (listener,)
+
+    def remove_status_listener(self, listener):
+        """
+        Stop calling `listener` when the agent's status changes.
+        """
+        self._status_listeners = tuple(
+            other for other in self._status_listeners if other != listener
+        )
+
+    def get_loop_stats(self) -> Tuple[int, float, int]:
+        """
+        Return the number of iterations of the agent's loop, the latency of
+        its last iteration in seconds and the depth of its queue, sent in its
+        heartbeats. Agents running a loop should override it.
+        """
+        return 0, 0.0, 0
+
+    def config_changed(self, config_diff: "ConfigDiff"):
+        """
+        Called after the agent's config was updated with the sections which
+        changed in its config file (see ConfigWatcher), so the agent can apply
+        them without being reloaded.
+        """
+
+    def load_config(self) -> "WLBBConfig":
+        """
+        Load the agent's config, set it as its config and return it.
+
+        The config published by the server in `shared_configs`, if it was set
+        and has this agent's config, is used without reading or parsing any
+        config file. Otherwise, the config is loaded from the config files.
+        """
+        # Imported here so agents don't load the config modules on import.
+        from wlbb.lib.config.wlbb_config import WLBBConfig
+
+        config = WLBBConfig(self)
+        shared_configs = self.shared_configs
+        if shared_configs is None or self.agent_id not in shared_configs.read():
+            config.load()
+        else:
+            shared_configs.update_config(config)
+        self.set_config(config)
+        return config
+
+    def flush_config(self):
+        """
+        Write the deferred saves of the agent's config. It is called after
+        `quit` by the agent runtime and supervisor.
+        """
+        config = getattr(self, "config", None)
+        if config is not None:
+            config.flush()
+
     # Setters
-    def set_config(self, cfg: WLBBConfig):
+    def set_config(self, cfg: "WLBBConfig"):
         """
         Change the config.
         """
         self.config = cfg
 
-    def set_config_loader(self, cfg_loader: ConfigLoader):
+    def set_config_loader(self, cfg_loader: "ConfigLoader"):
         """
         Change the config loader.
         """
         self.config_loader = cfg_loader
 
+    def set_shared_configs(self, shared_configs: "SharedConfigReader"):
+        """
+        Load the config from the configs published by the server in
+        `shared_configs` (see `load_config`).
+        """
+        self.shared_configs = shared_configs
+
     # Getters
     def get_config_sections_list(self):
         """
@@ -114,14 +206,27 @@ class WLBBAgent(ABC):
         """
         return self.config_sections
 
+    def get_config_schema(self) -> ConfigSchema:
+        """
+        Return the schema giving the type of the parameters of every config
+        section of this agent.
+        """
+        return self.config_schema
+
     def get_config(self):
         """
         Return the config.
         """
         return self.config
 
-    def get_config_loader(self):
+    def get_config_loader(self) -> "ConfigLoader":
         """
-        Return the config loader.
+        Return the config loader, a CfgConfigLoader unless another one was
+        set.
         """
+        if self.config_loader is None:
+            # Imported here so agents don't load the config modules on import.
+            from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+
+            self.config_loader = CfgConfigLoader()
         return self.config_loader
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+A camera agent streaming the LEDs seen by a camera.
+"""
+
+import asyncio
+import threading
+import time
+from typing import AsyncIterator, Iterator, Optional
+
+import numpy as np
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+from wlbb.lib.vision.blobs import BlobDetector
+from wlbb.lib.vision.capture import (
+    CameraSource,
+    CapturedFrame,
+    FrameRing,
+    Observation,
+    Region,
+    capture_frames,
+    create_source,
+    crop_frames,
+    detect_frames,
+)
+
+DEFAULT_BUFFER_COUNT = 4
+
+
+def parse_region(region: str) -> Optional[Region]:
+    """
+    Return the (left, top, right, bottom) region of a "left,top,right,bottom"
+    string, or None for an empty string.
+    """
+    if not region or not region.strip():
+        return None
+    values = tuple(int(value) for value in region.split(","))
+    if len(values) != 4:
+        raise ValueError("Invalid region : %a." % region)
+    return values
+
+
+class WLBBCameraAgent(WLBBAgent):
+    """
+    A WLBB agent capturing the frames of a camera source in a background
+    thread, into a FrameRing of preallocated buffers, and detecting the lit
+    LEDs in a region of them (see BlobDetector).
+
+    The source is built from the configured backend unless one is given.
+    Frames are dropped, oldest first, when they aren't processed as fast as
+    they are captured. When the capture fails, the agent becomes inactive and
+    the error is raised to the consumer of the frames.
+    """
+
+    agent = "camera"
+    config_sections = ["CAMERA"]
+    config_schema = {
+        "CAMERA": {
+            "backend": str,
+            "buffers": int,
+            "region": str,
+            "downsample": int,
+            "threshold": int,
+            "min_area": int,
+            "max_area": int,
+        }
+    }
+
+    def __init__(self, name: str, source: CameraSource = None):
+        super().__init__(name)
+        self.source = source
+        self.detector = BlobDetector()
+        self.buffer_count = DEFAULT_BUFFER_COUNT
+        self.region = None
+        self.step = 1
+        self.ring = None
+        self.processed_frames = 0
+        self.latency = 0.0
+        self.capture_error = None
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _configure(self):
+        config = getattr(self, "config", None)
+        if config is None:
+            return
+        self.buffer_count = config.get_parameter("CAMERA", "buffers", self.buffer_count)
+        self.region = parse_region(config.get_parameter("CAMERA", "region", ""))
+        self.step = config.get_parameter("CAMERA", "downsample", self.step)
+        detector = self.detector
+        detector.threshold = config.get_parameter(
+            "CAMERA", "threshold", detector.threshold
+        )
+        detector.min_area = config.get_parameter(
+            "CAMERA", "min_area", detector.min_area
+        )
+        detector.max_area = config.get_parameter(
+            "CAMERA", "max_area", detector.max_area
+        )
+
+    def init(self):
+        self._configure()
+        if self.source is None:
+            backend = "synthetic"
+            config = getattr(self, "config", None)
+            if config is not None:
+                backend = config.get_parameter("CAMERA", "backend", backend)
+            self.source = create_source(backend)
+
+    def quit(self):
+        self.stop()
+
+    def start(self):
+        """
+        Capture the frames of the source in a background thread.
+        """
+        if self._thread is not None:
+            return
+        if self.source is None:
+            self.init()
+        source = self.source
+        self.ring = FrameRing(source.shape, source.dtype, self.buffer_count)
+        self.capture_error = None
+        self._stop_event.clear()
+        source.open()
+        self._thread = threading.Thread(
+            target=self._capture,
+            name="wlbb-" + self.agent_id,
+            daemon=True,
+        )
+        self.status = Status.ACTIVE
+        self._thread.start()
+
+    def _capture(self):
+        try:
+            capture_frames(self.source, self.ring, self._stop_event)
+        except Exception as err:
+            self.capture_error = err
+            self.status = Status.INACTIVE
+            wlbb_logger.error(
+                "Capture of the camera agent %a failed : %s." % (self.agent_id, err)
+            )
+
+    def stop(self):
+        """
+        Stop capturing. The frames already captured can still be processed.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        # Wake up the capture waiting for a buffer held by the consumer.
+        self.ring.close()
+        self._thread.join()
+        self._thread = None
+        self.source.close()
+        self.status = Status.INACTIVE
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def reload(self):
+        self._configure()
+
+    def config_changed(self, config_diff):
+        # The number of buffers is only applied when the capture restarts.
+        self._configure()
+
+    def set_dark_frame(self, dark_frame: np.ndarray):
+        """
+        Subtract `dark_frame`, a full frame captured with every LED off, from
+        the next frames.
+        """
+        left, top, right, bottom = self.region or (0, 0, None, None)
+        step = self.step
+        self.detector.set_dark_frame(
+            np.asarray(dark_frame)[..., top:bottom:step, left:right:step]
+        )
+
+    def frames(self, timeout: float = None) -> Iterator[CapturedFrame]:
+        """
+        Yield the captured frames until the capture stops or no frame is
+        captured for `timeout` seconds. A frame is released, and its buffer
+        reused, when the next one is requested. Raise RuntimeError once the
+        frames captured before a capture failure are yielded.
+        """
+        ring = self.ring
+        if ring is None:
+            raise RuntimeError("The camera agent %a isn't started." % self.agent_id)
+        while True:
+            frame = ring.get(timeout)
+            if frame is None:
+                thread = self._thread
+                if ring.is_closed() and thread is not None:
+                    # The capture closes the ring just before failing.
+                    thread.join()
+                if self.capture_error is not None:
+                    raise RuntimeError(
+                        "Capture of the camera agent %a failed." % self.agent_id
+                    ) from self.capture_error
+                return
+            try:
+                yield frame
+            finally:
+                ring.release(frame)
+
+    def observations(self, timeout: float = None) -> Iterator[Observation]:
+        """
+        Yield the LEDs detected in every captured frame (see `frames`).
+        """
+        crops = crop_frames(self.frames(timeout), self.region, self.step)
+        for observation in detect_frames(crops, self.detector, self.region, self.step):
+            self.processed_frames += 1
+            self.latency = time.monotonic() - observation.timestamp
+            yield observation
+
+    async def stream(self, timeout: float = None) -> AsyncIterator[Observation]:
+        """
+        Asynchronously yield the LEDs detected in every captured frame. Frames
+        are waited for and processed in the default executor of the event
+        loop, which stays responsive.
+        """
+        loop = asyncio.get_event_loop()
+        observations = self.observations(timeout)
+        try:
+            while True:
+                observation = await loop.run_in_executor(None, next, observations, None)
+                if observation is None:
+                    return
+                yield observation
+        finally:
+            if not observations.gi_running:
+                observations.close()
+
+    def get_loop_stats(self):
+        """
+        Return the number of processed frames, the delay between the capture
+        of the last one and the detection of its LEDs, and the number of
+        frames waiting to be processed.
+        """
+        ring = self.ring
+        return self.processed_frames, self.latency, len(ring) if ring else 0
+
+    def get_dropped_frames(self) -> int:
+        """
+        Return the number of frames dropped because they weren't processed in
+        time since the capture started.
+        """
+        return self.ring.dropped if self.ring is not None else 0
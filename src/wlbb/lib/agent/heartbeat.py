@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the heartbeats sent by agents and the health table aggregating them.
+
+A heartbeat is a fixed-size little endian struct:
+    version (u16), status (u8), padding, loop iterations (u64),
+    last tick latency in seconds (f32), queue depth (u32), RSS in bytes (u64),
+    wall clock timestamp (f64), agent id (48 bytes, NUL padded)
+Each agent packs its heartbeats in a preallocated buffer, sent as a
+HEARTBEAT message (see WLBBClient.send_heartbeat). The server records them in
+its HealthTable.
+"""
+
+import os
+import sys
+import time
+import struct
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+
+__all__ = (
+    "Heartbeat",
+    "HeartbeatEncoder",
+    "HeartbeatEmitter",
+    "HealthTable",
+    "decode_heartbeat",
+    "get_rss",
+    "HEARTBEAT_SIZE",
+)
+
+HEARTBEAT_VERSION = 1
+_HEARTBEAT = struct.Struct("<HBxQfIQd48s")
+HEARTBEAT_SIZE = _HEARTBEAT.size
+MAX_AGENT_ID_LENGTH = 48
+# Agent ids come from the network, so only the most recent ones are cached.
+_MAX_CACHED_AGENT_IDS = 1024
+
+
+class Heartbeat(NamedTuple):
+    """
+    The health of an agent at a given time.
+    """
+
+    agent_id: str
+    status: Status
+    iteration: int
+    latency: float
+    queue_depth: int
+    rss: int
+    timestamp: float
+
+
+class _StatmReader:
+    """
+    Read the resident set size of the current process from /proc/self/statm,
+    keeping the file open between reads.
+    """
+
+    def __init__(self):
+        self._fd = None
+        self._pid = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE")
+
+    def read(self) -> int:
+        pid = os.getpid()
+        if self._pid != pid:
+            # The opened file describes the parent after a fork.
+            if self._fd is not None:
+                os.close(self._fd)
+            self._fd = os.open("/proc/self/statm", os.O_RDONLY)
+            self._pid = pid
+        return int(os.pread(self._fd, 64, 0).split()[1]) * self._page_size
+
+
+_statm_reader = None
+
+
+def get_rss() -> int:
+    """
+    Return the resident set size of the current process in bytes, or its peak
+    resident set size where it isn't available, or 0.
+    """
+    global _statm_reader
+
+    if sys.platform.startswith("linux"):
+        if _statm_reader is None:
+            _statm_reader = _StatmReader()
+        return _statm_reader.read()
+    try:
+        import resource
+    except ImportError:  # Windows
+        return 0
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
+
+
+class HeartbeatEncoder:
+    """
+    Pack the heartbeats of an agent in a reused buffer.
+    """
+
+    def __init__(self, wlbb_agent: WLBBAgent):
+        agent_id = wlbb_agent.agent_id.encode("ascii")
+        if len(agent_id) > MAX_AGENT_ID_LENGTH:
+            raise ValueError("Agent id %a is too long." % wlbb_agent.agent_id)
+        self.wlbb_agent = wlbb_agent
+        self.agent_id = agent_id
+        self.buffer = bytearray(HEARTBEAT_SIZE)
+        self.view = memoryview(self.buffer)
+
+    def encode(
+        self,
+        iteration: int = 0,
+        latency: float = 0.0,
+        queue_depth: int = 0,
+        rss: int = None,
+        timestamp: float = None,
+    ) -> memoryview:
+        """
+        Pack a heartbeat of the agent and return a view of the buffer, which
+        is overwritten by the next heartbeat.
+        """
+        if rss is None:
+            rss = get_rss()
+        if timestamp is None:
+            timestamp = time.time()
+        _HEARTBEAT.pack_into(
+            self.buffer,
+            0,
+            HEARTBEAT_VERSION,
+            self.wlbb_agent.status.value,
+            iteration,
+            latency,
+            queue_depth,
+            rss,
+            timestamp,
+            self.agent_id,
+        )
+        return self.view
+
+
+@lru_cache(maxsize=_MAX_CACHED_AGENT_IDS)
+def _decode_agent_id(raw_agent_id: bytes) -> str:
+    try:
+        return raw_agent_id.rstrip(b"\0").decode("ascii")
+    except UnicodeDecodeError:
+        raise ValueError("Heartbeat agent id isn't ascii.") from None
+
+
+def decode_heartbeat(buffer: Union[bytes, bytearray, memoryview]) -> Heartbeat:
+    """
+    Return the heartbeat packed in `buffer`.
+    """
+    (
+        version,
+        status,
+        iteration,
+        latency,
+        queue_depth,
+        rss,
+        timestamp,
+        raw_agent_id,
+    ) = _HEARTBEAT.unpack_from(buffer)
+    if version != HEARTBEAT_VERSION:
+        raise ValueError("Unsupported heartbeat version : %d." % version)
+    return Heartbeat(
+        _decode_agent_id(raw_agent_id),
+        Status(status),
+        iteration,
+        latency,
+        queue_depth,
+        rss,
+        timestamp,
+    )
+
+
+class HeartbeatEmitter:
+    """
+    Send the heartbeats of an agent every `interval` seconds from a background
+    thread.
+
+    `send` is called with a view of the packed heartbeat, which is only valid
+    until it returns. The loop statistics are given by the agent's
+    `get_loop_stats`.
+    """
+
+    def __init__(
+        self,
+        wlbb_agent: WLBBAgent,
+        send: Callable[[memoryview], None],
+        interval: float = 0.1,
+    ):
+        self.encoder = HeartbeatEncoder(wlbb_agent)
+        self.wlbb_agent = wlbb_agent
+        self.send = send
+        self.interval = interval
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def emit(self):
+        """
+        Send a heartbeat now.
+        """
+        iteration, latency, queue_depth = self.wlbb_agent.get_loop_stats()
+        self.send(self.encoder.encode(iteration, latency, queue_depth))
+
+    def start(self):
+        """
+        Start sending heartbeats.
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run,
+            name="wlbb-heartbeat-" + self.wlbb_agent.agent_id,
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _run(self):
+        next_time = time.monotonic()
+        while True:
+            try:
+                self.emit()
+            except Exception as err:
+                wlbb_logger.error(
+                    "Failed to send a heartbeat of %a : %s."
+                    % (self.wlbb_agent.agent_id, err)
+                )
+            next_time += self.interval
+            if self._stop_event.wait(max(0.0, next_time - time.monotonic())):
+                return
+
+    def stop(self):
+        """
+        Stop sending heartbeats.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+
+class _HealthEntry:
+    """
+    The last heartbeat of an agent and when it was received.
+    """
+
+    __slots__ = ("heartbeat", "received_at")
+
+    def __init__(self, heartbeat: Heartbeat, received_at: float):
+        self.heartbeat = heartbeat
+        self.received_at = received_at
+
+
+class HealthTable:
+    """
+    Aggregate the heartbeats of agents and find the stale ones.
+
+    An agent is stale when its last heartbeat was received more than
+    `stale_after` seconds ago. Entries are kept ordered by reception time, so
+    finding the stale agents only visits them and the first fresh one.
+    """
+
+    def __init__(self, stale_after: float = 1.0):
+        self.stale_after = stale_after
+        self._entries: Dict[str, _HealthEntry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def update(
+        self,
+        heartbeat: Union[Heartbeat, bytes, bytearray, memoryview],
+        received_at: float = None,
+    ) -> Heartbeat:
+        """
+        Record a heartbeat, packed or not, received at the monotonic time
+        `received_at` (now if None) and return it.
+        """
+        if not isinstance(heartbeat, Heartbeat):
+            heartbeat = decode_heartbeat(heartbeat)
+        if received_at is None:
+            received_at = time.monotonic()
+        entries = self._entries
+        with self._lock:
+            entry = entries.get(heartbeat.agent_id)
+            if entry is None:
+                entries[heartbeat.agent_id] = _HealthEntry(heartbeat, received_at)
+            else:
+                entry.heartbeat = heartbeat
+                entry.received_at = received_at
+                entries.move_to_end(heartbeat.agent_id)
+        return heartbeat
+
+    def remove(self, agent_id: str):
+        """
+        Forget an agent.
+        """
+        with self._lock:
+            self._entries.pop(agent_id, None)
+
+    def get_stale_agents(self, now: float = None) -> List[str]:
+        """
+        Return the ids of the agents whose last heartbeat is older than
+        `stale_after` seconds at the monotonic time `now` (now if None).
+        """
+        if now is None:
+            now = time.monotonic()
+        deadline = now - self.stale_after
+        stale_agents = []
+        with self._lock:
+            for agent_id, entry in self._entries.items():
+                if entry.received_at >= deadline:
+                    break
+                stale_agents.append(agent_id)
+        return stale_agents
+
+    def is_stale(self, agent_id: str, now: float = None) -> bool:
+        """
+        Return True if the agent's last heartbeat is too old or if none was
+        received.
+        """
+        if now is None:
+            now = time.monotonic()
+        entry = self._entries.get(agent_id)
+        return entry is None or entry.received_at < now - self.stale_after
+
+    def get_heartbeat(self, agent_id: str) -> Heartbeat:
+        """
+        Return the last heartbeat of an agent, or None.
+        """
+        entry = self._entries.get(agent_id)
+        if entry is None:
+            return None
+        return entry.heartbeat
+
+    def get_heartbeats(self) -> Dict[str, Heartbeat]:
+        """
+        Return the last heartbeat of every agent associated with its id.
+        """
+        with self._lock:
+            return {
+                agent_id: entry.heartbeat for agent_id, entry in self._entries.items()
+            }
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+A processing agent locating the lit LEDs in camera frames.
+"""
+
+import time
+
+import numpy as np
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+from wlbb.lib.vision.blobs import BlobDetector
+from wlbb.lib.vision.identification import (
+    GrayCodeIdentifier,
+    Identification,
+    identify_leds,
+)
+
+
+class WLBBProcessingAgent(WLBBAgent):
+    """
+    A WLBB agent detecting the lit LEDs of the grayscale frames it is given
+    (see BlobDetector).
+    """
+
+    agent = "processing"
+    config_sections = ["PROCESSING"]
+    config_schema = {"PROCESSING": {"threshold": int, "min_area": int, "max_area": int}}
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.detector = BlobDetector()
+        self.processed_frames = 0
+        self.latency = 0.0
+
+    def _configure(self):
+        config = getattr(self, "config", None)
+        if config is None:
+            return
+        detector = self.detector
+        detector.threshold = config.get_parameter(
+            "PROCESSING", "threshold", detector.threshold
+        )
+        detector.min_area = config.get_parameter(
+            "PROCESSING", "min_area", detector.min_area
+        )
+        detector.max_area = config.get_parameter(
+            "PROCESSING", "max_area", detector.max_area
+        )
+
+    def init(self):
+        self._configure()
+
+    def quit(self):
+        pass
+
+    def start(self):
+        self.status = Status.ACTIVE
+
+    def stop(self):
+        self.status = Status.INACTIVE
+
+    def restart(self):
+        self.stop()
+        self.start()
+
+    def reload(self):
+        self._configure()
+
+    def config_changed(self, config_diff):
+        self._configure()
+
+    def set_dark_frame(self, dark_frame: np.ndarray):
+        """
+        Subtract `dark_frame`, captured with every LED off, from the next
+        frames.
+        """
+        self.detector.set_dark_frame(dark_frame)
+
+    def process_frame(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Return the (u, v, intensity) of every lit LED of `frame`.
+        """
+        start = time.perf_counter()
+        blobs = self.detector.detect(frame)
+        self.latency = time.perf_counter() - start
+        self.processed_frames += 1
+        return blobs
+
+    def identify(
+        self, frames: np.ndarray, identifier: GrayCodeIdentifier
+    ) -> Identification:
+        """
+        Return the LEDs found in the frames of an identification sequence and
+        their index (see identify_leds).
+        """
+        return identify_leds(frames, identifier, self.detector)
+
+    def get_loop_stats(self):
+        return self.processed_frames, self.latency, 0
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a registry of the running agents indexed by type and status.
+"""
+
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Set
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+
+__all__ = ("AgentRegistry",)
+
+
+class AgentRegistry:
+    """
+    Keep track of agents by id, agent type and status.
+
+    The registry listens to the status changes of its agents, so its indexes
+    are updated by every lifecycle transition. Queries by type and status
+    return frozensets of agent ids which are cached until an agent of the
+    queried type or status is added, removed or changes status, so repeated
+    queries don't cost more than a dict lookup.
+    """
+
+    def __init__(self):
+        self._agents: Dict[str, WLBBAgent] = {}
+        self._statuses: Dict[str, Status] = {}
+        self._by_type: Dict[str, Set[str]] = {}
+        self._by_status: Dict[Status, Set[str]] = {status: set() for status in Status}
+        self._queries: Dict[tuple, FrozenSet[str]] = {}
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def register(self, wlbb_agent: WLBBAgent):
+        """
+        Add an agent to the registry.
+        """
+        agent_id = wlbb_agent.agent_id
+        with self._lock:
+            if agent_id in self._agents:
+                raise ValueError("Agent %a is already registered." % agent_id)
+            status = wlbb_agent.status
+            self._agents[agent_id] = wlbb_agent
+            self._statuses[agent_id] = status
+            self._by_type.setdefault(wlbb_agent.agent, set()).add(agent_id)
+            self._by_status[status].add(agent_id)
+            self._invalidate(wlbb_agent.agent, (status,))
+            wlbb_agent.add_status_listener(self._status_changed)
+
+    def unregister(self, agent_id: str):
+        """
+        Remove an agent from the registry.
+        """
+        with self._lock:
+            wlbb_agent = self._agents.pop(agent_id, None)
+            if wlbb_agent is None:
+                return
+            wlbb_agent.remove_status_listener(self._status_changed)
+            status = self._statuses.pop(agent_id)
+            agent_ids = self._by_type[wlbb_agent.agent]
+            agent_ids.discard(agent_id)
+            if not agent_ids:
+                del self._by_type[wlbb_agent.agent]
+            self._by_status[status].discard(agent_id)
+            self._invalidate(wlbb_agent.agent, (status,))
+
+    def _status_changed(self, wlbb_agent: WLBBAgent, _, new_status: Status):
+        agent_id = wlbb_agent.agent_id
+        with self._lock:
+            # The indexed status is the reference, the agent's previous status
+            # may have been set while it wasn't registered.
+            old_status = self._statuses.get(agent_id)
+            if old_status is None or old_status is new_status:
+                return
+            self._statuses[agent_id] = new_status
+            self._by_status[old_status].discard(agent_id)
+            self._by_status[new_status].add(agent_id)
+            self._invalidate(wlbb_agent.agent, (old_status, new_status))
+
+    def _invalidate(self, agent_type: str, statuses: Iterable[Status]):
+        self._version += 1
+        for query_type in (agent_type, None):
+            self._queries.pop((query_type, None), None)
+            for status in statuses:
+                self._queries.pop((query_type, status), None)
+
+    def get_agent(self, agent_id: str) -> WLBBAgent:
+        """
+        Return the agent `agent_id`.
+        """
+        try:
+            return self._agents[agent_id]
+        except KeyError:
+            raise ValueError("Unknown agent : %a." % agent_id) from None
+
+    def get_agent_ids(
+        self, agent_type: str = None, status: Status = None
+    ) -> FrozenSet[str]:
+        """
+        Return the ids of the agents of type `agent_type` in status `status`.
+        Every type or every status is matched if they are None.
+        """
+        key = (agent_type, status)
+        agent_ids = self._queries.get(key)
+        if agent_ids is not None:
+            return agent_ids
+
+        with self._lock:
+            if agent_type is None and status is None:
+                agent_ids = frozenset(self._agents)
+            elif agent_type is None:
+                agent_ids = frozenset(self._by_status[status])
+            elif status is None:
+                agent_ids = frozenset(self._by_type.get(agent_type, ()))
+            else:
+                agent_ids = frozenset(
+                    self._by_type.get(agent_type, set()).intersection(
+                        self._by_status[status]
+                    )
+                )
+            self._queries[key] = agent_ids
+        return agent_ids
+
+    def get_agents(self, agent_type: str = None, status: Status = None) -> List:
+        """
+        Return the agents of type `agent_type` in status `status`. Every type
+        or every status is matched if they are None.
+        """
+        agents = self._agents
+        return [
+            agents[agent_id]
+            for agent_id in self.get_agent_ids(agent_type, status)
+            if agent_id in agents
+        ]
+
+    def get_status(self, agent_id: str) -> Status:
+        """
+        Return the status of the agent `agent_id`.
+        """
+        try:
+            return self._statuses[agent_id]
+        except KeyError:
+            raise ValueError("Unknown agent : %a." % agent_id) from None
+
+    def get_statuses(self, agent_ids: Iterable[str] = None) -> Dict[str, Status]:
+        """
+        Return a consistent snapshot of the status of the given agents, or of
+        every agent, associated with their id. Unknown agents are ignored.
+        """
+        with self._lock:
+            if agent_ids is None:
+                return dict(self._statuses)
+            statuses = self._statuses
+            return {
+                agent_id: statuses[agent_id]
+                for agent_id in agent_ids
+                if agent_id in statuses
+            }
+
+    def get_status_counts(self, agent_type: str = None) -> Dict[Status, int]:
+        """
+        Return how many agents of type `agent_type`, or of every type, are in
+        each status.
+        """
+        return {
+            status: len(self.get_agent_ids(agent_type, status)) for status in Status
+        }
+
+    def get_agent_types(self) -> List[str]:
+        """
+        Return the type of every registered agent.
+        """
+        with self._lock:
+            return list(self._by_type)
+
+    def get_version(self) -> int:
+        """
+        Return a number which changes every time an agent is added, removed or
+        changes status, so callers can cache what they derive from the
+        registry.
+        """
+        return self._version
+
+    def __contains__(self, agent_id: str) -> bool:
+        return agent_id in self._agents
+
+    def __len__(self) -> int:
+        return len(self._agents)
@@ -0,0 +1,390 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define an asyncio runtime running the lifecycle transitions of many agents
+concurrently.
+
+Agents defining asynchronous lifecycle methods inherit from AsyncWLBBAgent.
+Synchronous agents are wrapped in a SyncAgentAdapter which runs their
+lifecycle methods in an executor, so a slow agent doesn't block the others.
+"""
+
+import asyncio
+from abc import abstractmethod
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Dict, Iterable, NamedTuple
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+
+__all__ = (
+    "AsyncWLBBAgent",
+    "SyncAgentAdapter",
+    "AgentRuntime",
+    "TransitionResult",
+    "TRANSITIONS",
+)
+
+TRANSITIONS = ("init", "start", "stop", "quit", "restart", "reload")
+
+# Status of an agent once a transition succeeded. Other transitions keep it.
+_TRANSITION_STATUSES = {
+    "start": Status.ACTIVE,
+    "restart": Status.ACTIVE,
+    "stop": Status.INACTIVE,
+    "quit": Status.INACTIVE,
+}
+
+
+class AsyncWLBBAgent(WLBBAgent):
+    """
+    Abstract definition of a WLBB agent whose lifecycle methods are
+    coroutines.
+    """
+
+    @abstractmethod
+    async def init(self):
+        """
+        Initialize the agent.
+        """
+
+    @abstractmethod
+    async def start(self):
+        """
+        Start the agent's operation.
+        """
+
+    @abstractmethod
+    async def stop(self):
+        """
+        Stop the agent's operation.
+        """
+
+    @abstractmethod
+    async def quit(self):
+        """
+        Uninitialize the agent.
+        """
+
+    @abstractmethod
+    async def restart(self):
+        """
+        Restart the agent's operation.
+        """
+
+    @abstractmethod
+    async def reload(self):
+        """
+        Reload the agent.
+        """
+
+
+class SyncAgentAdapter(AsyncWLBBAgent):
+    """
+    Run the lifecycle methods of a synchronous agent in an executor.
+
+    A lifecycle method can't be interrupted once it runs in the executor. If
+    the coroutine awaiting it is cancelled, the agent gets back the status it
+    had before the transition once the method returns, and the next transition
+    waits for it to return.
+    """
+
+    def __init__(self, wlbb_agent: WLBBAgent, executor: Executor = None):
+        self.agent = wlbb_agent.agent
+        super().__init__(wlbb_agent.name)
+        self.wlbb_agent = wlbb_agent
+        self.executor = executor
+        self.config_sections = wlbb_agent.get_config_sections_list()
+        self.config_schema = wlbb_agent.get_config_schema()
+        self._pending = None
+
+    @property
+    def status(self) -> Status:
+        return self.wlbb_agent.status
+
+    @status.setter
+    def status(self, status: Status):
+        self.wlbb_agent.status = status
+
+    def add_status_listener(self, listener):
+        self.wlbb_agent.add_status_listener(listener)
+
+    def remove_status_listener(self, listener):
+        self.wlbb_agent.remove_status_listener(listener)
+
+    async def _wait_pending(self):
+        pending = self._pending
+        if pending is None or pending.done():
+            return
+        try:
+            await asyncio.shield(pending)
+        except Exception:
+            # It was already reported to the cancelled transition.
+            pass
+
+    async def _run(self, method_name: str):
+        await self._wait_pending()
+        status = self.status
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(
+            self.executor, getattr(self.wlbb_agent, method_name)
+        )
+        self._pending = future
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            future.add_done_callback(lambda _: setattr(self, "status", status))
+            raise
+
+    async def init(self):
+        await self._run("init")
+
+    async def start(self):
+        await self._run("start")
+
+    async def stop(self):
+        await self._run("stop")
+
+    async def quit(self):
+        await self._run("quit")
+
+    async def restart(self):
+        await self._run("restart")
+
+    async def reload(self):
+        await self._run("reload")
+
+    def config_changed(self, config_diff):
+        self.wlbb_agent.config_changed(config_diff)
+
+    def flush_config(self):
+        self.wlbb_agent.flush_config()
+
+    # Setters
+    def set_config(self, cfg):
+        self.wlbb_agent.set_config(cfg)
+
+    def set_config_loader(self, cfg_loader):
+        self.wlbb_agent.set_config_loader(cfg_loader)
+
+    # Getters
+    def get_config(self):
+        return self.wlbb_agent.get_config()
+
+    def get_config_loader(self):
+        return self.wlbb_agent.get_config_loader()
+
+
+class TransitionResult(NamedTuple):
+    """
+    The outcome of a lifecycle transition of an agent.
+
+    `error` is None if the transition succeeded, otherwise the raised exception
+    (asyncio.TimeoutError if it timed out).
+    """
+
+    agent_id: str
+    transition: str
+    status: Status
+    error: BaseException = None
+
+
+class AgentRuntime:
+    """
+    Run the lifecycle transitions of many agents concurrently.
+
+    Transitions of a single agent run one after another while transitions of
+    different agents run concurrently, at most `max_concurrency` at once if it
+    is given. A transition taking longer than its timeout is cancelled.
+
+    Once a transition succeeded, the agent's status is the one expected after
+    it (ACTIVE after start and restart, INACTIVE after stop and quit). A
+    transition which fails, times out or is cancelled leaves the agent with the
+    status it had before the transition.
+
+    The deferred config saves of an agent are written once its quit
+    transition returns, even if it failed, so agents don't have to.
+    """
+
+    def __init__(
+        self,
+        timeout: float = 10.0,
+        executor: Executor = None,
+        max_concurrency: int = None,
+    ):
+        self.timeout = timeout
+        self._own_executor = executor is None
+        if executor is None:
+            executor = ThreadPoolExecutor(thread_name_prefix="wlbb-agent")
+        self.executor = executor
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._agents: Dict[str, AsyncWLBBAgent] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def add_agent(self, wlbb_agent: WLBBAgent) -> AsyncWLBBAgent:
+        """
+        Add an agent to the runtime and return it, wrapped in a
+        SyncAgentAdapter if its lifecycle methods are synchronous.
+        """
+        if wlbb_agent.agent_id in self._agents:
+            raise ValueError("Agent %a was already added." % wlbb_agent.agent_id)
+        if not isinstance(wlbb_agent, AsyncWLBBAgent):
+            wlbb_agent = SyncAgentAdapter(wlbb_agent, self.executor)
+        self._agents[wlbb_agent.agent_id] = wlbb_agent
+        return wlbb_agent
+
+    def remove_agent(self, agent_id: str):
+        """
+        Remove an agent from the runtime.
+        """
+        self._agents.pop(agent_id, None)
+        self._locks.pop(agent_id, None)
+
+    def get_agent(self, agent_id: str) -> AsyncWLBBAgent:
+        """
+        Return the agent `agent_id`.
+        """
+        try:
+            return self._agents[agent_id]
+        except KeyError:
+            raise ValueError("Unknown agent : %a." % agent_id) from None
+
+    def get_agents(self) -> Dict[str, AsyncWLBBAgent]:
+        """
+        Return every agent associated with its id.
+        """
+        return dict(self._agents)
+
+    def _get_lock(self, agent_id: str) -> asyncio.Lock:
+        lock = self._locks.get(agent_id)
+        if lock is None:
+            lock = self._locks[agent_id] = asyncio.Lock()
+        return lock
+
+    def _get_semaphore(self):
+        if self.max_concurrency is not None and self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def run_transition(
+        self, agent_id: str, transition: str, timeout: float = None
+    ) -> TransitionResult:
+        """
+        Run the lifecycle method `transition` of an agent and return its
+        outcome. The default timeout of the runtime is used if `timeout` is
+        None.
+        """
+        if transition not in TRANSITIONS:
+            raise ValueError("Unknown transition : %a." % transition)
+        wlbb_agent = self.get_agent(agent_id)
+        if timeout is None:
+            timeout = self.timeout
+
+        semaphore = self._get_semaphore()
+        if semaphore is not None:
+            async with semaphore:
+                return await self._run_transition(wlbb_agent, transition, timeout)
+        return await self._run_transition(wlbb_agent, transition, timeout)
+
+    async def _run_transition(
+        self, wlbb_agent: AsyncWLBBAgent, transition: str, timeout: float
+    ) -> TransitionResult:
+        async with self._get_lock(wlbb_agent.agent_id):
+            status = wlbb_agent.status
+            try:
+                await asyncio.wait_for(getattr(wlbb_agent, transition)(), timeout)
+            except asyncio.CancelledError:
+                wlbb_agent.status = status
+                raise
+            except Exception as err:
+                wlbb_agent.status = status
+                if transition == "quit":
+                    await self._flush_config(wlbb_agent)
+                if isinstance(err, asyncio.TimeoutError):
+                    wlbb_logger.error(
+                        "Agent %a didn't %s within %s seconds."
+                        % (wlbb_agent.agent_id, transition, timeout)
+                    )
+                else:
+                    wlbb_logger.error(
+                        "Agent %a failed to %s : %s."
+                        % (wlbb_agent.agent_id, transition, err)
+                    )
+                return TransitionResult(wlbb_agent.agent_id, transition, status, err)
+
+            if transition == "quit":
+                await self._flush_config(wlbb_agent)
+            wlbb_agent.status = _TRANSITION_STATUSES.get(transition, wlbb_agent.status)
+            return TransitionResult(wlbb_agent.agent_id, transition, wlbb_agent.status)
+
+    async def _flush_config(self, wlbb_agent: AsyncWLBBAgent):
+        loop = asyncio.get_event_loop()
+        try:
+            await loop.run_in_executor(self.executor, wlbb_agent.flush_config)
+        except Exception as err:
+            wlbb_logger.error(
+                "Failed to save the config of agent %a : %s."
+                % (wlbb_agent.agent_id, err)
+            )
+
+    async def run_transitions(
+        self,
+        transition: str,
+        agent_ids: Iterable[str] = None,
+        timeout: float = None,
+    ) -> Dict[str, TransitionResult]:
+        """
+        Run the lifecycle method `transition` of the given agents, or of every
+        agent, concurrently and return their outcome by agent id.
+        """
+        if agent_ids is None:
+            agent_ids = list(self._agents)
+        else:
+            agent_ids = list(agent_ids)
+        results = await asyncio.gather(
+            *(
+                self.run_transition(agent_id, transition, timeout)
+                for agent_id in agent_ids
+            )
+        )
+        return dict(zip(agent_ids, results))
+
+    async def init_agents(self, agent_ids: Iterable[str] = None, timeout=None):
+        """
+        Initialize the given agents, or every agent, concurrently.
+        """
+        return await self.run_transitions("init", agent_ids, timeout)
+
+    async def start_agents(self, agent_ids: Iterable[str] = None, timeout=None):
+        """
+        Start the given agents, or every agent, concurrently.
+        """
+        return await self.run_transitions("start", agent_ids, timeout)
+
+    async def stop_agents(self, agent_ids: Iterable[str] = None, timeout=None):
+        """
+        Stop the given agents, or every agent, concurrently.
+        """
+        return await self.run_transitions("stop", agent_ids, timeout)
+
+    async def quit_agents(self, agent_ids: Iterable[str] = None, timeout=None):
+        """
+        Uninitialize the given agents, or every agent, concurrently.
+        """
+        return await self.run_transitions("quit", agent_ids, timeout)
+
+    def get_status(self, agent_id: str) -> Status:
+        """
+        Return the status of an agent.
+        """
+        return self.get_agent(agent_id).status
+
+    def close(self, wait: bool = True):
+        """
+        Shut down the executor if it was created by the runtime.
+        """
+        if self._own_executor:
+            self.executor.shutdown(wait=wait)
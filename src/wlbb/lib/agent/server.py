@@ -5,8 +5,40 @@
 server.py
 """
 
-from wlbb.lib.config import Config
-from wlbb.lib.profile import Profile
+import asyncio
+import struct
+import threading
+from typing import Dict, Iterable, List, Union
+
+from wlbb.lib.agent.heartbeat import HealthTable, decode_heartbeat
+from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+from wlbb.lib.config.config_loader import ConfigLoader
+from wlbb.lib.config.shared_config import (
+    DEFAULT_SEGMENT_NAME,
+    SHARED_CONFIGS_COMMAND,
+    SharedConfigPublisher,
+)
+from wlbb.lib.config.watcher import ConfigWatcher
+from wlbb.lib.config.wlbb_config import WLBBConfig, load_configs
+from wlbb.lib.logger import wlbb_logger
+from wlbb.lib.network.protocol import ProtocolError
+from wlbb.lib.network.server import ServerSession, WLBBNetworkServer
+from wlbb.lib.network.shm_ring import is_local_peer
+from wlbb.lib.network.udp import DEFAULT_MTU
+from wlbb.lib.profile import Profile, get_profile_path
+from wlbb.lib.scheduler import TickScheduler, TickStats
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7510
+DEFAULT_FRAME_RATE = 60.0
+DEFAULT_HEARTBEAT_TIMEOUT = 1.0
+DEFAULT_SHARED_CONFIGS_SIZE = 1 << 20
+DEFAULT_LOCAL_RING_SLOTS = 4
+DEFAULT_LOCAL_RING_SLOT_SIZE = 1 << 20
+DEFAULT_CONFIG_POLL_INTERVAL = 1.0
+# Value of the udp_frames parameter sending the LED frames to each agent
+# instead of a multicast group.
+UDP_UNICAST = "unicast"
 
 
 def get_server_id(server_name: str):
@@ -16,33 +48,412 @@ def get_server_id(server_name: str):
         return "server"
 
 
+class _ServedAgent:
+    """
+    The config of an agent whose config the server publishes. The agent
+    itself isn't run by the server.
+    """
+
+    def __init__(self, wlbb_agent):
+        self.agent = wlbb_agent.agent
+        self.name = wlbb_agent.name
+        self.agent_id = wlbb_agent.agent_id
+        self.config_sections = wlbb_agent.get_config_sections_list()
+        self.config_schema = wlbb_agent.get_config_schema()
+        self.config_loader = wlbb_agent.get_config_loader()
+        self.config = None
+
+    def config_changed(self, config_diff):
+        pass
+
+    def set_config(self, cfg: WLBBConfig):
+        self.config = cfg
+
+    def get_config_sections_list(self):
+        return self.config_sections
+
+    def get_config_schema(self):
+        return self.config_schema
+
+    def get_config(self) -> WLBBConfig:
+        return self.config
+
+    def get_config_loader(self) -> ConfigLoader:
+        return self.config_loader
+
+
 class WLBBServer:
+    config_sections = ["SERVER"]
+    config_schema = {
+        "SERVER": {
+            "host": str,
+            "port": int,
+            "token": str,
+            "frame_rate": float,
+            "profile": str,
+            "heartbeat_timeout": float,
+            "shared_configs": str,
+            "shared_configs_size": int,
+            "local_ring_slots": int,
+            "local_ring_slot_size": int,
+            "udp_frames": str,
+            "udp_mtu": int,
+            "config_poll_interval": float,
+        }
+    }
+    config_loader: ConfigLoader = None
+
     def __init__(self, server_name: str = ""):
         self.server_id = get_server_id(server_name)
+        self.name = self.agent_id = self.server_id
 
-        self.config = Config()
+        self.config = WLBBConfig(self)
         self.profile = Profile()
+        self.health = HealthTable(DEFAULT_HEARTBEAT_TIMEOUT)
+        self.identification = None
+
+        self.network_server = None
+        self.scheduler = None
+        self.shared_configs = None
+        self.config_watcher = None
+        self._agents: Dict[str, _ServedAgent] = {}
+        self._publish_lock = threading.Lock()
+        self._loop = None
+        self._stop_event = None
+        self._thread = None
+        self._started = threading.Event()
+        self._start_error = None
 
     def init(self):
-        pass
+        self.config.load()
+        token = self.config.get_parameter("SERVER", "token")
+        self.network_server = WLBBNetworkServer(
+            self.config.get_parameter("SERVER", "host", DEFAULT_HOST),
+            self.config.get_parameter("SERVER", "port", DEFAULT_PORT),
+            token=token.encode("utf-8") if token else None,
+        )
+        self.network_server.register_command(
+            "get_server_id", lambda session, args: self.server_id.encode("ascii")
+        )
+        self.network_server.register_command(
+            SHARED_CONFIGS_COMMAND, self._get_shared_configs
+        )
+        self.network_server.heartbeat_handler = self._heartbeat
+        self.health.stale_after = self.config.get_parameter(
+            "SERVER", "heartbeat_timeout", DEFAULT_HEARTBEAT_TIMEOUT
+        )
+        self.scheduler = TickScheduler(
+            self.config.get_parameter("SERVER", "frame_rate", DEFAULT_FRAME_RATE),
+            self.tick,
+        )
+        profile_name = self.config.get_parameter("SERVER", "profile")
+        if profile_name:
+            self.load_profile(profile_name)
+        cfg_loader = self.get_config_loader()
+        if isinstance(cfg_loader, CfgConfigLoader):
+            # Only config files can be watched.
+            self.config_watcher = ConfigWatcher(cfg_loader)
+            self.config_watcher.add_change_listener(self._configs_changed)
+            for served_agent in self._agents.values():
+                self.config_watcher.watch(served_agent)
 
     def mainloop(self):
-        pass
+        """
+        Serve the agents until `stop` is called.
+        """
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._serve(loop))
+        finally:
+            loop.close()
+
+    async def _serve(self, loop):
+        self._loop = loop
+        self._stop_event = asyncio.Event()
+        try:
+            await self.network_server.start()
+            self._open_led_frame_ring()
+            self._open_led_frame_udp()
+            self._open_shared_configs()
+            self._start_config_watcher()
+        except Exception as err:
+            # Raised by `start` in its calling thread.
+            self._start_error = err
+            return
+        finally:
+            self._started.set()
+        ticking = asyncio.ensure_future(self.scheduler.run())
+        try:
+            await self._stop_event.wait()
+        finally:
+            self.scheduler.stop()
+            await ticking
+            await self.network_server.stop()
+            if self.config_watcher is not None:
+                self.config_watcher.stop()
+            self._close_shared_configs()
+            self._loop = None
+
+    def _open_led_frame_ring(self):
+        slot_count = self.config.get_parameter(
+            "SERVER", "local_ring_slots", DEFAULT_LOCAL_RING_SLOTS
+        )
+        if slot_count <= 0:
+            return
+        slot_size = self.config.get_parameter(
+            "SERVER", "local_ring_slot_size", DEFAULT_LOCAL_RING_SLOT_SIZE
+        )
+        try:
+            self.network_server.open_led_frame_ring(slot_count, slot_size)
+        except (NotImplementedError, OSError, ValueError) as err:
+            # Every agent gets the LED frames through the network.
+            wlbb_logger.warning("No local LED frame ring : %s." % err)
+
+    def _open_led_frame_udp(self):
+        udp_frames = self.config.get_parameter("SERVER", "udp_frames", "")
+        if not udp_frames:
+            return
+        mtu = self.config.get_parameter("SERVER", "udp_mtu", DEFAULT_MTU)
+        try:
+            if udp_frames == UDP_UNICAST:
+                self.network_server.open_led_frame_udp(mtu=mtu)
+            else:
+                group, port = udp_frames.rsplit(":", 1)
+                self.network_server.open_led_frame_udp(group, int(port), mtu)
+        except (OSError, ValueError) as err:
+            # Every agent gets the LED frames through its connection.
+            wlbb_logger.warning("No UDP LED frames : %s." % err)
+
+    def _open_shared_configs(self):
+        name = self.config.get_parameter(
+            "SERVER", "shared_configs", "%s_%s" % (DEFAULT_SEGMENT_NAME, self.server_id)
+        )
+        if not name:
+            return
+        size = self.config.get_parameter(
+            "SERVER", "shared_configs_size", DEFAULT_SHARED_CONFIGS_SIZE
+        )
+        try:
+            self.shared_configs = SharedConfigPublisher(name, size)
+        except (NotImplementedError, OSError, ValueError) as err:
+            # Agents still get their configs from the config files.
+            wlbb_logger.warning("Configs not shared in %a : %s." % (name, err))
+            return
+        self.publish_configs()
+
+    def _start_config_watcher(self):
+        interval = self.config.get_parameter(
+            "SERVER", "config_poll_interval", DEFAULT_CONFIG_POLL_INTERVAL
+        )
+        if self.config_watcher is not None and interval > 0:
+            self.config_watcher.start(interval)
+
+    def _configs_changed(self, pushed_diffs):
+        # The watched configs are only the ones of the served agents.
+        self.publish_configs()
+
+    def _close_shared_configs(self):
+        with self._publish_lock:
+            shared_configs, self.shared_configs = self.shared_configs, None
+        if shared_configs is not None:
+            shared_configs.close()
+
+    def _get_shared_configs(self, session: ServerSession, args: bytes) -> bytes:
+        if not is_local_peer(session.transport):
+            raise ValueError(
+                "Agent %a isn't on the server's machine." % session.agent_id
+            )
+        if self.shared_configs is None:
+            raise ValueError("Configs aren't shared.")
+        return self.shared_configs.name.encode("ascii")
+
+    def _heartbeat(self, session: ServerSession, payload: bytes):
+        try:
+            heartbeat = decode_heartbeat(payload)
+        except (ValueError, struct.error) as err:
+            raise ProtocolError("Invalid heartbeat : %s." % err) from None
+        if heartbeat.agent_id != session.agent_id:
+            raise ProtocolError(
+                "Heartbeat of %a sent by %a." % (heartbeat.agent_id, session.agent_id)
+            )
+        self.health.update(heartbeat)
+
+    def add_agents(self, wlbb_agents: Iterable):
+        """
+        Load the configs of `wlbb_agents` and publish them to the agents of
+        the machine, which then don't read their config files (see
+        `WLBBAgent.load_config`). They are published again whenever the config
+        files change. The agents themselves aren't initialized nor run.
+        """
+        served_agents = [_ServedAgent(wlbb_agent) for wlbb_agent in wlbb_agents]
+        for served_agent, config in zip(served_agents, load_configs(served_agents)):
+            served_agent.set_config(config)
+            with self._publish_lock:
+                self._agents[served_agent.agent_id] = served_agent
+            if self.config_watcher is not None:
+                self.config_watcher.watch(served_agent)
+        self.publish_configs()
+
+    def remove_agent(self, agent_id: str):
+        """
+        Stop publishing the config of the agent `agent_id`.
+        """
+        with self._publish_lock:
+            served_agent = self._agents.pop(agent_id, None)
+        if served_agent is None:
+            return
+        if self.config_watcher is not None:
+            self.config_watcher.unwatch(served_agent)
+        self.publish_configs()
+
+    def publish_configs(self, configs: Iterable[WLBBConfig] = ()) -> int:
+        """
+        Publish the server config, the configs of the agents added with
+        `add_agents` and `configs`, other configs of agents, to the agents of
+        the machine (see SharedConfigReader). Return the published version,
+        or 0 if configs aren't shared.
+        """
+        with self._publish_lock:
+            if self.shared_configs is None:
+                return 0
+            agent_configs = [agent.config for agent in self._agents.values()]
+            return self.shared_configs.publish_configs(
+                [self.config, *agent_configs, *configs]
+            )
+
+    def tick(self, frame_number: int, deadline: float):
+        """
+        Render the animation frame `frame_number`, due at `deadline` on the
+        event loop clock. Called by the scheduler at the configured frame
+        rate, between the messages of the agents.
+        """
+        sequence = self.identification
+        if sequence is not None and not sequence.tick(frame_number):
+            self.identification = None
+
+    def start_identification(self, hold_ticks: int = 2):
+        """
+        Show the Gray code sequence identifying the LEDs of the profile on
+        their controllers, every frame being held `hold_ticks` ticks, and
+        return the GrayCodeSequence recording the tick of every frame.
+        """
+        # NumPy is only required to identify the LEDs.
+        from wlbb.lib.vision.identification import (
+            GrayCodeIdentifier,
+            GrayCodeSequence,
+        )
+
+        profile = self.profile
+        if not len(profile):
+            raise ValueError("The profile has no LED to identify.")
+        sequence = GrayCodeSequence(
+            GrayCodeIdentifier(len(profile)),
+            profile.get_controllers(),
+            profile.get_channels(),
+            self.network_server.send_led_frame,
+            hold_ticks,
+        )
+        self.identification = sequence
+        return sequence
 
     def start(self):
-        pass
+        """
+        Run the mainloop in a background thread and wait until it serves.
+        Raise the error preventing it from serving, such as an OSError if
+        its port is already in use.
+        """
+        if self._thread is not None:
+            return
+        if self.network_server is None:
+            self.init()
+        self._started.clear()
+        self._thread = threading.Thread(
+            target=self.mainloop, name="wlbb-" + self.server_id, daemon=True
+        )
+        self._thread.start()
+        self._started.wait()
+        error, self._start_error = self._start_error, None
+        if error is not None:
+            self._thread.join()
+            self._thread = None
+            raise error
 
     def stop(self):
-        pass
+        """
+        Stop the mainloop.
+        """
+        loop = self._loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self._stop_event.set)
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
 
     def restart(self):
-        pass
+        self.stop()
+        self.start()
 
-    def get_profile(self):
-        pass
+    def get_profile(self) -> Profile:
+        """
+        Return the LED profile.
+        """
+        return self.profile
 
-    def load_profile(self, new_profile):
-        pass
+    def load_profile(self, new_profile: Union[Profile, str]):
+        """
+        Replace the LED profile by `new_profile`, a Profile or the name of a
+        profile of the profile directory, and close the previous one.
+        """
+        if isinstance(new_profile, str):
+            new_profile = Profile(get_profile_path(new_profile))
+        old_profile, self.profile = self.profile, new_profile
+        if old_profile is not new_profile:
+            old_profile.close()
 
     def reload(self):
-        pass
+        """
+        Reopen the LED profile if its file was replaced.
+        """
+        if self.profile.is_replaced():
+            self.load_profile(Profile(self.profile.path))
+
+    # Getters
+    def get_agent_configs(self) -> List[WLBBConfig]:
+        """
+        Return the configs of the agents added with `add_agents`.
+        """
+        return [agent.config for agent in self._agents.values()]
+
+    def get_health_table(self) -> HealthTable:
+        """
+        Return the table of the last heartbeat of every agent.
+        """
+        return self.health
+
+    def get_tick_stats(self) -> TickStats:
+        """
+        Return the pacing statistics of the animation frames.
+        """
+        return self.scheduler.get_stats()
+
+    def get_config_sections_list(self):
+        """
+        Return a list containing every config section required by the server.
+        """
+        return self.config_sections
+
+    def get_config_schema(self):
+        """
+        Return the schema giving the type of the parameters of every config
+        section of the server.
+        """
+        return self.config_schema
+
+    def get_config_loader(self) -> ConfigLoader:
+        """
+        Return the config loader, a CfgConfigLoader unless another one was
+        set.
+        """
+        if self.config_loader is None:
+            self.config_loader = CfgConfigLoader()
+        return self.config_loader
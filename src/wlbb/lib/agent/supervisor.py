@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a supervisor running each agent in its own worker process.
+
+Agents running in different processes don't share a GIL, so CPU heavy agents
+don't slow down the others. The supervisor watches the worker processes and
+restarts the crashed ones after an exponentially growing delay. The status of
+each agent is shared with the supervisor through a shared memory value.
+"""
+
+import time
+import threading
+import multiprocessing
+from typing import Dict, List, NamedTuple, Type
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.agent.agent import WLBBAgent, Status
+
+__all__ = ("AgentSupervisor", "RestartPolicy")
+
+
+class RestartPolicy(NamedTuple):
+    """
+    How crashed agents are restarted.
+
+    The first restart happens `initial_delay` seconds after the crash and each
+    following one waits `factor` times longer, up to `max_delay`. The delay is
+    reset once an agent ran for `reset_after` seconds without crashing. An
+    agent isn't restarted anymore after `max_restarts` restarts, if given.
+    """
+
+    initial_delay: float = 0.5
+    factor: float = 2.0
+    max_delay: float = 30.0
+    reset_after: float = 60.0
+    max_restarts: int = None
+
+
+def _open_shared_configs(name: str):
+    """
+    Return a reader of the shared config segment `name`, or None if it can't
+    be opened.
+    """
+    # Imported here so workers not reading shared configs don't load them.
+    from wlbb.lib.config.shared_config import SharedConfigReader
+
+    try:
+        return SharedConfigReader(name)
+    except (NotImplementedError, OSError, ValueError) as err:
+        wlbb_logger.warning("Can't open the shared configs %a : %s." % (name, err))
+        return None
+
+
+def _run_agent(
+    agent_class,
+    name,
+    args,
+    kwargs,
+    status_value,
+    stop_event,
+    interval,
+    shared_configs=None,
+):
+    """
+    Run an agent in a worker process until `stop_event` is set.
+    """
+    wlbb_agent = agent_class(name, *args, **kwargs)
+    reader = None
+    if shared_configs:
+        reader = _open_shared_configs(shared_configs)
+        wlbb_agent.set_shared_configs(reader)
+    try:
+        wlbb_agent.init()
+        wlbb_agent.start()
+        status_value.value = wlbb_agent.status.value
+        while not stop_event.wait(interval):
+            status_value.value = wlbb_agent.status.value
+        wlbb_agent.stop()
+        try:
+            wlbb_agent.quit()
+        finally:
+            wlbb_agent.flush_config()
+        status_value.value = Status.INACTIVE.value
+    finally:
+        if reader is not None:
+            reader.close()
+
+
+class _SupervisedAgent:
+    """
+    An agent run by the supervisor and its worker process.
+    """
+
+    def __init__(self, agent_class, name, args, kwargs, context):
+        self.agent_class = agent_class
+        self.name = name
+        self.agent_id = "{agent}-{name}".format(agent=agent_class.agent, name=name)
+        self.args = args
+        self.kwargs = kwargs
+        self.status_value = context.Value("b", Status.INACTIVE.value, lock=False)
+        self.stop_event = context.Event()
+        self.process = None
+        self.started_at = None
+        self.restarts = 0
+        self.delay = None
+        self.restart_at = None
+        self.enabled = False
+
+
+class AgentSupervisor:
+    """
+    Run each agent in its own worker process and restart the crashed ones.
+
+    Agents are given by their class, which must be importable by the worker
+    processes, and their constructor arguments. `start_method` is the
+    multiprocessing start method of the worker processes, the platform's
+    default if None.
+
+    If `shared_configs` is the name of the shared config segment of the
+    server, agents load their config from it instead of their config files
+    (see `WLBBAgent.load_config`).
+    """
+
+    def __init__(
+        self,
+        restart_policy: RestartPolicy = None,
+        start_method: str = None,
+        status_interval: float = 0.05,
+        shared_configs: str = None,
+    ):
+        if restart_policy is None:
+            restart_policy = RestartPolicy()
+        self.restart_policy = restart_policy
+        self.context = multiprocessing.get_context(start_method)
+        self.status_interval = status_interval
+        self.shared_configs = shared_configs
+        self._agents: Dict[str, _SupervisedAgent] = {}
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def add_agent(self, agent_class: Type[WLBBAgent], name: str, *args, **kwargs):
+        """
+        Add an agent built with `agent_class(name, *args, **kwargs)` in its
+        worker process and return its id.
+        """
+        supervised = _SupervisedAgent(agent_class, name, args, kwargs, self.context)
+        with self._lock:
+            if supervised.agent_id in self._agents:
+                raise ValueError("Agent %a was already added." % supervised.agent_id)
+            self._agents[supervised.agent_id] = supervised
+        return supervised.agent_id
+
+    def _get_supervised(self, agent_id: str) -> _SupervisedAgent:
+        try:
+            return self._agents[agent_id]
+        except KeyError:
+            raise ValueError("Unknown agent : %a." % agent_id) from None
+
+    def _spawn(self, supervised: _SupervisedAgent):
+        supervised.stop_event.clear()
+        supervised.status_value.value = Status.INACTIVE.value
+        supervised.process = self.context.Process(
+            target=_run_agent,
+            args=(
+                supervised.agent_class,
+                supervised.name,
+                supervised.args,
+                supervised.kwargs,
+                supervised.status_value,
+                supervised.stop_event,
+                self.status_interval,
+                self.shared_configs,
+            ),
+            name="wlbb-" + supervised.agent_id,
+            daemon=True,
+        )
+        supervised.process.start()
+        supervised.started_at = time.monotonic()
+        supervised.restart_at = None
+
+    def start_agent(self, agent_id: str):
+        """
+        Start the worker process of an agent.
+        """
+        with self._lock:
+            supervised = self._get_supervised(agent_id)
+            supervised.enabled = True
+            supervised.delay = None
+            if supervised.process is None or not supervised.process.is_alive():
+                self._spawn(supervised)
+
+    def stop_agent(self, agent_id: str, timeout: float = 5.0):
+        """
+        Stop an agent and wait for its worker process to exit, terminating it
+        after `timeout` seconds.
+        """
+        with self._lock:
+            supervised = self._get_supervised(agent_id)
+            supervised.enabled = False
+            supervised.restart_at = None
+            process = supervised.process
+            if process is None:
+                return
+            supervised.stop_event.set()
+        process.join(timeout)
+        if process.is_alive():
+            wlbb_logger.warning(
+                "Agent %a didn't stop within %s seconds, terminating it."
+                % (agent_id, timeout)
+            )
+            process.terminate()
+            process.join()
+        supervised.status_value.value = Status.INACTIVE.value
+
+    def _get_next_delay(self, supervised: _SupervisedAgent) -> float:
+        policy = self.restart_policy
+        ran_for = time.monotonic() - supervised.started_at
+        if supervised.delay is None or ran_for >= policy.reset_after:
+            return policy.initial_delay
+        return min(supervised.delay * policy.factor, policy.max_delay)
+
+    def poll(self) -> List[str]:
+        """
+        Check the worker processes once, schedule the restart of the crashed
+        agents and restart the ones whose delay elapsed. Return the ids of the
+        restarted agents.
+        """
+        restarted = []
+        now = time.monotonic()
+        with self._lock:
+            for supervised in self._agents.values():
+                process = supervised.process
+                if not supervised.enabled or process is None:
+                    continue
+
+                if supervised.restart_at is None:
+                    if process.is_alive():
+                        continue
+                    supervised.status_value.value = Status.INACTIVE.value
+                    policy = self.restart_policy
+                    if (
+                        policy.max_restarts is not None
+                        and supervised.restarts >= policy.max_restarts
+                    ):
+                        wlbb_logger.error(
+                            "Agent %a crashed (exit code %s) and won't be "
+                            "restarted anymore."
+                            % (supervised.agent_id, process.exitcode)
+                        )
+                        supervised.enabled = False
+                        continue
+                    supervised.delay = self._get_next_delay(supervised)
+                    supervised.restart_at = now + supervised.delay
+                    wlbb_logger.error(
+                        "Agent %a crashed (exit code %s), restarting it in %s "
+                        "seconds."
+                        % (supervised.agent_id, process.exitcode, supervised.delay)
+                    )
+
+                if supervised.restart_at <= now:
+                    supervised.restarts += 1
+                    self._spawn(supervised)
+                    restarted.append(supervised.agent_id)
+        return restarted
+
+    def start(self, interval: float = 0.1):
+        """
+        Start every agent and watch them every `interval` seconds from a
+        background thread.
+        """
+        for agent_id in list(self._agents):
+            self.start_agent(agent_id)
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="wlbb-supervisor", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stop_event.wait(interval):
+            try:
+                self.poll()
+            except Exception as err:
+                wlbb_logger.error("Agent supervisor poll failed : %s." % err)
+
+    def stop(self, timeout: float = 5.0):
+        """
+        Stop watching the agents and stop every agent.
+        """
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        for agent_id in list(self._agents):
+            self.stop_agent(agent_id, timeout)
+
+    # Getters
+    def get_status(self, agent_id: str) -> Status:
+        """
+        Return the status of an agent as reported by its worker process.
+        """
+        supervised = self._get_supervised(agent_id)
+        process = supervised.process
+        if process is None or not process.is_alive():
+            return Status.INACTIVE
+        return Status(supervised.status_value.value)
+
+    def get_restart_count(self, agent_id: str) -> int:
+        """
+        Return how many times an agent was restarted after crashing.
+        """
+        return self._get_supervised(agent_id).restarts
+
+    def get_restart_delay(self, agent_id: str) -> float:
+        """
+        Return the delay before the last restart of an agent, or None.
+        """
+        return self._get_supervised(agent_id).delay
+
+    def get_pid(self, agent_id: str) -> int:
+        """
+        Return the pid of the worker process of an agent, or None.
+        """
+        process = self._get_supervised(agent_id).process
+        if process is None:
+            return None
+        return process.pid
+
+    def get_agent_ids(self) -> List[str]:
+        """
+        Return the id of every supervised agent.
+        """
+        return list(self._agents)
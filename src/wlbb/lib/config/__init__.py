@@ -3,8 +3,51 @@
 
 """
 This subpackage allow WLBB instances to use configurations.
+
+Its classes are only imported when they are first accessed, so importing a
+module of this subpackage doesn't import every config loader.
 """
 
-from wlbb.lib.config.wlbb_config import WLBBConfig
-from wlbb.lib.config.config_loader import ConfigLoader
-from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+import sys
+import importlib
+
+__all__ = (
+    "WLBBConfig",
+    "load_configs",
+    "ConfigLoader",
+    "CfgConfigLoader",
+    "SnapshotConfigLoader",
+    "ConfigWatcher",
+)
+
+_LAZY_ATTRIBUTES = {
+    "WLBBConfig": "wlbb.lib.config.wlbb_config",
+    "load_configs": "wlbb.lib.config.wlbb_config",
+    "ConfigLoader": "wlbb.lib.config.config_loader",
+    "CfgConfigLoader": "wlbb.lib.config.cfg_config_loader",
+    "SnapshotConfigLoader": "wlbb.lib.config.snapshot_config_loader",
+    "ConfigWatcher": "wlbb.lib.config.watcher",
+}
+
+
+def __getattr__(name):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError(
+            "module {module!r} has no attribute {name!r}".format(
+                module=__name__, name=name
+            )
+        )
+    value = getattr(importlib.import_module(module_name), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()).union(__all__))
+
+
+if sys.version_info < (3, 7):
+    # Module level __getattr__ isn't supported before Python 3.7.
+    for _name in __all__:
+        __getattr__(_name)
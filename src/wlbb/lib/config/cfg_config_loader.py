@@ -5,16 +5,22 @@
 Define CfgConfigLoader.
 """
 
+import io
 import os
-from typing import List
-from configparser import ConfigParser
+from typing import TYPE_CHECKING, List
 
 from wlbb.lib.config.config_loader import ConfigLoader
 from wlbb.lib.config.config_loader import ConfigDict
-from wlbb.lib.paths import create_dir, create_file, delete_file
+from wlbb.lib.config.config_cache import FrozenConfig, ParsedConfigCache
+from wlbb.lib.config.config_cache import parsed_config_cache, thaw_config
+from wlbb.lib.config.config_dir_index import ConfigDirIndex, config_dir_index
+from wlbb.lib.paths import create_dir, create_file, delete_file, write_file_atomic
 
+if TYPE_CHECKING:
+    from configparser import ConfigParser
 
-def configparser_to_dict(config_parser: ConfigParser) -> ConfigDict:
+
+def configparser_to_dict(config_parser: "ConfigParser") -> ConfigDict:
     """
     Convert a config parser into a config dict.
     """
@@ -26,66 +32,111 @@ def configparser_to_dict(config_parser: ConfigParser) -> ConfigDict:
     return new_dict
 
 
+def new_config_parser() -> "ConfigParser":
+    """
+    Return an empty config parser.
+    """
+    # configparser is only imported once a config file is actually parsed.
+    from configparser import ConfigParser
+
+    config_parser = ConfigParser(default_section="WLBB_CONFIG")
+    config_parser.clear()
+    return config_parser
+
+
+def parse_config_file(path: str) -> ConfigDict:
+    """
+    Parse the config file at `path` with a fresh config parser.
+    """
+    config_parser = new_config_parser()
+    config_parser.read(path)
+    return configparser_to_dict(config_parser)
+
+
 class CfgConfigLoader(ConfigLoader):
     """
     A config loader using the builtin module configparser.
+
+    Parsed files are kept in a `ParsedConfigCache` so loading an unchanged file
+    doesn't parse it again, and config directories are indexed by a
+    `ConfigDirIndex` so checking if a config exists doesn't list the whole
+    directory. Both are shared by every CfgConfigLoader unless other ones are
+    given.
     """
 
-    def __init__(self):
+    def __init__(
+        self, cache: ParsedConfigCache = None, dir_index: ConfigDirIndex = None
+    ):
         self.ext = "cfg"
-        self.config_parser = ConfigParser(default_section="WLBB_CONFIG")
-        self.config_parser.clear()
+        if cache is None:
+            cache = parsed_config_cache
+        if dir_index is None:
+            dir_index = config_dir_index
+        self.cache = cache
+        self.dir_index = dir_index
+
+    def get_config_path(self, config_dir: str, config_name: str) -> str:
+        """
+        Return the path of the file containing the config `config_name`.
+        """
+        config_file = "{name}.{ext}".format(name=config_name, ext=self.ext)
+        return os.path.join(config_dir, config_file)
 
     def get_config_list(self, config_dir: str) -> List[str]:
-        if not os.path.isdir(config_dir):
-            return []
-
-        cfgs = []
-        for conf_file in os.listdir(config_dir):
-            name, ext = os.path.splitext(conf_file)
-            if ext == self.ext:
-                cfgs.append(name)
-
-        return cfgs
+        return list(self.dir_index.get_names(config_dir))
 
     def create_config(self, config_dir: str, config_name: str):
-        config_file = "{name}.{ext}".format(name=config_name, ext=self.ext)
-        path = os.path.join(config_dir, config_file)
+        path = self.get_config_path(config_dir, config_name)
 
         if not os.path.isdir(config_dir):
             create_dir(config_dir)
 
-        if config_name not in self.get_config_list(config_dir):
+        if not self.dir_index.contains(config_dir, config_name):
+            previous_mtime_ns = self.dir_index.get_mtime(config_dir)
             create_file(path)
+            self.dir_index.add(config_dir, config_name, previous_mtime_ns)
 
     def delete_config(self, config_dir: str, config_name: str):
-        config_file = "{name}.{ext}".format(name=config_name, ext=self.ext)
-        path = os.path.join(config_dir, config_file)
+        path = self.get_config_path(config_dir, config_name)
 
-        if not os.path.isdir(config_dir):
-            return
-        if config_name not in self.get_config_list(config_dir):
+        if not self.dir_index.contains(config_dir, config_name):
             return
 
+        previous_mtime_ns = self.dir_index.get_mtime(config_dir)
         delete_file(path)
+        self.dir_index.discard(config_dir, config_name, previous_mtime_ns)
+        self.cache.invalidate(path)
 
     def load_config(self, config_dir: str, config_name: str) -> ConfigDict:
-        config_file = "{name}.{ext}".format(name=config_name, ext=self.ext)
-        path = os.path.join(config_dir, config_file)
-
-        if not os.path.isdir(config_dir):
-            return {}
-        if config_name not in self.get_config_list(config_dir):
+        frozen_config = self.load_frozen_config(config_dir, config_name)
+        if frozen_config is None:
             return {}
+        return thaw_config(frozen_config)
+
+    def load_frozen_config(self, config_dir: str, config_name: str) -> FrozenConfig:
+        """
+        Return the requested configuration as an immutable mapping shared with
+        every other caller, or None if it doesn't exist.
+        """
+        path = self.get_config_path(config_dir, config_name)
 
-        self.config_parser.read(path)
-        return configparser_to_dict(self.config_parser)
+        try:
+            return self.cache.get(path, parse_config_file)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
 
     def save_config(self, config_dict: ConfigDict, config_dir: str, config_name: str):
-        config_file = "{name}.{ext}".format(name=config_name, ext=self.ext)
-        path = os.path.join(config_dir, config_file)
+        path = self.get_config_path(config_dir, config_name)
+
+        if not os.path.isdir(config_dir):
+            create_dir(config_dir)
+
+        config_parser = new_config_parser()
+        config_parser.read_dict(config_dict)
+        cfg = io.StringIO()
+        config_parser.write(cfg)
+        previous_mtime_ns = self.dir_index.get_mtime(config_dir)
+        write_file_atomic(path, cfg.getvalue())
 
-        self.create_config(config_dir, config_name)
-        self.config_parser.read_dict(config_dict)
-        with open(path, "w") as cfg:
-            self.config_parser.write(cfg)
+        self.dir_index.add(config_dir, config_name, previous_mtime_ns)
+        self.cache.invalidate(path)
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a cache of parsed configuration files.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Callable, Mapping, NamedTuple, Tuple
+
+from wlbb.lib.wlbb_typing import ConfigDict
+
+__all__ = (
+    "FrozenConfig",
+    "CacheStats",
+    "ParsedConfigCache",
+    "freeze_config_dict",
+    "thaw_config",
+    "get_file_signature",
+    "parsed_config_cache",
+)
+
+FrozenConfig = Mapping[str, Mapping[str, str]]
+FileSignature = Tuple[int, int, int]
+
+
+class CacheStats(NamedTuple):
+    """
+    Counters describing the activity of a parsed config cache.
+    """
+
+    hits: int
+    misses: int
+    evictions: int
+    size: int
+    maxsize: int
+
+
+def get_file_signature(path) -> FileSignature:
+    """
+    Return the signature (mtime_ns, size, inode) of the file at `path`.
+    Raise an OSError if the file can't be stated.
+    """
+    stat = os.stat(path)
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def freeze_config_dict(config_dict: ConfigDict) -> FrozenConfig:
+    """
+    Return an immutable view of a config dict which doesn't share its sections
+    with `config_dict`.
+    """
+    return MappingProxyType(
+        {
+            section: MappingProxyType(dict(section_dict))
+            for section, section_dict in config_dict.items()
+        }
+    )
+
+
+def thaw_config(frozen_config: FrozenConfig) -> ConfigDict:
+    """
+    Return a mutable config dict built from a frozen config.
+    """
+    return {
+        section: dict(section_dict) for section, section_dict in frozen_config.items()
+    }
+
+
+class ParsedConfigCache:
+    """
+    A bounded LRU cache of parsed configuration files.
+
+    Entries are keyed on the file's path and are only valid as long as the
+    file's signature (mtime_ns, size, inode) doesn't change. Cached values are
+    immutable so they can be shared between every caller.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        if maxsize < 1:
+            raise ValueError("Cache's maxsize must be at least 1.")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path, parse: Callable[[str], ConfigDict]) -> FrozenConfig:
+        """
+        Return the parsed config stored in the file at `path`, calling
+        `parse(path)` only if the file changed since it was last parsed.
+        """
+        path = os.fspath(path)
+        signature = get_file_signature(path)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == signature:
+                self._entries.move_to_end(path)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        frozen_config = freeze_config_dict(parse(path))
+
+        with self._lock:
+            self._entries[path] = (signature, frozen_config)
+            self._entries.move_to_end(path)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+        return frozen_config
+
+    def invalidate(self, path):
+        """
+        Forget the parsed config stored for `path` if there is one.
+        """
+        with self._lock:
+            self._entries.pop(os.fspath(path), None)
+
+    def clear(self):
+        """
+        Forget every parsed config and reset the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+            self.evictions = 0
+
+    def get_stats(self) -> CacheStats:
+        """
+        Return the cache's counters.
+        """
+        with self._lock:
+            return CacheStats(
+                self.hits, self.misses, self.evictions, len(self._entries), self.maxsize
+            )
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+parsed_config_cache = ParsedConfigCache()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the differences between two configurations.
+"""
+
+from typing import Any, Dict, Mapping, NamedTuple, Tuple
+
+__all__ = ("SectionDiff", "ConfigDiff", "diff_section", "diff_config")
+
+
+class SectionDiff(NamedTuple):
+    """
+    The differences between two states of a config section.
+
+    `changed` associates the added or modified parameters with their new value
+    and `removed` contains the names of the removed parameters.
+    """
+
+    changed: Dict[str, Any]
+    removed: Tuple[str, ...]
+
+
+ConfigDiff = Dict[str, SectionDiff]
+
+
+def diff_section(
+    old_section: Mapping[str, Any], new_section: Mapping[str, Any]
+) -> SectionDiff:
+    """
+    Return the differences between two states of a config section, or None if
+    they are equal.
+    """
+    changed = {
+        parameter: value
+        for parameter, value in new_section.items()
+        if parameter not in old_section or old_section[parameter] != value
+    }
+    removed = tuple(
+        parameter for parameter in old_section if parameter not in new_section
+    )
+    if not changed and not removed:
+        return None
+    return SectionDiff(changed, removed)
+
+
+def diff_config(
+    old_config: Mapping[str, Mapping[str, Any]],
+    new_config: Mapping[str, Mapping[str, Any]],
+) -> ConfigDiff:
+    """
+    Return the differences between two configurations, only containing the
+    sections which changed.
+    """
+    config_diff = {}
+    for section_name in set(old_config).union(new_config):
+        section_diff = diff_section(
+            old_config.get(section_name, {}), new_config.get(section_name, {})
+        )
+        if section_diff is not None:
+            config_diff[section_name] = section_diff
+    return config_diff
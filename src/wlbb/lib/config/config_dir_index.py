@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define an index of the configuration files contained in directories.
+"""
+
+import os
+import threading
+from typing import Dict, FrozenSet, Set
+
+__all__ = ("ConfigDirIndex", "config_dir_index")
+
+
+class _DirEntry:
+    """
+    The indexed content of a directory.
+    """
+
+    __slots__ = ("mtime_ns", "names")
+
+    def __init__(self, mtime_ns: int, names: Set[str]):
+        self.mtime_ns = mtime_ns
+        self.names = names
+
+
+class ConfigDirIndex:
+    """
+    An index of the config names found in directories for a given file
+    extension.
+
+    A directory is scanned once and its index is only rebuilt when its mtime
+    changes. Config loaders keep the index up to date when they create or
+    delete a config themselves, so membership checks cost a single stat.
+    """
+
+    def __init__(self, ext: str):
+        self.suffix = "." + ext
+        self.scans = 0
+        self._dirs: Dict[str, _DirEntry] = {}
+        self._lock = threading.Lock()
+
+    def _scan(self, config_dir: str, mtime_ns: int) -> _DirEntry:
+        names = set()
+        suffix_len = len(self.suffix)
+        with os.scandir(config_dir) as entries:
+            for entry in entries:
+                name = entry.name
+                if len(name) > suffix_len and name.endswith(self.suffix):
+                    names.add(name[:-suffix_len])
+
+        dir_entry = _DirEntry(mtime_ns, names)
+        with self._lock:
+            self._dirs[config_dir] = dir_entry
+            self.scans += 1
+        return dir_entry
+
+    def _get_entry(self, config_dir: str) -> _DirEntry:
+        """
+        Return the up to date index of `config_dir` or None if it isn't a
+        directory.
+        """
+        try:
+            mtime_ns = os.stat(config_dir).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            with self._lock:
+                self._dirs.pop(config_dir, None)
+            return None
+
+        dir_entry = self._dirs.get(config_dir)
+        if dir_entry is not None and dir_entry.mtime_ns == mtime_ns:
+            return dir_entry
+
+        try:
+            return self._scan(config_dir, mtime_ns)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def get_names(self, config_dir) -> FrozenSet[str]:
+        """
+        Return every config name found in `config_dir`.
+        """
+        dir_entry = self._get_entry(os.fspath(config_dir))
+        if dir_entry is None:
+            return frozenset()
+        with self._lock:
+            return frozenset(dir_entry.names)
+
+    def contains(self, config_dir, config_name: str) -> bool:
+        """
+        Return True if the config `config_name` exists in `config_dir`.
+        """
+        dir_entry = self._get_entry(os.fspath(config_dir))
+        return dir_entry is not None and config_name in dir_entry.names
+
+    def get_mtime(self, config_dir) -> int:
+        """
+        Return the mtime of `config_dir` in nanoseconds, or None if it isn't
+        a directory. Config loaders get it before changing the directory and
+        give it to `add` or `discard`.
+        """
+        try:
+            return os.stat(os.fspath(config_dir)).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def _update(
+        self, config_dir, config_name: str, present: bool, previous_mtime_ns: int
+    ):
+        config_dir = os.fspath(config_dir)
+        try:
+            mtime_ns = os.stat(config_dir).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            self.invalidate(config_dir)
+            return
+
+        with self._lock:
+            dir_entry = self._dirs.get(config_dir)
+            if dir_entry is None:
+                return
+            if previous_mtime_ns is None or dir_entry.mtime_ns != previous_mtime_ns:
+                # The directory changed since it was indexed: the new mtime
+                # may hide files created by others, so it is scanned again.
+                del self._dirs[config_dir]
+                return
+            if present:
+                dir_entry.names.add(config_name)
+            else:
+                dir_entry.names.discard(config_name)
+            dir_entry.mtime_ns = mtime_ns
+
+    def add(self, config_dir, config_name: str, previous_mtime_ns: int = None):
+        """
+        Record that the config `config_name` was just created in `config_dir`,
+        whose mtime was `previous_mtime_ns` before (see `get_mtime`). The
+        index of `config_dir` is forgotten if it was out of date.
+        """
+        self._update(config_dir, config_name, True, previous_mtime_ns)
+
+    def discard(self, config_dir, config_name: str, previous_mtime_ns: int = None):
+        """
+        Record that the config `config_name` was just deleted from
+        `config_dir`, whose mtime was `previous_mtime_ns` before (see
+        `get_mtime`). The index of `config_dir` is forgotten if it was out of
+        date.
+        """
+        self._update(config_dir, config_name, False, previous_mtime_ns)
+
+    def invalidate(self, config_dir=None):
+        """
+        Forget the index of `config_dir`, or of every directory if it is None.
+        """
+        with self._lock:
+            if config_dir is None:
+                self._dirs.clear()
+            else:
+                self._dirs.pop(os.fspath(config_dir), None)
+
+
+config_dir_index = ConfigDirIndex("cfg")
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the sharing of configuration layers between WLBB instances.
+
+The configuration of a WLBB instance is made of layers looked up in order:
+the instance's own config, the optional site-wide config and the builtin
+default config. Layers are immutable mappings which are shared by every
+instance using them, including once their values are converted according to
+a schema.
+"""
+
+import threading
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Any, Mapping
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.config.config_schema import coerce_value
+from wlbb.lib.wlbb_typing import ConfigSectionSchema
+
+__all__ = ("coerce_layer_section", "EMPTY_LAYER")
+
+EMPTY_LAYER = MappingProxyType({})
+
+_MAX_COERCED_SECTIONS = 1024
+_coerced_sections = OrderedDict()
+_coerced_sections_lock = threading.Lock()
+
+
+def _coerce_values(
+    name: str, layer_section: Mapping[str, Any], schema: ConfigSectionSchema
+) -> dict:
+    coerced_dict = {}
+    for parameter, value in layer_section.items():
+        value_type = schema.get(parameter)
+        if value_type is not None:
+            try:
+                value = coerce_value(value, value_type)
+            except (TypeError, ValueError) as err:
+                wlbb_logger.warning(
+                    "Ignoring invalid value for parameter %a of section %a : %s."
+                    % (parameter, name, err)
+                )
+                continue
+        coerced_dict[parameter] = value
+    return coerced_dict
+
+
+def coerce_layer_section(
+    name: str, layer_section: Mapping[str, Any], schema: ConfigSectionSchema = None
+) -> Mapping[str, Any]:
+    """
+    Return an immutable mapping of the layer's section `name` whose values are
+    converted according to `schema`.
+
+    The converted section is computed once for a given layer section and schema
+    and then shared by every caller. Values which can't be converted are
+    ignored.
+    """
+    if not schema:
+        if isinstance(layer_section, MappingProxyType):
+            return layer_section
+        return MappingProxyType(dict(layer_section))
+
+    if not isinstance(layer_section, MappingProxyType):
+        # Only immutable layers can be shared.
+        return MappingProxyType(_coerce_values(name, layer_section, schema))
+
+    key = (id(layer_section), id(schema))
+    with _coerced_sections_lock:
+        entry = _coerced_sections.get(key)
+        # The entry keeps the layer section and schema alive, so their ids
+        # can't be reused while it is cached.
+        if entry is not None and entry[0] is layer_section and entry[1] is schema:
+            _coerced_sections.move_to_end(key)
+            return entry[2]
+
+    coerced_section = MappingProxyType(_coerce_values(name, layer_section, schema))
+
+    with _coerced_sections_lock:
+        _coerced_sections[key] = (layer_section, schema, coerced_section)
+        while len(_coerced_sections) > _MAX_COERCED_SECTIONS:
+            _coerced_sections.popitem(last=False)
+
+    return coerced_section
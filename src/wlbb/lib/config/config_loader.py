@@ -8,6 +8,7 @@ from abc import ABC, abstractmethod
 from typing import List
 
 from wlbb.lib.wlbb_typing import ConfigDict
+from wlbb.lib.config.config_cache import freeze_config_dict
 
 __all__ = "ConfigLoader"
 
@@ -62,3 +63,15 @@ class ConfigLoader(ABC):
             "PARAMETER_GROUP_1":{"parameter1":value1, "parameter2":value2}
         }
         """
+
+    def load_frozen_config(self, config_dir: str, config_name: str):
+        """
+        Return the requested configuration as an immutable mapping, or None if
+        it doesn't exist.
+
+        Config loaders able to share parsed configurations between callers
+        should override this method.
+        """
+        if config_name not in self.get_config_list(config_dir):
+            return None
+        return freeze_config_dict(self.load_config(config_dir, config_name))
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define how parameters read from configuration files are given a type.
+
+A config section schema associates parameter names with the type of their
+value, for example:
+{
+    "brightness": float, "led_count": int, "enabled": bool, "name": str
+}
+A type can also be any callable converting a value into the expected one.
+"""
+
+from typing import Any, Callable
+
+__all__ = ("coerce_bool", "coerce_value")
+
+BOOLEAN_STATES = {
+    "1": True,
+    "yes": True,
+    "true": True,
+    "on": True,
+    "0": False,
+    "no": False,
+    "false": False,
+    "off": False,
+}
+
+
+def coerce_bool(value: Any) -> bool:
+    """
+    Convert `value` into a boolean the same way configparser does.
+    """
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str):
+        try:
+            return BOOLEAN_STATES[value.strip().lower()]
+        except KeyError:
+            raise ValueError("Not a boolean : %a." % value) from None
+    return bool(value)
+
+
+def coerce_value(value: Any, value_type: Callable[[Any], Any]) -> Any:
+    """
+    Convert `value` into `value_type`.
+    """
+    if value_type is bool:
+        return coerce_bool(value)
+    if isinstance(value_type, type) and isinstance(value, value_type):
+        return value
+    return value_type(value)
@@ -6,19 +6,62 @@ Default config related module.
 
 from os import PathLike
 
-from importlib_resources import files
-
 from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+from wlbb.lib.config.config_loader import ConfigLoader
+from wlbb.lib.config.config_cache import FrozenConfig
+from wlbb.lib.config.config_layers import EMPTY_LAYER
+from wlbb.lib.paths import get_config_dir
 
 __all__ = (
     "DEFAULT_CFG_NAME",
     "BuiltinDefaultConfigLoader",
     "get_builtin_default_config_dir",
+    "SITE_CFG_NAME",
+    "load_frozen_builtin_default_config",
+    "load_frozen_site_config",
 )
 
 DEFAULT_CFG_NAME = "default_config"
+# Agent names can't contain an hyphen so this can't be an agent's config.
+SITE_CFG_NAME = "wlbb-site"
 BuiltinDefaultConfigLoader = CfgConfigLoader
 
+_builtin_default_config_dir = None
+
 
 def get_builtin_default_config_dir() -> PathLike:
-    return files("wlbb").joinpath("data")
+    """
+    Return the directory containing the builtin default config.
+    """
+    global _builtin_default_config_dir
+
+    if _builtin_default_config_dir is None:
+        from importlib_resources import files
+
+        _builtin_default_config_dir = files("wlbb").joinpath("data")
+    return _builtin_default_config_dir
+
+
+def load_frozen_builtin_default_config(cfg_loader: ConfigLoader = None) -> FrozenConfig:
+    """
+    Return the builtin default config as an immutable mapping loaded with
+    `cfg_loader` or with a builtin default config loader.
+    """
+    if cfg_loader is None:
+        cfg_loader = BuiltinDefaultConfigLoader()
+    frozen_config = cfg_loader.load_frozen_config(
+        get_builtin_default_config_dir(), DEFAULT_CFG_NAME
+    )
+    if frozen_config is None:
+        return EMPTY_LAYER
+    return frozen_config
+
+
+def load_frozen_site_config(cfg_loader: ConfigLoader = None) -> FrozenConfig:
+    """
+    Return the site-wide config, which completes the builtin default config for
+    every agent, as an immutable mapping, or None if there isn't any.
+    """
+    if cfg_loader is None:
+        cfg_loader = BuiltinDefaultConfigLoader()
+    return cfg_loader.load_frozen_config(get_config_dir(), SITE_CFG_NAME)
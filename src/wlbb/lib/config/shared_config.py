@@ -0,0 +1,275 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the distribution of configurations through shared memory.
+
+The server publishes the configs of every agent in a shared memory segment
+which agent processes running on the same machine read without any file access
+or parsing.
+
+Segment layout (little endian):
+    magic (8 bytes), version (u64), payload length (u64), checksum (u64),
+    payload (marshal)
+The version is odd while the server is writing the payload, so readers retry
+until they read the same even version before and after copying the payload.
+
+Python issues no memory barrier between the stores of the server or between
+the loads of a reader, and the ARM CPUs of the boards don't keep them in
+order across cores: a reader may see the new even version with a stale
+length or a partly written payload. The checksum is the CRC32 of the version
+followed by the payload, so such a copy is rejected and read again instead
+of being decoded, and a consistent copy of the previous version can't be
+taken for the new one. The ordering of the version stores is then only an
+optimization.
+"""
+
+import time
+import zlib
+import struct
+import marshal
+from typing import Dict, Iterable, Mapping, Optional
+
+from wlbb.lib.config.config_cache import thaw_config
+from wlbb.lib.config.wlbb_config import WLBBConfig
+from wlbb.lib.logger import wlbb_logger
+from wlbb.lib.network.protocol import CommandError
+from wlbb.lib.shared_segment import (
+    ReadOnlySegment,
+    assert_shared_memory_available,
+    shared_memory,
+    unlink_segment,
+)
+from wlbb.lib.wlbb_typing import ConfigDict
+
+__all__ = (
+    "SharedConfigPublisher",
+    "SharedConfigReader",
+    "open_shared_configs",
+    "DEFAULT_SEGMENT_NAME",
+    "SHARED_CONFIGS_COMMAND",
+)
+
+DEFAULT_SEGMENT_NAME = "wlbb_configs"
+SHARED_CONFIGS_COMMAND = "shared_configs"
+
+SEGMENT_MAGIC = b"WLBBCFG2"
+_HEADER = struct.Struct("<8sQQQ")
+_VERSION = struct.Struct("<Q")
+_VERSION_OFFSET = 8
+
+
+def get_checksum(version: int, payload: bytes) -> int:
+    """
+    Return the checksum of the payload published as `version`.
+    """
+    return zlib.crc32(payload, zlib.crc32(_VERSION.pack(version)))
+
+
+def _unlink_stale_segment(name: str):
+    """
+    Unlink the shared config segment `name` left by a previous server. Raise
+    a FileExistsError if it isn't a shared config segment.
+    """
+    segment = ReadOnlySegment(name)
+    try:
+        magic = bytes(segment.buf[: len(SEGMENT_MAGIC)])
+    finally:
+        segment.close()
+    # Any version of the layout.
+    if magic[:-1] != SEGMENT_MAGIC[:-1]:
+        raise FileExistsError(
+            "Segment %a exists and isn't a shared config segment." % name
+        )
+    wlbb_logger.warning("Unlinking the shared configs %a left behind." % name)
+    unlink_segment(name)
+
+
+class SharedConfigPublisher:
+    """
+    Publish the configs of many agents in a shared memory segment.
+
+    The segment is created with a fixed `size` and is unlinked by `close`. A
+    shared config segment of the same name left by a crashed server is
+    unlinked first.
+    """
+
+    def __init__(self, name: str = DEFAULT_SEGMENT_NAME, size: int = 1 << 20):
+        assert_shared_memory_available("shared memory config distribution")
+        if size <= _HEADER.size:
+            raise ValueError("Shared config segment is too small.")
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            _unlink_stale_segment(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        self.name = self.shm.name
+        self.version = 0
+        _HEADER.pack_into(
+            self.shm.buf, 0, SEGMENT_MAGIC, self.version, 0, get_checksum(0, b"")
+        )
+
+    def get_capacity(self) -> int:
+        """
+        Return the maximum size of a published payload.
+        """
+        return self.shm.size - _HEADER.size
+
+    def publish(self, configs: Mapping[str, Mapping[str, Mapping[str, str]]]) -> int:
+        """
+        Publish the configs associated with agent ids and return the new
+        version.
+        """
+        payload = marshal.dumps(
+            {agent_id: thaw_config(config) for agent_id, config in configs.items()}
+        )
+        if len(payload) > self.get_capacity():
+            raise ValueError(
+                "Configs (%d bytes) don't fit in the shared config segment "
+                "(%d bytes)." % (len(payload), self.get_capacity())
+            )
+
+        buf = self.shm.buf
+        version = self.version + 2
+        _VERSION.pack_into(buf, _VERSION_OFFSET, self.version + 1)
+        buf[_HEADER.size : _HEADER.size + len(payload)] = payload
+        _HEADER.pack_into(
+            buf,
+            0,
+            SEGMENT_MAGIC,
+            self.version + 1,
+            len(payload),
+            get_checksum(version, payload),
+        )
+        self.version = version
+        _VERSION.pack_into(buf, _VERSION_OFFSET, self.version)
+        return self.version
+
+    def publish_configs(self, configs: Iterable[WLBBConfig]) -> int:
+        """
+        Publish the given configs of agents and return the new version.
+        """
+        return self.publish(
+            {
+                config.wlbb_instance.agent_id: config.get_config_view()
+                for config in configs
+            }
+        )
+
+    def close(self):
+        """
+        Close and unlink the shared memory segment.
+        """
+        self.shm.close()
+        self.shm.unlink()
+
+
+class SharedConfigReader:
+    """
+    Read the configs published by a SharedConfigPublisher from a read-only
+    mapping of its segment.
+
+    The configs are only decoded again when the published version changed.
+    """
+
+    def __init__(self, name: str = DEFAULT_SEGMENT_NAME):
+        assert_shared_memory_available("shared memory config distribution")
+        self.segment = ReadOnlySegment(name)
+        self.buf = self.segment.buf
+        magic = bytes(self.buf[:8])
+        if magic != SEGMENT_MAGIC:
+            self.close()
+            raise ValueError("%a isn't a shared config segment." % name)
+        self.version = None
+        self.configs = {}
+        self._imported_versions = {}
+
+    def get_version(self) -> int:
+        """
+        Return the currently published version.
+        """
+        return _VERSION.unpack_from(self.buf, _VERSION_OFFSET)[0]
+
+    def has_changed(self) -> bool:
+        """
+        Return True if a new version was published since the last read.
+        """
+        return self.get_version() != self.version
+
+    def read(self, timeout: float = 1.0) -> Dict[str, ConfigDict]:
+        """
+        Return the published configs associated with agent ids, decoding them
+        again only if a new version was published.
+        """
+        deadline = time.monotonic() + timeout
+        capacity = len(self.buf) - _HEADER.size
+        while True:
+            version = self.get_version()
+            if version == self.version:
+                return self.configs
+            if version % 2 == 0:
+                _, _, length, checksum = _HEADER.unpack_from(self.buf)
+                payload = bytes(
+                    self.buf[_HEADER.size : _HEADER.size + min(length, capacity)]
+                )
+                # A torn copy fails the checksum (see the module docstring).
+                if (
+                    self.get_version() == version
+                    and length <= capacity
+                    and get_checksum(version, payload) == checksum
+                ):
+                    self.configs = marshal.loads(payload) if payload else {}
+                    self.version = version
+                    return self.configs
+            if time.monotonic() > deadline:
+                raise TimeoutError("Shared configs are being written for too long.")
+            time.sleep(0)
+
+    def get_config(self, agent_id: str) -> ConfigDict:
+        """
+        Return the published config of an agent, or an empty config. The
+        returned config must not be modified.
+        """
+        return self.read().get(agent_id, {})
+
+    def update_config(self, config: WLBBConfig) -> bool:
+        """
+        Import the published config of `config`'s WLBB instance if a new
+        version was published since it was last imported. Return True if it was
+        imported.
+        """
+        agent_id = config.wlbb_instance.agent_id
+        configs = self.read()
+        if self._imported_versions.get(agent_id) == self.version:
+            return False
+        # Published configs are already merged with the default ones.
+        config.import_dict(configs.get(agent_id, {}), complete_default=False)
+        self._imported_versions[agent_id] = self.version
+        return True
+
+    def close(self):
+        """
+        Detach from the shared memory segment.
+        """
+        self.segment.close()
+
+
+async def open_shared_configs(client) -> Optional[SharedConfigReader]:
+    """
+    Ask the server connected to `client` for its shared config segment and
+    return a reader of it, or None if the server and the agent can't share
+    memory, in which case the configs must be loaded from the config files.
+    """
+    if shared_memory is None:
+        return None
+    try:
+        name = await client.command(SHARED_CONFIGS_COMMAND)
+    except CommandError as err:
+        wlbb_logger.debug("No shared configs : %s." % err)
+        return None
+    try:
+        return SharedConfigReader(name.decode("ascii"))
+    except (OSError, ValueError) as err:
+        # The server runs on another machine reached through loopback.
+        wlbb_logger.debug("Can't open the shared configs : %s." % err)
+        return None
@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define SnapshotConfigLoader.
+"""
+
+import os
+import mmap
+import struct
+import marshal
+import threading
+from typing import Dict, Iterable, List, Tuple
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.config.config_loader import ConfigLoader
+from wlbb.lib.config.config_loader import ConfigDict
+from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+from wlbb.lib.config.config_cache import get_file_signature, thaw_config
+from wlbb.lib.paths import create_dir, get_cache_dir, write_file_atomic
+
+__all__ = ("SnapshotConfigLoader", "get_default_snapshot_path")
+
+SNAPSHOT_MAGIC = b"WLBBSNAP"
+SNAPSHOT_VERSION = 1
+
+# magic, format version, marshal version
+_HEADER = struct.Struct("<8sHH")
+
+# {config_dir: {config_name: (source file signature, config dict)}}
+Snapshot = Dict[str, Dict[str, Tuple[Tuple[int, int, int], ConfigDict]]]
+
+
+def get_default_snapshot_path() -> str:
+    """
+    Return the path of the default config snapshot.
+    """
+    return os.path.join(get_cache_dir(), "configs.snapshot")
+
+
+def read_snapshot(path: str, use_mmap: bool = False) -> Snapshot:
+    """
+    Return the snapshot stored at `path`, or an empty snapshot if it doesn't
+    exist or can't be read by this version of WLBB.
+    """
+    try:
+        with open(path, "rb") as snapshot_file:
+            if use_mmap:
+                with mmap.mmap(
+                    snapshot_file.fileno(), 0, access=mmap.ACCESS_READ
+                ) as snapshot_map:
+                    return _decode_snapshot(memoryview(snapshot_map), path)
+            return _decode_snapshot(memoryview(snapshot_file.read()), path)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as err:
+        # mmap raises a ValueError for empty files. Unreadable snapshots are
+        # ignored so the configs are parsed instead.
+        wlbb_logger.warning(
+            "Ignoring unreadable config snapshot %a : %s." % (path, err)
+        )
+        return {}
+
+
+def _decode_snapshot(data: memoryview, path: str) -> Snapshot:
+    try:
+        if len(data) < _HEADER.size:
+            raise ValueError("truncated header")
+        magic, version, marshal_version = _HEADER.unpack_from(data)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError("bad magic")
+        if (version, marshal_version) != (SNAPSHOT_VERSION, marshal.version):
+            wlbb_logger.info("Ignoring config snapshot %a of another version." % path)
+            return {}
+        with data[_HEADER.size :] as payload:
+            snapshot = marshal.loads(payload)
+    except (ValueError, EOFError, TypeError) as err:
+        wlbb_logger.warning("Ignoring invalid config snapshot %a : %s." % (path, err))
+        return {}
+    finally:
+        data.release()
+
+    if not isinstance(snapshot, dict):
+        wlbb_logger.warning("Ignoring invalid config snapshot %a." % path)
+        return {}
+    return snapshot
+
+
+def write_snapshot(snapshot: Snapshot, path: str):
+    """
+    Atomically write `snapshot` at `path`.
+    """
+    snapshot_dir = os.path.dirname(path)
+    if snapshot_dir and not os.path.isdir(snapshot_dir):
+        create_dir(snapshot_dir)
+
+    write_file_atomic(
+        path,
+        _HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, marshal.version)
+        + marshal.dumps(snapshot),
+    )
+
+
+class SnapshotConfigLoader(ConfigLoader):
+    """
+    A config loader reading configurations from a precompiled snapshot.
+
+    The snapshot is a single marshal file containing the loaded configs and the
+    signature of their source file. A config is only returned from the snapshot
+    if its source file didn't change since, otherwise it is loaded by the
+    fallback CfgConfigLoader. Every operation modifying configs is delegated to
+    the fallback loader.
+    """
+
+    def __init__(
+        self,
+        snapshot_path: str = None,
+        fallback: CfgConfigLoader = None,
+        use_mmap: bool = False,
+    ):
+        if snapshot_path is None:
+            snapshot_path = get_default_snapshot_path()
+        if fallback is None:
+            fallback = CfgConfigLoader()
+        self.snapshot_path = snapshot_path
+        self.fallback = fallback
+        self.use_mmap = use_mmap
+        self.hits = 0
+        self.misses = 0
+        self._snapshot = None
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def _get_snapshot(self) -> Snapshot:
+        if self._snapshot is None:
+            snapshot = read_snapshot(self.snapshot_path, self.use_mmap)
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = snapshot
+        return self._snapshot
+
+    def _set_entry(
+        self, config_dir: str, config_name: str, signature, config_dict: ConfigDict
+    ):
+        snapshot = self._get_snapshot()
+        with self._lock:
+            snapshot.setdefault(config_dir, {})[config_name] = (
+                signature,
+                thaw_config(config_dict),
+            )
+            self._dirty = True
+
+    def _drop_entry(self, config_dir: str, config_name: str):
+        snapshot = self._get_snapshot()
+        with self._lock:
+            if snapshot.get(config_dir, {}).pop(config_name, None) is not None:
+                self._dirty = True
+
+    def get_config_list(self, config_dir: str) -> List[str]:
+        return self.fallback.get_config_list(config_dir)
+
+    def create_config(self, config_dir: str, config_name: str):
+        self.fallback.create_config(config_dir, config_name)
+
+    def delete_config(self, config_dir: str, config_name: str):
+        self.fallback.delete_config(config_dir, config_name)
+        self._drop_entry(os.fspath(config_dir), config_name)
+
+    def load_config(self, config_dir: str, config_name: str) -> ConfigDict:
+        config_dir = os.fspath(config_dir)
+        path = self.fallback.get_config_path(config_dir, config_name)
+        try:
+            signature = get_file_signature(path)
+        except (FileNotFoundError, NotADirectoryError):
+            self._drop_entry(config_dir, config_name)
+            return {}
+
+        entry = self._get_snapshot().get(config_dir, {}).get(config_name)
+        if entry is not None and tuple(entry[0]) == signature:
+            self.hits += 1
+            return thaw_config(entry[1])
+
+        self.misses += 1
+        config_dict = self.fallback.load_config(config_dir, config_name)
+        # The signature was taken before loading so a concurrent modification
+        # makes the entry stale instead of hiding the modification.
+        self._set_entry(config_dir, config_name, signature, config_dict)
+        return config_dict
+
+    def save_config(self, config_dict: ConfigDict, config_dir: str, config_name: str):
+        self.fallback.save_config(config_dict, config_dir, config_name)
+        self._drop_entry(os.fspath(config_dir), config_name)
+
+    def compile_snapshot(self, config_dirs: Iterable[str]):
+        """
+        Load every config found in `config_dirs` and write the snapshot.
+        """
+        for config_dir in config_dirs:
+            config_dir = os.fspath(config_dir)
+            for config_name in self.fallback.get_config_list(config_dir):
+                self.load_config(config_dir, config_name)
+        self.write_snapshot(force=True)
+
+    def write_snapshot(self, force: bool = False):
+        """
+        Write the snapshot if it changed since it was read.
+        """
+        snapshot = self._get_snapshot()
+        with self._lock:
+            if not (self._dirty or force):
+                return
+            write_snapshot(snapshot, self.snapshot_path)
+            self._dirty = False
+
+    def reload_snapshot(self):
+        """
+        Forget the snapshot in memory so it is read again on the next load.
+        """
+        with self._lock:
+            self._snapshot = None
+            self._dirty = False
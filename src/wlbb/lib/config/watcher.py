@@ -0,0 +1,424 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a watcher pushing configuration changes to running agents.
+"""
+
+import os
+import sys
+import time
+import errno
+import struct
+import threading
+from typing import Callable, Dict, List, Optional, Set
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.config.cfg_config_loader import CfgConfigLoader
+from wlbb.lib.config.config_cache import get_file_signature
+from wlbb.lib.config.config_diff import ConfigDiff, diff_config
+from wlbb.lib.config.default import SITE_CFG_NAME
+from wlbb.lib.config.wlbb_config import WLBBConfig
+from wlbb.lib.paths import get_config_dir
+
+__all__ = ("ConfigWatcher",)
+
+_RACY_MTIME_NS = 50_000_000
+
+# inotify(7) constants.
+_IN_ATTRIB = 0x00000004
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_IGNORED = 0x00008000
+_IN_Q_OVERFLOW = 0x00004000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+_INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def _get_signature(path):
+    try:
+        return get_file_signature(path)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+class _WatchedFile:
+    """
+    A config file, its inode in the config directory and the agents using it.
+    """
+
+    __slots__ = ("path", "file_name", "signature", "inode", "agents")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file_name = os.path.basename(path)
+        self.signature = _get_signature(path)
+        self.inode = self.signature[2] if self.signature is not None else None
+        self.agents = []
+
+
+class _DirEvents:
+    """
+    The names of the files changed in a directory, given by inotify on Linux.
+    `get_changed_names` returns None when changes may have been missed and
+    every file must be checked, and `watching` is False once the directory
+    isn't watched anymore, after it was removed.
+    """
+
+    def __init__(self, path: str):
+        import ctypes
+
+        libc = ctypes.CDLL(None, use_errno=True)
+        self._fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watching = True
+        mask = _IN_ATTRIB | _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE
+        if libc.inotify_add_watch(self._fd, os.fsencode(path), mask) < 0:
+            error = ctypes.get_errno()
+            self.close()
+            raise OSError(error, "Can't watch %a" % path)
+
+    def get_changed_names(self) -> Optional[Set[str]]:
+        names = set()
+        while True:
+            try:
+                data = os.read(self._fd, 1 << 16)
+            except BlockingIOError:
+                return names
+            offset = 0
+            while offset < len(data):
+                _, mask, _, length = _INOTIFY_EVENT.unpack_from(data, offset)
+                offset += _INOTIFY_EVENT.size
+                if mask & _IN_IGNORED:
+                    self.watching = False
+                if mask & (_IN_Q_OVERFLOW | _IN_IGNORED):
+                    # Events were dropped or the directory isn't watched anymore.
+                    return None
+                name = data[offset : offset + length].rstrip(b"\0")
+                names.add(os.fsdecode(name))
+                offset += length
+
+    def close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+class ConfigWatcher:
+    """
+    Watch the config files of agents and push the sections which changed to
+    them.
+
+    Each poll looks for the watched config files which changed and only these
+    are loaded again and compared with the agents' live config. The agents'
+    config is updated with the differences and their `config_changed` hook is
+    called with them. A change of the site-wide config is pushed to every
+    watched agent.
+
+    The cost of a poll grows with the number of changed files rather than of
+    watched files: on Linux, inotify gives the names of the changed files,
+    whether they were replaced or modified in place, and only these are
+    stated, as well as the site-wide config if it isn't in the config
+    directory. Elsewhere, or if `use_inotify` is False, the config directory is
+    only listed when its mtime changed, and only the files replaced by a
+    rename, like the saves of CfgConfigLoader, are stated: their inode, given
+    by the listing without a stat, changed. Files modified in place are then
+    missed unless `notify` is called for them.
+
+    If `stat_all` is True, every watched file is stated by each poll instead,
+    which detects any modification at a cost growing with the number of
+    watched files.
+
+    The listeners added with `add_change_listener` are called after every
+    poll which pushed changes.
+    """
+
+    def __init__(
+        self,
+        cfg_loader: CfgConfigLoader = None,
+        config_dir: str = None,
+        stat_all: bool = False,
+        use_inotify: bool = True,
+    ):
+        if cfg_loader is None:
+            cfg_loader = CfgConfigLoader()
+        if config_dir is None:
+            config_dir = get_config_dir()
+        self.cfg_loader = cfg_loader
+        self.config_dir = os.fspath(config_dir)
+        self.stat_all = stat_all
+        self._files: Dict[str, _WatchedFile] = {}
+        site_dir = get_config_dir()
+        self._site_file = _WatchedFile(
+            cfg_loader.get_config_path(site_dir, SITE_CFG_NAME)
+        )
+        self._site_file_listed = os.path.abspath(site_dir) == os.path.abspath(
+            self.config_dir
+        )
+        self._dir_events = None
+        if use_inotify and not stat_all and sys.platform.startswith("linux"):
+            try:
+                self._dir_events = _DirEvents(self.config_dir)
+            except (OSError, AttributeError) as err:
+                if getattr(err, "errno", None) != errno.ENOENT:
+                    wlbb_logger.debug("Can't use inotify : %s." % err)
+        self._notified: Set[str] = set()
+        self._change_listeners = ()
+        self._dir_mtime_ns = None
+        self._dir_racy = True
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def _get_dir_mtime_ns(self):
+        try:
+            return os.stat(self.config_dir).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+    def watch(self, agent):
+        """
+        Push the changes of `agent`'s config file to it. The agent's config
+        must already be loaded.
+        """
+        cfg_name = agent.get_config().cfg_name
+        with self._lock:
+            watched_file = self._files.get(cfg_name)
+            if watched_file is None:
+                watched_file = _WatchedFile(
+                    self.cfg_loader.get_config_path(self.config_dir, cfg_name)
+                )
+                self._files[cfg_name] = watched_file
+            if agent not in watched_file.agents:
+                watched_file.agents.append(agent)
+
+    def unwatch(self, agent):
+        """
+        Stop pushing the changes of `agent`'s config file to it.
+        """
+        cfg_name = agent.get_config().cfg_name
+        with self._lock:
+            watched_file = self._files.get(cfg_name)
+            if watched_file is None or agent not in watched_file.agents:
+                return
+            watched_file.agents.remove(agent)
+            if not watched_file.agents:
+                del self._files[cfg_name]
+
+    def add_change_listener(self, listener: Callable[[Dict[str, ConfigDiff]], None]):
+        """
+        Call `listener(pushed_diffs)` with the differences pushed by a poll,
+        by agent id, every time it pushed some.
+        """
+        if listener not in self._change_listeners:
+            self._change_listeners = self._change_listeners + (listener,)
+
+    def remove_change_listener(self, listener):
+        """
+        Stop calling `listener` when changes are pushed.
+        """
+        self._change_listeners = tuple(
+            other for other in self._change_listeners if other != listener
+        )
+
+    def notify(self, cfg_name: str):
+        """
+        Make the next poll check the config file `cfg_name` even if no change
+        of it was detected.
+        """
+        with self._lock:
+            self._notified.add(cfg_name)
+
+    def _get_replaced_files(self) -> List[_WatchedFile]:
+        """
+        Return the watched files whose inode changed since the last listing of
+        the config directory, if its mtime changed.
+        """
+        dir_mtime_ns = self._get_dir_mtime_ns()
+        if dir_mtime_ns == self._dir_mtime_ns and not self._dir_racy:
+            return []
+        self._dir_mtime_ns = dir_mtime_ns
+        # A file replaced right after the listing may not change the
+        # directory's mtime with coarse timestamps, so it is listed again
+        # until its mtime is old enough.
+        self._dir_racy = (
+            dir_mtime_ns is None or time.time() * 1e9 - dir_mtime_ns < _RACY_MTIME_NS
+        )
+
+        inodes = {}
+        try:
+            with os.scandir(self.config_dir) as entries:
+                for entry in entries:
+                    inodes[entry.name] = entry.inode()
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        watched_files = list(self._files.values())
+        if self._site_file_listed:
+            watched_files.append(self._site_file)
+        return [
+            watched_file
+            for watched_file in watched_files
+            if inodes.get(watched_file.file_name) != watched_file.inode
+        ]
+
+    def _get_candidates(self) -> List[_WatchedFile]:
+        """
+        Return the watched files which may have changed since the last poll.
+        """
+        dir_events = self._dir_events
+        if dir_events is not None:
+            names = dir_events.get_changed_names()
+            if names is not None:
+                candidates = [
+                    watched_file
+                    for watched_file in self._files.values()
+                    if watched_file.file_name in names
+                ]
+                if not self._site_file_listed or self._site_file.file_name in names:
+                    candidates.append(self._site_file)
+                return candidates
+            if not dir_events.watching:
+                # The directory mtime is used instead from now on.
+                wlbb_logger.warning("Config directory not watched by inotify anymore.")
+                dir_events.close()
+                self._dir_events = None
+                self._dir_mtime_ns = None
+            # Changes may have been missed: every file is checked once.
+            candidates = [self._site_file]
+            candidates.extend(self._files.values())
+            return candidates
+
+        candidates = self._get_replaced_files()
+        if not self._site_file_listed:
+            candidates.append(self._site_file)
+        return candidates
+
+    def poll(self) -> Dict[str, ConfigDiff]:
+        """
+        Check the watched config files once and push their changes to the
+        agents. Return the pushed differences by agent id.
+        """
+        with self._lock:
+            if self.stat_all:
+                candidates = [self._site_file]
+                candidates.extend(self._files.values())
+            else:
+                candidates = self._get_candidates()
+            if self._notified:
+                for cfg_name in self._notified:
+                    watched_file = self._files.get(cfg_name)
+                    if cfg_name == SITE_CFG_NAME:
+                        watched_file = self._site_file
+                    if watched_file is not None and watched_file not in candidates:
+                        candidates.append(watched_file)
+                self._notified.clear()
+
+            changed_files = []
+            for watched_file in candidates:
+                signature = _get_signature(watched_file.path)
+                if signature != watched_file.signature:
+                    watched_file.signature = signature
+                    watched_file.inode = signature[2] if signature else None
+                    changed_files.append(watched_file)
+            if self._site_file in changed_files:
+                # Every agent's config is completed by the site-wide config.
+                changed_files = list(self._files.values())
+
+            pushed_diffs = {}
+            for watched_file in changed_files:
+                for agent in list(watched_file.agents):
+                    config_diff = self._push_changes(agent)
+                    if config_diff:
+                        pushed_diffs[agent.agent_id] = config_diff
+            if pushed_diffs:
+                for listener in self._change_listeners:
+                    try:
+                        listener(pushed_diffs)
+                    except Exception as err:
+                        wlbb_logger.error("Config change listener failed : %s." % err)
+            return pushed_diffs
+
+    def _push_changes(self, agent) -> ConfigDiff:
+        config = agent.get_config()
+        new_config = WLBBConfig(agent)
+        try:
+            new_config.import_dict(
+                self.cfg_loader.load_config(self.config_dir, config.cfg_name),
+                cfg_loader=self.cfg_loader,
+            )
+        except Exception as err:
+            wlbb_logger.error(
+                "Failed to reload the config of %a : %s." % (agent.agent_id, err)
+            )
+            return {}
+
+        config_diff = diff_config(
+            config.get_config_view(), new_config.get_config_view()
+        )
+        if not config_diff:
+            return {}
+
+        config.apply_diff(config_diff)
+        try:
+            agent.config_changed(config_diff)
+        except Exception as err:
+            wlbb_logger.error(
+                "Agent %a failed to handle its config changes : %s."
+                % (agent.agent_id, err)
+            )
+        return config_diff
+
+    def get_watched_agents(self) -> List:
+        """
+        Return every watched agent.
+        """
+        with self._lock:
+            return [
+                agent
+                for watched_file in self._files.values()
+                for agent in watched_file.agents
+            ]
+
+    def start(self, interval: float = 1.0):
+        """
+        Poll the config files every `interval` seconds from a background thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(
+            target=self._run, args=(interval,), name="wlbb-config-watcher", daemon=True
+        )
+        self._thread.start()
+
+    def _run(self, interval: float):
+        while not self._stop_event.wait(interval):
+            try:
+                self.poll()
+            except Exception as err:
+                wlbb_logger.error("Config watcher poll failed : %s." % err)
+
+    def stop(self):
+        """
+        Stop the background thread.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def close(self):
+        """
+        Stop the background thread and stop watching the config directory.
+        """
+        self.stop()
+        with self._lock:
+            if self._dir_events is not None:
+                self._dir_events.close()
+                self._dir_events = None
@@ -7,53 +7,169 @@ Created on Thu Jun 30 21:31:41 2022
 @author: lothaire
 """
 
-from typing import List, Dict, Any
+from collections import ChainMap
+from types import MappingProxyType
+from typing import List, Dict, Any, Iterable, Mapping
 
 from wlbb.lib.logger import wlbb_logger
 
 from wlbb.lib.config.config_loader import ConfigLoader
-from wlbb.lib.wlbb_typing import ConfigSectionDict, ConfigDict
+from wlbb.lib.wlbb_typing import ConfigSectionDict, ConfigDict, ConfigSectionSchema
 
-from wlbb.lib.config.default import get_builtin_default_config_dir
-from wlbb.lib.config.default import DEFAULT_CFG_NAME, BuiltinDefaultConfigLoader
+from wlbb.lib.config.default import load_frozen_builtin_default_config
+from wlbb.lib.config.default import load_frozen_site_config
+from wlbb.lib.config.config_cache import FrozenConfig
+from wlbb.lib.config.config_cache import freeze_config_dict, thaw_config
+from wlbb.lib.config.config_layers import EMPTY_LAYER, coerce_layer_section
+from wlbb.lib.config.config_schema import coerce_value
+from wlbb.lib.config.config_diff import ConfigDiff
+from wlbb.lib.config.write_behind import WriteBehindSaver, config_saver
 
 from wlbb.lib.paths import get_config_dir
 
-__all__ = ("WLBBConfig", "WLBBConfigSection")
+__all__ = ("WLBBConfig", "WLBBConfigSection", "load_configs")
 
 
 class WLBBConfigSection:
     """
     A cluster of parameters which can be modified and accessed.
+
+    Parameters are looked up in the section's own values, then in the shared
+    layers it was created with (highest priority first), by a plain loop over
+    them: the layers are shared by every section created from them and never
+    copied. Modifications are only stored in the section's own values, and
+    the layers are only copied, as a whole section, when a parameter they
+    contain is removed.
+
+    Values are converted once, when they are set, according to the section's
+    schema. Reading them through `get_view` or the mapping operators doesn't
+    copy anything.
     """
 
-    def __init__(self, name: str, section_dict: dict = None):
+    __slots__ = ("name", "schema", "_maps", "_values", "_view")
+
+    def __init__(
+        self,
+        name: str,
+        section_dict: ConfigSectionDict = None,
+        schema: ConfigSectionSchema = None,
+        layers: List[Mapping[str, Any]] = None,
+    ):
         self.name = name
-        if section_dict is None:
-            self.section_dict = {}
-        else:
-            self.section_dict = section_dict
+        self.schema = schema
+        shared_layers = []
+        if layers is not None:
+            shared_layers = [
+                coerce_layer_section(name, layer, schema) for layer in layers
+            ]
+        self._values = ChainMap({}, *shared_layers)
+        # The section's own values followed by its layers, shared with the
+        # ChainMap so modifying one modifies the other.
+        self._maps = self._values.maps
+        self._view = MappingProxyType(self._values)
+        if section_dict is not None:
+            self.update(section_dict)
+
+    def _coerce(self, parameter: str, value: Any) -> Any:
+        if self.schema is None:
+            return value
+        value_type = self.schema.get(parameter)
+        if value_type is None:
+            return value
+        return coerce_value(value, value_type)
 
     def get_dict(self) -> ConfigSectionDict:
         """
-        Return the dictionnary representation of the config section.
+        Return a copy of the dictionnary representation of the config section.
+        """
+        return dict(self._values)
+
+    def get_local_dict(self) -> ConfigSectionDict:
+        """
+        Return a copy of the parameters set in this section rather than in its
+        shared layers.
+        """
+        return dict(self._maps[0])
+
+    def get_view(self) -> Mapping[str, Any]:
+        """
+        Return a read-only view of the config section's parameters.
         """
-        return self.section_dict.copy()
+        return self._view
 
     def get_parameter_list(self) -> List[str]:
         """
         Return a list containing every parameter name in this section.
         """
-        return list(self.get_dict())
+        return list(self._values)
+
+    def get_parameter(self, parameter: str, default: Any = None) -> Any:
+        """
+        Return the value of a parameter or `default` if it doesn't exist.
+        """
+        for values in self._maps:
+            if parameter in values:
+                return values[parameter]
+        return default
 
     def add_parameter(self, parameter: str, value: Any):
         """
         Add a new parameter.
         """
-        if not parameter in self.get_parameter_list():
-            self.section_dict[parameter] = value
-        else:
-            pass
+        if parameter not in self:
+            self.set_parameter(parameter, value)
+
+    def set_parameter(self, parameter: str, value: Any):
+        """
+        Set the value of a parameter, adding it if it doesn't exist.
+        """
+        self._maps[0][parameter] = self._coerce(parameter, value)
+
+    def remove_parameter(self, parameter: str):
+        """
+        Remove a parameter if it exists.
+        """
+        if parameter not in self:
+            return
+        maps = self._maps
+        if any(parameter in layer for layer in maps[1:]):
+            # Shared layers can't be modified: copy them into the section.
+            maps[0].update(self._values)
+            del maps[1:]
+        del maps[0][parameter]
+
+    def update(self, section_dict: ConfigSectionDict):
+        """
+        Set the value of every parameter of `section_dict`.
+
+        Values which can't be converted to their declared type are ignored.
+        """
+        for parameter, value in section_dict.items():
+            try:
+                self.set_parameter(parameter, value)
+            except (TypeError, ValueError) as err:
+                wlbb_logger.warning(
+                    "Ignoring invalid value for parameter %a of section %a : %s."
+                    % (parameter, self.name, err)
+                )
+
+    def __contains__(self, parameter: str) -> bool:
+        for values in self._maps:
+            if parameter in values:
+                return True
+        return False
+
+    def __getitem__(self, parameter: str) -> Any:
+        for values in self._maps:
+            if parameter in values:
+                return values[parameter]
+        raise KeyError(parameter)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self) -> int:
+        return len(self._values)
 
 
 class WLBBConfig:
@@ -63,7 +179,7 @@ class WLBBConfig:
     """
 
     cfg_name: str
-    cfg_dict: ConfigDict
+    cfg_dict: Dict[str, Mapping[str, Any]]
     sections: Dict[str, WLBBConfigSection]
 
     def __init__(self, wlbb_instance):
@@ -74,65 +190,132 @@ class WLBBConfig:
         self.cfg_name = self.wlbb_instance.name
         self.cfg_dict = {}
         self.sections = {}
+        self._section_views = {}
+        self._config_view = MappingProxyType(self._section_views)
 
-    def _raw_import_dict(self, new_config_dict: ConfigDict):
+    def _import_layers(self, layers: List[FrozenConfig]):
+        """
+        Import the configuration made of `layers`, from the lowest priority to
+        the highest one.
+        """
         self.cfg_dict.clear()
         self.sections.clear()
-
-        for cs_name, cs_dict in new_config_dict.items():
-            if cs_name in self.wlbb_instance.get_config_sections_list():
-                self.cfg_dict[cs_name] = cs_dict
-
-    def _raw_import_config(
-        self, cfg_dir: str, cfg_name: str, cfg_loader: ConfigLoader = None
+        self._section_views.clear()
+
+        for cs_name in self.wlbb_instance.get_config_sections_list():
+            section_layers = [
+                layer[cs_name] for layer in reversed(layers) if cs_name in layer
+            ]
+            if section_layers:
+                self._add_section(cs_name, layers=section_layers)
+
+    def _add_section(
+        self,
+        cs_name: str,
+        cs_dict: ConfigSectionDict = None,
+        layers: List[Mapping[str, Any]] = None,
     ):
-        if cfg_loader is None:
-            cfg_loader = self.wlbb_instance.get_config_loader()
-
-        new_config_dict = cfg_loader.load_config(cfg_dir, cfg_name)
+        section = WLBBConfigSection(
+            cs_name,
+            cs_dict,
+            self.wlbb_instance.get_config_schema().get(cs_name),
+            layers,
+        )
+        self.sections[cs_name] = section
+        # The config dict shares the sections' read-only views.
+        self.cfg_dict[cs_name] = section.get_view()
+        self._section_views[cs_name] = section.get_view()
 
-        self._raw_import_dict(new_config_dict)
+    def _raw_import_dict(self, new_config_dict: ConfigDict):
+        self._import_layers([freeze_config_dict(new_config_dict)])
 
-    def import_default(self):
+    def _load_default_layers(
+        self, cfg_loader: ConfigLoader = None, default_config_dict: ConfigDict = None
+    ) -> List[FrozenConfig]:
         """
-        Generate and import a default config compatible with the WLBB instance.
+        Return the builtin default and site-wide config layers.
         """
-        cfg_loader = BuiltinDefaultConfigLoader()
+        if cfg_loader is None:
+            cfg_loader = self.wlbb_instance.get_config_loader()
 
-        self._raw_import_config(
-            get_builtin_default_config_dir(), DEFAULT_CFG_NAME, cfg_loader
-        )
+        if default_config_dict is None:
+            default_layer = load_frozen_builtin_default_config(cfg_loader)
+        elif isinstance(default_config_dict, MappingProxyType):
+            default_layer = default_config_dict
+        else:
+            default_layer = freeze_config_dict(default_config_dict)
 
-        if len(self.wlbb_instance.get_config_sections()) > len(self.get_config_dict()):
+        sections = self.wlbb_instance.get_config_sections_list()
+        missing_sections = [
+            section for section in sections if section not in default_layer
+        ]
+        if missing_sections:
             wlbb_logger.warning(
                 "Builtin default config doesn't contain every config section."
             )
-            sections = set(self.wlbb_instance.get_config_sections())
-            sections_found = set(self.get_config_dict())
-            missing_sections = list(sections.difference(sections_found))
             wlbb_logger.debug(
                 "Sections missing in the default config : %a." % missing_sections
             )
 
-    def import_dict(self, new_config_dict: ConfigDict, complete_default=True):
+        site_layer = load_frozen_site_config(cfg_loader)
+        if site_layer is None:
+            return [default_layer]
+        return [default_layer, site_layer]
+
+    def import_default(
+        self, cfg_loader: ConfigLoader = None, default_config_dict: ConfigDict = None
+    ):
+        """
+        Generate and import a default config compatible with the WLBB instance.
+
+        The default config is the builtin default config completed by the
+        site-wide config. They are loaded with `cfg_loader`, the WLBB instance's
+        config loader or a builtin default config loader, unless an already
+        loaded `default_config_dict` is given for the builtin default config.
+        """
+        self._import_layers(self._load_default_layers(cfg_loader, default_config_dict))
+
+    def import_dict(
+        self,
+        new_config_dict: ConfigDict,
+        complete_default=True,
+        cfg_loader: ConfigLoader = None,
+        default_config_dict: ConfigDict = None,
+    ):
         """
         Import the config `new_config_dict`.
+
+        If `complete_default` is True, missing parameters are taken from the
+        default config (see `import_default`).
         """
+        self._import_frozen(
+            freeze_config_dict(new_config_dict),
+            complete_default,
+            cfg_loader,
+            default_config_dict,
+        )
+
+    def _import_frozen(
+        self,
+        frozen_config: FrozenConfig,
+        complete_default=True,
+        cfg_loader: ConfigLoader = None,
+        default_config_dict: ConfigDict = None,
+    ):
         if not complete_default:
-            self._raw_import_dict(new_config_dict)
+            self._import_layers([frozen_config])
             return
 
-        self.import_default()
-
-        default_config_dict = self.cfg_dict
-
-        for section_name, section_dict in new_config_dict.items():
-            if section_name in self.wlbb_instance.get_config_sections():
-                if section_name in default_config_dict:
-                    default_config_dict.update(section_dict)
+        layers = self._load_default_layers(cfg_loader, default_config_dict)
+        layers.append(frozen_config)
+        self._import_layers(layers)
 
     def import_config(
-        self, cfg_name: str, cfg_loader: ConfigLoader = None, complete_default=True
+        self,
+        cfg_name: str,
+        cfg_loader: ConfigLoader = None,
+        complete_default=True,
+        default_config_dict: ConfigDict = None,
     ):
         """
         Import the config named `cfg_name` if it exists and modify it to be
@@ -141,11 +324,17 @@ class WLBBConfig:
         if cfg_loader is None:
             cfg_loader = self.wlbb_instance.get_config_loader()
 
-        new_config_dict = cfg_loader.load_config(get_config_dir(), cfg_name)
+        frozen_config = cfg_loader.load_frozen_config(get_config_dir(), cfg_name)
+        if frozen_config is None:
+            frozen_config = EMPTY_LAYER
 
-        self.import_dict(new_config_dict, complete_default)
+        self._import_frozen(
+            frozen_config, complete_default, cfg_loader, default_config_dict
+        )
 
-    def load(self, cfg_loader: ConfigLoader = None):
+    def load(
+        self, cfg_loader: ConfigLoader = None, default_config_dict: ConfigDict = None
+    ):
         """
         Load the WLBB instance's associated configuration using the given config
         loader or a default one.
@@ -154,24 +343,126 @@ class WLBBConfig:
         an generated configuration file is created containing a compatible
         configuration.
         """
-        self.import_config(self.cfg_name, cfg_loader)
+        self.import_config(
+            self.cfg_name, cfg_loader, default_config_dict=default_config_dict
+        )
 
-    def save(self, cfg_loader: ConfigLoader = None):
+    def save(
+        self,
+        cfg_loader: ConfigLoader = None,
+        deferred: bool = False,
+        saver: WriteBehindSaver = None,
+    ):
         """
         Save the current configuration in the WLBB instance's associated config file.
+
+        If `deferred` is True, the save is only scheduled on the write-behind
+        `saver` (or the default one) and this method returns immediately.
         """
         if cfg_loader is None:
             cfg_loader = self.wlbb_instance.get_config_loader()
 
-        cfg_loader.save_config(self.get_config_dict(), get_config_dir(), self.cfg_name)
+        if not deferred:
+            cfg_loader.save_config(
+                self.get_config_dict(), get_config_dir(), self.cfg_name
+            )
+            return
+
+        if saver is None:
+            saver = config_saver
+        saver.schedule(
+            cfg_loader, thaw_config(self.cfg_dict), get_config_dir(), self.cfg_name
+        )
+
+    def flush(self, saver: WriteBehindSaver = None):
+        """
+        Write the deferred saves of the configuration and wait for them.
+        """
+        if saver is None:
+            saver = config_saver
+        saver.flush(get_config_dir(), self.cfg_name)
+
+    def apply_diff(self, config_diff: ConfigDiff):
+        """
+        Modify the configuration according to `config_diff`, only touching the
+        sections it contains.
+        """
+        for section_name, section_diff in config_diff.items():
+            section = self.sections.get(section_name)
+            if section is None:
+                if section_diff.changed:
+                    self._add_section(section_name, section_diff.changed)
+                continue
+            section.update(section_diff.changed)
+            for parameter in section_diff.removed:
+                section.remove_parameter(parameter)
+            if not len(section):
+                # The section was removed.
+                del self.sections[section_name]
+                del self.cfg_dict[section_name]
+                del self._section_views[section_name]
 
     def get_config_dict(self) -> ConfigDict:
         """
         Return the dictionnary representation of the configuration.
         """
-        return self.cfg_dict.copy()
+        return thaw_config(self.cfg_dict)
+
+    def get_config_view(self) -> Mapping[str, Mapping[str, Any]]:
+        """
+        Return a read-only view of the configuration associating section names
+        with read-only views of their parameters.
+        """
+        return self._config_view
 
     def get_config_section(self, section_name: str) -> WLBBConfigSection:
         """
         Return the requested config section if it exists.
         """
+        return self.sections.get(section_name)
+
+    def get_parameter(self, section_name: str, parameter: str, default: Any = None):
+        """
+        Return the value of a parameter or `default` if it doesn't exist.
+        """
+        section = self.sections.get(section_name)
+        if section is None:
+            return default
+        return section.get_parameter(parameter, default)
+
+
+def load_configs(
+    wlbb_instances: Iterable, cfg_loader: ConfigLoader = None, max_workers: int = None
+) -> List[WLBBConfig]:
+    """
+    Load the configurations of many WLBB instances at once and return them in
+    the same order.
+
+    The builtin default config is loaded once for each distinct config loader
+    and the instances' configs are loaded concurrently by a thread pool of
+    `max_workers` threads.
+    """
+    configs = [WLBBConfig(wlbb_instance) for wlbb_instance in wlbb_instances]
+    if not configs:
+        return []
+
+    cfg_loaders = []
+    default_config_dicts = {}
+    for config in configs:
+        instance_cfg_loader = cfg_loader
+        if instance_cfg_loader is None:
+            instance_cfg_loader = config.wlbb_instance.get_config_loader()
+        if id(instance_cfg_loader) not in default_config_dicts:
+            default_config_dicts[
+                id(instance_cfg_loader)
+            ] = load_frozen_builtin_default_config(instance_cfg_loader)
+        cfg_loaders.append(instance_cfg_loader)
+
+    def load_config(config, instance_cfg_loader):
+        config.load(instance_cfg_loader, default_config_dicts[id(instance_cfg_loader)])
+        return config
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers) as executor:
+        return list(executor.map(load_config, configs, cfg_loaders))
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a write-behind saver for configurations.
+"""
+
+import os
+import time
+import atexit
+import threading
+from typing import Dict, NamedTuple, Tuple
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.config.config_loader import ConfigLoader
+from wlbb.lib.wlbb_typing import ConfigDict
+
+__all__ = ("WriteBehindSaver", "SaverStats", "config_saver")
+
+_SaveKey = Tuple[int, str, str]
+
+
+class SaverStats(NamedTuple):
+    """
+    Counters describing the activity of a write-behind saver.
+    """
+
+    scheduled: int
+    coalesced: int
+    written: int
+    failed: int
+    pending: int
+
+
+class _PendingSave:
+    """
+    The last state of a config waiting to be saved.
+    """
+
+    __slots__ = (
+        "cfg_loader",
+        "config_dict",
+        "config_dir",
+        "config_name",
+        "first",
+        "due",
+    )
+
+    def __init__(self, cfg_loader, config_dict, config_dir, config_name, first, due):
+        self.cfg_loader = cfg_loader
+        self.config_dict = config_dict
+        self.config_dir = config_dir
+        self.config_name = config_name
+        self.first = first
+        self.due = due
+
+
+class WriteBehindSaver:
+    """
+    Save configurations from a background thread.
+
+    Saves scheduled for the same config within `delay` seconds of each other
+    are coalesced into a single write of the last state, but a config is never
+    kept pending more than `max_delay` seconds after its first scheduled save.
+    Scheduling a save never waits for a write.
+    """
+
+    def __init__(self, delay: float = 0.5, max_delay: float = 5.0):
+        self.delay = delay
+        self.max_delay = max(delay, max_delay)
+        self.scheduled = 0
+        self.coalesced = 0
+        self.written = 0
+        self.failed = 0
+        self._pending: Dict[_SaveKey, _PendingSave] = {}
+        self._condition = threading.Condition()
+        # Held while pending saves are taken and written so an older state can
+        # never be written after a newer one.
+        self._write_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+
+    def _start(self):
+        self._thread = threading.Thread(
+            target=self._run, name="wlbb-config-saver", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def schedule(
+        self,
+        cfg_loader: ConfigLoader,
+        config_dict: ConfigDict,
+        config_dir: str,
+        config_name: str,
+    ):
+        """
+        Schedule the save of `config_dict` as the config `config_name` in
+        `config_dir` with `cfg_loader`.
+
+        The caller must not modify `config_dict` afterwards.
+        """
+        config_dir = os.fspath(config_dir)
+        key = (id(cfg_loader), config_dir, config_name)
+        now = time.monotonic()
+
+        with self._condition:
+            if self._closed:
+                raise RuntimeError("Can't schedule a save on a closed saver.")
+            self.scheduled += 1
+            pending = self._pending.get(key)
+            if pending is None:
+                self._pending[key] = _PendingSave(
+                    cfg_loader,
+                    config_dict,
+                    config_dir,
+                    config_name,
+                    now,
+                    now + self.delay,
+                )
+            else:
+                self.coalesced += 1
+                pending.config_dict = config_dict
+                pending.due = min(now + self.delay, pending.first + self.max_delay)
+
+            if self._thread is None:
+                self._start()
+            self._condition.notify()
+
+    def _take(self, keys=None, due_before: float = None):
+        with self._condition:
+            if keys is None:
+                keys = list(self._pending)
+            taken = []
+            for key in keys:
+                pending = self._pending.get(key)
+                if pending is None:
+                    continue
+                if due_before is not None and pending.due > due_before:
+                    continue
+                taken.append(self._pending.pop(key))
+            return taken
+
+    def _write(self, pending_saves):
+        for pending in pending_saves:
+            try:
+                pending.cfg_loader.save_config(
+                    pending.config_dict, pending.config_dir, pending.config_name
+                )
+            except Exception as err:
+                self.failed += 1
+                wlbb_logger.error(
+                    "Failed to save config %a in %a : %s."
+                    % (pending.config_name, pending.config_dir, err)
+                )
+            else:
+                self.written += 1
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._closed:
+                    if self._pending:
+                        timeout = (
+                            min(pending.due for pending in self._pending.values())
+                            - time.monotonic()
+                        )
+                        if timeout <= 0:
+                            break
+                        self._condition.wait(timeout)
+                    else:
+                        self._condition.wait()
+                if self._closed:
+                    return
+
+            with self._write_lock:
+                self._write(self._take(due_before=time.monotonic()))
+
+    def flush(self, config_dir: str = None, config_name: str = None):
+        """
+        Write now the pending saves of the config `config_name` in `config_dir`,
+        or every pending save if they are None, and wait for them.
+        """
+        with self._write_lock:
+            keys = None
+            if config_dir is not None:
+                config_dir = os.fspath(config_dir)
+                with self._condition:
+                    keys = [
+                        key
+                        for key in self._pending
+                        if key[1] == config_dir
+                        and (config_name is None or key[2] == config_name)
+                    ]
+            self._write(self._take(keys))
+
+    def close(self):
+        """
+        Write every pending save and stop the background thread.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+        self.flush()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        atexit.unregister(self.close)
+
+    def get_stats(self) -> SaverStats:
+        """
+        Return the saver's counters.
+        """
+        with self._condition:
+            return SaverStats(
+                self.scheduled,
+                self.coalesced,
+                self.written,
+                self.failed,
+                len(self._pending),
+            )
+
+
+config_saver = WriteBehindSaver()
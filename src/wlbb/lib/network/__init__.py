@@ -0,0 +1,6 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This subpackage allow WLBB servers and agents to communicate over a network.
+"""
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the asyncio client agents use to connect to a WLBB server.
+"""
+
+import time
+import struct
+import asyncio
+import itertools
+from typing import Callable, Dict, Tuple, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.network.protocol import (
+    DEFAULT_MAX_MESSAGE_SIZE,
+    AuthenticationError,
+    CommandError,
+    ErrorCode,
+    MessageDecoder,
+    MessageType,
+    ProtocolError,
+    decode_error,
+    decode_led_frame,
+    decode_result,
+    decode_welcome,
+    encode_command,
+    encode_header,
+    encode_hello,
+    encode_led_frame_header,
+)
+from wlbb.lib.network.server import set_nodelay
+
+__all__ = ("WLBBClient",)
+
+_PING = struct.Struct("<Q")
+
+
+class WLBBClient(asyncio.Protocol):
+    """
+    The connection of an agent to a WLBB server.
+
+    LED frames sent by the server are passed to `on_led_frame(controller,
+    frame_number, colors)`, where `colors` is only valid until it returns.
+    """
+
+    def __init__(
+        self,
+        agent_id: str,
+        token: bytes = b"",
+        max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE,
+    ):
+        self.agent_id = agent_id
+        self.token = token
+        self.decoder = MessageDecoder(max_message_size)
+        self.on_led_frame: Callable[[int, int, memoryview], None] = None
+        self.transport = None
+        self.session_id = None
+        self._loop = None
+        self._welcome = None
+        self._requests: Dict[int, asyncio.Future] = {}
+        self._request_ids = itertools.count(1)
+        self._closed = None
+
+    async def connect(self, host: str, port: int, timeout: float = 5.0) -> int:
+        """
+        Connect and authenticate to the server and return the session id.
+        """
+        loop = self._loop = asyncio.get_event_loop()
+        self._welcome = loop.create_future()
+        self._closed = loop.create_future()
+        await asyncio.wait_for(
+            loop.create_connection(lambda: self, host, port), timeout
+        )
+        self.send(MessageType.HELLO, encode_hello(self.agent_id, self.token))
+        try:
+            self.session_id = await asyncio.wait_for(self._welcome, timeout)
+        except BaseException:
+            self.transport.close()
+            raise
+        return self.session_id
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        set_nodelay(transport)
+
+    def connection_lost(self, exc):
+        error = ConnectionError("Connection to the server lost.")
+        if not self._welcome.done():
+            self._welcome.set_exception(error)
+        for future in self._requests.values():
+            if not future.done():
+                future.set_exception(error)
+        self._requests.clear()
+        if not self._closed.done():
+            self._closed.set_result(None)
+
+    def data_received(self, data: bytes):
+        try:
+            messages = self.decoder.feed(data)
+        except ProtocolError as err:
+            wlbb_logger.error("Invalid message from the server : %s." % err)
+            self.transport.close()
+            return
+        for message_type, payload in messages:
+            if message_type == MessageType.LED_FRAME:
+                if self.on_led_frame is not None:
+                    self.on_led_frame(*decode_led_frame(memoryview(payload)))
+            elif message_type in (MessageType.RESULT, MessageType.PONG):
+                self._resolve(message_type, payload)
+            elif message_type == MessageType.WELCOME:
+                if not self._welcome.done():
+                    self._welcome.set_result(decode_welcome(payload))
+            elif message_type == MessageType.ERROR:
+                self._error(payload)
+
+    def _resolve(self, message_type: int, payload: bytes):
+        try:
+            if message_type == MessageType.RESULT:
+                request_id, error, result = decode_result(payload)
+            else:
+                (request_id,) = _PING.unpack_from(payload)
+                error, result = False, payload
+        except (ProtocolError, struct.error):
+            wlbb_logger.error(
+                "Invalid %s message from the server." % MessageType(message_type).name
+            )
+            return
+        future = self._requests.pop(request_id, None)
+        if future is None or future.done():
+            return
+        if error:
+            future.set_exception(CommandError(result.decode("utf-8", "replace")))
+        else:
+            future.set_result(result)
+
+    def _error(self, payload: bytes):
+        code, text = decode_error(payload)
+        if code == ErrorCode.AUTHENTICATION:
+            error = AuthenticationError(text)
+        else:
+            error = ProtocolError(text)
+        if not self._welcome.done():
+            self._welcome.set_exception(error)
+        else:
+            wlbb_logger.error("Server error : %s." % text)
+
+    def send(self, message_type: int, payload: bytes = b""):
+        """
+        Send a message to the server.
+        """
+        self.transport.write(encode_header(message_type, len(payload)) + payload)
+
+    def _new_request(self) -> Tuple[int, asyncio.Future]:
+        request_id = next(self._request_ids) & 0xFFFFFFFF
+        future = asyncio.get_event_loop().create_future()
+        self._requests[request_id] = future
+        return request_id, future
+
+    async def command(self, command: str, args: bytes = b"", timeout: float = None):
+        """
+        Send a command to the server and return its result. Raise a
+        CommandError if it failed.
+        """
+        request_id, future = self._new_request()
+        self.send(MessageType.COMMAND, encode_command(request_id, command, args))
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.pop(request_id, None)
+
+    async def ping(self, timeout: float = None) -> float:
+        """
+        Return the round trip time to the server in seconds.
+        """
+        request_id, future = self._new_request()
+        begin = time.perf_counter()
+        self.send(MessageType.PING, _PING.pack(request_id))
+        try:
+            await asyncio.wait_for(future, timeout)
+        finally:
+            self._requests.pop(request_id, None)
+        return time.perf_counter() - begin
+
+    def send_led_frame(self, controller: int, frame_number: int, colors: bytes):
+        """
+        Send a LED frame to the server.
+        """
+        self.transport.write(
+            encode_led_frame_header(controller, frame_number, len(colors)) + colors
+        )
+
+    def send_heartbeat(self, heartbeat: Union[bytes, bytearray, memoryview]):
+        """
+        Send a packed heartbeat (see HeartbeatEncoder) to the server. It is
+        copied, so this can be called from any thread, such as the one of a
+        HeartbeatEmitter.
+        """
+        message = encode_header(MessageType.HEARTBEAT, len(heartbeat)) + heartbeat
+        self._loop.call_soon_threadsafe(self._write, message)
+
+    def _write(self, message: bytes):
+        if self.transport is not None and not self.transport.is_closing():
+            self.transport.write(message)
+
+    async def close(self):
+        """
+        Say goodbye to the server and wait for the connection to be closed.
+        """
+        if self.transport is None:
+            return
+        if not self.transport.is_closing():
+            self.send(MessageType.BYE)
+            self.transport.close()
+        await self._closed
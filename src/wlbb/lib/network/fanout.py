@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the fan-out of LED frames to the LED controller agents.
+
+Each LED controller owns a slice of the LED strip. Frames are computed in
+buffers taken from a preallocated pool and every controller is sent a
+memoryview of its slice behind a header precomputed for it, in a single
+`sendmsg` call on its socket. The frame is only copied for a controller whose
+socket can't take the whole message at once, in which case the rest is queued
+in its transport.
+"""
+
+import os
+import socket
+import struct
+import asyncio
+from collections import deque
+from typing import Dict, List, NamedTuple, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.network.protocol import HEADER_SIZE, encode_led_frame_header
+
+__all__ = (
+    "FramePool",
+    "PooledFrame",
+    "LedFrameFanout",
+    "FanoutStats",
+    "dup_transport_socket",
+    "write_message",
+)
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+_FRAME_NUMBER = struct.Struct("<I")
+# Offset of the frame number in a LED frame header, after the controller.
+_FRAME_NUMBER_OFFSET = HEADER_SIZE + 2
+
+
+class PooledFrame:
+    """
+    A preallocated frame buffer of a FramePool.
+    """
+
+    __slots__ = ("index", "buffer", "view")
+
+    def __init__(self, index: int, size: int):
+        self.index = index
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+
+
+class FramePool:
+    """
+    A fixed number of preallocated frame buffers.
+    """
+
+    def __init__(self, frame_size: int, count: int = 3):
+        self.frame_size = frame_size
+        self.frames = [PooledFrame(index, frame_size) for index in range(count)]
+        self._free = deque(self.frames)
+
+    def acquire(self) -> PooledFrame:
+        """
+        Return a free frame. Raise a RuntimeError if every frame is in use.
+        """
+        try:
+            return self._free.popleft()
+        except IndexError:
+            raise RuntimeError("Every frame of the pool is in use.") from None
+
+    def release(self, frame: PooledFrame):
+        """
+        Give a frame back to the pool.
+        """
+        self._free.append(frame)
+
+    def get_free_count(self) -> int:
+        """
+        Return the number of free frames.
+        """
+        return len(self._free)
+
+
+class FanoutStats(NamedTuple):
+    """
+    Statistics of a LedFrameFanout.
+
+    `direct` counts the messages sent without any copy, `copied` the ones
+    partly queued in their transport and `dropped` the ones skipped because
+    their controller was too far behind.
+    """
+
+    frames: int
+    direct: int
+    copied: int
+    dropped: int
+
+
+class _Controller:
+    """
+    A LED controller connection and the slice of the strip it owns.
+    """
+
+    __slots__ = ("controller", "transport", "sock", "header", "views")
+
+    def __init__(self, controller, transport, sock, header, views):
+        self.controller = controller
+        self.transport = transport
+        self.sock = sock
+        self.header = header
+        # The slice of each frame of the pool, by frame index.
+        self.views = views
+
+
+def dup_transport_socket(transport: asyncio.Transport):
+    """
+    Return a non-blocking duplicate of the socket of `transport`, or None if
+    it can't be written directly.
+    """
+    if not hasattr(socket.socket, "sendmsg"):  # Windows
+        return None
+    transport_sock = transport.get_extra_info("socket")
+    if transport_sock is None:
+        return None
+    sock = socket.socket(fileno=os.dup(transport_sock.fileno()))
+    sock.setblocking(False)
+    return sock
+
+
+def write_message(
+    transport: asyncio.Transport, sock: socket.socket, header: Buffer, payload: Buffer
+) -> bool:
+    """
+    Write `header` followed by `payload` on `transport`, in a single `sendmsg`
+    call on `sock`, its duplicated socket, if nothing is buffered in the
+    transport. What the socket can't take is copied in the transport.
+
+    Return True if the whole message was sent without any copy.
+    """
+    sent = 0
+    if sock is not None and transport.get_write_buffer_size() == 0:
+        try:
+            sent = sock.sendmsg((header, payload))
+        except (BlockingIOError, InterruptedError):
+            sent = 0
+        except OSError as err:
+            # Let the transport report the error.
+            wlbb_logger.debug("Direct send failed : %s." % err)
+            sent = 0
+        if sent == len(header) + len(payload):
+            return True
+
+    header_size = len(header)
+    if sent < header_size:
+        transport.write(bytes(header[sent:]) + payload)
+    else:
+        transport.write(bytes(payload[sent - header_size :]))
+    return False
+
+
+class LedFrameFanout:
+    """
+    Send the slices of LED frames to their controller.
+
+    Frames are `led_count * bytes_per_led` bytes long and taken from a pool of
+    `pool_size` frames. A controller whose transport already buffers more than
+    `max_buffered` bytes skips frames until it catches up.
+
+    Frames must be sent from the event loop thread of the transports.
+    """
+
+    def __init__(
+        self,
+        led_count: int,
+        bytes_per_led: int = 3,
+        pool_size: int = 3,
+        max_buffered: int = 1 << 20,
+    ):
+        self.led_count = led_count
+        self.bytes_per_led = bytes_per_led
+        self.pool = FramePool(led_count * bytes_per_led, pool_size)
+        self.max_buffered = max_buffered
+        self._controllers: Dict[int, List[_Controller]] = {}
+        self._closed: List[_Controller] = []
+        self.frames = 0
+        self.direct = 0
+        self.copied = 0
+        self.dropped = 0
+
+    def add_controller(
+        self, transport: asyncio.Transport, controller: int, offset: int, count: int
+    ):
+        """
+        Send the `count` LEDs starting at `offset` of every frame to
+        `controller` through `transport`.
+        """
+        if offset < 0 or count <= 0 or offset + count > self.led_count:
+            raise ValueError(
+                "LEDs %d to %d are out of the strip." % (offset, offset + count - 1)
+            )
+        start = offset * self.bytes_per_led
+        size = count * self.bytes_per_led
+        header = bytearray(encode_led_frame_header(controller, 0, size))
+        target = _Controller(
+            controller,
+            transport,
+            dup_transport_socket(transport),
+            header,
+            [frame.view[start : start + size] for frame in self.pool.frames],
+        )
+        self._controllers.setdefault(controller, []).append(target)
+
+    def remove_controller(self, controller: int):
+        """
+        Stop sending frames to `controller`.
+        """
+        for target in self._controllers.pop(controller, ()):
+            if target.sock is not None:
+                target.sock.close()
+
+    def _remove_target(self, target: _Controller):
+        targets = self._controllers.get(target.controller)
+        if targets is not None and target in targets:
+            targets.remove(target)
+            if not targets:
+                del self._controllers[target.controller]
+        if target.sock is not None:
+            target.sock.close()
+
+    def acquire_frame(self) -> PooledFrame:
+        """
+        Return a frame buffer to compute the LED colors in.
+        """
+        return self.pool.acquire()
+
+    def release_frame(self, frame: PooledFrame):
+        """
+        Give a frame back to the pool once it isn't used anymore.
+        """
+        self.pool.release(frame)
+
+    def send_frame(self, frame: PooledFrame, frame_number: int):
+        """
+        Send the slices of `frame` to every controller. The frame can be
+        modified or released as soon as this returns.
+        """
+        self.frames += 1
+        frame_number &= 0xFFFFFFFF
+        index = frame.index
+        closed = self._closed
+        for targets in self._controllers.values():
+            for target in targets:
+                if target.transport.is_closing():
+                    closed.append(target)
+                    continue
+                _FRAME_NUMBER.pack_into(
+                    target.header, _FRAME_NUMBER_OFFSET, frame_number
+                )
+                self._send(target, target.views[index])
+        if closed:
+            # Only the closed connections, a controller can have others.
+            for target in closed:
+                self._remove_target(target)
+            closed.clear()
+
+    def _send(self, target: _Controller, payload: memoryview):
+        if target.transport.get_write_buffer_size() > self.max_buffered:
+            self.dropped += 1
+        elif write_message(target.transport, target.sock, target.header, payload):
+            self.direct += 1
+        else:
+            self.copied += 1
+
+    def get_stats(self) -> FanoutStats:
+        """
+        Return the statistics of the fan-out.
+        """
+        return FanoutStats(self.frames, self.direct, self.copied, self.dropped)
+
+    def close(self):
+        """
+        Stop sending frames to every controller.
+        """
+        for controller in list(self._controllers):
+            self.remove_controller(controller)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the binary protocol spoken between WLBB servers and agents.
+
+Every message starts with a header (little endian):
+    payload length (u32), message type (u8), protocol version (u8), reserved
+    (u16)
+followed by the payload whose layout depends on the message type:
+    HELLO       agent id length (u8), agent id (ascii), auth token
+    WELCOME     session id (u32)
+    ERROR       error code (u16), message (utf-8)
+    COMMAND     request id (u32), command length (u8), command (ascii), args
+    RESULT      request id (u32), error (u8, 0 on success), result
+    LED_FRAME   controller (u16), frame number (u32), LED colors
+    PING, PONG  opaque data echoed by the peer
+    BYE         nothing
+    HEARTBEAT   packed agent heartbeat (see wlbb.lib.agent.heartbeat)
+"""
+
+import struct
+from enum import IntEnum
+from typing import List, NamedTuple, Tuple, Union
+
+__all__ = (
+    "MessageType",
+    "ErrorCode",
+    "Message",
+    "MessageDecoder",
+    "ProtocolError",
+    "AuthenticationError",
+    "CommandError",
+    "encode_message",
+    "encode_header",
+    "encode_hello",
+    "decode_hello",
+    "encode_welcome",
+    "decode_welcome",
+    "encode_error",
+    "decode_error",
+    "encode_command",
+    "decode_command",
+    "encode_result",
+    "decode_result",
+    "encode_led_frame_header",
+    "decode_led_frame",
+    "HEADER_SIZE",
+    "MAX_HELLO_SIZE",
+    "PROTOCOL_VERSION",
+)
+
+PROTOCOL_VERSION = 1
+DEFAULT_MAX_MESSAGE_SIZE = 16 << 20
+# Limit of the messages of an agent which isn't authenticated yet.
+MAX_HELLO_SIZE = 4096
+
+_HEADER = struct.Struct("<IBBH")
+HEADER_SIZE = _HEADER.size
+_U32 = struct.Struct("<I")
+_ERROR = struct.Struct("<H")
+_COMMAND = struct.Struct("<IB")
+_RESULT = struct.Struct("<IB")
+_LED_FRAME = struct.Struct("<HI")
+LED_FRAME_HEADER_SIZE = HEADER_SIZE + _LED_FRAME.size
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class MessageType(IntEnum):
+    """
+    Type of a protocol message.
+    """
+
+    HELLO = 1
+    WELCOME = 2
+    ERROR = 3
+    COMMAND = 4
+    RESULT = 5
+    LED_FRAME = 6
+    PING = 7
+    PONG = 8
+    BYE = 9
+    HEARTBEAT = 10
+
+
+class ErrorCode(IntEnum):
+    """
+    Code of an ERROR message.
+    """
+
+    PROTOCOL = 1
+    AUTHENTICATION = 2
+
+
+class ProtocolError(Exception):
+    """
+    Raised when a peer doesn't follow the protocol.
+    """
+
+
+class AuthenticationError(ProtocolError):
+    """
+    Raised when the server refuses an agent.
+    """
+
+
+class CommandError(Exception):
+    """
+    Raised when a command failed on the server.
+    """
+
+
+class Message(NamedTuple):
+    """
+    A decoded message header and its payload.
+    """
+
+    message_type: int
+    payload: bytes
+
+
+def encode_header(message_type: int, payload_size: int) -> bytes:
+    """
+    Return the header of a message.
+    """
+    return _HEADER.pack(payload_size, message_type, PROTOCOL_VERSION, 0)
+
+
+def encode_message(message_type: int, payload: Buffer = b"") -> bytes:
+    """
+    Return a message with its header.
+    """
+    return encode_header(message_type, len(payload)) + payload
+
+
+class MessageDecoder:
+    """
+    Split the bytes received from a stream into messages.
+
+    Received data is appended to a buffer which is only compacted once per
+    call to `feed`, so many small messages received at once are decoded
+    without moving the buffer for each one.
+    """
+
+    def __init__(self, max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE):
+        self.max_message_size = max_message_size
+        self._buffer = bytearray()
+
+    def feed(self, data: Buffer) -> List[Message]:
+        """
+        Add received data and return the messages it completed.
+        """
+        buffer = self._buffer
+        buffer += data
+        messages = []
+        offset = 0
+        end = len(buffer)
+        while end - offset >= HEADER_SIZE:
+            size, message_type, version, _ = _HEADER.unpack_from(buffer, offset)
+            if version != PROTOCOL_VERSION:
+                raise ProtocolError("Unsupported protocol version : %d." % version)
+            if size > self.max_message_size:
+                raise ProtocolError(
+                    "Message of %d bytes is larger than %d bytes."
+                    % (size, self.max_message_size)
+                )
+            payload_start = offset + HEADER_SIZE
+            payload_end = payload_start + size
+            if payload_end > end:
+                break
+            messages.append(
+                Message(message_type, bytes(buffer[payload_start:payload_end]))
+            )
+            offset = payload_end
+        if offset:
+            del buffer[:offset]
+        return messages
+
+    def get_buffered_size(self) -> int:
+        """
+        Return the size of the received data which isn't a complete message yet.
+        """
+        return len(self._buffer)
+
+
+# HELLO
+def encode_hello(agent_id: str, token: bytes = b"") -> bytes:
+    """
+    Return the payload of a HELLO message.
+    """
+    raw_agent_id = agent_id.encode("ascii")
+    if len(raw_agent_id) > 255:
+        raise ValueError("Agent id %a is too long." % agent_id)
+    if 1 + len(raw_agent_id) + len(token) > MAX_HELLO_SIZE:
+        raise ValueError("Auth token is too long.")
+    return bytes((len(raw_agent_id),)) + raw_agent_id + token
+
+
+def decode_hello(payload: Buffer) -> Tuple[str, bytes]:
+    """
+    Return the agent id and the auth token of a HELLO payload.
+    """
+    if not payload:
+        raise ProtocolError("Empty HELLO message.")
+    length = payload[0]
+    if len(payload) < 1 + length:
+        raise ProtocolError("Truncated HELLO message.")
+    try:
+        agent_id = bytes(payload[1 : 1 + length]).decode("ascii")
+    except UnicodeDecodeError:
+        raise ProtocolError("Agent id isn't ascii.") from None
+    return agent_id, bytes(payload[1 + length :])
+
+
+# WELCOME
+def encode_welcome(session_id: int) -> bytes:
+    """
+    Return the payload of a WELCOME message.
+    """
+    return _U32.pack(session_id)
+
+
+def decode_welcome(payload: Buffer) -> int:
+    """
+    Return the session id of a WELCOME payload.
+    """
+    try:
+        return _U32.unpack(payload)[0]
+    except struct.error:
+        raise ProtocolError("Invalid WELCOME message.") from None
+
+
+# ERROR
+def encode_error(code: int, text: str = "") -> bytes:
+    """
+    Return the payload of an ERROR message.
+    """
+    return _ERROR.pack(code) + text.encode("utf-8")
+
+
+def decode_error(payload: Buffer) -> Tuple[int, str]:
+    """
+    Return the code and the text of an ERROR payload.
+    """
+    try:
+        (code,) = _ERROR.unpack_from(payload)
+    except struct.error:
+        raise ProtocolError("Invalid ERROR message.") from None
+    return code, bytes(payload[_ERROR.size :]).decode("utf-8", "replace")
+
+
+# COMMAND
+def encode_command(request_id: int, command: str, args: bytes = b"") -> bytes:
+    """
+    Return the payload of a COMMAND message.
+    """
+    raw_command = command.encode("ascii")
+    if len(raw_command) > 255:
+        raise ValueError("Command %a is too long." % command)
+    return _COMMAND.pack(request_id, len(raw_command)) + raw_command + args
+
+
+def decode_command(payload: Buffer) -> Tuple[int, str, bytes]:
+    """
+    Return the request id, the command and its arguments of a COMMAND
+    payload.
+    """
+    try:
+        request_id, length = _COMMAND.unpack_from(payload)
+    except struct.error:
+        raise ProtocolError("Invalid COMMAND message.") from None
+    start = _COMMAND.size
+    if len(payload) < start + length:
+        raise ProtocolError("Truncated COMMAND message.")
+    try:
+        command = bytes(payload[start : start + length]).decode("ascii")
+    except UnicodeDecodeError:
+        raise ProtocolError("Command isn't ascii.") from None
+    return request_id, command, bytes(payload[start + length :])
+
+
+# RESULT
+def encode_result(request_id: int, result: bytes = b"", error: bool = False) -> bytes:
+    """
+    Return the payload of a RESULT message. If `error` is True, `result` is
+    the utf-8 encoded error message.
+    """
+    return _RESULT.pack(request_id, int(error)) + result
+
+
+def decode_result(payload: Buffer) -> Tuple[int, bool, bytes]:
+    """
+    Return the request id, whether the command failed and the result of a
+    RESULT payload.
+    """
+    try:
+        request_id, error = _RESULT.unpack_from(payload)
+    except struct.error:
+        raise ProtocolError("Invalid RESULT message.") from None
+    return request_id, bool(error), bytes(payload[_RESULT.size :])
+
+
+# LED_FRAME
+def encode_led_frame_header(controller: int, frame_number: int, size: int) -> bytes:
+    """
+    Return the message header and the payload header of a LED frame whose
+    colors are `size` bytes long, to be sent before the colors.
+    """
+    return encode_header(MessageType.LED_FRAME, _LED_FRAME.size + size) + (
+        _LED_FRAME.pack(controller, frame_number & 0xFFFFFFFF)
+    )
+
+
+def decode_led_frame(payload: Buffer) -> Tuple[int, int, Buffer]:
+    """
+    Return the controller, the frame number and the LED colors of a LED_FRAME
+    payload.
+    """
+    try:
+        controller, frame_number = _LED_FRAME.unpack_from(payload)
+    except struct.error:
+        raise ProtocolError("Invalid LED_FRAME message.") from None
+    return controller, frame_number, payload[_LED_FRAME.size :]
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the asyncio TCP server agents connect to.
+
+The server is built on asyncio protocols rather than streams: messages are
+decoded and dispatched directly from `data_received`, so thousands of small
+messages don't each cost a task switch.
+
+When an agent doesn't read fast enough and the write buffer of its session
+is full, LED frames aren't sent to it until the buffer drains, and the
+connection is aborted if other messages still fill the buffer beyond
+`max_write_buffer_size`.
+
+LED frames are sent to each agent as their header and a view of the colors,
+in a single `sendmsg` call (see `wlbb.lib.network.fanout.write_message`), so
+a frame is only copied for an agent whose socket can't take it at once.
+"""
+
+import hmac
+import socket
+import asyncio
+import itertools
+from typing import Awaitable, Callable, Dict, List, Set, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.network.fanout import dup_transport_socket, write_message
+from wlbb.lib.network.protocol import (
+    DEFAULT_MAX_MESSAGE_SIZE,
+    MAX_HELLO_SIZE,
+    ErrorCode,
+    Message,
+    MessageDecoder,
+    MessageType,
+    ProtocolError,
+    decode_command,
+    decode_hello,
+    decode_led_frame,
+    encode_error,
+    encode_header,
+    encode_led_frame_header,
+    encode_result,
+    encode_welcome,
+)
+from wlbb.lib.network.shm_ring import (
+    LOCAL_RING_COMMAND,
+    LOCAL_RING_OPENED_COMMAND,
+    ShmRingWriter,
+    is_local_peer,
+)
+from wlbb.lib.network.udp import (
+    DEFAULT_MTU,
+    UDP_FRAMES_COMMAND,
+    UDP_FRAMES_OPENED_COMMAND,
+    UdpFrameSender,
+    create_multicast_sender,
+)
+
+__all__ = ("WLBBNetworkServer", "ServerSession", "LED_FRAMES_STREAM")
+
+# Name of the local ring stream of the LED frames sent by the server, whose
+# messages are whole LED_FRAME messages.
+LED_FRAMES_STREAM = "led_frames"
+
+DEFAULT_MAX_WRITE_BUFFER_SIZE = 4 << 20
+
+CommandHandler = Callable[["ServerSession", bytes], Union[bytes, Awaitable[bytes]]]
+LedFrameHandler = Callable[["ServerSession", int, int, memoryview], None]
+HeartbeatHandler = Callable[["ServerSession", bytes], None]
+
+
+def set_nodelay(transport: asyncio.BaseTransport):
+    """
+    Disable Nagle's algorithm on a TCP transport, so small messages are sent
+    immediately.
+    """
+    sock = transport.get_extra_info("socket")
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+class ServerSession(asyncio.Protocol):
+    """
+    The connection of an agent to the server.
+
+    Until the agent is authenticated by a HELLO message, every other message
+    or a message larger than MAX_HELLO_SIZE closes the connection.
+    """
+
+    def __init__(self, server: "WLBBNetworkServer"):
+        self.server = server
+        self.decoder = MessageDecoder(min(server.max_message_size, MAX_HELLO_SIZE))
+        self.transport = None
+        self.session_id = None
+        self.agent_id = None
+        self.messages_received = 0
+        self.writing_paused = False
+        self.dropped_frames = 0
+        self.direct_frames = 0
+        self.copied_frames = 0
+        # Duplicate of the socket of the transport LED frames are sent on.
+        self.sock = None
+
+    def connection_made(self, transport: asyncio.Transport):
+        self.transport = transport
+        set_nodelay(transport)
+
+    def connection_lost(self, exc):
+        self.server._remove_session(self)
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def pause_writing(self):
+        self.writing_paused = True
+
+    def resume_writing(self):
+        self.writing_paused = False
+
+    def data_received(self, data: bytes):
+        try:
+            messages = self.decoder.feed(data)
+        except ProtocolError as err:
+            self.fail(ErrorCode.PROTOCOL, str(err))
+            return
+        self.messages_received += len(messages)
+        for message in messages:
+            if self.transport.is_closing():
+                return
+            try:
+                self._dispatch(message)
+            except ProtocolError as err:
+                self.fail(ErrorCode.PROTOCOL, str(err))
+                return
+
+    def _dispatch(self, message: Message):
+        message_type = message.message_type
+        if self.session_id is None:
+            if message_type != MessageType.HELLO:
+                raise ProtocolError("Expected a HELLO message.")
+            self._hello(message.payload)
+        elif message_type == MessageType.LED_FRAME:
+            handler = self.server.led_frame_handler
+            if handler is not None:
+                handler(self, *decode_led_frame(memoryview(message.payload)))
+        elif message_type == MessageType.HEARTBEAT:
+            handler = self.server.heartbeat_handler
+            if handler is not None:
+                handler(self, message.payload)
+        elif message_type == MessageType.COMMAND:
+            self._command(message.payload)
+        elif message_type == MessageType.PING:
+            self.send(MessageType.PONG, message.payload)
+        elif message_type == MessageType.BYE:
+            self.transport.close()
+        else:
+            raise ProtocolError("Unexpected message type : %d." % message_type)
+
+    def _hello(self, payload: bytes):
+        agent_id, token = decode_hello(payload)
+        if not self.server.authenticate(agent_id, token):
+            wlbb_logger.warning("Agent %a failed to authenticate." % agent_id)
+            self.fail(ErrorCode.AUTHENTICATION, "Authentication failed.")
+            return
+        self.agent_id = agent_id
+        self.session_id = self.server._add_session(self)
+        self.sock = dup_transport_socket(self.transport)
+        self.decoder.max_message_size = self.server.max_message_size
+        self.send(MessageType.WELCOME, encode_welcome(self.session_id))
+
+    def _command(self, payload: bytes):
+        request_id, command, args = decode_command(payload)
+        handler = self.server.command_handlers.get(command)
+        if handler is None:
+            self.send_result(request_id, b"Unknown command : %a." % command, True)
+            return
+        try:
+            result = handler(self, args)
+        except Exception as err:
+            self.send_result(request_id, str(err).encode("utf-8"), True)
+            return
+        if isinstance(result, (bytes, bytearray, memoryview)) or result is None:
+            self.send_result(request_id, result or b"")
+            return
+        future = asyncio.ensure_future(result)
+        future.add_done_callback(lambda done: self._command_done(request_id, done))
+
+    def _command_done(self, request_id: int, future: asyncio.Future):
+        if future.cancelled():
+            self.send_result(request_id, b"Command cancelled.", True)
+        elif future.exception() is not None:
+            self.send_result(request_id, str(future.exception()).encode("utf-8"), True)
+        else:
+            self.send_result(request_id, future.result() or b"")
+
+    def send(self, message_type: int, payload: bytes = b""):
+        """
+        Send a message to the agent.
+        """
+        transport = self.transport
+        if transport is None or transport.is_closing():
+            return
+        transport.write(encode_header(message_type, len(payload)) + payload)
+        if (
+            self.writing_paused
+            and transport.get_write_buffer_size() > self.server.max_write_buffer_size
+        ):
+            wlbb_logger.warning(
+                "Agent %a doesn't read its messages, disconnecting it." % self.agent_id
+            )
+            transport.abort()
+
+    def send_result(self, request_id: int, result: bytes, error: bool = False):
+        """
+        Send the result of a command to the agent.
+        """
+        self.send(MessageType.RESULT, encode_result(request_id, result, error))
+
+    def fail(self, code: int, text: str):
+        """
+        Send an error to the agent and close the connection.
+        """
+        self.send(MessageType.ERROR, encode_error(code, text))
+        self.transport.close()
+
+
+class WLBBNetworkServer:
+    """
+    An asyncio TCP server dispatching the messages of authenticated agents.
+
+    Agents are authenticated by `authenticate(agent_id, token)` if it is given,
+    otherwise by comparing their token with `token`, otherwise every agent is
+    accepted. Commands are dispatched to the handlers registered with
+    `register_command`, which return the result as bytes or a coroutine
+    returning it, LED frames to `led_frame_handler` and heartbeats to
+    `heartbeat_handler`, which raises a ProtocolError for an invalid one.
+
+    Agents running on the same machine as the server can read the streams
+    registered with `add_local_ring` from shared memory ring buffers instead
+    of the network (see `open_local_ring`). The LED frames sent by the server
+    go through the ring created by `open_led_frame_ring`, if any, to the
+    agents which opened it, and through UDP once `open_led_frame_udp` was
+    called to the agents which asked for it (see `open_udp_frames`).
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        token: bytes = None,
+        authenticate: Callable[[str, bytes], bool] = None,
+        max_message_size: int = DEFAULT_MAX_MESSAGE_SIZE,
+        max_write_buffer_size: int = DEFAULT_MAX_WRITE_BUFFER_SIZE,
+    ):
+        self.host = host
+        self.port = port
+        self.token = token
+        self._authenticate = authenticate
+        self.max_message_size = max_message_size
+        self.max_write_buffer_size = max_write_buffer_size
+        self.command_handlers: Dict[str, CommandHandler] = {}
+        self.led_frame_handler: LedFrameHandler = None
+        self.heartbeat_handler: HeartbeatHandler = None
+        self._sessions: Dict[int, ServerSession] = {}
+        self._session_ids = itertools.count(1)
+        self._server = None
+        self.local_rings: Dict[str, str] = {}
+        # Ids of the sessions reading each stream from its local ring.
+        self.local_ring_sessions: Dict[str, Set[int]] = {}
+        self.led_frame_ring = None
+        # Sender of the LED frames to the multicast group, if any, and socket
+        # of the senders to each agent otherwise.
+        self.udp_multicast: UdpFrameSender = None
+        self.udp_sock = None
+        self.udp_mtu = DEFAULT_MTU
+        # Sender of the LED frames of each session receiving them through UDP.
+        self.udp_sessions: Dict[int, UdpFrameSender] = {}
+        self.register_command(LOCAL_RING_COMMAND, self._get_local_ring)
+        self.register_command(LOCAL_RING_OPENED_COMMAND, self._local_ring_opened)
+        self.register_command(UDP_FRAMES_COMMAND, self._get_udp_frames)
+        self.register_command(UDP_FRAMES_OPENED_COMMAND, self._udp_frames_opened)
+
+    def authenticate(self, agent_id: str, token: bytes) -> bool:
+        """
+        Return True if the agent `agent_id` is allowed to connect.
+        """
+        if self._authenticate is not None:
+            return self._authenticate(agent_id, token)
+        if self.token is None:
+            return True
+        return hmac.compare_digest(self.token, token)
+
+    def register_command(self, command: str, handler: CommandHandler):
+        """
+        Call `handler(session, args)` when an agent sends `command`.
+        """
+        self.command_handlers[command] = handler
+
+    def add_local_ring(self, stream: str, ring_name: str):
+        """
+        Let agents on the same machine read `stream` from the shared memory
+        ring `ring_name`.
+        """
+        self.local_rings[stream] = ring_name
+
+    def remove_local_ring(self, stream: str):
+        """
+        Stop offering the shared memory ring of `stream`.
+        """
+        self.local_rings.pop(stream, None)
+        self.local_ring_sessions.pop(stream, None)
+
+    def open_led_frame_ring(self, slot_count: int = 4, slot_size: int = 1 << 20):
+        """
+        Create the local ring of the LED frames sent by the server, for
+        messages of at most `slot_size` bytes. It is closed by `stop`.
+        """
+        self.close_led_frame_ring()
+        self.led_frame_ring = ShmRingWriter(slot_count=slot_count, slot_size=slot_size)
+        self.add_local_ring(LED_FRAMES_STREAM, self.led_frame_ring.name)
+
+    def close_led_frame_ring(self):
+        """
+        Close the local ring of the LED frames. Its readers get the next
+        frames through the network.
+        """
+        ring, self.led_frame_ring = self.led_frame_ring, None
+        if ring is not None:
+            self.remove_local_ring(LED_FRAMES_STREAM)
+            ring.close()
+
+    def open_led_frame_udp(
+        self,
+        group: str = None,
+        port: int = 0,
+        mtu: int = DEFAULT_MTU,
+        ttl: int = 1,
+        interface: str = "0.0.0.0",
+    ):
+        """
+        Send the LED frames sent to every session through UDP to the agents
+        asking for it, in datagrams of at most `mtu` bytes. They are sent
+        once to the multicast group `group` on `port` through `interface`,
+        or to each agent if `group` is None. It is closed by `stop`.
+        """
+        self.close_led_frame_udp()
+        if group is not None:
+            sock = create_multicast_sender(ttl, interface)
+            self.udp_multicast = UdpFrameSender((group, port), mtu, sock)
+        else:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_sock = sock
+        self.udp_mtu = mtu
+
+    def close_led_frame_udp(self):
+        """
+        Stop sending the LED frames through UDP. Their agents get the next
+        frames through the network.
+        """
+        sock, self.udp_sock = self.udp_sock, None
+        self.udp_multicast = None
+        self.udp_sessions.clear()
+        if sock is not None:
+            sock.close()
+
+    def _get_local_ring(self, session: ServerSession, args: bytes) -> bytes:
+        stream = args.decode("ascii", "replace")
+        if not is_local_peer(session.transport):
+            raise ValueError(
+                "Agent %a isn't on the server's machine." % session.agent_id
+            )
+        ring_name = self.local_rings.get(stream)
+        if ring_name is None:
+            raise ValueError("No local ring for %a." % stream)
+        return ring_name.encode("ascii")
+
+    def _local_ring_opened(self, session: ServerSession, args: bytes) -> bytes:
+        stream = args.decode("ascii", "replace")
+        if stream not in self.local_rings:
+            raise ValueError("No local ring for %a." % stream)
+        self.local_ring_sessions.setdefault(stream, set()).add(session.session_id)
+        return b""
+
+    def _get_udp_frames(self, session: ServerSession, args: bytes) -> bytes:
+        if self.udp_sock is None:
+            raise ValueError("LED frames aren't sent through UDP.")
+        if self.udp_multicast is None:
+            return b""
+        return ("%s:%d" % self.udp_multicast.address).encode("ascii")
+
+    def _udp_frames_opened(self, session: ServerSession, args: bytes) -> bytes:
+        if self.udp_sock is None:
+            raise ValueError("LED frames aren't sent through UDP.")
+        sender = self.udp_multicast
+        if sender is None:
+            host = session.transport.get_extra_info("peername")[0]
+            sender = UdpFrameSender((host, int(args)), self.udp_mtu, self.udp_sock)
+        self.udp_sessions[session.session_id] = sender
+        return b""
+
+    def _add_session(self, session: ServerSession) -> int:
+        session_id = next(self._session_ids)
+        self._sessions[session_id] = session
+        return session_id
+
+    def _remove_session(self, session: ServerSession):
+        if session.session_id is not None:
+            self._sessions.pop(session.session_id, None)
+            for session_ids in self.local_ring_sessions.values():
+                session_ids.discard(session.session_id)
+            self.udp_sessions.pop(session.session_id, None)
+
+    async def start(self):
+        """
+        Start listening. The port chosen by the system is stored in `port` if
+        it was 0.
+        """
+        loop = asyncio.get_event_loop()
+        self._server = await loop.create_server(
+            lambda: ServerSession(self), self.host, self.port
+        )
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stop listening and close every session.
+        """
+        if self._server is None:
+            return
+        self._server.close()
+        for session in list(self._sessions.values()):
+            session.transport.close()
+        await self._server.wait_closed()
+        self._server = None
+        self.close_led_frame_ring()
+        self.close_led_frame_udp()
+
+    def is_serving(self) -> bool:
+        """
+        Return True if the server is listening.
+        """
+        return self._server is not None
+
+    def send_led_frame(
+        self, controller: int, frame_number: int, data: bytes, session_ids=None
+    ):
+        """
+        Send a LED frame to the given sessions, or to every session. Sessions
+        whose write buffer is full drop the frame. A frame sent to every
+        session is written in the LED frame ring, and the sessions reading it
+        get the frame from there, and the sessions receiving the frames
+        through UDP get it that way. `data` isn't copied for a session whose
+        socket takes the whole frame, and can be modified once this returns.
+        """
+        payload = memoryview(data).cast("B")
+        header = encode_led_frame_header(controller, frame_number, len(payload))
+        sessions = self._sessions
+        local_session_ids = udp_sessions = ()
+        if session_ids is None:
+            session_ids = list(sessions)
+            ring = self.led_frame_ring
+            size = len(header) + len(payload)
+            if ring is not None and size <= ring.slot_size:
+                slot = ring.reserve()
+                slot[: len(header)] = header
+                slot[len(header) : size] = payload
+                ring.commit(size)
+                local_session_ids = self.local_ring_sessions.get(LED_FRAMES_STREAM, ())
+            udp_sessions = self.udp_sessions
+            if self.udp_multicast is not None:
+                if udp_sessions:
+                    self.udp_multicast.send_frame(controller, frame_number, payload)
+            else:
+                for sender in udp_sessions.values():
+                    sender.send_frame(controller, frame_number, payload)
+        for session_id in session_ids:
+            session = sessions.get(session_id)
+            if (
+                session is None
+                or session.transport.is_closing()
+                or session_id in local_session_ids
+                or session_id in udp_sessions
+            ):
+                continue
+            if session.writing_paused:
+                session.dropped_frames += 1
+            elif write_message(session.transport, session.sock, header, payload):
+                session.direct_frames += 1
+            else:
+                session.copied_frames += 1
+
+    # Getters
+    def get_sessions(self) -> List[ServerSession]:
+        """
+        Return every authenticated session.
+        """
+        return list(self._sessions.values())
+
+    def get_session(self, session_id: int) -> ServerSession:
+        """
+        Return the session `session_id`, or None.
+        """
+        return self._sessions.get(session_id)
@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define a shared memory ring buffer moving messages between processes of the
+same machine.
+
+A single writer publishes messages, like camera frames or LED buffers, in the
+slots of a ring read by any number of readers. The writer never waits for the
+readers: a reader too far behind loses the overwritten messages. Messages are
+written and read directly in the shared memory, without serialization.
+
+Segment layout (little endian), slots being aligned on 64 bytes:
+    magic (8 bytes), slot count (u32), reserved (u32), slot size (u64),
+    write sequence (u64)
+    for each slot: state (u64), message length (u64), checksum (u64), message
+The state of a slot is `2 * sequence + 1` while the message `sequence` is
+written in it and `2 * sequence + 2` once it is complete, so readers detect
+messages overwritten while they read them, like a seqlock.
+
+As for the shared configs (see wlbb.lib.config.shared_config), nothing keeps
+the stores of the writer in order for a reader on another core: it may see
+the new state with a stale length or a partly written message. The checksum
+is the CRC32 of the sequence and the length followed by the message, written
+before the state, and readers check their copy against it before moving to
+the next message, so a torn message is counted as lost instead of being
+returned, and a message left from a previous lap of the ring can't be taken
+for the new one.
+
+Readers are woken up by a byte written in a named pipe they create in the
+ring's wakeup directory.
+"""
+
+import os
+import zlib
+import time
+import errno
+import select
+import struct
+import tempfile
+import ipaddress
+from typing import Dict, NamedTuple, Optional, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.network.protocol import CommandError
+from wlbb.lib.shared_segment import (
+    ReadOnlySegment,
+    assert_shared_memory_available,
+    shared_memory,
+)
+
+__all__ = (
+    "ShmRingWriter",
+    "ShmRingReader",
+    "RingStats",
+    "get_wake_dir",
+    "is_local_peer",
+    "open_local_ring",
+    "LOCAL_RING_COMMAND",
+    "LOCAL_RING_OPENED_COMMAND",
+)
+
+RING_MAGIC = b"WLBBRNG2"
+_RING_HEADER = struct.Struct("<8sIIQQ")
+_WRITE_SEQUENCE_OFFSET = 24
+_U64 = struct.Struct("<Q")
+_SLOT_HEADER = struct.Struct("<QQQ")
+_LENGTH_OFFSET = 8
+_CHECKSUM_KEY = struct.Struct("<QQ")
+_SLOT_ALIGNMENT = 64
+_RACY_MTIME_NS = 50_000_000
+
+LOCAL_RING_COMMAND = "local_ring"
+LOCAL_RING_OPENED_COMMAND = "local_ring_opened"
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+def _get_slot_stride(slot_size: int) -> int:
+    size = _SLOT_HEADER.size + slot_size
+    return -(-size // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+
+
+def _get_slots_offset() -> int:
+    return -(-_RING_HEADER.size // _SLOT_ALIGNMENT) * _SLOT_ALIGNMENT
+
+
+def get_checksum(sequence: int, message: Buffer) -> int:
+    """
+    Return the checksum of the message `sequence`.
+    """
+    return zlib.crc32(message, zlib.crc32(_CHECKSUM_KEY.pack(sequence, len(message))))
+
+
+def get_wake_dir(name: str) -> str:
+    """
+    Return the directory of the wakeup pipes of the ring `name`.
+    """
+    return os.path.join(tempfile.gettempdir(), "wlbb-ring-" + name)
+
+
+class RingStats(NamedTuple):
+    """
+    Statistics of a ring reader: the messages read and the ones it lost
+    because they were overwritten before it read them.
+    """
+
+    read: int
+    lost: int
+
+
+class ShmRingWriter:
+    """
+    Publish messages of at most `slot_size` bytes in a ring of `slot_count`
+    slots. The shared memory segment is unlinked by `close`.
+    """
+
+    def __init__(self, name: str = None, slot_count: int = 4, slot_size: int = 1 << 20):
+        assert_shared_memory_available("the shared memory ring buffer")
+        if slot_count < 1 or slot_size < 1:
+            raise ValueError("A ring needs at least one slot of one byte.")
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slot_stride = _get_slot_stride(slot_size)
+        self.slots_offset = _get_slots_offset()
+        self.shm = shared_memory.SharedMemory(
+            name=name,
+            create=True,
+            size=self.slots_offset + slot_count * self.slot_stride,
+        )
+        self.name = self.shm.name
+        self.buf = self.shm.buf
+        _RING_HEADER.pack_into(self.buf, 0, RING_MAGIC, slot_count, 0, slot_size, 0)
+        self.sequence = 0
+        self._reserved = None
+
+        self.wake_dir = get_wake_dir(self.name)
+        self._wake_fds: Dict[str, int] = {}
+        self._wake_dir_mtime_ns = None
+        self._wake_dir_racy = True
+        if hasattr(os, "mkfifo"):
+            os.makedirs(self.wake_dir, mode=0o700, exist_ok=True)
+        else:  # Windows: readers poll the ring.
+            self.wake_dir = None
+
+    def _get_slot_offset(self, sequence: int) -> int:
+        return self.slots_offset + (sequence % self.slot_count) * self.slot_stride
+
+    def reserve(self) -> memoryview:
+        """
+        Return the memory of the next message, to be written in place before
+        calling `commit`.
+        """
+        offset = self._get_slot_offset(self.sequence)
+        # Readers ignore the slot until it is committed.
+        _U64.pack_into(self.buf, offset, 2 * self.sequence + 1)
+        start = offset + _SLOT_HEADER.size
+        self._reserved = self.buf[start : start + self.slot_size]
+        return self._reserved
+
+    def commit(self, length: int):
+        """
+        Publish the `length` first bytes of the reserved message and wake up
+        the readers.
+        """
+        if self._reserved is None:
+            raise RuntimeError("No message was reserved.")
+        if not 0 <= length <= self.slot_size:
+            raise ValueError("Invalid message length : %d." % length)
+        with self._reserved[:length] as message:
+            checksum = get_checksum(self.sequence, message)
+        self._reserved.release()
+        self._reserved = None
+        offset = self._get_slot_offset(self.sequence)
+        # The length and the checksum are written before the state publishing
+        # the message, readers checking them anyway (see the module docstring).
+        _CHECKSUM_KEY.pack_into(self.buf, offset + _LENGTH_OFFSET, length, checksum)
+        _U64.pack_into(self.buf, offset, 2 * self.sequence + 2)
+        self.sequence += 1
+        _U64.pack_into(self.buf, _WRITE_SEQUENCE_OFFSET, self.sequence)
+        self._wake_readers()
+
+    def write(self, message: Buffer):
+        """
+        Copy a message in the ring and publish it.
+        """
+        length = len(message)
+        if length > self.slot_size:
+            raise ValueError(
+                "Message of %d bytes is larger than the slots (%d bytes)."
+                % (length, self.slot_size)
+            )
+        self.reserve()[:length] = message
+        self.commit(length)
+
+    def _update_wake_fds(self):
+        try:
+            mtime_ns = os.stat(self.wake_dir).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime_ns == self._wake_dir_mtime_ns and not self._wake_dir_racy:
+            return
+        self._wake_dir_mtime_ns = mtime_ns
+        # A pipe created right after the scan may not change the directory's
+        # mtime with coarse timestamps, so it is scanned again until its mtime
+        # is old enough.
+        self._wake_dir_racy = time.time() * 1e9 - mtime_ns < _RACY_MTIME_NS
+        pipe_names = set(os.listdir(self.wake_dir))
+        for pipe_name in list(self._wake_fds):
+            if pipe_name not in pipe_names:
+                os.close(self._wake_fds.pop(pipe_name))
+        for pipe_name in pipe_names.difference(self._wake_fds):
+            try:
+                self._wake_fds[pipe_name] = os.open(
+                    os.path.join(self.wake_dir, pipe_name), os.O_WRONLY | os.O_NONBLOCK
+                )
+            except OSError as err:
+                if err.errno == errno.ENXIO:
+                    # Nobody reads the pipe anymore.
+                    self._remove_wake_pipe(pipe_name)
+
+    def _remove_wake_pipe(self, pipe_name: str):
+        try:
+            os.unlink(os.path.join(self.wake_dir, pipe_name))
+        except FileNotFoundError:
+            pass
+
+    def _wake_readers(self):
+        if self.wake_dir is None:
+            return
+        self._update_wake_fds()
+        for pipe_name, fd in list(self._wake_fds.items()):
+            try:
+                os.write(fd, b"\0")
+            except BlockingIOError:
+                # The reader has pending wakeups already.
+                pass
+            except BrokenPipeError:
+                os.close(self._wake_fds.pop(pipe_name))
+                self._remove_wake_pipe(pipe_name)
+
+    def close(self):
+        """
+        Close and unlink the shared memory segment and the wakeup directory.
+        """
+        for fd in self._wake_fds.values():
+            os.close(fd)
+        self._wake_fds.clear()
+        if self.wake_dir is not None:
+            for pipe_name in os.listdir(self.wake_dir):
+                self._remove_wake_pipe(pipe_name)
+            try:
+                os.rmdir(self.wake_dir)
+            except OSError:
+                pass
+        if self._reserved is not None:
+            self._reserved.release()
+        self.buf.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ShmRingReader:
+    """
+    Read the messages published in a ring from a read-only mapping of its
+    segment, starting with the next published one.
+    """
+
+    def __init__(self, name: str):
+        assert_shared_memory_available("the shared memory ring buffer")
+        self.segment = ReadOnlySegment(name)
+        self.buf = self.segment.buf
+        magic, slot_count, _, slot_size, sequence = _RING_HEADER.unpack_from(self.buf)
+        if magic != RING_MAGIC:
+            self.segment.close()
+            raise ValueError("%a isn't a ring buffer segment." % name)
+        self.name = name
+        self.slot_count = slot_count
+        self.slot_size = slot_size
+        self.slot_stride = _get_slot_stride(slot_size)
+        self.slots_offset = _get_slots_offset()
+        self.sequence = sequence
+        self.read_count = 0
+        self.lost_count = 0
+        self._open_wake_pipe()
+
+    def _open_wake_pipe(self):
+        self.wake_path = None
+        self._wake_fd = None
+        self._keepalive_fd = None
+        wake_dir = get_wake_dir(self.name)
+        if not hasattr(os, "mkfifo") or not os.path.isdir(wake_dir):
+            return
+        self.wake_path = os.path.join(wake_dir, "%d-%x" % (os.getpid(), id(self)))
+        os.mkfifo(self.wake_path, 0o600)
+        self._wake_fd = os.open(self.wake_path, os.O_RDONLY | os.O_NONBLOCK)
+        # Keeping a writer open prevents the pipe from signaling end of file
+        # when the ring writer closes it.
+        self._keepalive_fd = os.open(self.wake_path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def fileno(self) -> int:
+        """
+        Return the file descriptor which is readable when messages were
+        published, to be used with select or `loop.add_reader`.
+        """
+        if self._wake_fd is None:
+            raise OSError("Ring %a has no wakeup pipe." % self.name)
+        return self._wake_fd
+
+    def get_write_sequence(self) -> int:
+        """
+        Return the sequence number of the next published message.
+        """
+        return _U64.unpack_from(self.buf, _WRITE_SEQUENCE_OFFSET)[0]
+
+    def get_pending_count(self) -> int:
+        """
+        Return the number of published messages not read yet, including the
+        ones which will be lost.
+        """
+        return self.get_write_sequence() - self.sequence
+
+    def seek_latest(self):
+        """
+        Skip every pending message but the newest one.
+        """
+        write_sequence = self.get_write_sequence()
+        if write_sequence - self.sequence > 1:
+            self.lost_count += write_sequence - 1 - self.sequence
+            self.sequence = write_sequence - 1
+
+    def _read(self, copy):
+        """
+        Call `copy(message)` with a view of the next message and return its
+        result, a copy of the message, or None if no message is pending. The
+        copy is dropped if the message was overwritten during the copy or if
+        it doesn't match its checksum.
+        """
+        while True:
+            write_sequence = self.get_write_sequence()
+            if self.sequence >= write_sequence:
+                return None
+            oldest = write_sequence - self.slot_count
+            if self.sequence < oldest:
+                self.lost_count += oldest - self.sequence
+                self.sequence = oldest
+
+            offset = self.slots_offset + (self.sequence % self.slot_count) * (
+                self.slot_stride
+            )
+            state, length, checksum = _SLOT_HEADER.unpack_from(self.buf, offset)
+            expected_state = 2 * self.sequence + 2
+            if state == expected_state and length <= self.slot_size:
+                start = offset + _SLOT_HEADER.size
+                with self.buf[start : start + length] as message:
+                    result = copy(message)
+                if (
+                    _U64.unpack_from(self.buf, offset)[0] == expected_state
+                    and get_checksum(self.sequence, result) == checksum
+                ):
+                    self.sequence += 1
+                    self.read_count += 1
+                    return result
+            # The message was overwritten or torn.
+            self.lost_count += 1
+            self.sequence += 1
+
+    def read_into(self, buffer: Buffer) -> int:
+        """
+        Copy the next message in `buffer` and return its length, or -1 if no
+        message is pending. `buffer` must be large enough for the messages.
+        """
+
+        view = memoryview(buffer)
+
+        def copy(message):
+            view[: len(message)] = message
+            return view[: len(message)]
+
+        with view:
+            message = self._read(copy)
+            if message is None:
+                return -1
+            length = len(message)
+            message.release()
+            return length
+
+    def read(self) -> Optional[bytes]:
+        """
+        Return a copy of the next message, or None if no message is pending.
+        """
+        return self._read(bytes)
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Wait until a message is pending or `timeout` seconds elapsed. Return
+        True if a message is pending.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.get_pending_count() <= 0:
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return False
+            if self._wake_fd is None:
+                time.sleep(0.001)
+                continue
+            readable, _, _ = select.select([self._wake_fd], [], [], remaining)
+            if readable:
+                self.clear_wakeups()
+        return True
+
+    def clear_wakeups(self):
+        """
+        Empty the wakeup pipe.
+        """
+        try:
+            while os.read(self._wake_fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+
+    def get_stats(self) -> RingStats:
+        """
+        Return the statistics of the reader.
+        """
+        return RingStats(self.read_count, self.lost_count)
+
+    def close(self):
+        """
+        Detach from the ring.
+        """
+        for fd in (self._wake_fd, self._keepalive_fd):
+            if fd is not None:
+                os.close(fd)
+        self._wake_fd = self._keepalive_fd = None
+        if self.wake_path is not None:
+            try:
+                os.unlink(self.wake_path)
+            except FileNotFoundError:
+                pass
+        self.buf.release()
+        self.segment.close()
+
+
+def is_local_peer(transport) -> bool:
+    """
+    Return True if the peer of a stream transport runs on this machine.
+    """
+    peername = transport.get_extra_info("peername")
+    if not isinstance(peername, tuple):
+        # Unix domain socket.
+        return peername is not None
+    try:
+        return ipaddress.ip_address(peername[0]).is_loopback
+    except ValueError:
+        return False
+
+
+async def open_local_ring(client, stream: str) -> Optional[ShmRingReader]:
+    """
+    Ask the server connected to `client` for the ring of `stream` and return
+    a reader of it, or None if the server and the agent can't share memory,
+    in which case the stream must go through the network.
+
+    Once the reader is open, the server is told so and stops sending the
+    stream through the network to the agent.
+    """
+    if shared_memory is None:
+        return None
+    try:
+        ring_name = await client.command(LOCAL_RING_COMMAND, stream.encode("ascii"))
+    except CommandError as err:
+        wlbb_logger.debug("No local ring for %a : %s." % (stream, err))
+        return None
+    try:
+        reader = ShmRingReader(ring_name.decode("ascii"))
+    except (OSError, ValueError) as err:
+        # The server runs on another machine reached through loopback.
+        wlbb_logger.debug("Can't open the local ring of %a : %s." % (stream, err))
+        return None
+    try:
+        await client.command(LOCAL_RING_OPENED_COMMAND, stream.encode("ascii"))
+    except BaseException:
+        reader.close()
+        raise
+    return reader
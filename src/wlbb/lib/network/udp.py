@@ -0,0 +1,526 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the UDP transport of LED frames, in unicast or multicast.
+
+Unlike TCP, a lost datagram doesn't delay the following frames: receivers
+display the newest complete frame and drop the older ones. Frames are split in
+datagrams of at most `mtu` bytes, each one starting with a header (little
+endian):
+    version (u8), sender epoch (u8), controller (u16), frame sequence number
+    (u32), frame size (u32), chunk offset in the frame (u32)
+followed by the chunk of the frame. Sequence numbers wrap around and are
+compared with serial number arithmetic (RFC 1982).
+
+A sender picks a random epoch when it is created, so receivers start over
+from the first frame of a restarted sender instead of taking its frames for
+late ones. In case the new epoch is the same, they also start over after
+`max_late_chunks` late chunks in a row.
+
+The server sends its LED frames through UDP to the agents which asked for it
+with `open_udp_frames`, either to a multicast group or to each agent.
+"""
+
+import os
+import socket
+import struct
+import asyncio
+from collections import OrderedDict
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+from wlbb.lib.network.protocol import CommandError
+
+__all__ = (
+    "UdpFrameSender",
+    "UdpFrameReceiver",
+    "FrameReassembler",
+    "ReassemblerStats",
+    "iter_frame_chunks",
+    "is_newer_sequence",
+    "create_multicast_sender",
+    "create_multicast_receiver",
+    "open_udp_frames",
+    "DEFAULT_MTU",
+    "UDP_FRAMES_COMMAND",
+    "UDP_FRAMES_OPENED_COMMAND",
+)
+
+# Commands asking the server for the multicast group of its LED frames, if
+# any, and telling it to send them through UDP.
+UDP_FRAMES_COMMAND = "get_udp_frames"
+UDP_FRAMES_OPENED_COMMAND = "udp_frames_opened"
+
+UDP_VERSION = 2
+DEFAULT_MTU = 1400
+DEFAULT_MAX_LATE_CHUNKS = 64
+_CHUNK_HEADER = struct.Struct("<BBHIII")
+CHUNK_HEADER_SIZE = _CHUNK_HEADER.size
+_SEQUENCE_MASK = 0xFFFFFFFF
+_HALF_SEQUENCE = 0x80000000
+
+Buffer = Union[bytes, bytearray, memoryview]
+Address = Tuple[str, int]
+
+
+def is_newer_sequence(sequence: int, reference: int) -> bool:
+    """
+    Return True if the sequence number `sequence` comes after `reference`,
+    taking wrap around into account.
+    """
+    return (
+        sequence != reference
+        and ((sequence - reference) & _SEQUENCE_MASK) < _HALF_SEQUENCE
+    )
+
+
+def _get_chunk_size(mtu: int) -> int:
+    chunk_size = mtu - CHUNK_HEADER_SIZE
+    if chunk_size <= 0:
+        raise ValueError("MTU of %d bytes is too small." % mtu)
+    return chunk_size
+
+
+def iter_frame_chunks(
+    controller: int,
+    sequence: int,
+    frame: Buffer,
+    mtu: int = DEFAULT_MTU,
+    epoch: int = 0,
+) -> Iterator[bytes]:
+    """
+    Yield the datagrams of a frame sent by a sender of epoch `epoch`.
+    """
+    chunk_size = _get_chunk_size(mtu)
+    view = memoryview(frame)
+    size = len(view)
+    sequence &= _SEQUENCE_MASK
+    for offset in range(0, max(size, 1), chunk_size):
+        yield _CHUNK_HEADER.pack(
+            UDP_VERSION, epoch, controller, sequence, size, offset
+        ) + view[offset : offset + chunk_size]
+
+
+class UdpFrameSender:
+    """
+    Send LED frames over UDP to `address`, which may be a multicast group.
+
+    The chunks of a frame are sent directly from the frame's memory with
+    `sendmsg`, behind a reused header. The epoch of the sender is random
+    unless given.
+    """
+
+    def __init__(
+        self,
+        address: Address,
+        mtu: int = DEFAULT_MTU,
+        sock: socket.socket = None,
+        epoch: int = None,
+    ):
+        if sock is None:
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.sock = sock
+        self.address = address
+        self.mtu = mtu
+        self.chunk_size = _get_chunk_size(mtu)
+        self.header = bytearray(CHUNK_HEADER_SIZE)
+        self.epoch = os.urandom(1)[0] if epoch is None else epoch
+        self._sendmsg = getattr(sock, "sendmsg", None)
+        self.sent_frames = 0
+        self.send_errors = 0
+
+    def send_frame(self, controller: int, sequence: int, frame: Buffer):
+        """
+        Send a frame. Datagrams which can't be sent are lost like any other
+        datagram.
+        """
+        view = memoryview(frame)
+        size = len(view)
+        sequence &= _SEQUENCE_MASK
+        header = self.header
+        for offset in range(0, max(size, 1), self.chunk_size):
+            _CHUNK_HEADER.pack_into(
+                header, 0, UDP_VERSION, self.epoch, controller, sequence, size, offset
+            )
+            chunk = view[offset : offset + self.chunk_size]
+            try:
+                if self._sendmsg is not None:
+                    self._sendmsg((header, chunk), (), 0, self.address)
+                else:  # Windows
+                    self.sock.sendto(bytes(header) + chunk, self.address)
+            except OSError as err:
+                self.send_errors += 1
+                wlbb_logger.debug("Failed to send a LED frame chunk : %s." % err)
+        self.sent_frames += 1
+
+    def close(self):
+        """
+        Close the socket.
+        """
+        self.sock.close()
+
+
+class ReassemblerStats(NamedTuple):
+    """
+    Statistics of a FrameReassembler.
+
+    `late` counts the chunks of frames older than the newest complete one,
+    `incomplete` the frames dropped before all their chunks were received and
+    `restarts` the times a controller's frames started over.
+    """
+
+    completed: int
+    late: int
+    incomplete: int
+    invalid: int
+    restarts: int
+
+
+class _PendingFrame:
+    """
+    A frame whose chunks are being received.
+
+    Every chunk but the last one of a frame has the chunk size of its sender,
+    which is taken from the first of them received. Chunks which don't fit
+    the frame cut in chunks of that size are rejected, so the received chunks
+    never overlap and the frame is complete once their sizes add up to the
+    frame size.
+    """
+
+    __slots__ = ("buffer", "offsets", "received", "chunk_size", "last_offset")
+
+    def __init__(self, buffer: bytearray):
+        self.buffer = buffer
+        self.offsets = set()
+        self.received = 0
+        self.chunk_size = None
+        self.last_offset = None
+
+    def is_valid_chunk(self, offset: int, length: int) -> bool:
+        """
+        Return True if the chunk of `length` bytes at `offset` fits the
+        chunks received before, and remember its place in the frame.
+        """
+        chunk_size = self.chunk_size
+        last_offset = self.last_offset
+        if offset + length == len(self.buffer):
+            # The last chunk, which can be shorter.
+            if last_offset is not None:
+                return offset == last_offset
+            if chunk_size is not None and (offset % chunk_size or length > chunk_size):
+                return False
+            self.last_offset = offset
+            return True
+        if chunk_size is None:
+            if last_offset is not None and (
+                last_offset % length or len(self.buffer) - last_offset > length
+            ):
+                return False
+            chunk_size = self.chunk_size = length
+        return length == chunk_size and offset % chunk_size == 0
+
+
+class _ControllerFrames:
+    """
+    The frames of a controller being received and the newest complete one.
+    """
+
+    __slots__ = (
+        "pending",
+        "latest_sequence",
+        "latest_frame",
+        "epoch",
+        "late_chunks",
+        "restarted",
+    )
+
+    def __init__(self, epoch: int):
+        self.pending: Dict[int, _PendingFrame] = OrderedDict()
+        self.latest_sequence = None
+        self.latest_frame = None
+        self.epoch = epoch
+        # Chunks older than the latest frame received in a row.
+        self.late_chunks = 0
+        # Whether the next frame can be older than the latest one.
+        self.restarted = False
+
+
+class FrameReassembler:
+    """
+    Reassemble the frames of each controller from their chunks.
+
+    At most `max_pending` incomplete frames are kept for each controller, the
+    oldest ones being dropped first. Once a frame is complete, the older
+    incomplete frames are dropped and the chunks of older frames are ignored.
+    Frame buffers are reused once they are neither pending nor the latest
+    frame. Frames larger than `max_frame_size` bytes are ignored.
+
+    The frames of a controller start over when their sender's epoch changes
+    or after `max_late_chunks` late chunks in a row (see the module
+    docstring).
+    """
+
+    def __init__(
+        self,
+        max_pending: int = 4,
+        max_frame_size: int = 1 << 24,
+        max_late_chunks: int = DEFAULT_MAX_LATE_CHUNKS,
+    ):
+        self.max_pending = max_pending
+        self.max_frame_size = max_frame_size
+        self.max_late_chunks = max_late_chunks
+        self._controllers: Dict[int, _ControllerFrames] = {}
+        self._free_buffers: Dict[int, list] = {}
+        self.completed = 0
+        self.late = 0
+        self.incomplete = 0
+        self.invalid = 0
+        self.restarts = 0
+
+    def _get_buffer(self, size: int) -> bytearray:
+        buffers = self._free_buffers.get(size)
+        if buffers:
+            return buffers.pop()
+        return bytearray(size)
+
+    def _free_buffer(self, buffer: bytearray):
+        buffers = self._free_buffers.setdefault(len(buffer), [])
+        if len(buffers) < self.max_pending + 1:
+            buffers.append(buffer)
+
+    def feed(self, datagram: Buffer) -> Tuple[int, int, bytearray]:
+        """
+        Add a received datagram. Return the controller, the sequence number
+        and the frame it completed, or None. The returned frame is only valid
+        until the next frame of the controller is completed.
+        """
+        try:
+            (
+                version,
+                epoch,
+                controller,
+                sequence,
+                size,
+                offset,
+            ) = _CHUNK_HEADER.unpack_from(datagram)
+        except struct.error:
+            self.invalid += 1
+            return None
+        chunk = memoryview(datagram)[CHUNK_HEADER_SIZE:]
+        if (
+            version != UDP_VERSION
+            or size > self.max_frame_size
+            or offset + len(chunk) > size
+            or (not chunk and size)
+        ):
+            self.invalid += 1
+            return None
+
+        frames = self._controllers.get(controller)
+        if frames is None:
+            frames = self._controllers[controller] = _ControllerFrames(epoch)
+        elif epoch != frames.epoch:
+            self._restart(frames)
+            frames.epoch = epoch
+        if (
+            frames.latest_sequence is not None
+            and not frames.restarted
+            and not is_newer_sequence(sequence, frames.latest_sequence)
+        ):
+            frames.late_chunks += 1
+            if frames.late_chunks < self.max_late_chunks:
+                self.late += 1
+                return None
+            self._restart(frames)
+        frames.late_chunks = 0
+
+        pending = frames.pending.get(sequence)
+        if pending is None:
+            if len(frames.pending) >= self.max_pending:
+                _, dropped = frames.pending.popitem(last=False)
+                self._free_buffer(dropped.buffer)
+                self.incomplete += 1
+            pending = frames.pending[sequence] = _PendingFrame(self._get_buffer(size))
+        elif len(pending.buffer) != size:
+            self.invalid += 1
+            return None
+
+        if offset in pending.offsets:
+            return None
+        if not pending.is_valid_chunk(offset, len(chunk)):
+            self.invalid += 1
+            return None
+        pending.offsets.add(offset)
+        pending.buffer[offset : offset + len(chunk)] = chunk
+        pending.received += len(chunk)
+        if pending.received < size:
+            return None
+
+        # The frame is complete, older frames won't be displayed anymore.
+        del frames.pending[sequence]
+        for older_sequence in [
+            other for other in frames.pending if not is_newer_sequence(other, sequence)
+        ]:
+            self._free_buffer(frames.pending.pop(older_sequence).buffer)
+            self.incomplete += 1
+        if frames.latest_frame is not None:
+            self._free_buffer(frames.latest_frame)
+        frames.latest_sequence = sequence
+        frames.latest_frame = pending.buffer
+        frames.restarted = False
+        self.completed += 1
+        return controller, sequence, pending.buffer
+
+    def _restart(self, frames: _ControllerFrames):
+        """
+        Forget the pending frames of a controller and accept its next frames
+        whatever their sequence number. Its latest frame stays valid until
+        the next one is complete.
+        """
+        for pending in frames.pending.values():
+            self._free_buffer(pending.buffer)
+        frames.pending.clear()
+        frames.late_chunks = 0
+        frames.restarted = True
+        self.restarts += 1
+
+    def get_latest_frame(self, controller: int) -> Tuple[int, bytearray]:
+        """
+        Return the sequence number and the newest complete frame of a
+        controller, or None.
+        """
+        frames = self._controllers.get(controller)
+        if frames is None or frames.latest_frame is None:
+            return None
+        return frames.latest_sequence, frames.latest_frame
+
+    def get_stats(self) -> ReassemblerStats:
+        """
+        Return the statistics of the reassembler.
+        """
+        return ReassemblerStats(
+            self.completed, self.late, self.incomplete, self.invalid, self.restarts
+        )
+
+
+class UdpFrameReceiver(asyncio.DatagramProtocol):
+    """
+    Receive LED frames over UDP and pass every newest complete frame to
+    `on_frame(controller, sequence, frame)`.
+    """
+
+    def __init__(
+        self,
+        on_frame: Callable[[int, int, bytearray], None] = None,
+        max_pending: int = 4,
+    ):
+        self.on_frame = on_frame
+        self.reassembler = FrameReassembler(max_pending)
+        self.transport = None
+
+    def connection_made(self, transport: asyncio.DatagramTransport):
+        self.transport = transport
+
+    def datagram_received(self, data: bytes, addr: Address):
+        frame = self.reassembler.feed(data)
+        if frame is not None and self.on_frame is not None:
+            self.on_frame(*frame)
+
+    def error_received(self, exc: Exception):
+        wlbb_logger.debug("LED frame receiver error : %s." % exc)
+
+    def get_latest_frame(self, controller: int) -> Tuple[int, bytearray]:
+        """
+        Return the sequence number and the newest complete frame of a
+        controller, or None.
+        """
+        return self.reassembler.get_latest_frame(controller)
+
+    def close(self):
+        """
+        Close the transport.
+        """
+        if self.transport is not None:
+            self.transport.close()
+
+
+def create_multicast_sender(
+    ttl: int = 1, interface: str = "0.0.0.0", loopback: bool = True
+) -> socket.socket:
+    """
+    Return a UDP socket sending multicast datagrams through `interface`, which
+    can be given to a UdpFrameSender.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+    sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, int(loopback))
+    sock.setsockopt(
+        socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface)
+    )
+    return sock
+
+
+def create_multicast_receiver(
+    group: str, port: int, interface: str = "0.0.0.0"
+) -> socket.socket:
+    """
+    Return a non-blocking UDP socket bound to `port` and member of the
+    multicast `group`, which can be given to `loop.create_datagram_endpoint`.
+    """
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if hasattr(socket, "SO_REUSEPORT"):
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind(("", port))
+    sock.setsockopt(
+        socket.IPPROTO_IP,
+        socket.IP_ADD_MEMBERSHIP,
+        socket.inet_aton(group) + socket.inet_aton(interface),
+    )
+    sock.setblocking(False)
+    return sock
+
+
+async def open_udp_frames(
+    client, on_frame: Callable[[int, int, bytearray], None], max_pending: int = 4
+) -> Optional[UdpFrameReceiver]:
+    """
+    Ask the server connected to `client` to send its LED frames through UDP
+    and return the receiver passing them to `on_frame`, or None if the server
+    doesn't send frames through UDP, in which case they go through the
+    connection.
+
+    The receiver joins the multicast group of the server, if any, otherwise
+    it listens on the address of the connection and the server sends the
+    frames there.
+    """
+    try:
+        group = await client.command(UDP_FRAMES_COMMAND)
+    except CommandError as err:
+        wlbb_logger.debug("No UDP LED frames : %s." % err)
+        return None
+    loop = asyncio.get_event_loop()
+    receiver = UdpFrameReceiver(on_frame, max_pending)
+    try:
+        if group:
+            host, port = group.decode("ascii").rsplit(":", 1)
+            await loop.create_datagram_endpoint(
+                lambda: receiver, sock=create_multicast_receiver(host, int(port))
+            )
+        else:
+            local_host = client.transport.get_extra_info("sockname")[0]
+            await loop.create_datagram_endpoint(
+                lambda: receiver, local_addr=(local_host, 0)
+            )
+    except OSError as err:
+        wlbb_logger.warning("Can't receive the UDP LED frames : %s." % err)
+        return None
+    port = receiver.transport.get_extra_info("sockname")[1]
+    try:
+        await client.command(UDP_FRAMES_OPENED_COMMAND, b"%d" % port)
+    except BaseException:
+        receiver.close()
+        raise
+    return receiver
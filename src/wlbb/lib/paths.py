@@ -7,6 +7,7 @@ Some useful paths and utils to create file and directories.
 
 import os
 import sys
+import tempfile
 
 
 def create_dir(path):
@@ -23,6 +24,30 @@ def delete_file(path):
         os.remove(path)
 
 
+def write_file_atomic(path, content):
+    """
+    Write `content` (str or bytes) in the file at `path` through a temporary
+    file renamed over it, so the file is never left partially written.
+    """
+    directory, file_name = os.path.split(os.fspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix="." + file_name + ".", suffix=".tmp", dir=directory or None
+    )
+    try:
+        with os.fdopen(fd, "wb" if isinstance(content, bytes) else "w") as tmp_file:
+            tmp_file.write(content)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        try:
+            os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+        except FileNotFoundError:
+            pass
+        os.replace(tmp_path, path)
+    except BaseException:
+        delete_file(tmp_path)
+        raise
+
+
 # def _xdg_get_config_path():
 #    """
 #    Return the base directory relative for user-specific configuration.
@@ -85,3 +110,17 @@ def get_log_dir():
     Return the path of the directory which should contain the logs.
     """
     return os.path.join(get_data_path(), "logs")
+
+
+def get_cache_dir():
+    """
+    Return the path of the directory which should contain the caches.
+    """
+    return os.path.join(get_data_path(), "cache")
+
+
+def get_profile_dir():
+    """
+    Return the path of the directory which should contain the LED profiles.
+    """
+    return os.path.join(get_data_path(), "profiles")
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the LED profile: the id, 3D position, position confidence, controller
+and channel of every LED of an installation.
+
+Profiles are stored in the profile directory in a columnar file mapped in
+memory, so opening one doesn't depend on its LED count and every process
+opening it shares the same pages. File layout (little endian), columns being
+aligned on 64 bytes:
+    magic (8 bytes), format version (u32), LED count (u32), generation (u64)
+    LED ids (u32 per LED)
+    positions (3 f32 per LED: x, y, z)
+    confidences (f32 per LED)
+    controllers (u16 per LED)
+    channels (u16 per LED)
+The generation is incremented by every update, so processes sharing a profile
+can tell when it changed.
+
+Columns are exposed as memoryviews of the mapping, which can be wrapped
+without copy by `numpy.frombuffer`. Positions of unknown LEDs are NaN.
+"""
+
+import os
+import sys
+import mmap
+import array
+import struct
+import itertools
+from typing import Dict, Iterable, NamedTuple, Tuple
+
+from wlbb.lib.paths import get_profile_dir, write_file_atomic
+
+__all__ = (
+    "Profile",
+    "ProfileLed",
+    "create_profile",
+    "get_profile_path",
+    "PROFILE_FORMAT_VERSION",
+)
+
+PROFILE_MAGIC = b"WLBBPRF1"
+PROFILE_FORMAT_VERSION = 1
+PROFILE_EXTENSION = ".profile"
+_HEADER = struct.Struct("<8sIIQ")
+_GENERATION_OFFSET = 16
+_GENERATION = struct.Struct("<Q")
+_ALIGNMENT = 64
+
+# Name, item format and items per LED of every column, in file order.
+_COLUMNS = (
+    ("led_ids", "I", 1),
+    ("xyz", "f", 3),
+    ("confidence", "f", 1),
+    ("controllers", "H", 1),
+    ("channels", "H", 1),
+)
+_DEFAULT_VALUES = {
+    "xyz": float("nan"),
+    "confidence": 0.0,
+    "controllers": 0,
+    "channels": 0,
+}
+
+
+def _align(offset: int) -> int:
+    return -(-offset // _ALIGNMENT) * _ALIGNMENT
+
+
+def _get_layout(led_count: int) -> Tuple[Dict[str, Tuple[int, int]], int]:
+    """
+    Return the offset and size of every column and the size of the file.
+    """
+    layout = {}
+    offset = _align(_HEADER.size)
+    for name, item_format, per_led in _COLUMNS:
+        size = led_count * per_led * struct.calcsize(item_format)
+        layout[name] = (offset, size)
+        offset = _align(offset + size)
+    return layout, offset
+
+
+def _check_byteorder():
+    if sys.byteorder != "little":
+        raise NotImplementedError("Profiles require a little endian machine.")
+
+
+def _to_bytes(item_format: str, per_led: int, values: Iterable) -> memoryview:
+    """
+    Return the bytes of `values` stored with `item_format`. LED positions are
+    given as (x, y, z) triplets.
+    """
+    try:
+        view = memoryview(values)
+    except TypeError:
+        pass
+    else:
+        # Arrays of the right type, like float32 NumPy arrays, aren't copied.
+        if view.format.lstrip("<=@") == item_format and view.c_contiguous:
+            return view.cast("B")
+    if per_led > 1:
+        values = itertools.chain.from_iterable(values)
+    return memoryview(array.array(item_format, values)).cast("B")
+
+
+def get_profile_path(profile_name: str) -> str:
+    """
+    Return the path of the profile `profile_name` in the profile directory.
+    """
+    return os.path.join(get_profile_dir(), profile_name + PROFILE_EXTENSION)
+
+
+def create_profile(
+    path: str,
+    led_ids: Iterable[int],
+    xyz: Iterable[Tuple[float, float, float]] = None,
+    confidence: Iterable[float] = None,
+    controllers: Iterable[int] = None,
+    channels: Iterable[int] = None,
+) -> "Profile":
+    """
+    Write a new profile at `path`, replacing any existing one atomically, and
+    return it opened for writing. Missing columns take their default values.
+    """
+    _check_byteorder()
+    led_ids = _to_bytes("I", 1, led_ids)
+    led_count = len(led_ids) // 4
+    layout, size = _get_layout(led_count)
+    content = bytearray(size)
+    _HEADER.pack_into(content, 0, PROFILE_MAGIC, PROFILE_FORMAT_VERSION, led_count, 0)
+    columns = {"led_ids": led_ids, "xyz": xyz, "confidence": confidence}
+    columns.update(controllers=controllers, channels=channels)
+    # The LED ids, which give the LED count, are already converted.
+    for name, item_format, per_led in _COLUMNS[1:]:
+        values = columns[name]
+        if values is None:
+            values = itertools.repeat(_DEFAULT_VALUES[name], led_count * per_led)
+            per_led = 1
+        columns[name] = _to_bytes(item_format, per_led, values)
+    for name, raw in columns.items():
+        offset, column_size = layout[name]
+        if len(raw) != column_size:
+            raise ValueError(
+                "Column %a doesn't have one value per LED (%d LEDs)."
+                % (name, led_count)
+            )
+        content[offset : offset + column_size] = raw
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    write_file_atomic(path, bytes(content))
+    return Profile(path, writable=True)
+
+
+class ProfileLed(NamedTuple):
+    """
+    The data of one LED of a profile.
+    """
+
+    led_id: int
+    x: float
+    y: float
+    z: float
+    confidence: float
+    controller: int
+    channel: int
+
+
+class Profile:
+    """
+    A LED profile mapped from the file at `path`, or an empty profile if
+    `path` is None.
+
+    Updates of a profile opened with `writable` are written in place in the
+    shared mapping. The memoryviews returned by the getters must be released
+    before closing the profile.
+    """
+
+    def __init__(self, path: str = None, writable: bool = False):
+        self.path = path
+        self.writable = writable
+        self.led_count = 0
+        self._map = None
+        self._file_id = None
+        self._index = None
+        if path is None:
+            self._columns = {
+                name: memoryview(b"").cast(item_format)
+                for name, item_format, _ in _COLUMNS
+            }
+        else:
+            self._open()
+
+    def _open(self):
+        _check_byteorder()
+        with open(self.path, "r+b" if self.writable else "rb") as profile_file:
+            stat = os.fstat(profile_file.fileno())
+            if stat.st_size < _HEADER.size:
+                raise ValueError("%a isn't a profile." % self.path)
+            access = mmap.ACCESS_WRITE if self.writable else mmap.ACCESS_READ
+            self._map = mmap.mmap(profile_file.fileno(), 0, access=access)
+        self._file_id = (stat.st_dev, stat.st_ino)
+
+        magic, version, led_count, _ = _HEADER.unpack_from(self._map)
+        layout, size = _get_layout(led_count)
+        error = None
+        if magic != PROFILE_MAGIC:
+            error = "%a isn't a profile." % self.path
+        elif version != PROFILE_FORMAT_VERSION:
+            error = "Unsupported profile format version : %d." % version
+        elif len(self._map) < size:
+            error = "Profile %a is truncated." % self.path
+        if error is not None:
+            self._map.close()
+            self._map = None
+            raise ValueError(error)
+
+        self.led_count = led_count
+        buffer = memoryview(self._map)
+        self._columns = {}
+        for name, item_format, _ in _COLUMNS:
+            offset, column_size = layout[name]
+            self._columns[name] = buffer[offset : offset + column_size].cast(
+                item_format
+            )
+        buffer.release()
+
+    def __len__(self) -> int:
+        return self.led_count
+
+    def _check_range(self, start: int, count: int):
+        if start < 0 or start + count > self.led_count:
+            raise IndexError(
+                "LEDs %d to %d are out of the profile (%d LEDs)."
+                % (start, start + count - 1, self.led_count)
+            )
+
+    def update(
+        self,
+        start: int,
+        xyz: Iterable[Tuple[float, float, float]] = None,
+        confidence: Iterable[float] = None,
+        controllers: Iterable[int] = None,
+        channels: Iterable[int] = None,
+    ):
+        """
+        Overwrite in place the given columns of the consecutive LEDs starting
+        at the LED index `start`, then increment the generation. Nothing is
+        written if the values of any column are invalid.
+        """
+        if not self.writable:
+            raise ValueError("Profile %a is opened read-only." % self.path)
+        updates = {"xyz": xyz, "confidence": confidence}
+        updates.update(controllers=controllers, channels=channels)
+        checked_updates = []
+        for name, item_format, per_led in _COLUMNS:
+            values = updates.get(name)
+            if values is None:
+                continue
+            raw = _to_bytes(item_format, per_led, values)
+            item_size = struct.calcsize(item_format) * per_led
+            if len(raw) % item_size:
+                raise ValueError("Incomplete values for column %a." % name)
+            count = len(raw) // item_size
+            self._check_range(start, count)
+            checked_updates.append((name, raw, item_size, count))
+        for name, raw, item_size, count in checked_updates:
+            column = self._columns[name].cast("B")
+            column[start * item_size : (start + count) * item_size] = raw
+            column.release()
+        _GENERATION.pack_into(self._map, _GENERATION_OFFSET, self.get_generation() + 1)
+
+    def set_led(
+        self,
+        index: int,
+        xyz: Tuple[float, float, float] = None,
+        confidence: float = None,
+        controller: int = None,
+        channel: int = None,
+    ):
+        """
+        Overwrite in place the given data of the LED at `index`.
+        """
+        self.update(
+            index,
+            None if xyz is None else (xyz,),
+            None if confidence is None else (confidence,),
+            None if controller is None else (controller,),
+            None if channel is None else (channel,),
+        )
+
+    def flush(self):
+        """
+        Write the updates to the disk.
+        """
+        if self._map is not None:
+            self._map.flush()
+
+    def is_replaced(self) -> bool:
+        """
+        Return True if the profile's file was replaced or deleted since it was
+        opened.
+        """
+        if self.path is None:
+            return False
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_dev, stat.st_ino) != self._file_id
+
+    def close(self):
+        """
+        Unmap the profile.
+        """
+        for column in self._columns.values():
+            column.release()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+
+    # Getters
+    def get_generation(self) -> int:
+        """
+        Return the number of updates of the profile since it was created.
+        """
+        if self._map is None:
+            return 0
+        return _GENERATION.unpack_from(self._map, _GENERATION_OFFSET)[0]
+
+    def get_led_ids(self) -> memoryview:
+        """
+        Return the ids of the LEDs.
+        """
+        return self._columns["led_ids"]
+
+    def get_xyz(self) -> memoryview:
+        """
+        Return the positions of the LEDs, as x, y, z for every LED in a row.
+        """
+        return self._columns["xyz"]
+
+    def get_confidence(self) -> memoryview:
+        """
+        Return the confidence of the positions of the LEDs.
+        """
+        return self._columns["confidence"]
+
+    def get_controllers(self) -> memoryview:
+        """
+        Return the controller of every LED.
+        """
+        return self._columns["controllers"]
+
+    def get_channels(self) -> memoryview:
+        """
+        Return the channel of every LED on its controller.
+        """
+        return self._columns["channels"]
+
+    def get_index(self, led_id: int) -> int:
+        """
+        Return the index of the LED `led_id`. Raise a KeyError if there isn't
+        such LED. The index is built on the first call.
+        """
+        if self._index is None:
+            self._index = {
+                other_id: index for index, other_id in enumerate(self.get_led_ids())
+            }
+        return self._index[led_id]
+
+    def get_position(self, index: int) -> Tuple[float, float, float]:
+        """
+        Return the position of the LED at `index`.
+        """
+        self._check_range(index, 1)
+        return tuple(self._columns["xyz"][3 * index : 3 * index + 3].tolist())
+
+    def get_led(self, index: int) -> ProfileLed:
+        """
+        Return the data of the LED at `index`.
+        """
+        columns = self._columns
+        return ProfileLed(
+            columns["led_ids"][index],
+            *self.get_position(index),
+            columns["confidence"][index],
+            columns["controllers"][index],
+            columns["channels"][index],
+        )
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the scheduler pacing the animation frames of the server.
+
+Ticks are due at fixed deadlines `start + frame_number * period` on the
+monotonic clock of the event loop, rather than after sleeping one period, so
+the time spent rendering doesn't make the animation drift. When a tick ends
+after one or more following deadlines, the frames of these deadlines are
+skipped and the next tick keeps the frame number of its deadline, so
+animations computed from frame numbers stay on time.
+"""
+
+import math
+import asyncio
+import inspect
+from typing import Awaitable, Callable, NamedTuple, Union
+
+from wlbb.lib.logger import wlbb_logger
+
+__all__ = ("TickScheduler", "TickStats")
+
+TickCallback = Callable[[int, float], Union[None, Awaitable[None]]]
+
+
+class TickStats(NamedTuple):
+    """
+    Statistics of a TickScheduler, times being in seconds.
+
+    The jitter of a tick is the delay between its deadline and the moment it
+    started. A tick overruns when it ends after the deadline of the next
+    frame, whose frame is then skipped.
+    """
+
+    ticks: int
+    skipped: int
+    overruns: int
+    last_jitter: float
+    mean_jitter: float
+    max_jitter: float
+    last_duration: float
+    max_duration: float
+
+
+class TickScheduler:
+    """
+    Call `on_tick(frame_number, deadline)` `rate` times per second in the
+    running event loop. `on_tick` may return an awaitable, which is awaited
+    before the next tick.
+    """
+
+    def __init__(self, rate: float, on_tick: TickCallback):
+        if rate <= 0:
+            raise ValueError("Invalid tick rate : %r." % rate)
+        self.rate = rate
+        self.period = 1 / rate
+        self.on_tick = on_tick
+        self._stopping = False
+        self._running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Reset the statistics.
+        """
+        self.ticks = 0
+        self.skipped = 0
+        self.overruns = 0
+        self.last_jitter = 0.0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+        self.last_duration = 0.0
+        self.max_duration = 0.0
+
+    async def run(self):
+        """
+        Tick until `stop` is called.
+        """
+        loop = asyncio.get_event_loop()
+        period = self.period
+        start = loop.time()
+        frame_number = 0
+        self._stopping = False
+        self._running = True
+        try:
+            while not self._stopping:
+                deadline = start + frame_number * period
+                delay = deadline - loop.time()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    if self._stopping:
+                        break
+                tick_start = loop.time()
+                try:
+                    result = self.on_tick(frame_number, deadline)
+                    if inspect.isawaitable(result):
+                        await result
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    wlbb_logger.exception("Tick %d failed." % frame_number)
+                tick_end = loop.time()
+                self._record(deadline, tick_start, tick_end)
+
+                # The frames whose deadline passed during the tick are skipped.
+                next_frame_number = frame_number + 1
+                late_frame_number = math.floor((tick_end - start) / period) + 1
+                if late_frame_number > next_frame_number:
+                    self.overruns += 1
+                    self.skipped += late_frame_number - next_frame_number
+                    next_frame_number = late_frame_number
+                frame_number = next_frame_number
+        finally:
+            self._running = False
+
+    def _record(self, deadline: float, tick_start: float, tick_end: float):
+        jitter = max(tick_start - deadline, 0.0)
+        duration = tick_end - tick_start
+        self.ticks += 1
+        self.last_jitter = jitter
+        self.total_jitter += jitter
+        if jitter > self.max_jitter:
+            self.max_jitter = jitter
+        self.last_duration = duration
+        if duration > self.max_duration:
+            self.max_duration = duration
+
+    def stop(self):
+        """
+        Stop ticking after the current tick. Must be called from the event
+        loop thread.
+        """
+        self._stopping = True
+
+    def is_running(self) -> bool:
+        """
+        Return True if the scheduler is ticking.
+        """
+        return self._running
+
+    def get_stats(self) -> TickStats:
+        """
+        Return the statistics of the scheduler.
+        """
+        return TickStats(
+            self.ticks,
+            self.skipped,
+            self.overruns,
+            self.last_jitter,
+            self.total_jitter / self.ticks if self.ticks else 0.0,
+            self.max_jitter,
+            self.last_duration,
+            self.max_duration,
+        )
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Shared memory segments used to exchange data between processes of the same
+machine.
+"""
+
+import os
+import mmap
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+__all__ = (
+    "shared_memory",
+    "assert_shared_memory_available",
+    "ReadOnlySegment",
+    "unlink_segment",
+)
+
+
+def assert_shared_memory_available(feature: str):
+    """
+    Raise a NotImplementedError if shared memory segments aren't available.
+    """
+    if shared_memory is None:
+        raise NotImplementedError(
+            "%s requires Python 3.8 or newer." % feature.capitalize()
+        )
+
+
+class ReadOnlySegment:
+    """
+    A shared memory segment mapped read-only.
+    """
+
+    def __init__(self, name: str):
+        try:
+            import _posixshmem
+        except ImportError:
+            # Windows: segments aren't tracked so SharedMemory can be used.
+            self._shm = shared_memory.SharedMemory(name=name)
+            self._map = None
+            self.buf = self._shm.buf.toreadonly()
+            return
+
+        # Mapping the segment ourselves avoids registering it in the resource
+        # tracker, which would unlink it when this process exits.
+        fd = _posixshmem.shm_open("/" + name, os.O_RDONLY, mode=0)
+        try:
+            self._map = mmap.mmap(
+                fd, os.fstat(fd).st_size, mmap.MAP_SHARED, mmap.PROT_READ
+            )
+        finally:
+            os.close(fd)
+        self._shm = None
+        self.buf = memoryview(self._map)
+
+    def close(self):
+        """
+        Unmap the segment.
+        """
+        self.buf.release()
+        if self._map is not None:
+            self._map.close()
+        else:
+            self._shm.close()
+
+
+def unlink_segment(name: str):
+    """
+    Unlink the shared memory segment `name` without registering it in the
+    resource tracker. Raise a FileExistsError on Windows, where a segment
+    exists only while a process has it open.
+    """
+    try:
+        import _posixshmem
+    except ImportError:
+        raise FileExistsError("Segment %a is open by another process." % name)
+    _posixshmem.shm_unlink("/" + name)
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+This subpackage allow WLBB processing agents to locate LEDs in camera frames.
+
+It requires NumPy (`pip install wlbb[vision]`).
+"""
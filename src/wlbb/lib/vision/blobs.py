@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the detection of lit LEDs in grayscale camera frames.
+
+A frame is compared to a dark frame captured with every LED off, the pixels
+brighter than the dark frame by more than a threshold are grouped in
+8-connected components and every component gives a candidate LED at its
+intensity-weighted centroid.
+
+Lit pixels are a tiny part of a frame, so only them are labeled: they are
+grouped in horizontal runs, runs touching a run of the next row are found
+with binary searches and merged by label propagation. Every step is a
+NumPy operation over all the lit pixels or runs at once.
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+
+__all__ = ("BlobDetector", "BlobRegions", "label_pixels")
+
+
+class BlobRegions(NamedTuple):
+    """
+    The (u, v, intensity) of the lit LEDs of a frame, the flat index of their
+    pixels and the LED of every pixel.
+    """
+
+    blobs: np.ndarray
+    pixels: np.ndarray
+    components: np.ndarray
+
+
+def _get_run_links(run_rows, run_starts, run_ends, width):
+    """
+    Return the pairs of runs of consecutive rows which touch, the first run
+    of each pair being the upper one.
+    """
+    # Keys of the runs in raster order, with a margin so the neighbors of the
+    # first and last columns stay in their row.
+    stride = width + 2
+    start_keys = run_rows * stride + run_starts
+    end_keys = run_rows * stride + run_ends
+    next_row_keys = (run_rows + 1) * stride
+    # The runs of the next row touching a run end after its start - 1 and
+    # start before its end + 1.
+    first = np.searchsorted(end_keys, next_row_keys + run_starts - 1, "left")
+    last = np.searchsorted(start_keys, next_row_keys + run_ends + 1, "right")
+    counts = np.maximum(last - first, 0)
+    upper = np.repeat(np.arange(len(run_rows)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    lower = np.repeat(first, counts) + offsets
+    return upper, lower
+
+
+def _merge_labels(labels, upper, lower):
+    """
+    Give every group of linked runs the smallest label of the group.
+    """
+    while True:
+        linked = np.minimum(labels[upper], labels[lower])
+        np.minimum.at(labels, upper, linked)
+        np.minimum.at(labels, lower, linked)
+        # Follow the labels to their root.
+        roots = labels[labels]
+        while not np.array_equal(roots, labels):
+            labels = roots
+            roots = labels[labels]
+        if np.array_equal(labels[upper], labels[lower]):
+            return labels
+
+
+def label_pixels(pixels: np.ndarray, width: int):
+    """
+    Group the pixels of a frame `width` pixels wide, given by their flat
+    index in increasing order, in 8-connected components. Return the number
+    of components and the component of every pixel, components being
+    numbered in the raster order of their first pixel.
+    """
+    if not len(pixels):
+        return 0, np.zeros(0, np.intp)
+    rows, cols = np.divmod(pixels, width)
+    breaks = np.flatnonzero((np.diff(pixels) != 1) | (np.diff(rows) != 0)) + 1
+    run_first = np.concatenate(([0], breaks))
+    run_last = np.concatenate((breaks, [len(pixels)])) - 1
+    upper, lower = _get_run_links(
+        rows[run_first], cols[run_first], cols[run_last], width
+    )
+
+    labels = np.arange(len(run_first))
+    if len(upper):
+        labels = _merge_labels(labels, upper, lower)
+    # Labels are the first run of their component, numbered in order.
+    is_root = labels == np.arange(len(labels))
+    components = (np.cumsum(is_root) - 1)[labels]
+    pixel_components = np.repeat(components, run_last - run_first + 1)
+    return int(is_root.sum()), pixel_components
+
+
+class BlobDetector:
+    """
+    Detect the lit LEDs of grayscale frames.
+
+    Pixels brighter than the dark frame by more than `threshold` are lit, and
+    components of less than `min_area` or more than `max_area` lit pixels are
+    ignored. Buffers are allocated for the first frame and reused as long as
+    frames keep the same shape and type.
+    """
+
+    def __init__(
+        self,
+        threshold: int = 40,
+        min_area: int = 1,
+        max_area: int = None,
+        dark_frame: np.ndarray = None,
+    ):
+        self.threshold = threshold
+        self.min_area = min_area
+        self.max_area = max_area
+        self.dark_frame = None
+        self._difference = None
+        self._mask = None
+        if dark_frame is not None:
+            self.set_dark_frame(dark_frame)
+
+    def set_dark_frame(self, dark_frame: np.ndarray):
+        """
+        Subtract `dark_frame`, captured with every LED off, from the frames.
+        If several dark frames are given along the first axis, their maximum
+        is used so their noise isn't detected.
+        """
+        dark_frame = np.asarray(dark_frame)
+        if dark_frame.ndim == 3:
+            dark_frame = dark_frame.max(axis=0)
+        self.dark_frame = np.ascontiguousarray(dark_frame)
+
+    def _get_buffers(self, frame: np.ndarray):
+        if self._mask is None or self._mask.shape != frame.shape:
+            self._mask = np.empty(frame.shape, bool)
+            self._difference = None
+        if self._difference is None or self._difference.dtype != frame.dtype:
+            self._difference = np.empty(frame.shape, frame.dtype)
+        return self._difference, self._mask
+
+    def subtract_dark_frame(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Return how much brighter than the dark frame every pixel of `frame`
+        is. The result is only valid until the next frame is processed.
+        """
+        if self.dark_frame is None:
+            return frame
+        if self.dark_frame.shape != frame.shape:
+            raise ValueError(
+                "Frame of shape %s doesn't match the dark frame of shape %s."
+                % (frame.shape, self.dark_frame.shape)
+            )
+        difference, _ = self._get_buffers(frame)
+        # Unsigned subtraction clamped at 0, without a wider temporary frame.
+        np.minimum(frame, self.dark_frame, out=difference)
+        np.subtract(frame, difference, out=difference)
+        return difference
+
+    def detect(self, frame: np.ndarray) -> np.ndarray:
+        """
+        Return the (u, v, intensity) of every lit LED of a grayscale frame as
+        a float32 array, u being the column and v the row of the centroid of
+        its pixels and intensity the sum of their brightness above the dark
+        frame.
+        """
+        return self._detect(frame, False).blobs
+
+    def detect_regions(self, frame: np.ndarray) -> BlobRegions:
+        """
+        Return the lit LEDs of a grayscale frame like `detect` and their
+        pixels, to measure the same LEDs in other frames.
+        """
+        return self._detect(frame, True)
+
+    def _detect(self, frame: np.ndarray, with_pixels: bool) -> BlobRegions:
+        frame = np.asarray(frame)
+        if frame.ndim != 2:
+            raise ValueError("Expected a grayscale frame, not %d axes." % frame.ndim)
+        difference = self.subtract_dark_frame(frame)
+        _, mask = self._get_buffers(frame)
+        np.greater(difference, self.threshold, out=mask)
+        pixels = np.flatnonzero(mask)
+        count, components = label_pixels(pixels, frame.shape[1])
+        if not count:
+            return BlobRegions(np.zeros((0, 3), np.float32), pixels, components)
+
+        rows, cols = np.divmod(pixels, frame.shape[1])
+        # Indexed by rows and columns so strided views of frames aren't copied.
+        weights = difference[rows, cols].astype(np.float64)
+        intensities = np.bincount(components, weights, count)
+        u = np.bincount(components, weights * cols, count) / intensities
+        v = np.bincount(components, weights * rows, count) / intensities
+        blobs = np.stack((u, v, intensities), axis=1).astype(np.float32)
+
+        if self.min_area > 1 or self.max_area is not None:
+            areas = np.bincount(components, minlength=count)
+            keep = areas >= self.min_area
+            if self.max_area is not None:
+                keep &= areas <= self.max_area
+            blobs = blobs[keep]
+            if with_pixels:
+                kept_pixels = keep[components]
+                pixels = pixels[kept_pixels]
+                components = (np.cumsum(keep) - 1)[components[kept_pixels]]
+        if not with_pixels:
+            return BlobRegions(blobs, None, None)
+        return BlobRegions(blobs, pixels, components)
@@ -0,0 +1,408 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the self-calibration of the cameras from the identified LEDs.
+
+The poses and intrinsics of the cameras and the LED positions are jointly
+refined by a bundle adjustment minimizing the reprojection errors of every
+observation. Every camera has 9 parameters: a rotation vector, a translation,
+a focal length in pixels and two radial distortion coefficients, its
+principal point being known (usually the center of its frames):
+    x, y = (R @ X + t)[:2] / (R @ X + t)[2]
+    u, v = f * (1 + k1 * r2 + k2 * r2 ** 2) * (x, y) + principal point
+with r2 = x ** 2 + y ** 2.
+
+An observation only depends on its camera and its LED, so the Jacobian is
+sparse and given to `scipy.optimize.least_squares` with its sparsity: the
+trust region steps are solved by LSMR, whose cost grows linearly with the
+number of observations instead of cubically with the number of parameters.
+
+Uncalibrated cameras are first roughly located by `initialize_cameras` from
+the observations alone: the relative pose of two cameras is given by their
+essential matrix, and every other camera is placed from the LEDs seen by the
+previous ones.
+
+It requires SciPy (`pip install wlbb[calibration]`).
+"""
+
+from typing import NamedTuple
+
+import numpy as np
+from scipy.optimize import least_squares
+from scipy.sparse import coo_matrix
+from scipy.spatial.transform import Rotation
+
+from wlbb.lib.vision.triangulation import triangulate
+
+__all__ = (
+    "Calibration",
+    "bundle_adjust",
+    "project_observations",
+    "get_projection_matrices",
+    "get_jacobian_sparsity",
+    "initialize_cameras",
+    "CAMERA_PARAMETER_COUNT",
+    "DEFAULT_FOCAL_RATIO",
+)
+
+CAMERA_PARAMETER_COUNT = 9
+# The focal length of a webcam with a horizontal field of view of about 64
+# degrees, relative to the width of its frames.
+DEFAULT_FOCAL_RATIO = 0.8
+
+
+class Calibration(NamedTuple):
+    """
+    The result of a bundle adjustment: the parameters of every camera, the
+    position of every LED (NaN for the LEDs observed by less than two
+    cameras), the RMS reprojection error in pixels, the number of evaluations
+    of the residuals and whether the solver converged.
+    """
+
+    cameras: np.ndarray
+    principal_points: np.ndarray
+    xyz: np.ndarray
+    rms_error: float
+    evaluation_count: int
+    success: bool
+
+
+def _rotate(points: np.ndarray, rotation_vectors: np.ndarray) -> np.ndarray:
+    """
+    Rotate every point by its rotation vector (Rodrigues' formula).
+    """
+    angles = np.linalg.norm(rotation_vectors, axis=1)[:, None]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        axes = np.where(angles > 0, rotation_vectors / angles, 0)
+    cos, sin = np.cos(angles), np.sin(angles)
+    dot = (points * axes).sum(axis=1)[:, None]
+    return cos * points + sin * np.cross(axes, points) + dot * (1 - cos) * axes
+
+
+def project_observations(
+    cameras: np.ndarray, principal_points: np.ndarray, xyz: np.ndarray
+) -> np.ndarray:
+    """
+    Return the (u, v) of the points `xyz` (M, 3) seen by the cameras of
+    parameters `cameras` (M, 9) and principal points `principal_points`
+    (M, 2), one camera per point.
+    """
+    points = _rotate(xyz, cameras[:, :3]) + cameras[:, 3:6]
+    normalized = points[:, :2] / points[:, 2, None]
+    r2 = (normalized**2).sum(axis=1)
+    distortion = 1 + r2 * (cameras[:, 7] + r2 * cameras[:, 8])
+    return (cameras[:, 6] * distortion)[:, None] * normalized + principal_points
+
+
+def get_projection_matrices(
+    cameras: np.ndarray, principal_points: np.ndarray
+) -> np.ndarray:
+    """
+    Return the projection matrix (C, 3, 4) of every camera, distortion being
+    ignored.
+    """
+    cameras = np.asarray(cameras, np.float64)
+    count = len(cameras)
+    intrinsics = np.zeros((count, 3, 3))
+    intrinsics[:, 0, 0] = intrinsics[:, 1, 1] = cameras[:, 6]
+    intrinsics[:, :2, 2] = principal_points
+    intrinsics[:, 2, 2] = 1
+    extrinsics = np.concatenate(
+        (Rotation.from_rotvec(cameras[:, :3]).as_matrix(), cameras[:, 3:6, None]),
+        axis=2,
+    )
+    return intrinsics @ extrinsics
+
+
+def get_jacobian_sparsity(
+    camera_indexes: np.ndarray,
+    point_indexes: np.ndarray,
+    camera_count: int,
+    point_count: int,
+):
+    """
+    Return the sparsity structure of the Jacobian of the residuals of the
+    observations of the points `point_indexes` by the cameras
+    `camera_indexes`: the (u, v) residuals of an observation only depend on
+    the 9 parameters of its camera and the 3 coordinates of its point.
+    """
+    observation_count = len(camera_indexes)
+    camera_parameter_count = camera_count * CAMERA_PARAMETER_COUNT
+    camera_columns = camera_indexes[:, None] * CAMERA_PARAMETER_COUNT + np.arange(
+        CAMERA_PARAMETER_COUNT
+    )
+    point_columns = camera_parameter_count + point_indexes[:, None] * 3 + np.arange(3)
+    columns = np.concatenate((camera_columns, point_columns), axis=1)
+    # The u and v residuals of an observation have the same columns.
+    columns = np.repeat(columns, 2, axis=0)
+    rows = np.repeat(np.arange(2 * observation_count), columns.shape[1])
+    return coo_matrix(
+        (np.ones(len(rows), np.int8), (rows, columns.ravel())),
+        shape=(2 * observation_count, camera_parameter_count + point_count * 3),
+    ).tocsr()
+
+
+def _estimate_essential_matrix(points1: np.ndarray, points2: np.ndarray):
+    """
+    Return the essential matrix E such that x2.T @ E @ x1 = 0 for the
+    normalized points `points1` and `points2` (M, 2) of two cameras (eight
+    point algorithm).
+    """
+    x1, y1 = points1.T
+    x2, y2 = points2.T
+    rows = np.stack(
+        (x2 * x1, x2 * y1, x2, y2 * x1, y2 * y1, y2, x1, y1, np.ones_like(x1)),
+        axis=1,
+    )
+    essential = np.linalg.svd(rows)[2][-1].reshape(3, 3)
+    # An essential matrix has two equal singular values and a null one.
+    u, _, vt = np.linalg.svd(essential)
+    return u @ np.diag((1.0, 1.0, 0.0)) @ vt
+
+
+def _decompose_essential_matrix(
+    essential: np.ndarray, points1: np.ndarray, points2: np.ndarray
+):
+    """
+    Return the rotation and unit translation of the second camera relative
+    to the first one of the essential matrix `essential`, out of the four
+    possible ones the one seeing the most points in front of both cameras.
+    """
+    u, _, vt = np.linalg.svd(essential)
+    if np.linalg.det(u) < 0:
+        u = -u
+    if np.linalg.det(vt) < 0:
+        vt = -vt
+    w = np.array(((0.0, -1.0, 0.0), (1.0, 0.0, 0.0), (0.0, 0.0, 1.0)))
+    observations = np.stack((points1, points2), axis=1)
+    mask = np.ones(observations.shape[:2], bool)
+    best_count, best_pose = -1, None
+    for rotation in (u @ w @ vt, u @ w.T @ vt):
+        for translation in (u[:, 2], -u[:, 2]):
+            extrinsics = np.concatenate((rotation, translation[:, None]), axis=1)
+            projections = np.stack((np.eye(3, 4), extrinsics))
+            xyz = triangulate(projections, observations, mask).xyz
+            in_front = (xyz[:, 2] > 0) & ((xyz @ rotation[2] + translation[2]) > 0)
+            if in_front.sum() > best_count:
+                best_count, best_pose = in_front.sum(), (rotation, translation)
+    return best_pose
+
+
+def _estimate_pose(xyz: np.ndarray, points: np.ndarray):
+    """
+    Return the rotation and translation of the camera seeing the points
+    `xyz` (M, 3) at the normalized points `points` (M, 2), from at least 6
+    points (direct linear transform).
+    """
+    # Centered and scaled points condition the linear system.
+    center = xyz.mean(axis=0)
+    scale = np.sqrt(3) / np.linalg.norm(xyz - center, axis=1).mean()
+    homogeneous = np.concatenate(
+        ((xyz - center) * scale, np.ones((len(xyz), 1))), axis=1
+    )
+    zeros = np.zeros_like(homogeneous)
+    rows = np.concatenate(
+        (
+            np.concatenate((homogeneous, zeros, -points[:, :1] * homogeneous), axis=1),
+            np.concatenate((zeros, homogeneous, -points[:, 1:] * homogeneous), axis=1),
+        )
+    )
+    projection = np.linalg.svd(rows)[2][-1].reshape(3, 4)
+    # Back to the coordinates of `xyz`.
+    projection = np.concatenate(
+        (
+            scale * projection[:, :3],
+            (projection[:, 3] - scale * projection[:, :3] @ center)[:, None],
+        ),
+        axis=1,
+    )
+    if np.linalg.det(projection[:, :3]) < 0:
+        projection = -projection
+    u, singular_values, vt = np.linalg.svd(projection[:, :3])
+    return u @ vt, projection[:, 3] / singular_values.mean()
+
+
+def initialize_cameras(
+    observations: np.ndarray,
+    mask: np.ndarray,
+    principal_points: np.ndarray,
+    focal: float = None,
+    max_evaluations: int = 50,
+):
+    """
+    Return initial parameters (C, 9) of the cameras of principal points
+    `principal_points` (C, 2) and initial LED positions (N, 3), NaN for the
+    LEDs not triangulated, from the observations (N, C, 2) where `mask`
+    (N, C) is True alone, to start `bundle_adjust` from.
+
+    The cameras are first assumed to have the focal length `focal` in
+    pixels, DEFAULT_FOCAL_RATIO times the width of their frames by default,
+    and no distortion. The relative pose of the two cameras sharing the most
+    LEDs is given by their essential matrix, which sets the scale of the
+    scene to a unit distance between them, and their LEDs are triangulated.
+    The pose of every other camera is then estimated from the LEDs already
+    triangulated (perspective-n-point), camera after camera, its own LEDs
+    being triangulated in turn. The cameras placed so far are bundle
+    adjusted, in up to `max_evaluations` evaluations, after each new one.
+    """
+    observations = np.asarray(observations, np.float64)
+    mask = np.asarray(mask, bool)
+    camera_count = mask.shape[1]
+    principal_points = np.broadcast_to(
+        np.asarray(principal_points, np.float64), (camera_count, 2)
+    )
+    cameras = np.zeros((camera_count, CAMERA_PARAMETER_COUNT))
+    if focal is None:
+        cameras[:, 6] = DEFAULT_FOCAL_RATIO * 2 * principal_points[:, 0]
+    else:
+        cameras[:, 6] = focal
+
+    shared_counts = mask.T.astype(np.int64) @ mask
+    np.fill_diagonal(shared_counts, 0)
+    first, second = np.unravel_index(np.argmax(shared_counts), shared_counts.shape)
+    if shared_counts[first, second] < 8:
+        raise ValueError("No two cameras share the 8 LEDs needed to calibrate.")
+    shared = mask[:, first] & mask[:, second]
+    normalized = (observations - principal_points) / cameras[:, 6, None]
+    rotation, translation = _decompose_essential_matrix(
+        _estimate_essential_matrix(
+            normalized[shared, first], normalized[shared, second]
+        ),
+        normalized[shared, first],
+        normalized[shared, second],
+    )
+    cameras[second, :3] = Rotation.from_matrix(rotation).as_rotvec()
+    cameras[second, 3:6] = translation
+    initialized = np.zeros(camera_count, bool)
+    initialized[[first, second]] = True
+
+    while True:
+        xyz = triangulate(
+            get_projection_matrices(cameras, principal_points),
+            observations,
+            mask & initialized,
+        ).xyz
+        known = mask & ~np.isnan(xyz).any(axis=1)[:, None]
+        counts = np.where(initialized, -1, known.sum(axis=0))
+        camera = int(np.argmax(counts))
+        if counts[camera] < 6:
+            break
+        seen = known[:, camera]
+        points = observations[seen, camera] - principal_points[camera]
+        rotation, translation = _estimate_pose(xyz[seen], points / cameras[camera, 6])
+        cameras[camera, :3] = Rotation.from_matrix(rotation).as_rotvec()
+        cameras[camera, 3:6] = translation
+        initialized[camera] = True
+
+        # The cameras placed so far are refined, their focal lengths becoming
+        # the guess for the next ones, so errors don't pile up.
+        calibration = bundle_adjust(
+            observations[:, initialized],
+            mask[:, initialized],
+            cameras[initialized],
+            principal_points[initialized],
+            max_evaluations=max_evaluations,
+        )
+        cameras[initialized] = calibration.cameras
+        cameras[~initialized, 6] = np.median(calibration.cameras[:, 6])
+    if not initialized.all():
+        raise ValueError(
+            "The cameras %s don't see the 6 triangulated LEDs needed to calibrate."
+            % np.flatnonzero(~initialized).tolist()
+        )
+    return cameras, xyz
+
+
+def bundle_adjust(
+    observations: np.ndarray,
+    mask: np.ndarray,
+    cameras: np.ndarray,
+    principal_points: np.ndarray,
+    xyz: np.ndarray = None,
+    loss: str = "linear",
+    f_scale: float = 1.0,
+    max_evaluations: int = None,
+    tolerance: float = 1e-8,
+) -> Calibration:
+    """
+    Refine the parameters `cameras` (C, 9) of the cameras of principal
+    points `principal_points` (C, 2) and the LED positions `xyz` (N, 3) so
+    they explain the observations (N, C, 2) where `mask` (N, C) is True.
+
+    The cameras and LED positions of a previous calibration can be given to
+    warm start the adjustment. Missing or NaN LED positions are triangulated
+    from the given cameras. LEDs observed by less than two cameras aren't
+    adjusted. A robust `loss` of `least_squares`, with inliers residuals up to
+    `f_scale` pixels, limits the effect of misidentified LEDs.
+    """
+    observations = np.asarray(observations, np.float64)
+    mask = np.array(mask, bool)
+    cameras = np.array(cameras, np.float64)
+    camera_count = len(cameras)
+    principal_points = np.broadcast_to(
+        np.asarray(principal_points, np.float64), (camera_count, 2)
+    )
+    led_count = len(observations)
+    if xyz is None:
+        xyz = np.full((led_count, 3), np.nan)
+    xyz = np.array(xyz, np.float64)
+    unknown = np.isnan(xyz).any(axis=1)
+    if unknown.any():
+        projections = get_projection_matrices(cameras, principal_points)
+        triangulation = triangulate(projections, observations, mask)
+        xyz[unknown] = triangulation.xyz[unknown]
+
+    # Only the LEDs with a position and at least two observations are solved.
+    solved = (mask.sum(axis=1) >= 2) & ~np.isnan(xyz).any(axis=1)
+    mask &= solved[:, None]
+    solved_indexes = np.flatnonzero(solved)
+    point_count = len(solved_indexes)
+    point_indexes, camera_indexes = np.nonzero(mask[solved_indexes])
+    observed = observations[solved_indexes][point_indexes, camera_indexes]
+    observation_principal_points = principal_points[camera_indexes]
+    camera_parameter_count = camera_count * CAMERA_PARAMETER_COUNT
+
+    def get_residuals(parameters):
+        camera_parameters = parameters[:camera_parameter_count].reshape(
+            camera_count, CAMERA_PARAMETER_COUNT
+        )
+        points = parameters[camera_parameter_count:].reshape(point_count, 3)
+        projected = project_observations(
+            camera_parameters[camera_indexes],
+            observation_principal_points,
+            points[point_indexes],
+        )
+        return (projected - observed).ravel()
+
+    result = least_squares(
+        get_residuals,
+        np.concatenate((cameras.ravel(), xyz[solved_indexes].ravel())),
+        jac_sparsity=get_jacobian_sparsity(
+            camera_indexes, point_indexes, camera_count, point_count
+        ),
+        method="trf",
+        tr_solver="lsmr",
+        x_scale="jac",
+        loss=loss,
+        f_scale=f_scale,
+        max_nfev=max_evaluations,
+        ftol=tolerance,
+        xtol=tolerance,
+    )
+
+    adjusted_xyz = np.full((led_count, 3), np.nan)
+    adjusted_xyz[solved_indexes] = result.x[camera_parameter_count:].reshape(-1, 3)
+    rms_error = (
+        float(np.sqrt((result.fun**2).sum() / len(camera_indexes)))
+        if len(camera_indexes)
+        else 0.0
+    )
+    return Calibration(
+        result.x[:camera_parameter_count].reshape(camera_count, -1),
+        np.array(principal_points),
+        adjusted_xyz,
+        rms_error,
+        result.nfev,
+        result.success,
+    )
@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the capture of camera frames into a fixed pool of buffers.
+
+Every frame buffer of a FrameRing is allocated once, in a single array, and
+camera sources write their frames into them in place. A buffer goes from the
+free buffers to the captured frames, waiting to be processed, and back to the
+free buffers once released by the consumer. When the consumer is too slow
+and no buffer is free, the oldest captured frame is dropped and its buffer
+reused, so the consumer always gets the latest frames and capture never
+allocates. Capture only waits while the consumer holds every buffer.
+
+Camera sources are pluggable: a backend is registered by name with
+`register_backend` and built by `create_source`. The "synthetic" backend
+renders still LEDs with sensor noise, to run the pipeline without a camera.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Dict, Iterator, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from wlbb.lib.vision.blobs import BlobDetector
+
+__all__ = (
+    "CapturedFrame",
+    "Observation",
+    "FrameRing",
+    "CameraSource",
+    "SyntheticSource",
+    "register_backend",
+    "create_source",
+    "capture_frames",
+    "crop_frames",
+    "detect_frames",
+)
+
+Region = Tuple[int, int, int, int]
+
+
+class CapturedFrame(NamedTuple):
+    """
+    A frame of a FrameRing: the index of its buffer, its number in the
+    capture, its capture time (`time.monotonic`) and its image, a view of its
+    buffer only valid until it is released.
+    """
+
+    slot: int
+    number: int
+    timestamp: float
+    image: np.ndarray
+
+
+class Observation(NamedTuple):
+    """
+    The (u, v, intensity) of the LEDs detected in the frame `number`, in the
+    coordinates of the full frame (see BlobDetector.detect).
+    """
+
+    number: int
+    timestamp: float
+    blobs: np.ndarray
+
+
+class FrameRing:
+    """
+    A pool of `size` preallocated frame buffers of shape `shape` and type
+    `dtype`, filled by one capture thread and processed in order by a
+    consumer.
+    """
+
+    def __init__(self, shape: Tuple[int, ...], dtype=np.uint8, size: int = 4):
+        if size < 2:
+            raise ValueError("A frame ring needs at least 2 buffers, not %d." % size)
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.size = size
+        self.buffers = np.zeros((size,) + self.shape, self.dtype)
+        self.captured = 0
+        self.dropped = 0
+        self._free = deque(range(size))
+        self._ready = deque()
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def acquire(self, timeout: float = None) -> Optional[Tuple[int, np.ndarray]]:
+        """
+        Return a buffer to capture a frame into and its index, taking the
+        buffer of the oldest captured frame if none is free. When the
+        consumer holds every buffer, wait up to `timeout` seconds for it to
+        release one. Return None on timeout or once the ring is closed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._free or self._ready or self._closed, timeout
+            ):
+                return None
+            if self._closed:
+                return None
+            if self._free:
+                slot = self._free.popleft()
+            else:
+                slot = self._ready.popleft().slot
+                self.dropped += 1
+        return slot, self.buffers[slot]
+
+    def publish(self, slot: int, number: int, timestamp: float):
+        """
+        Queue the frame captured in the buffer `slot` for the consumer.
+        """
+        with self._condition:
+            self._ready.append(
+                CapturedFrame(slot, number, timestamp, self.buffers[slot])
+            )
+            self.captured += 1
+            self._condition.notify()
+
+    def discard(self, slot: int):
+        """
+        Give back a buffer acquired without capturing a frame into it.
+        """
+        with self._condition:
+            self._free.append(slot)
+            self._condition.notify_all()
+
+    def get(self, timeout: float = None) -> Optional[CapturedFrame]:
+        """
+        Return the oldest captured frame, waiting up to `timeout` seconds for
+        one. Return None on timeout or once the ring is closed and empty.
+        """
+        with self._condition:
+            if not self._condition.wait_for(
+                lambda: self._ready or self._closed, timeout
+            ):
+                return None
+            if not self._ready:
+                return None
+            return self._ready.popleft()
+
+    def release(self, frame: CapturedFrame):
+        """
+        Give back the buffer of a processed frame.
+        """
+        with self._condition:
+            self._free.append(frame.slot)
+            self._condition.notify_all()
+
+    def close(self):
+        """
+        Wake up the consumer once the captured frames are processed, and the
+        capture waiting for a buffer.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def is_closed(self) -> bool:
+        """
+        Return whether the ring was closed.
+        """
+        return self._closed
+
+    def __len__(self) -> int:
+        return len(self._ready)
+
+
+class CameraSource(ABC):
+    """
+    Abstract definition of a camera backend writing its frames of shape
+    `shape` and type `dtype` into given buffers.
+    """
+
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+
+    def open(self):
+        """
+        Start the camera.
+        """
+
+    def close(self):
+        """
+        Stop the camera.
+        """
+
+    @abstractmethod
+    def read_into(self, buffer: np.ndarray) -> bool:
+        """
+        Write the next frame into `buffer`, waiting for it. Return False at
+        the end of the stream.
+        """
+
+
+class SyntheticSource(CameraSource):
+    """
+    A camera of `width` x `height` grayscale frames seeing still LEDs at the
+    (u, v) of `positions`, at `frame_rate` frames per second (as fast as
+    possible if None) and for `frame_count` frames (forever if None).
+
+    `variant_count` frames with different sensor noise are rendered once, so
+    reading a frame is a copy.
+    """
+
+    def __init__(
+        self,
+        width: int = 640,
+        height: int = 480,
+        positions=(),
+        brightness: float = 200.0,
+        noise: float = 2.0,
+        frame_rate: float = None,
+        frame_count: int = None,
+        variant_count: int = 4,
+        seed: int = 0,
+    ):
+        self.shape = (height, width)
+        self.dtype = np.dtype(np.uint8)
+        self.positions = np.array(positions, np.float64).reshape(-1, 2)
+        self.frame_rate = frame_rate
+        self.frame_count = frame_count
+        self.read_frames = 0
+        self._next_time = None
+
+        rows, cols = np.mgrid[-4:5, -4:5]
+        light = np.zeros((height + 8, width + 8))
+        for u, v in self.positions:
+            r, c = int(round(v)), int(round(u))
+            spot = np.exp(-((cols + c - u) ** 2 + (rows + r - v) ** 2) / 3)
+            light[r : r + 9, c : c + 9] += brightness * spot
+        light = light[4:-4, 4:-4]
+        rng = np.random.default_rng(seed)
+        self._variants = [
+            np.clip(10 + light + rng.normal(0, noise, self.shape), 0, 255).astype(
+                np.uint8
+            )
+            for _ in range(variant_count)
+        ]
+
+    def open(self):
+        self._next_time = None
+
+    def read_into(self, buffer: np.ndarray) -> bool:
+        if self.frame_count is not None and self.read_frames >= self.frame_count:
+            return False
+        if self.frame_rate:
+            now = time.monotonic()
+            if self._next_time is None:
+                self._next_time = now
+            elif self._next_time > now:
+                time.sleep(self._next_time - now)
+            self._next_time += 1 / self.frame_rate
+        np.copyto(buffer, self._variants[self.read_frames % len(self._variants)])
+        self.read_frames += 1
+        return True
+
+
+_backends: Dict[str, Callable[..., CameraSource]] = {"synthetic": SyntheticSource}
+
+
+def register_backend(name: str, factory: Callable[..., CameraSource]):
+    """
+    Make `create_source(name, ...)` return `factory(...)`.
+    """
+    _backends[name] = factory
+
+
+def create_source(backend: str = "synthetic", **options) -> CameraSource:
+    """
+    Return a camera source of the backend `backend` built with `options`.
+    """
+    try:
+        factory = _backends[backend]
+    except KeyError:
+        raise ValueError("Unknown camera backend : %a." % backend) from None
+    return factory(**options)
+
+
+def capture_frames(
+    source: CameraSource, ring: FrameRing, stop_event: threading.Event = None
+):
+    """
+    Capture the frames of `source` into `ring` until the end of the stream,
+    until `stop_event` is set or until the ring is closed, then close the
+    ring.
+    """
+    number = 0
+    try:
+        while stop_event is None or not stop_event.is_set():
+            acquired = ring.acquire()
+            if acquired is None:
+                break
+            slot, buffer = acquired
+            if not source.read_into(buffer):
+                ring.discard(slot)
+                break
+            ring.publish(slot, number, time.monotonic())
+            number += 1
+    finally:
+        ring.close()
+
+
+def crop_frames(
+    frames: Iterator[CapturedFrame], region: Region = None, step: int = 1
+) -> Iterator[Tuple[CapturedFrame, np.ndarray]]:
+    """
+    Yield every frame with the view of its image in `region` (left, top,
+    right, bottom), taking one pixel out of `step` along both axes. No pixel
+    is copied.
+    """
+    left, top, right, bottom = region or (0, 0, None, None)
+    for frame in frames:
+        yield frame, frame.image[top:bottom:step, left:right:step]
+
+
+def detect_frames(
+    crops: Iterator[Tuple[CapturedFrame, np.ndarray]],
+    detector: BlobDetector,
+    region: Region = None,
+    step: int = 1,
+) -> Iterator[Observation]:
+    """
+    Yield the LEDs detected by `detector` in the cropped frames of
+    `crop_frames(frames, region, step)`.
+    """
+    left, top = (region or (0, 0))[:2]
+    for frame, image in crops:
+        blobs = detector.detect(image)
+        if step != 1:
+            blobs[:, :2] *= step
+        blobs[:, 0] += left
+        blobs[:, 1] += top
+        yield Observation(frame.number, frame.timestamp, blobs)
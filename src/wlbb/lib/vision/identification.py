@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the identification of LEDs by structured light.
+
+Instead of lighting the LEDs one at a time, every LED blinks the bits of a
+code word made of the Gray code of its index followed by check bits, each bit
+being shown in a frame and its complement in the next one. Every LED is then
+lit in one frame of each pair, so it is found in the first pair, and each bit
+is read by comparing the LED's brightness in the two frames, which doesn't
+depend on the LED's brightness or on the ambient light. N LEDs are identified
+in `2 * (ceil(log2(N)) + check bits)` frames.
+
+The check bits are the syndrome of a Hamming code over the index bits, so any
+one or two misread bits of a code word are detected instead of giving the
+index of another LED.
+
+The server shows the sequence on the LED controllers with a GrayCodeSequence,
+one frame every few ticks, and records the tick of every frame to match them
+with the captured camera frames.
+"""
+
+from typing import Callable, List, NamedTuple
+
+import numpy as np
+
+from wlbb.lib.vision.blobs import BlobDetector, BlobRegions
+
+__all__ = (
+    "GrayCodeIdentifier",
+    "GrayCodeSequence",
+    "Identification",
+    "identify_leds",
+    "measure_regions",
+)
+
+
+def _get_check_bit_count(data_bits: int) -> int:
+    check_bits = 2
+    while data_bits > 2**check_bits - check_bits - 1:
+        check_bits += 1
+    return check_bits
+
+
+class GrayCodeIdentifier:
+    """
+    The code words of `led_count` LEDs and their decoding.
+
+    `check_bits` defaults to the fewest check bits detecting every one or two
+    bit error.
+    """
+
+    def __init__(self, led_count: int, check_bits: int = None):
+        if led_count < 1:
+            raise ValueError("Invalid LED count : %d." % led_count)
+        self.led_count = led_count
+        self.data_bits = max((led_count - 1).bit_length(), 1)
+        if check_bits is None:
+            check_bits = _get_check_bit_count(self.data_bits)
+        # Every data bit changes the syndrome by a distinct value which isn't a
+        # power of two, so no one or two bit error leaves it unchanged.
+        codes = [code for code in range(3, 2**check_bits) if code & (code - 1)][
+            : self.data_bits
+        ]
+        if len(codes) < self.data_bits:
+            raise ValueError(
+                "%d check bits can't protect %d bits." % (check_bits, self.data_bits)
+            )
+        self.check_bits = check_bits
+        self.bit_count = self.data_bits + check_bits
+        self.frame_count = 2 * self.bit_count
+        self._syndrome_codes = np.array(codes, np.int64)
+        self._data_shifts = np.arange(self.data_bits, dtype=np.int64)
+        self._check_shifts = np.arange(check_bits, dtype=np.int64)
+        self.code_words = self.encode(np.arange(led_count))
+
+    def _get_syndromes(self, data: np.ndarray) -> np.ndarray:
+        return np.bitwise_xor.reduce(
+            np.where(data, self._syndrome_codes, 0), axis=1
+        ).astype(np.int64)
+
+    def encode(self, indexes: np.ndarray) -> np.ndarray:
+        """
+        Return the code words of the LEDs at `indexes`, as one row of bits per
+        LED.
+        """
+        indexes = np.asarray(indexes, np.int64)
+        gray = indexes ^ (indexes >> 1)
+        data = ((gray[:, None] >> self._data_shifts) & 1).astype(bool)
+        syndromes = self._get_syndromes(data)
+        check = ((syndromes[:, None] >> self._check_shifts) & 1).astype(bool)
+        return np.concatenate((data, check), axis=1)
+
+    def decode(self, bits: np.ndarray) -> np.ndarray:
+        """
+        Return the LED index of every row of code word bits, or -1 for the
+        rows which aren't a valid code word.
+        """
+        bits = np.asarray(bits, bool)
+        data = bits[:, : self.data_bits]
+        check = (bits[:, self.data_bits :] << self._check_shifts).sum(axis=1)
+        gray = (data << self._data_shifts).sum(axis=1)
+        indexes = gray.copy()
+        shift = 1
+        while shift < self.data_bits:
+            indexes ^= indexes >> shift
+            shift <<= 1
+        valid = (check == self._get_syndromes(data)) & (indexes < self.led_count)
+        return np.where(valid, indexes, -1)
+
+    def decode_intensities(
+        self, intensities: np.ndarray, min_contrast: float = 0.0
+    ) -> np.ndarray:
+        """
+        Return the LED index of blobs whose brightness in every frame of the
+        sequence is given by a row of `intensities`, or -1 for the blobs not
+        identified. A bit whose frames differ by less than `min_contrast`
+        times their sum is unreadable.
+        """
+        intensities = np.asarray(intensities, np.float64)
+        shown, complement = intensities[:, 0::2], intensities[:, 1::2]
+        indexes = self.decode(shown > complement)
+        if min_contrast > 0:
+            contrast = np.abs(shown - complement)
+            unreadable = contrast < min_contrast * (shown + complement)
+            indexes[unreadable.any(axis=1)] = -1
+        return indexes
+
+    def get_frame_states(self, frame_index: int) -> np.ndarray:
+        """
+        Return whether every LED is lit in the frame `frame_index` of the
+        sequence.
+        """
+        states = self.code_words[:, frame_index // 2]
+        return ~states if frame_index % 2 else states
+
+    def render_frame(self, frame_index: int, colors: np.ndarray, color=255):
+        """
+        Write in `colors`, an array with one row per LED, the colors of the
+        LEDs in the frame `frame_index` of the sequence.
+        """
+        states = self.get_frame_states(frame_index)
+        colors[...] = 0
+        colors[states] = color
+
+
+class GrayCodeSequence:
+    """
+    Show the frames of the sequence of `identifier` on the LED controllers.
+
+    The LED `i` is the channel `channels[i]` of the controller
+    `controllers[i]`. Every frame is sent with `send_led_frame(controller,
+    frame_number, colors)`, `bytes_per_led` bytes per channel, and held for
+    `hold_ticks` ticks, then every LED is turned off. The tick at which each
+    frame was shown is appended to `frame_ticks`.
+    """
+
+    def __init__(
+        self,
+        identifier: GrayCodeIdentifier,
+        controllers: np.ndarray,
+        channels: np.ndarray,
+        send_led_frame: Callable[[int, int, bytes], None],
+        hold_ticks: int = 2,
+        bytes_per_led: int = 3,
+        color: int = 255,
+    ):
+        controllers = np.array(controllers, np.int64)
+        channels = np.array(channels, np.int64)
+        if not len(controllers) == len(channels) == identifier.led_count:
+            raise ValueError(
+                "Expected the controller and channel of %d LEDs." % identifier.led_count
+            )
+        if hold_ticks < 1:
+            raise ValueError("Invalid hold ticks : %d." % hold_ticks)
+        self.identifier = identifier
+        self.send_led_frame = send_led_frame
+        self.hold_ticks = hold_ticks
+        self.color = color
+        self.frame_ticks: List[int] = []
+        self.done = False
+        self._led_colors = np.zeros((identifier.led_count, bytes_per_led), np.uint8)
+        # The LEDs, their channels and the colors sent to every controller.
+        self._targets = []
+        for controller in np.unique(controllers):
+            leds = np.flatnonzero(controllers == controller)
+            colors = np.zeros((channels[leds].max() + 1, bytes_per_led), np.uint8)
+            self._targets.append((int(controller), leds, channels[leds], colors))
+
+    def _send(self, tick: int):
+        for controller, leds, channels, colors in self._targets:
+            colors[channels] = self._led_colors[leds]
+            self.send_led_frame(controller, tick, memoryview(colors).cast("B"))
+
+    def tick(self, tick: int) -> bool:
+        """
+        Show the next frame of the sequence if the current one was held long
+        enough at the tick `tick`. Return False once the sequence is over.
+        """
+        if self.done:
+            return False
+        frame_ticks = self.frame_ticks
+        if frame_ticks and tick - frame_ticks[-1] < self.hold_ticks:
+            return True
+        frame_index = len(frame_ticks)
+        if frame_index == self.identifier.frame_count:
+            self._led_colors[...] = 0
+            self._send(tick)
+            self.done = True
+            return False
+        self.identifier.render_frame(frame_index, self._led_colors, self.color)
+        self._send(tick)
+        frame_ticks.append(tick)
+        return True
+
+
+def measure_regions(
+    frames: np.ndarray, regions: BlobRegions, dark_frame: np.ndarray = None
+) -> np.ndarray:
+    """
+    Return the brightness of the blobs of `regions` in every frame of
+    `frames`, as one row per blob and one column per frame.
+    """
+    frames = np.asarray(frames)
+    blob_count = len(regions.blobs)
+    if not blob_count:
+        return np.zeros((0, len(frames)))
+    order = np.argsort(regions.components, kind="stable")
+    pixels = regions.pixels[order]
+    starts = np.searchsorted(regions.components[order], np.arange(blob_count))
+    values = frames.reshape(len(frames), -1)[:, pixels].astype(np.float64)
+    if dark_frame is not None:
+        values -= np.asarray(dark_frame).ravel()[pixels]
+    return np.add.reduceat(values, starts, axis=1).T
+
+
+class Identification(NamedTuple):
+    """
+    The (u, v, intensity) of the blobs found in a sequence and the LED index
+    of every blob, -1 for the blobs not identified.
+    """
+
+    blobs: np.ndarray
+    led_indexes: np.ndarray
+
+
+def identify_leds(
+    frames: np.ndarray,
+    identifier: GrayCodeIdentifier,
+    detector: BlobDetector,
+    min_contrast: float = 0.1,
+) -> Identification:
+    """
+    Identify the LEDs in the frames of a sequence of `identifier`, captured
+    by a still camera. Blobs are found by `detector` in the brightest pixels
+    of the first pair of frames, where every LED is lit.
+    """
+    if len(frames) != identifier.frame_count:
+        raise ValueError(
+            "Expected %d frames, got %d." % (identifier.frame_count, len(frames))
+        )
+    regions = detector.detect_regions(np.maximum(frames[0], frames[1]))
+    intensities = measure_regions(frames, regions, detector.dark_frame)
+    return Identification(
+        regions.blobs, identifier.decode_intensities(intensities, min_contrast)
+    )
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""
+Define the triangulation of the LED positions from their observations by
+several calibrated cameras.
+
+The observations of every LED are given at once as an array padded to the
+camera count, with a mask of the valid ones. Every LED position is the
+direct linear transform (DLT) solution: the eigenvector of the smallest
+eigenvalue of the 4x4 normal matrix built from its observations. The normal
+matrices of all the LEDs are built with one einsum and solved by one batched
+`eigh` call.
+"""
+
+from typing import List, NamedTuple
+
+import numpy as np
+
+from wlbb.lib.profile import Profile
+from wlbb.lib.vision.identification import Identification
+
+__all__ = (
+    "Triangulation",
+    "triangulate",
+    "project",
+    "gather_observations",
+    "store_positions",
+)
+
+
+class Triangulation(NamedTuple):
+    """
+    The position of every LED, the RMS distance in pixels between its
+    observations and the projections of its position, the number of cameras
+    which observed it and whether it was triangulated, ie observed by at
+    least two cameras and in front of them.
+    """
+
+    xyz: np.ndarray
+    reprojection_errors: np.ndarray
+    camera_counts: np.ndarray
+    valid: np.ndarray
+
+
+def project(projections: np.ndarray, xyz: np.ndarray) -> np.ndarray:
+    """
+    Return the (u, v) projection of every position of `xyz` (N, 3) by every
+    camera projection matrix of `projections` (C, 3, 4), as a (N, C, 2)
+    array, and the depth of the positions in every camera (N, C).
+    """
+    points = np.concatenate((xyz, np.ones((len(xyz), 1))), axis=1)
+    projected = np.einsum("cij,nj->nci", projections, points)
+    depths = projected[:, :, 2]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return projected[:, :, :2] / depths[:, :, None], depths
+
+
+def triangulate(
+    projections: np.ndarray, observations: np.ndarray, mask: np.ndarray
+) -> Triangulation:
+    """
+    Triangulate the LEDs observed at the (u, v) of `observations` (N, C, 2)
+    by the cameras of projection matrices `projections` (C, 3, 4), only the
+    observations where `mask` (N, C) is True being used.
+    """
+    projections = np.asarray(projections, np.float64)
+    observations = np.asarray(observations, np.float64)
+    mask = np.asarray(mask, bool)
+
+    # Each observation gives two equations u * P3 - P1 and v * P3 - P2.
+    rows = (
+        observations[:, :, :, None] * projections[None, :, 2, None, :]
+        - projections[None, :, :2, :]
+    )
+    # Unit rows make the cameras weigh the same whatever their scale, and
+    # masked observations weigh nothing.
+    norms = np.linalg.norm(rows, axis=3, keepdims=True)
+    weights = mask[:, :, None, None] / np.where(norms > 0, norms, 1)
+    rows = rows * weights
+    normal_matrices = np.einsum("ncki,nckj->nij", rows, rows)
+    _, eigenvectors = np.linalg.eigh(normal_matrices)
+    points = eigenvectors[:, :, 0]
+
+    camera_counts = mask.sum(axis=1)
+    valid = (camera_counts >= 2) & (np.abs(points[:, 3]) > 1e-12)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        xyz = points[:, :3] / points[:, 3, None]
+    xyz[~valid] = np.nan
+
+    projected, depths = project(projections, xyz)
+    valid &= ((depths > 0) | ~mask).all(axis=1)
+    squared_errors = np.where(mask, ((projected - observations) ** 2).sum(axis=2), 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        errors = np.sqrt(squared_errors.sum(axis=1) / camera_counts)
+    errors[~valid] = np.nan
+    xyz[~valid] = np.nan
+    return Triangulation(xyz, errors, camera_counts, valid)
+
+
+def gather_observations(identifications: List[Identification], led_count: int):
+    """
+    Return the padded observations (N, C, 2) and their mask (N, C) of
+    `led_count` LEDs from the identification of the LEDs in the frames of
+    each camera. LEDs identified more than once by a camera are ambiguous and
+    ignored for this camera.
+    """
+    observations = np.zeros((led_count, len(identifications), 2))
+    mask = np.zeros((led_count, len(identifications)), bool)
+    for camera, (blobs, led_indexes) in enumerate(identifications):
+        identified = led_indexes >= 0
+        indexes = led_indexes[identified]
+        counts = np.bincount(indexes, minlength=led_count)
+        observations[indexes, camera] = blobs[identified, :2]
+        mask[indexes, camera] = True
+        mask[counts > 1, camera] = False
+    return observations, mask
+
+
+def store_positions(
+    profile: Profile,
+    triangulation: Triangulation,
+    start: int = 0,
+    max_error: float = np.inf,
+):
+    """
+    Write the positions of the LEDs triangulated with a reprojection error
+    below `max_error` pixels in a writable profile, from its LED `start`,
+    with a confidence decreasing with the error. Other LEDs are unchanged.
+    """
+    count = len(triangulation.xyz)
+    stored = triangulation.valid & (triangulation.reprojection_errors <= max_error)
+    profile_xyz = np.frombuffer(profile.get_xyz(), np.float32).reshape(-1, 3)
+    profile_confidence = np.frombuffer(profile.get_confidence(), np.float32)
+    xyz = profile_xyz[start : start + count].copy()
+    confidence = profile_confidence[start : start + count].copy()
+    del profile_xyz, profile_confidence
+    xyz[stored] = triangulation.xyz[stored]
+    confidence[stored] = 1 / (1 + triangulation.reprojection_errors[stored])
+    profile.update(start, xyz=xyz, confidence=confidence)
@@ -4,7 +4,9 @@
 Some type definition for WLBB.
 """
 
-from typing import Dict, Any
+from typing import Any, Callable, Dict
 
 ConfigSectionDict = Dict[str, Any]
 ConfigDict = Dict[str, ConfigSectionDict]
+ConfigSectionSchema = Dict[str, Callable[[Any], Any]]
+ConfigSchema = Dict[str, ConfigSectionSchema]